@@ -0,0 +1,188 @@
+# bench_abr.py
+# Adaptive bitrate controller against an emulated cellular uplink. A stand-in
+# WHIP endpoint (aiohttp + aiortc, in-process) receives a synthetic 640x360
+# stream published the way the local publishers do. A link emulator on the
+# DTLS transport adds delay, random loss and a bandwidth cap with a bounded
+# queue. The link goes clean -> congested -> clean. Runs once with the
+# ladder fixed at the top rung and once adaptive, and reports received frame
+# rate, resolution and the longest freeze per phase, plus every ABR decision.
+# Requires aiortc.
+# Usage: python bench/bench_abr.py [phase_seconds]
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local"))
+
+from aiohttp import ClientSession, web # noqa: E402
+from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack # noqa: E402
+from aiortc.rtcdtlstransport import RTCDtlsTransport # noqa: E402
+import av # noqa: E402
+
+from adaptive_bitrate import DEFAULT_LADDER, AdaptationController, AdaptiveOutput # noqa: E402
+from frame_capture import CaptureEngine, SyntheticSource # noqa: E402
+
+PORT = 9937
+PHASES = ( # name, one-way delay s, random loss, uplink kbps (None = unlimited)
+    ("clean", 0.02, 0.0, None),
+    ("congested", 0.15, 0.05, 300),
+    ("recovered", 0.02, 0.0, None),
+)
+MAX_QUEUE_S = 0.4 # Packets that would wait longer in the bottleneck are dropped, like a modem buffer
+
+# === Link Emulator ===
+class Link:
+    def __init__(self):
+        self.delay, self.loss, self.kbps = 0.0, 0.0, None
+        self.next_free = {} # transport -> when the bottleneck frees up
+        self.last_due = {} # transport -> latest delivery time, so a shorter delay can't reorder packets
+        self.dropped = 0
+
+    def set(self, delay, loss, kbps):
+        self.delay, self.loss, self.kbps = delay, loss, kbps
+
+    def install(self):
+        original = RTCDtlsTransport._send_rtp
+        link = self
+
+        async def send_rtp(transport, data):
+            now = time.monotonic()
+            if random.random() < link.loss:
+                link.dropped += 1
+                return
+            wait = link.delay
+            if link.kbps:
+                start = max(now, link.next_free.get(transport, now))
+                if start - now > MAX_QUEUE_S:
+                    link.dropped += 1
+                    return
+                link.next_free[transport] = start + len(data) * 8 / (link.kbps * 1000)
+                wait += link.next_free[transport] - now
+            due = max(now + wait, link.last_due.get(transport, now))
+            link.last_due[transport] = due
+            asyncio.get_running_loop().call_later(due - now, lambda: asyncio.ensure_future(deliver(transport, data)))
+
+        async def deliver(transport, data):
+            try:
+                await original(transport, data)
+            except ConnectionError:
+                pass # Delivered after the peer connection closed
+        RTCDtlsTransport._send_rtp = send_rtp
+
+# === Stand-in WHIP Endpoint ===
+class Endpoint:
+    def __init__(self):
+        self.frames = [] # (time, width, height)
+        self.pcs = set()
+
+    async def whip(self, request):
+        pc = RTCPeerConnection()
+        self.pcs.add(pc)
+
+        @pc.on("track")
+        def on_track(track):
+            asyncio.ensure_future(self.consume(track))
+
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=await request.text(), type="offer"))
+        await pc.setLocalDescription(await pc.createAnswer())
+        return web.Response(status=201, text=pc.localDescription.sdp, content_type="application/sdp")
+
+    async def consume(self, track):
+        while True:
+            try:
+                frame = await track.recv()
+            except Exception:
+                return
+            self.frames.append((time.monotonic(), frame.width, frame.height))
+
+    async def close(self):
+        for pc in self.pcs:
+            await pc.close()
+        self.pcs.clear()
+
+# === Publisher ===
+class SyntheticTrack(VideoStreamTrack):
+    """Same shape as the webcam/Pi Camera tracks: capture ring + adaptive output."""
+    kind = "video"
+
+    def __init__(self):
+        super().__init__()
+        self.capture = CaptureEngine(SyntheticSource(640, 360, fps=30, format="yuv420p", noise=True), name="synthetic")
+        self.capture.start()
+        self.output = AdaptiveOutput(DEFAULT_LADDER[-1].fps)
+
+    async def recv(self):
+        pts, time_base = await self.output.next_timestamp()
+        frame = av.VideoFrame.from_ndarray(await self.capture.frame(), format=self.capture.format)
+        frame.pts, frame.time_base = pts, time_base
+        return self.output.scale(frame)
+
+    def stop(self):
+        super().stop()
+        self.capture.stop()
+
+async def publish(adaptive, link, endpoint, phase_s):
+    pc = RTCPeerConnection()
+    track = SyntheticTrack()
+    sender = pc.addTrack(track)
+    await pc.setLocalDescription(await pc.createOffer())
+    async with ClientSession() as session:
+        async with session.post(f"http://127.0.0.1:{PORT}/bench/whip", data=pc.localDescription.sdp,
+                                headers={"Content-Type": "application/sdp"}) as resp:
+            await pc.setRemoteDescription(RTCSessionDescription(sdp=await resp.text(), type="answer"))
+
+    log = []
+    controller = AdaptationController(DEFAULT_LADDER, apply=track.output.set_rung, log=log.append)
+    adapter = asyncio.create_task(controller.run(sender, interval=0.5)) if adaptive else None
+    await asyncio.sleep(2) # ICE + DTLS
+    endpoint.frames.clear()
+    bounds = []
+    for name, delay, loss, kbps in PHASES:
+        link.set(delay, loss, kbps)
+        start = time.monotonic()
+        await asyncio.sleep(phase_s)
+        bounds.append((name, start, time.monotonic()))
+    link.set(0, 0, None)
+    if adapter:
+        adapter.cancel()
+    track.stop()
+    await pc.close()
+    await endpoint.close()
+    return bounds, log
+
+def report(label, bounds, frames, started):
+    for name, start, end in bounds:
+        times = [start] + [t for t, _, _ in frames if start <= t < end] + [end]
+        sizes = [f"{w}x{h}" for t, w, h in frames if start <= t < end]
+        freeze = max(b - a for a, b in zip(times, times[1:]))
+        common = max(set(sizes), key=sizes.count) if sizes else "-"
+        print(f"{label:<9} {name:<10} {(len(times) - 2) / (end - start):>7.1f} {common:>10} {freeze * 1000:>11.0f}")
+
+async def main(phase_s):
+    link = Link()
+    link.install()
+    endpoint = Endpoint()
+    app = web.Application()
+    app.router.add_post("/{path}/whip", endpoint.whip)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    print(f"Phases of {phase_s:.0f}s: " + ", ".join(
+        f"{name} ({delay * 1000:.0f} ms, {loss:.0%} loss, {f'{kbps} kbps' if kbps else 'unlimited'})"
+        for name, delay, loss, kbps in PHASES))
+    print(f"{'mode':<9} {'phase':<10} {'recv fps':>7} {'resolution':>10} {'freeze ms':>11}")
+    for label, adaptive in (("fixed", False), ("adaptive", True)):
+        started = time.monotonic()
+        bounds, log = await publish(adaptive, link, endpoint, phase_s)
+        report(label, bounds, list(endpoint.frames), started)
+        for line in log:
+            print(f"  {line}")
+    print(f"link dropped {link.dropped} packets")
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    phase_s = float(sys.argv[1]) if len(sys.argv) > 1 else 20.0
+    asyncio.run(main(phase_s))
@@ -0,0 +1,83 @@
+# bench_brake.py
+# Drives the emergency brake against a simulated approaching obstacle on the
+# fake GPIO backend and asserts the sample -> PWM cut latency stays within one
+# sample period. Also checks that a run of missing echoes throttles the speed.
+# Usage: python bench/bench_brake.py [rate_hz] [closing_speed_cm_s]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from gpio_backend import FakeGPIO # noqa: E402
+from ranging import UltrasonicRanger # noqa: E402
+from safety import BrakeController # noqa: E402
+
+TRIG, ECHO, FORWARD_PIN = 31, 32, 37
+
+def make_robot(rate_hz):
+    gpio = FakeGPIO()
+    obstacle = gpio.attach_ultrasonic(TRIG, ECHO)
+    pwm = gpio.PWM(FORWARD_PIN, 100)
+    pwm.start(0)
+    ranger = UltrasonicRanger(gpio, TRIG, ECHO, rate_hz=rate_hz)
+    brake = BrakeController(
+        lambda action, speed: pwm.ChangeDutyCycle(speed),
+        lambda: pwm.ChangeDutyCycle(0),
+        sample_period_s=1 / rate_hz,
+    )
+    ranger.add_listener(brake.on_sample)
+    return gpio, obstacle, pwm, ranger, brake
+
+def run_approach(rate_hz, closing_speed, speed=60, runs=5):
+    period_ns = 1e9 / rate_hz
+    for run in range(runs):
+        gpio, obstacle, pwm, ranger, brake = make_robot(rate_hz)
+        threshold = brake.stopping_distance(speed)
+        obstacle.set(threshold + 40, 0)
+        ranger.start()
+        time.sleep(3 / rate_hz)
+        brake.command("forward", speed)
+        assert pwm.duty_cycle == speed, "forward command should drive the motor"
+
+        start = time.monotonic_ns()
+        obstacle.set(threshold + 40, closing_speed)
+        crossing_ns = start + (40 / closing_speed) * 1e9 # When the obstacle reaches the threshold
+        while pwm.duty_cycle and time.monotonic_ns() - start < 10e9:
+            time.sleep(0.001)
+        ranger.stop()
+        gpio.cleanup()
+
+        assert brake.brake_events == 1, "brake never engaged"
+        reaction_ns = pwm.last_change_ns - crossing_ns # Threshold crossing -> PWM cut
+        gap_at_cut = threshold - closing_speed * reaction_ns / 1e9
+        print(f"run {run}: threshold={threshold:5.1f} cm  sample->cut={brake.last_cut_latency_ns / 1e3:7.1f} us  "
+              f"crossing->cut={reaction_ns / 1e6:6.1f} ms  gap_at_cut={gap_at_cut:5.1f} cm")
+        assert brake.last_cut_latency_ns < period_ns, "PWM cut took longer than one sample period"
+        # Sample period, plus the echo time itself and scheduler jitter
+        assert reaction_ns < 2 * period_ns, "brake reacted later than one sample period after crossing"
+
+def run_unknown(rate_hz, speed=60):
+    gpio, obstacle, pwm, ranger, brake = make_robot(rate_hz)
+    obstacle.set(200)
+    ranger.start()
+    time.sleep(3 / rate_hz)
+    brake.command("forward", speed)
+    obstacle.set(None) # Echo lost
+    time.sleep((brake.unknown_after + 2) / rate_hz)
+    throttled = pwm.duty_cycle
+    obstacle.set(200)
+    time.sleep(3 / rate_hz)
+    restored = pwm.duty_cycle
+    ranger.stop()
+    gpio.cleanup()
+    print(f"unknown distance: throttled to {throttled}%, restored to {restored}%")
+    assert throttled == brake.unknown_speed
+    assert restored == speed
+
+if __name__ == "__main__":
+    rate_hz = float(sys.argv[1]) if len(sys.argv) > 1 else 20.0
+    closing_speed = float(sys.argv[2]) if len(sys.argv) > 2 else 60.0
+    print(f"Sample rate {rate_hz} Hz, obstacle closing at {closing_speed} cm/s")
+    run_approach(rate_hz, closing_speed)
+    run_unknown(rate_hz)
+    print("OK")
@@ -0,0 +1,136 @@
+# bench_broadcast.py
+# Load test for the /distance fan-out: hundreds of fast browser clients plus a
+# few slow ones that stop reading. Compares the old per-client asyncio.gather
+# broadcast with the BroadcastHub and reports fast-client latency percentiles.
+# Clients run in a separate process so their CPU doesn't skew the server.
+# Usage: python bench/bench_broadcast.py [fast_clients] [slow_clients] [seconds]
+import asyncio
+import base64
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+sys.path.insert(0, SERVER_DIR)
+
+import websockets # noqa: E402
+from fleet import DEFAULT_ROBOT # noqa: E402
+from telemetry_protocol import BINARY_SUBPROTOCOL, CHANNELS, HEADER, TelemetrySample, encode_frame # noqa: E402
+
+PORT = 9931
+RATE_HZ = 50
+SAMPLES_PER_FRAME = 500 # ~4.5 KB frames
+SERVER_SNDBUF = 16384 # Small server send buffers so slow clients back up within seconds, not minutes
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+# === Client Process ===
+async def fast_client(latencies, connected):
+    async with websockets.connect(f"ws://127.0.0.1:{PORT}/distance", subprotocols=[BINARY_SUBPROTOCOL],
+                                  max_size=None) as ws:
+        connected.append(ws)
+        try:
+            async for frame in ws:
+                base_ns = HEADER.unpack_from(frame)[5] # Only the header: keep client CPU low
+                latencies.append(time.monotonic_ns() - base_ns)
+        except websockets.ConnectionClosed:
+            pass
+
+async def slow_client(connected):
+    # Raw handshake, then never read again; a tiny receive buffer makes the
+    # server's sends back up within seconds
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    reader, writer = await asyncio.open_connection(sock=await connect(sock))
+    writer.write((f"GET /distance HTTP/1.1\r\nHost: 127.0.0.1:{PORT}\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {base64.b64encode(os.urandom(16)).decode()}\r\n"
+                  f"Sec-WebSocket-Version: 13\r\nSec-WebSocket-Protocol: {BINARY_SUBPROTOCOL}\r\n\r\n").encode())
+    await reader.readuntil(b"\r\n\r\n")
+    reader._transport.pause_reading()
+    connected.append(writer)
+    await asyncio.Event().wait()
+
+async def connect(sock):
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ("127.0.0.1", PORT))
+    return sock
+
+async def clients_main(fast, slow, seconds, results):
+    latencies, connected = [], []
+    tasks = [asyncio.create_task(fast_client(latencies, connected)) for _ in range(fast)]
+    tasks += [asyncio.create_task(slow_client(connected)) for _ in range(slow)]
+    await asyncio.sleep(seconds)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    results.put(latencies)
+
+def run_clients(fast, slow, seconds, results):
+    asyncio.run(clients_main(fast, slow, seconds, results))
+
+# === Server Process ===
+async def legacy_broadcast(ws_srv, frame):
+    clients = [subscriber.ws for subscriber in ws_srv.fleet.get(DEFAULT_ROBOT).hub.subscribers]
+    await asyncio.gather(*[client.send_bytes(frame) for client in clients if not client.closed],
+                         return_exceptions=True)
+
+async def shrink_send_buffer(request, response):
+    sock = request.transport.get_extra_info("socket")
+    if sock is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SERVER_SNDBUF)
+
+async def run(mode, fast, slow, seconds):
+    from aiohttp import web
+    import websoket_server as ws_srv
+    ws_srv.fleet.robots.clear()
+    robot = ws_srv.fleet.get_or_create(DEFAULT_ROBOT) # Browsers without ?robot= watch the default robot
+    app = await ws_srv.main()
+    app.on_response_prepare.append(shrink_send_buffer)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    results = multiprocessing.Queue()
+    clients = multiprocessing.Process(target=run_clients, args=(fast, slow, seconds + 5, results))
+    clients.start()
+    while len(robot.hub) < fast + slow:
+        await asyncio.sleep(0.05)
+
+    published = 0
+    start = time.monotonic()
+    while time.monotonic() - start < seconds:
+        samples = [TelemetrySample(CHANNELS["distance"], time.monotonic_ns(), 50.0)] * SAMPLES_PER_FRAME
+        frame = encode_frame(published, samples)
+        if mode == "legacy":
+            await legacy_broadcast(ws_srv, frame) # Waits for the slowest client
+        else:
+            ws_srv.broadcast_telemetry(robot, samples, frame)
+        published += 1
+        await asyncio.sleep(max(0, start + published / RATE_HZ - time.monotonic()))
+    elapsed = time.monotonic() - start
+    slow_disconnects = robot.hub.slow_disconnects
+
+    latencies = await asyncio.get_running_loop().run_in_executor(None, results.get)
+    clients.join()
+    await runner.cleanup()
+    print(f"{mode:<7} published={published / elapsed:5.1f}/s (target {RATE_HZ})  "
+          f"fast delivered={len(latencies) / max(fast, 1) / elapsed:5.1f}/s per client  "
+          f"latency p50={percentile(latencies, 50) / 1e6:8.2f} ms p99={percentile(latencies, 99) / 1e6:8.2f} ms  "
+          f"slow_disconnects={slow_disconnects}")
+
+if __name__ == "__main__":
+    fast = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    slow = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+    os.chdir(tempfile.mkdtemp()) # websoket_server logs and serves ./static relative to the cwd
+    os.makedirs("static")
+    logging.disable(logging.CRITICAL) # Keep per-connection log lines out of the measurement
+    print(f"{fast} fast + {slow} slow browser clients, {RATE_HZ} frames/s for {seconds}s")
+    for mode in ("legacy", "hub"):
+        asyncio.run(run(mode, fast, slow, seconds))
@@ -0,0 +1,103 @@
+# bench_capture.py
+# Frame capture for the WHIP publishers without a camera: a synthetic source
+# paced like a camera, read either inline in recv() (the old tracks) or by
+# frame_capture's background thread, while the encoder pulls at 30 fps. Reports
+# how long recv() blocks the loop, event-loop stalls seen by a 5 ms ticker (what
+# ICE/RTCP timers suffer), frame age when handed to the encoder, and unpaced
+# capture throughput. frame.copy() stands in for VideoFrame.from_ndarray.
+# Usage: python bench/bench_capture.py [seconds]
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local"))
+
+import numpy as np # noqa: E402
+from frame_capture import CaptureEngine, SyntheticSource # noqa: E402
+
+TICK_S = 0.005
+SEND_FPS = 30 # aiortc VideoStreamTrack's clock
+CAMERA_FPS = (30, 25, 15) # 15 = a webcam stretching exposure in low light
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+async def ticker(stalls, stop):
+    """Lateness of a 5 ms timer: how long the loop was blocked."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_S)
+        stalls.append((time.perf_counter() - start - TICK_S) * 1000)
+
+class InlineTrack:
+    """The old recv(): a blocking camera read on the event loop."""
+
+    def __init__(self, source):
+        self.source = source
+        source.open()
+        self.buffer = np.empty(source.shape, dtype=np.uint8)
+
+    async def recv(self):
+        self.source.read(self.buffer)
+        return self.buffer.copy(), 0.0 # Fresh, but the loop waited for it
+
+class EngineTrack:
+    def __init__(self, source):
+        self.capture = CaptureEngine(source, name="bench")
+        self.capture.start()
+
+    async def recv(self):
+        frame = await self.capture.frame()
+        return frame.copy(), self.capture.latency_ms[-1]
+
+async def run(track, seconds, send_fps):
+    stalls, ages, blocked = [], [], []
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(stalls, stop))
+    sent = 0
+    start = time.perf_counter()
+    next_send = start
+    while time.perf_counter() - start < seconds:
+        if send_fps:
+            next_send += 1 / send_fps
+            await asyncio.sleep(max(0, next_send - time.perf_counter())) # VideoStreamTrack.next_timestamp()
+        else:
+            await asyncio.sleep(0)
+        called = time.perf_counter()
+        _, age = await track.recv()
+        blocked.append((time.perf_counter() - called) * 1000)
+        ages.append(age)
+        sent += 1
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    return sent / elapsed, blocked, stalls, ages
+
+def report(name, rate, blocked, stalls, ages, extra=""):
+    print(f"{name:<22} {rate:>8.1f} {percentile(blocked, 50):>10.2f} {percentile(blocked, 99):>10.2f} "
+          f"{percentile(stalls, 99):>10.2f} {max(stalls):>10.2f} {percentile(ages, 50):>9.2f}  {extra}")
+
+async def main(seconds):
+    print(f"640x360 RGB, encoder pulls at {SEND_FPS} fps, {seconds}s per run")
+    print(f"{'camera / track':<22} {'sent/s':>8} {'recv p50':>10} {'recv p99':>10} {'stall p99':>10} "
+          f"{'stall max':>10} {'age p50':>9}  (ms)")
+    for camera_fps in CAMERA_FPS:
+        report(f"{camera_fps} fps inline read", *await run(InlineTrack(SyntheticSource(fps=camera_fps)), seconds, SEND_FPS))
+        track = EngineTrack(SyntheticSource(fps=camera_fps))
+        results = await run(track, seconds, SEND_FPS)
+        track.capture.stop()
+        stats = track.capture.stats()
+        report(f"{camera_fps} fps capture thread", *results, f"dropped={stats['dropped']} duplicated={stats['duplicated']}")
+
+    print("\nUnpaced (source and consumer as fast as possible; both share this machine's cores):")
+    report("inline read", *await run(InlineTrack(SyntheticSource()), seconds, None))
+    track = EngineTrack(SyntheticSource())
+    results = await run(track, seconds, None)
+    track.capture.stop()
+    report("capture thread", *results, f"captured={track.capture.captured / seconds:,.0f}/s")
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    asyncio.run(main(seconds))
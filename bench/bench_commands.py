@@ -0,0 +1,111 @@
+# bench_commands.py
+# Sends a burst of browser drive commands through websoket_server to a simulated
+# Pi whose handler takes a few ms per command, with and without the
+# latest-command-wins pipeline. Reports commands executed, command age at
+# execution and how long the Pi lags behind the browser's final intent.
+# Usage: python bench/bench_commands.py [commands] [interval_ms] [pi_handler_ms]
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import websockets # noqa: E402
+from aiohttp import web # noqa: E402
+from command_pipeline import CommandGate, CommandMailbox # noqa: E402
+from fleet import DEFAULT_ROBOT # noqa: E402
+
+PORT = 9932
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+# === Pi Process ===
+async def pi_main(pipeline, handler_s, results):
+    # Mirrors robot_listener.pi_control_handler, with a synchronous handler cost
+    gate = CommandGate()
+    executed = []
+    finished = asyncio.Event()
+
+    async def execute(data):
+        if pipeline and not gate.accept(data)[0]:
+            return
+        time.sleep(handler_s) # Synchronous GPIO work, like the old handle_drive_action()
+        executed.append((time.time() * 1000, data))
+        if data.get("value") == 100: # The browser's final intent
+            finished.set()
+
+    commands = CommandMailbox(execute, stamp=False)
+    async with websockets.connect(f"ws://127.0.0.1:{PORT}/pi_control") as ws:
+        results.put("connected")
+
+        async def read():
+            async for message in ws:
+                data = json.loads(message)
+                if data.get("type") == "heartbeat":
+                    gate.observe_clock(data.get("server_ts"))
+                    continue
+                if pipeline:
+                    commands.put(data)
+                else:
+                    await execute(data) # Old behaviour: every message, in order
+        reader = asyncio.create_task(read())
+        await finished.wait()
+        reader.cancel()
+    results.put(executed)
+
+def run_pi(use_gate, handler_s, results):
+    asyncio.run(pi_main(use_gate, handler_s, results))
+
+# === Server + Browser ===
+async def run(mode, commands, interval_s, handler_s):
+    import websoket_server as ws_srv
+    app = await ws_srv.main()
+    robot = ws_srv.fleet.get_or_create(DEFAULT_ROBOT) # The simulated Pi connects without ?robot=
+    if mode == "legacy":
+        # Forward every command in order, as handle_control used to
+        robot.commands.put = lambda data: asyncio.ensure_future(ws_srv.send_to_pi(robot, data))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    loop = asyncio.get_running_loop()
+    results = multiprocessing.Queue()
+    pi = multiprocessing.Process(target=run_pi, args=(mode == "pipeline", handler_s, results))
+    pi.start()
+    await loop.run_in_executor(None, results.get)
+    while robot.control_ws is None:
+        await asyncio.sleep(0.01)
+
+    async with websockets.connect(f"ws://127.0.0.1:{PORT}/control") as browser:
+        for seq in range(1, commands + 1):
+            speed = seq * 100 // commands # Slider drag: every command supersedes the last
+            await browser.send(json.dumps({"action": "forward", "value": speed, "seq": seq, "ts": time.time() * 1000}))
+            await asyncio.sleep(interval_s)
+        final_sent = time.time() * 1000
+        executed = await loop.run_in_executor(None, results.get)
+    pi.join()
+    await runner.cleanup()
+    robot.commands.__dict__.pop("put", None) # Undo the legacy patch
+
+    ages = [at - data["ts"] for at, data in executed]
+    print(f"{mode:<9} executed={len(executed):4d}/{commands}  age p50={percentile(ages, 50):7.1f} ms "
+          f"p99={percentile(ages, 99):7.1f} ms  final intent applied {executed[-1][0] - final_sent:7.1f} ms "
+          f"after the browser sent it")
+
+if __name__ == "__main__":
+    commands = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    interval_s = (float(sys.argv[2]) if len(sys.argv) > 2 else 2.0) / 1000
+    handler_s = (float(sys.argv[3]) if len(sys.argv) > 3 else 10.0) / 1000
+    os.chdir(tempfile.mkdtemp()) # websoket_server logs and serves ./static relative to the cwd
+    os.makedirs("static")
+    logging.disable(logging.CRITICAL)
+    print(f"{commands} commands every {interval_s * 1000:.1f} ms, Pi handler {handler_s * 1000:.1f} ms")
+    asyncio.run(run("legacy", commands, interval_s, handler_s))
+    asyncio.run(run("pipeline", commands, interval_s, handler_s))
@@ -0,0 +1,123 @@
+# bench_fleet.py
+# Routing throughput of websoket_server's fleet registry as the robot count
+# grows: browser commands routed to the right robot's mailbox and Pi link, a
+# linear scan over connected Pis for comparison, per-robot telemetry fan-out
+# to scoped viewers, and memory per idle robot. Runs in-process with fake sockets.
+# With few robots most commands are superseded in the mailbox before they are
+# forwarded; "forwarded" shows how many reached a Pi link.
+# Usage: python bench/bench_fleet.py [messages] [total_viewers]
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from telemetry_protocol import CHANNELS, TelemetrySample, encode_frame # noqa: E402
+
+ROBOT_COUNTS = (1, 10, 100, 1000)
+
+class FakeWebSocket:
+    closed = False
+
+    async def send_bytes(self, data):
+        pass
+
+    async def send_str(self, data):
+        pass
+
+def make_fleet(ws_srv, robots):
+    ws_srv.fleet.robots.clear()
+    ws_srv.fleet.max_robots = robots
+    return [ws_srv.fleet.get_or_create(f"robot-{i}") for i in range(robots)]
+
+async def drain(robots):
+    while any(robot.commands._slots for robot in robots):
+        await asyncio.sleep(0)
+
+async def route_registry(ws_srv, robots, targets):
+    """Each browser connection resolves its robot once (robot_for), then routes by reference."""
+    fleet = make_fleet(ws_srv, robots)
+    ids = [robot.robot_id for robot in fleet]
+    start = time.perf_counter()
+    for n, target in enumerate(targets):
+        ws_srv.fleet.get(ids[target]).commands.put({"action": "forward", "value": 50}) # Lookup kept in the loop
+        if n % 64 == 0:
+            await asyncio.sleep(0) # The socket reader yields between frames
+    await drain(fleet)
+    elapsed = time.perf_counter() - start
+    forwarded = sum(robot.commands.forwarded for robot in fleet)
+    return len(targets) / elapsed, forwarded
+
+async def route_linear(ws_srv, robots, targets):
+    """Baseline: a list of (robot ID, robot) connections searched per command."""
+    fleet = make_fleet(ws_srv, robots)
+    connections = [(robot.robot_id, robot) for robot in fleet]
+    ids = [robot.robot_id for robot in fleet]
+    start = time.perf_counter()
+    for n, target in enumerate(targets):
+        robot_id = ids[target]
+        robot = next(robot for connection_id, robot in connections if connection_id == robot_id)
+        robot.commands.put({"action": "forward", "value": 50})
+        if n % 64 == 0:
+            await asyncio.sleep(0)
+    await drain(fleet)
+    return len(targets) / (time.perf_counter() - start)
+
+async def fan_out(ws_srv, robots, total_viewers, frames_per_robot=20):
+    fleet = make_fleet(ws_srv, robots)
+    per_robot = max(1, total_viewers // robots)
+    subscribers = [robot.hub.subscribe(FakeWebSocket(), binary=True) for robot in fleet for _ in range(per_robot)]
+    frame_samples = [TelemetrySample(CHANNELS["distance"], time.monotonic_ns(), 50.0)]
+    frame = encode_frame(1, frame_samples)
+    start = time.perf_counter()
+    for _ in range(frames_per_robot):
+        for robot in fleet:
+            ws_srv.broadcast_telemetry(robot, frame_samples, frame)
+        await asyncio.sleep(0)
+    while any(subscriber.queue for subscriber in subscribers):
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    delivered = sum(subscriber.sent for subscriber in subscribers)
+    for robot in fleet:
+        for subscriber in tuple(robot.hub.subscribers):
+            robot.hub.unsubscribe(subscriber)
+    await asyncio.sleep(0)
+    return delivered / elapsed, per_robot
+
+async def memory_per_robot(ws_srv, robots):
+    ws_srv.fleet.robots.clear()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    make_fleet(ws_srv, robots)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename")) / robots
+
+async def main(messages, total_viewers):
+    import websoket_server as ws_srv
+    print(f"{messages} commands to random robots, {total_viewers} viewers spread across the fleet")
+    print(f"{'robots':>7} {'registry cmd/s':>15} {'linear cmd/s':>13} {'fan-out msg/s':>14} "
+          f"{'viewers/robot':>14} {'bytes/robot':>12} {'forwarded':>10}")
+    for robots in ROBOT_COUNTS:
+        rng = random.Random(robots)
+        targets = [rng.randrange(robots) for _ in range(messages)]
+        registry_rate, forwarded = await route_registry(ws_srv, robots, targets)
+        linear_rate = await route_linear(ws_srv, robots, targets)
+        fan_out_rate, per_robot = await fan_out(ws_srv, robots, total_viewers)
+        per_robot_bytes = await memory_per_robot(ws_srv, robots)
+        print(f"{robots:>7} {registry_rate:>15,.0f} {linear_rate:>13,.0f} {fan_out_rate:>14,.0f} "
+              f"{per_robot:>14} {per_robot_bytes:>12,.0f} {forwarded:>10}")
+        assert forwarded <= messages # Superseded commands for the same robot collapse, never duplicate
+
+if __name__ == "__main__":
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    total_viewers = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    os.chdir(tempfile.mkdtemp()) # websoket_server logs and serves ./static relative to the cwd
+    os.makedirs("static")
+    logging.disable(logging.CRITICAL)
+    asyncio.run(main(messages, total_viewers))
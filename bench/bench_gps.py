@@ -0,0 +1,179 @@
+# bench_gps.py
+# GPS from the receiver to the geofence alerts. Part 1: NMEAParser throughput
+# over a recorded stream at several read sizes, and the checksum folded a
+# half at a time against a byte-by-byte loop. Part 2: sim/gps_simulator.py's
+# pty read by GPSReader on a live event loop at 10 Hz, with corrupted
+# sentences: fixes received and the loop lag while reading. Part 3:
+# TrackSimplifier on an hour of noisy 1 Hz fixes: points sent and how far the
+# sent track strays from every fix. Part 4: a fleet (default 1000 robots,
+# 2000 geofences) in server/tracks.py: ingest rate with the fence checks, and
+# near() query latency with the grid against a scan of every track.
+# Usage: python bench/bench_gps.py [robots] [fences]
+import asyncio
+import math
+import os
+import random
+import sys
+import threading
+import time
+from functools import reduce
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "server"))
+sys.path.insert(0, os.path.join(ROOT, "sim"))
+from gps import Fix, GPSReader, NMEAParser, TrackSimplifier, nmea_checksum, offset_m, segment_distance # noqa: E402
+from gps_simulator import NOISE_M, ORIGIN, PtyGPS, nmea_epoch, route_fixes # noqa: E402
+from tracks import Geofence, TrackStore # noqa: E402
+
+EPOCHS = 20_000 # Parse stream length (3 sentences each)
+READ_SIZES = (16, 256, 4096)
+LIVE_S = 5.0
+LIVE_HZ = 10
+LIVE_BAUD = 115_200 # 10 Hz of GGA+GSA+RMC needs more than 9600 baud
+TOLERANCES_M = (1.0, 3.0, 5.0)
+FLEET_MINUTES = 30
+FLEET_POINT_S = 5 # One simplified point per robot every 5 s on average
+AREA_M = 5000 # Fleet spread over AREA_M x AREA_M around ORIGIN
+QUERIES = 300
+SCAN_QUERIES = 20
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+def to_degrees(x, y):
+    return (ORIGIN[0] + math.degrees(y / 6_371_000),
+            ORIGIN[1] + math.degrees(x / (6_371_000 * math.cos(math.radians(ORIGIN[0])))))
+
+# === Part 1: Parsing ===
+def parse():
+    fixes = route_fixes(1, 1.5, seed=1)
+    stream = b"".join(nmea_epoch(1.7e9 + t, lat, lon, speed, course)
+                      for (t, lat, lon, speed, course, _, _), _ in zip(fixes, range(EPOCHS)))
+    print(f"NMEA parsing: {EPOCHS * 3} sentences, {len(stream) / 1e6:.1f} MB")
+    print(f"{'read size':>10}{'sentences/s':>14}{'MB/s':>8}{'fixes':>8}")
+    for size in READ_SIZES:
+        parser = NMEAParser()
+        started = time.perf_counter()
+        count = 0
+        for i in range(0, len(stream), size):
+            count += len(parser.feed(stream[i:i + size], 0))
+        elapsed = time.perf_counter() - started
+        print(f"{size:>10}{parser.sentences / elapsed:>14,.0f}{len(stream) / elapsed / 1e6:>8.2f}{count:>8}")
+    bodies = [line[1:line.index(b"*")] for line in stream.split(b"\r\n")[:3000] if line]
+    assert all(nmea_checksum(body) == reduce(lambda a, b: a ^ b, body, 0) for body in bodies)
+    for name, checksum in (("folded", nmea_checksum), ("byte loop", lambda body: reduce(lambda a, b: a ^ b, body, 0))):
+        started = time.perf_counter()
+        for body in bodies:
+            checksum(body)
+        print(f"Checksum, {name}: {(time.perf_counter() - started) / len(bodies) * 1e6:.2f} us per sentence")
+
+# === Part 2: Live Device ===
+async def live():
+    gps = PtyGPS(LIVE_HZ, 1.5, LIVE_BAUD, corrupt=0.05, seed=2)
+    fixes = []
+    reader = GPSReader(gps.path, fixes.append, LIVE_BAUD)
+    lags = []
+    reader.start()
+    writer = threading.Thread(target=gps.run, args=(LIVE_S,), daemon=True)
+    writer.start()
+    loop = asyncio.get_running_loop()
+    while writer.is_alive():
+        expected = loop.time() + 0.01
+        await asyncio.sleep(0.01)
+        lags.append(loop.time() - expected)
+    await asyncio.sleep(0.2)
+    reader.stop()
+    gps.close()
+    stats = reader.stats()
+    print(f"\npty at {LIVE_HZ} Hz, {LIVE_BAUD} baud for {LIVE_S:.0f}s: {gps.epochs} epochs written "
+          f"({gps.corrupted} corrupted), {stats['bytes']} bytes read, {stats['sentences']} sentences, "
+          f"{len(fixes)} fixes, {stats['checksum_errors']} checksum errors, {stats['invalid']} invalid")
+    print(f"Loop lag while reading: p50 {percentile(lags, 0.5) * 1000:.2f} ms, "
+          f"p99 {percentile(lags, 0.99) * 1000:.2f} ms, max {max(lags) * 1000:.2f} ms")
+
+# === Part 3: Simplification ===
+def simplify():
+    fixes = [Fix(int(t * 1e9), lat, lon, speed, course, 1, 9, 0.9)
+             for (t, lat, lon, speed, course, _, _), _ in zip(route_fixes(1, 1.0, seed=3), range(3600))]
+    print(f"\nTrack simplification, {len(fixes)} fixes at 1 Hz, 1 m/s with {NOISE_M} m receiver noise")
+    print(f"{'tolerance m':>12}{'sent':>7}{'ratio':>8}{'max error m':>13}{'us/fix':>8}")
+    for tolerance in TOLERANCES_M:
+        simplifier = TrackSimplifier(tolerance)
+        started = time.perf_counter()
+        sent = [point for fix in fixes for point in simplifier.add(fix)]
+        elapsed = time.perf_counter() - started
+        worst, j = 0.0, 0
+        for fix in fixes: # Distance of each fix from the sent segment spanning its time
+            while j + 1 < len(sent) and sent[j + 1].timestamp_ns < fix.timestamp_ns:
+                j += 1
+            if j + 1 < len(sent):
+                a, b = sent[j], sent[j + 1]
+                px, py = offset_m(a.lat, a.lon, fix.lat, fix.lon)
+                bx, by = offset_m(a.lat, a.lon, b.lat, b.lon)
+                worst = max(worst, segment_distance(px, py, 0.0, 0.0, bx, by)[0])
+        print(f"{tolerance:>12.0f}{len(sent):>7}{len(fixes) / len(sent):>7.1f}x{worst:>13.1f}"
+              f"{elapsed / len(fixes) * 1e6:>8.1f}")
+
+# === Part 4: Fleet ===
+def fleet(robots, fences):
+    rng = random.Random(4)
+    geofences = []
+    for i in range(fences):
+        lat, lon = to_degrees(rng.uniform(0, AREA_M), rng.uniform(0, AREA_M))
+        geofences.append(Geofence(f"fence-{i}", lat, lon, rng.uniform(10, 50)))
+    store = TrackStore(geofences)
+    points = FLEET_MINUTES * 60 // FLEET_POINT_S
+    start_ms = int(time.time() * 1000) - FLEET_MINUTES * 60_000
+    walkers = [[rng.uniform(0, AREA_M), rng.uniform(0, AREA_M), rng.uniform(0, 2 * math.pi)] for _ in range(robots)]
+    print(f"\nFleet: {robots} robots, {points} points each over {FLEET_MINUTES} min, {fences} geofences")
+    ingest = 0.0
+    for step in range(points):
+        batch = []
+        for robot, walker in enumerate(walkers):
+            walker[2] += rng.gauss(0, 0.4)
+            distance = rng.uniform(0, 2 * FLEET_POINT_S) # 0-2 m/s
+            walker[0] = min(AREA_M, max(0, walker[0] + distance * math.sin(walker[2])))
+            walker[1] = min(AREA_M, max(0, walker[1] + distance * math.cos(walker[2])))
+            batch.append((f"robot-{robot}", start_ms + step * FLEET_POINT_S * 1000 + robot, *to_degrees(*walker[:2])))
+        started = time.perf_counter()
+        for robot_id, time_ms, lat, lon in batch:
+            store.add_point(robot_id, time_ms, lat, lon)
+        ingest += time.perf_counter() - started
+    stats = store.stats()
+    print(f"Ingest with fence checks: {stats['points'] / ingest:,.0f} points/s ({ingest / stats['points'] * 1e6:.1f} us "
+          f"per point); {stats['cells']} cells, {stats['index_entries']} entries, {stats['bytes'] / 1e6:.1f} MB; "
+          f"alerts {stats['alerts']}")
+    print(f"{'radius m':>9}{'window s':>9}{'grid p50 ms':>13}{'grid p99 ms':>13}{'scan p50 ms':>13}{'robots':>8}{'match':>7}")
+    for radius, window_s in ((10, 30), (50, 60), (200, 300)):
+        queries = []
+        for _ in range(QUERIES): # Around a place some robot passed, at a random time
+            track = store.tracks[f"robot-{rng.randrange(robots)}"]
+            i = rng.randrange(len(track))
+            queries.append((track.lats[i] + rng.uniform(-1, 1) * radius / 111_320, track.lons[i],
+                            start_ms + rng.randrange(FLEET_MINUTES * 60_000)))
+        grid_times, found, matched = [], 0, 0
+        answers = []
+        for lat, lon, time_ms in queries:
+            started = time.perf_counter()
+            answers.append(store.near(lat, lon, radius, time_ms, window_s * 1000))
+            grid_times.append(time.perf_counter() - started)
+            found += len(answers[-1])
+        scan_times = []
+        for (lat, lon, time_ms), answer in list(zip(queries, answers))[:SCAN_QUERIES]:
+            started = time.perf_counter()
+            expected = store.near_scan(lat, lon, radius, time_ms, window_s * 1000)
+            scan_times.append(time.perf_counter() - started)
+            matched += expected == answer
+        print(f"{radius:>9}{window_s:>9}{percentile(grid_times, 0.5) * 1000:>13.3f}"
+              f"{percentile(grid_times, 0.99) * 1000:>13.3f}{percentile(scan_times, 0.5) * 1000:>13.1f}"
+              f"{found / QUERIES:>8.1f}{matched:>4}/{SCAN_QUERIES}")
+
+def main(robots, fences):
+    parse()
+    asyncio.run(live())
+    simplify()
+    fleet(robots, fences)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000, int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
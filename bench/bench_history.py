@@ -0,0 +1,117 @@
+# bench_history.py
+# Cost of websoket_server's telemetry history (server/timeseries.py). Part 1:
+# storing a telemetry frame on the event loop, with and without segment
+# persistence, and the writer thread's cost per record. Part 2: memory per
+# million samples, in the raw ring and with the default rollup levels.
+# Part 3: /history query latency over a day of 20 Hz distance samples for
+# windows from 10 s to 24 h at two point budgets, including the JSON encode.
+# Part 4: the backfill a new /distance client gets.
+# Usage: python bench/bench_history.py [queries]
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from telemetry_protocol import CHANNELS, TelemetrySample, encode_frame # noqa: E402
+from timeseries import LEVELS, SegmentWriter, Series, TimeSeriesStore # noqa: E402
+
+RATE_HZ = 20
+FRAME_SAMPLES = 5 # A 0.25 s telemetry frame at 20 Hz
+DAY_MS = 24 * 3600 * 1000
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+def frames(count):
+    base = time.monotonic_ns()
+    return [[TelemetrySample(CHANNELS["distance"], base + (i * FRAME_SAMPLES + j) * 50_000_000, 100.0 + j)
+             for j in range(FRAME_SAMPLES)] for i in range(count)]
+
+# === Part 1: Ingest ===
+def ingest(count):
+    batches = frames(count)
+    print(f"Per sample stored ({FRAME_SAMPLES}-sample frames, {count * FRAME_SAMPLES} samples)")
+    for name, segments in (("memory only", None), ("with segments", SegmentWriter(tempfile.mkdtemp(), flush_s=3600))):
+        store = TimeSeriesStore(segments=segments)
+        start = time.perf_counter()
+        for batch in batches:
+            store.add("robot", batch)
+        loop_ns = (time.perf_counter() - start) / (count * FRAME_SAMPLES) * 1e9
+        line = f"  {name:<14} event loop {loop_ns:>6.0f} ns"
+        if segments:
+            start = time.perf_counter()
+            segments._write_pending() # What the writer thread does once per flush
+            line += f", writer thread {(time.perf_counter() - start) / segments.records * 1e9:>5.0f} ns"
+            segments.close()
+        print(line)
+
+# === Part 2: Memory ===
+def fill(series, samples, start_ms=0):
+    for i in range(samples):
+        series.add(start_ms + i * 1000 // RATE_HZ, 100.0 + i % 50)
+
+def memory():
+    million = 1_000_000
+    print("\nMemory per million samples")
+    for name, raw_capacity, levels in (("raw ring only", million, ((DAY_MS, 1),)),
+                                       ("raw + default rollups", million, LEVELS)):
+        tracemalloc.start()
+        series = Series(raw_capacity, levels)
+        fill(series, million)
+        allocated = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"  {name:<24} {series.nbytes() / 2 ** 20:>6.1f} MiB in arrays, {allocated / 2 ** 20:>6.1f} MiB allocated")
+    series = Series()
+    fill(series, DAY_MS * RATE_HZ // 1000)
+    print(f"  default series after a day at {RATE_HZ} Hz (full): {series.nbytes() / 2 ** 10:.0f} KiB")
+
+# === Part 3: Queries ===
+def queries(runs):
+    store = TimeSeriesStore()
+    series = store.series[("robot", CHANNELS["distance"])] = Series()
+    end = int(time.time() * 1000)
+    fill(series, DAY_MS * RATE_HZ // 1000, end - DAY_MS)
+    print(f"\n/history over a day of {RATE_HZ} Hz samples, {runs} queries each")
+    print(f"{'window':>7} {'budget':>7} {'res ms':>7} {'points':>7} {'p50 ms':>8} {'p99 ms':>8} {'+json p50':>10}")
+    for label, window_ms in (("10 s", 10_000), ("1 min", 60_000), ("10 min", 600_000), ("1 h", 3_600_000),
+                             ("6 h", 6 * 3_600_000), ("24 h", DAY_MS)):
+        for points in (500, 2000):
+            times, encoded = [], []
+            for _ in range(runs):
+                start = time.perf_counter()
+                result = store.query("robot", CHANNELS["distance"], end - window_ms, end, points)
+                times.append(time.perf_counter() - start)
+                json.dumps(result)
+                encoded.append(time.perf_counter() - start)
+            print(f"{label:>7} {points:>7} {result['resolution_ms']:>7} {len(result['t']):>7} "
+                  f"{percentile(times, 50) * 1000:>8.2f} {percentile(times, 99) * 1000:>8.2f} "
+                  f"{percentile(encoded, 50) * 1000:>10.2f}")
+
+# === Part 4: Backfill ===
+def backfill(runs):
+    store = TimeSeriesStore()
+    now_ms = int(time.time() * 1000)
+    for channel in ("distance", "command_age"): # A minute of both, up to now
+        fill(store.series.setdefault(("robot", CHANNELS[channel]), Series()), 60 * RATE_HZ, now_ms - 60_000)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        samples = store.recent("robot", 10.0)
+        encode_frame(0, samples)
+        times.append(time.perf_counter() - start)
+    print(f"\nBackfill of a new /distance client: {len(samples)} samples (2 channels, 10 s), "
+          f"p50 {percentile(times, 50) * 1000:.2f} ms, p99 {percentile(times, 99) * 1000:.2f} ms")
+
+def main(runs):
+    ingest(20_000)
+    memory()
+    queries(runs)
+    backfill(runs)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,222 @@
+# bench_link.py
+# Fault injection for the multiplexed Pi link. Runs websoket_server in-process
+# behind a TCP proxy and a simulated Pi (LinkClient sending telemetry frames at
+# 20 Hz) in a child process, then resets connections, blackholes the network
+# and restarts the server. Reports reconnect times, buffered/resent messages
+# and end-to-end loss in both directions.
+# Usage: python bench/bench_link.py [outage_s]
+import asyncio
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from aiohttp import web # noqa: E402
+from fleet import DEFAULT_ROBOT # noqa: E402
+from pi_link import LINK_PATH, LinkClient, LinkSession # noqa: E402
+from telemetry_protocol import CHANNELS, TelemetrySample, decode_frame, encode_frame # noqa: E402
+
+PORT = 9934 # websoket_server
+PROXY_PORT = 9935 # What the Pi connects to
+FRAME_INTERVAL = 0.05
+
+# === Pi Process ===
+async def pi_main(stop, results):
+    link = LinkSession()
+    probes = set()
+    client = None
+
+    def on_connect(resumed):
+        results.put(("connect", resumed, len(link.unacked), client.last_reconnect_ms))
+
+    def on_control(data):
+        if "probe" in data:
+            probes.add(data["probe"])
+        elif data.get("type") == "heartbeat":
+            asyncio.ensure_future(ack(data))
+
+    async def ack(data):
+        try:
+            await link.send_volatile("control", {"type": "heartbeat_ack", "hb": data["hb"], "hb_ts": data["hb_ts"]})
+        except ConnectionError:
+            pass
+
+    link.on("control", on_control)
+    client = LinkClient(f"ws://127.0.0.1:{PROXY_PORT}{LINK_PATH}", link, on_connect=on_connect)
+    runner = asyncio.create_task(client.run())
+    sent = 0
+    while not stop.is_set():
+        sent += 1
+        link.send("telemetry", encode_frame(sent, [TelemetrySample(CHANNELS["distance"], time.monotonic_ns(), 50.0)]))
+        await asyncio.sleep(FRAME_INTERVAL)
+    await asyncio.sleep(1) # Let the last frames drain
+    runner.cancel()
+    results.put(("done", sent, sorted(probes), client.stats(), link.stats(), list(client.reconnect_ms)))
+
+def run_pi(stop, results):
+    import builtins
+    builtins.print = lambda *args, **kwargs: None # LinkClient logs every reconnect
+    asyncio.run(pi_main(stop, results))
+
+# === Fault-injecting Proxy ===
+class Proxy:
+    def __init__(self):
+        self.pairs = set()
+        self.blackhole = False
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._accept, "127.0.0.1", PROXY_PORT)
+
+    async def stop_listening(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def reset(self):
+        for writer in list(self.pairs):
+            writer.transport.abort() # RST, like a dropped Wi-Fi association
+        self.pairs.clear()
+
+    async def _accept(self, reader, writer):
+        try:
+            up_reader, up_writer = await asyncio.open_connection("127.0.0.1", PORT)
+        except OSError:
+            writer.transport.abort()
+            return
+        self.pairs.update((writer, up_writer))
+        await asyncio.gather(self._pump(reader, up_writer), self._pump(up_reader, writer), return_exceptions=True)
+        for w in (writer, up_writer):
+            self.pairs.discard(w)
+            w.transport.abort()
+
+    async def _pump(self, reader, writer):
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            if not self.blackhole: # Blackholed bytes vanish; neither end sees a close
+                writer.write(data)
+                await writer.drain()
+        writer.transport.abort()
+
+# === Server ===
+received = set()
+duplicates = 0
+
+def fresh_link(ws_srv):
+    """A new server process: new robot state, so a new session ID and empty buffers."""
+    def count_telemetry(data):
+        global duplicates
+        seq, _ = decode_frame(data)
+        if seq in received:
+            duplicates += 1
+        received.add(seq)
+        ws_srv.handle_pi_telemetry(robot, data)
+    ws_srv.fleet.robots.clear()
+    robot = ws_srv.fleet.get_or_create(DEFAULT_ROBOT)
+    robot.link.on("telemetry", count_telemetry)
+    return robot.link
+
+async def start_server(ws_srv):
+    runner = web.AppRunner(await ws_srv.main(), shutdown_timeout=0.1)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    return runner
+
+async def wait_reconnected(link, connects, since):
+    """ms from `since` until the server's link has seen more than `connects` handshakes."""
+    while link.connects <= connects:
+        await asyncio.sleep(0.005)
+    return (time.monotonic() - since) * 1000
+
+async def main(outage_s):
+    import websoket_server as ws_srv
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    pi = multiprocessing.Process(target=run_pi, args=(stop, results))
+    pi.start() # Before binding, so the forked child does not inherit the listening sockets
+
+    link = fresh_link(ws_srv)
+    proxy = Proxy()
+    await proxy.start()
+    runner = await start_server(ws_srv)
+    await wait_reconnected(link, 0, time.monotonic())
+
+    probes_sent = 0
+    async def send_probes():
+        nonlocal probes_sent
+        while True:
+            probes_sent += 1
+            link.send("control", {"probe": probes_sent})
+            await asyncio.sleep(0.1)
+    prober = asyncio.create_task(send_probes())
+    await asyncio.sleep(2)
+
+    print(f"{'fault':<22} {'recovered after':>16} {'server buffered':>16}")
+    # 1. Connection reset
+    connects = link.connects
+    proxy.reset()
+    cleared = time.monotonic()
+    print(f"{'connection reset':<22} {await wait_reconnected(link, connects, cleared):13.1f} ms {link.stats()['max_buffered']:>16}")
+    await asyncio.sleep(2)
+
+    # 2. Half-open blackhole: nothing delivered, nothing closed, new connections refused
+    connects = link.connects
+    proxy.blackhole = True
+    await proxy.stop_listening()
+    peak = 0
+    end = time.monotonic() + outage_s
+    while time.monotonic() < end:
+        peak = max(peak, len(link.unacked))
+        await asyncio.sleep(0.05)
+    proxy.reset()
+    proxy.blackhole = False
+    await proxy.start()
+    cleared = time.monotonic()
+    print(f"{f'blackhole {outage_s}s':<22} {await wait_reconnected(link, connects, cleared):13.1f} ms {peak:>16}")
+    await asyncio.sleep(2)
+
+    # 3. Server process restart: the new process has a new session and nothing buffered
+    await runner.cleanup()
+    proxy.reset()
+    await asyncio.sleep(outage_s)
+    link = fresh_link(ws_srv)
+    runner = await start_server(ws_srv)
+    cleared = time.monotonic()
+    print(f"{f'server down {outage_s}s':<22} {await wait_reconnected(link, 0, cleared):13.1f} ms {'(lost)':>16}")
+    await asyncio.sleep(2)
+
+    prober.cancel()
+    stop.set()
+    connects = []
+    while True:
+        event = await asyncio.get_running_loop().run_in_executor(None, results.get)
+        if event[0] == "connect":
+            connects.append(event[1:])
+        else:
+            _, sent, probes, client_stats, link_stats, reconnect_ms = event
+            break
+    pi.join()
+    await runner.cleanup()
+
+    print("\nPi reconnects (link lost -> handshake, includes the outage):")
+    for (resumed, buffered, _), ms in zip(connects[1:], reconnect_ms):
+        print(f"  {ms:8.1f} ms  {'resumed' if resumed else 'new session':<12} {buffered:4d} frames buffered for resend")
+    missing = sent - len(received)
+    print(f"\ntelemetry: sent={sent} received={len(received)} missing={missing} duplicates={duplicates} "
+          f"resent={link_stats['resent']} dropped={link_stats['dropped']} max_buffered={link_stats['max_buffered']}")
+    # Probes buffered by the killed server process are gone with it; everything else must arrive
+    print(f"commands:  sent={probes_sent} received={len(probes)}")
+    assert missing <= 0, "telemetry frames lost across reconnects"
+    print("OK")
+
+if __name__ == "__main__":
+    outage_s = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    os.chdir(tempfile.mkdtemp()) # websoket_server logs and serves ./static relative to the cwd
+    os.makedirs("static")
+    logging.disable(logging.CRITICAL)
+    asyncio.run(main(outage_s))
@@ -0,0 +1,186 @@
+# bench_logging.py
+# Load test for websoket_server's logging. The server runs in its own
+# process, once as before (synchronous FileHandler + StreamHandler, an INFO
+# line for every browser command and every forward to the Pi) and once as
+# now (queue + listener thread, per-message lines sampled at DEBUG, raw
+# traffic in the binary message trace). A load process runs a Pi on the
+# link sending telemetry frames, browsers sending drive commands and
+# distance viewers, at three paced rates. Reports messages handled per
+# second and event-loop lag (lateness of a 5 ms timer in the server).
+# Usage: python bench/bench_logging.py [seconds]
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")
+sys.path.insert(0, SERVER_DIR)
+
+import aiohttp # noqa: E402
+from pi_link import CHANNELS as LINK_CHANNELS, LINK_PATH, LinkSession, encode_message # noqa: E402
+from telemetry_protocol import CHANNELS, TelemetrySample, encode_frame # noqa: E402
+
+PORT = 9942
+BROWSERS = 4
+VIEWERS = 10
+TICK_S = 0.005
+LOADS = ( # name, messages/s per sender
+    ("light", 50),
+    ("busy", 250),
+    ("heavy", 1000), # Near what one core handles with the old logging
+)
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+# === Server Process ===
+def run_server(mode, seconds, results):
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("static")
+    console = os.open("console.log", os.O_WRONLY | os.O_CREAT) # The console handler writes here, not the terminal
+    os.dup2(console, 2)
+    os.environ["ROBOT_SERVER_PORT"] = str(PORT)
+    import websoket_server as ws_srv
+    from aiohttp import web
+
+    if mode == "before":
+        # The old setup: handlers on the event loop thread, every message at INFO, no trace
+        ws_srv.log_pipeline.stop()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in (logging.FileHandler("websocket_server.log"), logging.StreamHandler()):
+            handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+            root.addHandler(handler)
+        for sampler in (ws_srv.control_log, ws_srv.forward_log, ws_srv.buffered_log, ws_srv.invalid_log):
+            sampler.interval_s = 0
+        ws_srv.control_log.level = ws_srv.forward_log.level = logging.INFO
+        ws_srv.trace.close()
+        ws_srv.trace = None
+
+    handled = {"telemetry": 0}
+    handle_pi_telemetry = ws_srv.handle_pi_telemetry
+    def counting_telemetry(robot, data):
+        handled["telemetry"] += 1
+        handle_pi_telemetry(robot, data)
+    ws_srv.handle_pi_telemetry = counting_telemetry
+
+    async def serve():
+        runner = web.AppRunner(await ws_srv.main(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", PORT).start()
+        for _ in LOADS:
+            await asyncio.sleep(0.5) # The load process connects
+            robot = ws_srv.fleet.get_or_create("default")
+            commands, telemetry = robot.commands.received, handled["telemetry"]
+            lags = []
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                before = time.perf_counter()
+                await asyncio.sleep(TICK_S)
+                lags.append((time.perf_counter() - before - TICK_S) * 1000)
+            elapsed = time.perf_counter() - start
+            results.put({
+                "commands": (robot.commands.received - commands) / elapsed,
+                "telemetry": (handled["telemetry"] - telemetry) / elapsed,
+                "lag_p50": percentile(lags, 50),
+                "lag_p99": percentile(lags, 99),
+                "lag_max": max(lags),
+                "log_bytes": os.path.getsize("websocket_server.log") + os.path.getsize("console.log"),
+                "trace_bytes": ws_srv.trace.written_bytes if ws_srv.trace else 0,
+            })
+            await asyncio.sleep(1.0) # Load stops between phases
+        await runner.cleanup()
+    asyncio.run(serve())
+
+def wait_for_port():
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", PORT), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+
+# === Load Process ===
+async def paced(rate, stop, send):
+    next_at = time.monotonic()
+    while not stop.is_set():
+        await send()
+        next_at += 1 / rate
+        await asyncio.sleep(max(0, next_at - time.monotonic()))
+
+async def pi(session, rate, stop):
+    link = LinkSession()
+    async with session.ws_connect(f"http://127.0.0.1:{PORT}{LINK_PATH}") as ws:
+        await ws.send_str(link.hello())
+        await ws.receive()
+        async def drain():
+            async for _ in ws:
+                pass
+        reader = asyncio.create_task(drain())
+        seq = 0
+        async def send():
+            nonlocal seq
+            seq += 1
+            frame = encode_frame(seq, [TelemetrySample(CHANNELS["distance"], time.monotonic_ns(), 50.0)])
+            await ws.send_bytes(encode_message(seq, LINK_CHANNELS["telemetry"], frame))
+        await paced(rate, stop, send)
+        reader.cancel()
+
+async def browser(session, rate, stop):
+    async with session.ws_connect(f"http://127.0.0.1:{PORT}/control") as ws:
+        seq = 0
+        async def send():
+            nonlocal seq
+            seq += 1
+            await ws.send_str(json.dumps({"action": "forward", "value": 50, "seq": seq, "ts": time.time() * 1000}))
+        await paced(rate, stop, send)
+
+async def viewer(session, stop):
+    async with session.ws_connect(f"http://127.0.0.1:{PORT}/distance") as ws:
+        while not stop.is_set():
+            try:
+                await ws.receive(timeout=0.5)
+            except asyncio.TimeoutError:
+                pass
+
+def run_load(seconds):
+    async def load():
+        async with aiohttp.ClientSession() as session:
+            for _, rate in LOADS:
+                stop = asyncio.Event()
+                tasks = [asyncio.create_task(pi(session, rate, stop))]
+                tasks += [asyncio.create_task(browser(session, rate, stop)) for _ in range(BROWSERS)]
+                tasks += [asyncio.create_task(viewer(session, stop)) for _ in range(VIEWERS)]
+                await asyncio.sleep(seconds + 0.5)
+                stop.set()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await asyncio.sleep(1.0)
+    asyncio.run(load())
+
+def main(seconds):
+    print(f"1 Pi sending telemetry, {BROWSERS} browsers sending commands, {VIEWERS} viewers; {seconds:.0f}s per load")
+    print(f"{'logging':<8} {'load':<9} {'cmds/s':>8} {'telem/s':>8} {'lag p50':>8} {'lag p99':>8} {'lag max':>8} "
+          f"{'log KB':>8} {'trace KB':>9}")
+    for mode in ("before", "now"):
+        results = multiprocessing.Queue()
+        server = multiprocessing.Process(target=run_server, args=(mode, seconds, results))
+        server.start()
+        wait_for_port()
+        loader = multiprocessing.Process(target=run_load, args=(seconds,))
+        loader.start()
+        for name, _ in LOADS:
+            r = results.get()
+            print(f"{mode:<8} {name:<9} {r['commands']:>8.0f} {r['telemetry']:>8.0f} {r['lag_p50']:>8.2f} "
+                  f"{r['lag_p99']:>8.2f} {r['lag_max']:>8.1f} {r['log_bytes'] / 1024:>8.0f} {r['trace_bytes'] / 1024:>9.0f}")
+        loader.join()
+        server.join()
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0)
@@ -0,0 +1,179 @@
+# bench_metrics.py
+# Cost of the instrumentation in server/metrics.py. Part 1: each update
+# (counter, labelled counter, gauge, histogram observe) in ns, net of the
+# loop. Part 2: the instrumented hot paths with and without their metric:
+# CommandGate.accept (Pi, per command), CommandMailbox.put (server, per
+# command), a telemetry frame published to 10 viewers and sent (server, per
+# frame) and a capture-thread frame (publisher), next to the JSON decode and
+# encode every command pays anyway. Part 3: what a /metrics scrape costs the
+# server's event loop as the fleet grows.
+# Usage: python bench/bench_metrics.py [iterations]
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local"))
+
+import numpy as np # noqa: E402
+from broadcast import BroadcastHub # noqa: E402
+from command_pipeline import CommandGate, CommandMailbox, wall_ms # noqa: E402
+from frame_capture import CaptureEngine # noqa: E402
+from metrics import Registry # noqa: E402
+
+VIEWERS = 10
+
+def per_call_ns(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e9
+
+# === Part 1: Updates ===
+def update_costs(iterations):
+    registry = Registry()
+    counter = registry.counter("bench_total", "Counter")
+    child = registry.counter("bench_labelled_total", "Labelled", ("robot",)).labels("default")
+    labelled = registry.counter("bench_lookup_total", "Looked up per call", ("robot",))
+    gauge = registry.gauge("bench_gauge", "Gauge")
+    histogram = registry.histogram("bench_seconds", "Histogram")
+    timer = registry.histogram("bench_timer_seconds", "Timer")
+    values = np.random.default_rng(0).exponential(0.005, 4096).tolist()
+    index = iter(range(10 ** 12))
+    baseline = per_call_ns(lambda: None, iterations)
+    cases = (
+        ("counter.inc()", counter.inc),
+        ("child.inc() (cached child)", child.inc),
+        ("labels(id).inc()", lambda: labelled.labels("default").inc()),
+        ("gauge.set()", lambda: gauge.set(3)),
+        ("histogram.observe()", lambda: histogram.observe(values[next(index) & 4095])),
+        ("observe_since(perf_counter())", lambda: timer.observe_since(time.perf_counter())),
+    )
+    print(f"Per update, net of a {baseline:.0f} ns call")
+    for name, fn in cases:
+        print(f"  {name:<32} {per_call_ns(fn, iterations) - baseline:>7.0f} ns")
+    print(f"  histogram p50/p99 of 5 ms exponential: {histogram.quantile(0.5) * 1000:.2f} / "
+          f"{histogram.quantile(0.99) * 1000:.2f} ms (exact: {np.percentile(values, 50) * 1000:.2f} / "
+          f"{np.percentile(values, 99) * 1000:.2f} ms)")
+
+# === Part 2: Hot Paths ===
+def gate_cost(metric, iterations):
+    gate = CommandGate(deadline_s=3600, age_metric=metric)
+    seq = iter(range(1, 10 ** 12))
+    return per_call_ns(lambda: gate.accept({"action": "forward", "seq": next(seq), "ts": wall_ms()}), iterations)
+
+def mailbox_cost(metric, iterations):
+    async def run():
+        async def send(data):
+            pass
+        mailbox = CommandMailbox(send, age_metric=metric)
+        cost = per_call_ns(lambda: mailbox.put({"action": "forward", "value": 50, "ts": wall_ms()}), iterations)
+        mailbox.close()
+        return cost
+    return asyncio.run(run())
+
+class NullSocket:
+    closed = False
+
+    async def send_bytes(self, data):
+        pass
+
+def broadcast_cost(metric, iterations):
+    async def run():
+        hub = BroadcastHub(max_queue=iterations + 1, lag_metric=metric)
+        for _ in range(VIEWERS):
+            hub.subscribe(NullSocket(), binary=True)
+        await asyncio.sleep(0)
+        frame = bytes(64)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            hub.publish(binary_payload=frame)
+            await asyncio.sleep(0) # Writers send it
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+        for subscriber in tuple(hub.subscribers):
+            hub.unsubscribe(subscriber)
+        return elapsed / iterations * 1e9
+    return asyncio.run(run())
+
+class CountingSource:
+    format = "yuv420p"
+    shape = (540, 640)
+
+    def __init__(self, frames):
+        self.frames = frames
+
+    def open(self):
+        pass
+
+    def read(self, out):
+        self.frames -= 1
+        return self.frames >= 0
+
+    def close(self):
+        pass
+
+def capture_cost(metric, iterations):
+    engine = CaptureEngine(CountingSource(iterations), read_time=metric, latency=metric)
+    start = time.perf_counter()
+    engine.start()
+    while engine.captured < iterations:
+        engine.latest()
+        time.sleep(0)
+    elapsed = time.perf_counter() - start
+    engine.stop()
+    return elapsed / iterations * 1e9
+
+def hot_paths(iterations):
+    metric = Registry().histogram("bench_seconds", "Histogram")
+    text = json.dumps({"action": "forward", "value": 50, "seq": 1, "ts": wall_ms()})
+    reference = min(per_call_ns(lambda: json.dumps(json.loads(text)), iterations) for _ in range(5))
+    print(f"\nFor scale: json.loads + json.dumps of one command {reference / 1000:.2f}us")
+    print(f"{'hot path':<40} {'without':>9} {'with':>9} {'overhead':>9}")
+    cases = (
+        ("CommandGate.accept (Pi, per command)", gate_cost, iterations),
+        ("CommandMailbox.put (server, per command)", mailbox_cost, iterations),
+        (f"publish + send to {VIEWERS} viewers (per frame)", broadcast_cost, iterations // 10),
+        ("capture thread (per frame, 2 observes)", capture_cost, iterations // 10),
+    )
+    for name, cost, n in cases:
+        without = min(cost(None, n) for _ in range(5))
+        with_metric = min(cost(metric, n) for _ in range(5))
+        print(f"{name:<40} {without / 1000:>7.2f}us {with_metric / 1000:>7.2f}us {(with_metric - without) / 1000:>+8.2f}us")
+
+# === Part 3: Scrape ===
+def scrape_cost():
+    os.chdir(tempfile.mkdtemp()) # websoket_server opens its log and trace in the working directory
+    os.environ["ROBOT_SERVER_TRACE"] = ""
+    import websoket_server as ws_srv
+    ws_srv.log_pipeline.stop()
+    for _ in range(1000):
+        ws_srv.command_age.observe(0.003)
+        ws_srv.broadcast_lag.observe(0.0004)
+        ws_srv.loop_lag.observe(0.0002)
+    print(f"\n{'robots':>7} {'render ms':>10} {'snapshot ms':>12} {'lines':>7} {'KiB':>7}")
+    for robots in (1, 10, 100, 1000):
+        while len(ws_srv.fleet) < robots:
+            robot = ws_srv.fleet.get_or_create(f"robot-{len(ws_srv.fleet)}")
+            ws_srv.telemetry_messages.labels(robot.robot_id).inc()
+        renders, snapshots = [], []
+        for _ in range(5):
+            start = time.perf_counter()
+            text = ws_srv.REGISTRY.render()
+            renders.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            ws_srv.REGISTRY.snapshot()
+            snapshots.append(time.perf_counter() - start)
+        print(f"{robots:>7} {min(renders) * 1000:>10.2f} {min(snapshots) * 1000:>12.2f} "
+              f"{text.count(chr(10)):>7} {len(text) / 1024:>7.0f}")
+
+def main(iterations):
+    update_costs(iterations)
+    hot_paths(iterations)
+    scrape_cost()
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,151 @@
+# bench_motion.py
+# Motion analysis stage (local/motion_detector.py). Part 1: per-frame
+# analysis cost on a 640x360 frame for each capture format and grid
+# decimation, against the Pi budget, with a full-resolution float
+# difference for comparison. Part 2: the motion-gated publisher track on a
+# scripted scene (still, someone walks through, still again): frames sent
+# and VP8 bytes per phase, gated vs ungated, how long detection takes and
+# how soon after it the full frame rate is back. Part 2 requires PyAV and
+# aiortc; times are wall clock on this machine, not a Pi.
+# Usage: python bench/bench_motion.py [phase_seconds]
+import asyncio
+import fractions
+import importlib.util
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local"))
+
+import numpy as np # noqa: E402
+import motion_detector # noqa: E402
+from frame_capture import frame_shape # noqa: E402
+from motion_detector import BUDGET_MS, MotionDetector # noqa: E402
+
+WIDTH, HEIGHT, FPS = 640, 360, 30
+PHASES = (("still", False), ("motion", True), ("still again", False))
+
+# === Part 1: Analysis Cost ===
+def full_resolution_diff():
+    """Same algorithm on every pixel of the Y plane: the cost decimation avoids."""
+    background = np.zeros((HEIGHT, WIDTH), np.float32)
+    def analyze(frame, format):
+        y = frame[:HEIGHT].astype(np.float32)
+        delta = y - background
+        moving = np.count_nonzero(np.abs(delta) > 20) / delta.size
+        background[:] += delta * 0.05
+        return moving
+    return analyze
+
+def analysis_cost(frames=300):
+    rng = np.random.default_rng(1)
+    print(f"Analysis cost per {WIDTH}x{HEIGHT} frame (budget {BUDGET_MS} ms on the Pi)")
+    print(f"{'format':<10} {'grid':>8} {'p50 ms':>8} {'max ms':>8}")
+    cases = [(format, step) for format in ("yuv420p", "yuyv422", "bgr24") for step in (4, 8, 16)]
+    for format, step in cases + [("yuv420p", 1)]:
+        shape = frame_shape(format, WIDTH, HEIGHT)
+        samples = [rng.integers(0, 256, shape, dtype=np.uint8) for _ in range(4)]
+        if step == 1:
+            analyze, label = full_resolution_diff(), "full"
+        else:
+            detector = MotionDetector(decimate=step, budget_ms=float("inf"))
+            analyze, label = detector.analyze, f"{WIDTH // step}x{HEIGHT // step}"
+        costs = []
+        for i in range(frames):
+            start = time.perf_counter()
+            analyze(samples[i % len(samples)], format)
+            costs.append((time.perf_counter() - start) * 1000)
+        costs.sort()
+        print(f"{format:<10} {label:>8} {costs[len(costs) // 2]:>8.3f} {costs[-1]:>8.3f}")
+
+# === Part 2: Motion-gated Track ===
+class SceneSource:
+    """A still textured scene with sensor noise; a square crosses it while `moving`."""
+    format = "yuv420p"
+
+    def __init__(self):
+        self.shape = frame_shape(self.format, WIDTH, HEIGHT)
+        rng = np.random.default_rng(2)
+        blocks = rng.integers(40, 200, (self.shape[0] // 32 + 1, WIDTH // 32 + 1), dtype=np.uint8)
+        scene = blocks.repeat(32, axis=0).repeat(32, axis=1)[:self.shape[0], :WIDTH]
+        self.frames = [np.clip(scene + rng.integers(-3, 4, scene.shape), 0, 255).astype(np.uint8) for _ in range(4)]
+        self.moving = False
+        self.count = 0
+        self._next = None
+
+    def open(self):
+        self._next = time.monotonic()
+
+    def read(self, out):
+        self._next += 1 / FPS
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.count += 1
+        np.copyto(out, self.frames[self.count % len(self.frames)])
+        if self.moving:
+            x = (self.count * 12) % (WIDTH - 80)
+            out[100:180, x:x + 80] = 235
+        return True
+
+    def close(self):
+        pass
+
+async def gated_run(gated, phase_s):
+    from aiortc.codecs.vpx import Vp8Encoder
+    from whip_publisher import CaptureStream
+    scene = SceneSource()
+    detector = MotionDetector()
+    events = []
+    detector.add_listener(lambda active, moving: events.append((time.monotonic(), active)))
+    stream = CaptureStream(scene, "scene", motion=detector, gated=gated)
+    stream.open()
+    encoder = Vp8Encoder()
+    sent = [] # (time, bytes)
+    bounds = []
+    phase = 0
+    phase_start = time.monotonic()
+    scene.moving = PHASES[0][1]
+    while phase < len(PHASES):
+        frame = await stream.track.recv()
+        now = time.monotonic()
+        frame.time_base = fractions.Fraction(1, 90000)
+        payloads, _ = encoder.encode(frame)
+        sent.append((now, sum(map(len, payloads))))
+        if now - phase_start >= phase_s:
+            bounds.append((PHASES[phase][0], phase_start, now))
+            phase += 1
+            phase_start = now
+            if phase < len(PHASES):
+                scene.moving = PHASES[phase][1]
+    stream.close()
+    return bounds, sent, events
+
+def report(label, bounds, sent, events):
+    for name, start, end in bounds:
+        frames = [size for t, size in sent if start <= t < end]
+        print(f"{label:<9} {name:<12} {len(frames) / (end - start):>6.1f} {sum(frames) * 8 / (end - start) / 1000:>8.0f}")
+    motion_start = bounds[1][1]
+    detected = next((t for t, active in events if active and t >= motion_start), None)
+    if detected is None:
+        return None
+    restored = next(t for t, _ in sent if t >= detected)
+    return (detected - motion_start) * 1000, (restored - detected) * 1000
+
+async def main(phase_s):
+    analysis_cost()
+    if importlib.util.find_spec("aiortc") is None:
+        print("\nPart 2 needs aiortc; skipped")
+        return
+    print(f"\nScripted scene, {phase_s:.0f}s phases, {FPS} fps capture, idle trickle {motion_detector.IDLE_FPS} fps, "
+          f"motion hold {motion_detector.MOTION_HOLD_S:.0f}s")
+    print(f"{'mode':<9} {'phase':<12} {'fps':>6} {'kbps':>8}")
+    for label, gated in (("ungated", False), ("gated", True)):
+        latency = report(label, *await gated_run(gated, phase_s))
+    if latency:
+        print(f"gated: motion detected {latency[0]:.0f} ms after it began, full rate back "
+              f"{latency[1]:.0f} ms later (one frame is {1000 / FPS:.0f} ms)")
+
+if __name__ == "__main__":
+    phase_s = float(sys.argv[1]) if len(sys.argv) > 1 else 6.0
+    asyncio.run(main(phase_s))
@@ -0,0 +1,67 @@
+# bench_ptz.py
+# Simulates an operator holding a pan key against a fake ONVIF PTZ service and
+# compares the old blocking handler with PTZExecutor: event loop blocking,
+# SOAP calls sent, merge ratio and submit -> ContinuousMove latency.
+# Usage: python bench/bench_ptz.py [hold_seconds] [repeat_hz] [rtt_ms]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from ptz_executor import FakePTZService, PTZExecutor # noqa: E402
+
+VELOCITY = {'PanTilt': {'x': -0.5, 'y': 0.0}, 'Zoom': 0.0}
+
+def blocking_move(service):
+    # The original handle_camera_movement() body, kept here as the baseline
+    service.ContinuousMove({'ProfileToken': 'token', 'Velocity': VELOCITY, 'Timeout': 'PT1S'})
+    time.sleep(0.5)
+    service.Stop({'ProfileToken': 'token'})
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0
+
+def run_blocking(hold_s, repeat_hz, rtt_s):
+    service = FakePTZService(rtt_s)
+    blocked = []
+    start = time.monotonic()
+    sent = 0
+    while time.monotonic() - start < hold_s:
+        t0 = time.monotonic()
+        blocking_move(service) # Commands arriving meanwhile queue up behind this
+        blocked.append(time.monotonic() - t0)
+        sent += 1
+    print(f"blocking   taps={sent:4d}  soap_calls={len(service.calls):4d}  "
+          f"loop_blocked p50={percentile(blocked, 50) * 1000:6.1f} ms max={max(blocked) * 1000:6.1f} ms")
+
+def run_executor(hold_s, repeat_hz, rtt_s):
+    service = FakePTZService(rtt_s)
+    ptz = PTZExecutor(service, "token")
+    blocked = []
+    start = time.monotonic()
+    while time.monotonic() - start < hold_s:
+        t0 = time.monotonic()
+        ptz.submit("cam_left", VELOCITY)
+        blocked.append(time.monotonic() - t0)
+        time.sleep(1 / repeat_hz)
+    release = time.monotonic_ns()
+    time.sleep(ptz.stop_after_s + 3 * rtt_s)
+    stops = [t for t, op, _ in service.calls if op == "Stop"]
+    ptz.close()
+    latencies = list(ptz.latencies_ns)
+    print(f"executor   taps={ptz.submitted:4d}  soap_calls={len(service.calls):4d}  "
+          f"loop_blocked p50={percentile(blocked, 50) * 1e6:6.1f} us max={max(blocked) * 1e6:6.1f} us")
+    print(f"           moves={ptz.moves_sent} stops={ptz.stops_sent} merge_ratio={ptz.merge_ratio():.1f}  "
+          f"submit->move p50={percentile(latencies, 50) / 1e6:5.1f} ms  "
+          f"release->stop={(stops[-1] - release) / 1e6 if stops else float('nan'):5.1f} ms")
+    assert ptz.stops_sent == 1, "one Stop expected after the key is released"
+    assert max(blocked) < 0.005, "submit() must not block the event loop"
+
+if __name__ == "__main__":
+    hold_s = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    repeat_hz = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    rtt_s = (float(sys.argv[3]) if len(sys.argv) > 3 else 40.0) / 1000
+    print(f"Holding pan for {hold_s}s at {repeat_hz} commands/s, SOAP RTT {rtt_s * 1000:.0f} ms")
+    run_blocking(hold_s, repeat_hz, rtt_s)
+    run_executor(hold_s, repeat_hz, rtt_s)
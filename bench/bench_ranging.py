@@ -0,0 +1,91 @@
+# bench_ranging.py
+# Compares the old busy-wait read_distance() with the interrupt-driven
+# UltrasonicRanger on the fake GPIO backend: achieved rate, accuracy and CPU time.
+# Usage: python bench/bench_ranging.py [seconds] [rate_hz]
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from gpio_backend import FakeGPIO # noqa: E402
+from ranging import UltrasonicRanger # noqa: E402
+
+TRIG, ECHO = 31, 32
+OBSTACLE_CM = 80.0
+
+def busy_wait_read_distance(gpio):
+    # The original robot_listener.read_distance(), kept here as the baseline
+    gpio.output(TRIG, True)
+    time.sleep(0.00001)
+    gpio.output(TRIG, False)
+    start = time.time()
+    timeout = start + 0.05
+    while gpio.input(ECHO) == 0 and time.time() < timeout:
+        start = time.time()
+    stop = time.time()
+    timeout = stop + 0.05
+    while gpio.input(ECHO) == 1 and time.time() < timeout:
+        stop = time.time()
+    distance = round((stop - start) * 17150, 2)
+    return distance if 2 <= distance <= 300 else -1
+
+def run_busy_wait(seconds, rate_hz):
+    gpio = FakeGPIO()
+    gpio.setup(TRIG, gpio.OUT)
+    gpio.setup(ECHO, gpio.IN)
+    gpio.attach_ultrasonic(TRIG, ECHO).set(OBSTACLE_CM)
+    gpio._ensure_thread()
+    readings = []
+    cpu = 0.0
+
+    def loop():
+        nonlocal cpu
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            t0 = time.thread_time()
+            readings.append(busy_wait_read_distance(gpio))
+            cpu += time.thread_time() - t0
+            time.sleep(1 / rate_hz)
+
+    # On real hardware the echo is an external signal; here the fake GPIO thread
+    # must win the GIL from the spinning loop, so shorten the switch interval
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(0.0001)
+    thread = threading.Thread(target=loop)
+    thread.start()
+    thread.join()
+    sys.setswitchinterval(switch_interval)
+    gpio.cleanup()
+    return readings, cpu
+
+def run_ranger(seconds, rate_hz):
+    gpio = FakeGPIO()
+    gpio.attach_ultrasonic(TRIG, ECHO).set(OBSTACLE_CM)
+    ranger = UltrasonicRanger(gpio, TRIG, ECHO, rate_hz=rate_hz)
+    readings = []
+    ranger.add_listener(lambda sample: readings.append(sample.value))
+    cpu_before = time.process_time()
+    ranger.start()
+    time.sleep(seconds)
+    ranger.stop()
+    cpu = time.process_time() - cpu_before # Includes the fake GPIO scheduler thread
+    gpio.cleanup()
+    return readings, cpu, ranger
+
+def report(name, readings, cpu, seconds):
+    valid = [r for r in readings if r != -1]
+    error = sum(abs(r - OBSTACLE_CM) for r in valid) / len(valid) if valid else float("nan")
+    print(f"{name:<12} rate={len(readings) / seconds:6.1f} Hz  valid={len(valid)}/{len(readings)}  "
+          f"mean_err={error:5.2f} cm  cpu={cpu * 1000 / max(len(readings), 1):7.3f} ms/ping  "
+          f"cpu_share={cpu / seconds * 100:5.1f}%")
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    rate_hz = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+    print(f"Obstacle at {OBSTACLE_CM} cm, {seconds}s per run, target {rate_hz} Hz")
+    readings, cpu = run_busy_wait(seconds, rate_hz)
+    report("busy-wait", readings, cpu, seconds)
+    readings, cpu, ranger = run_ranger(seconds, rate_hz)
+    report("edge-ranger", readings, cpu, seconds)
+    print(f"edge-ranger timeouts={ranger.timeouts} overruns={ranger.overruns}")
@@ -0,0 +1,168 @@
+# bench_recorder.py
+# Pre/post-event recorder (local/event_recorder.py) with a synthetic source.
+# Part 1: ring memory and append cost at camera-like bitrates, and how many
+# seconds RING_BYTES holds. Part 2: writer throughput, muxing H.264 packets
+# (the synthetic pattern encoded with libx264) into fragmented MP4 as fast as
+# it can. Part 3: packets fed in real time while events are triggered, with
+# the card emulated by a throttled file: trigger-to-disk latency (pre-event
+# backlog flushed and fsynced), size of the writes the card sees, packets
+# dropped, and the longest add() and trigger() on the producing thread
+# (the live path).
+# Requires PyAV with libx264.
+# Usage: python bench/bench_recorder.py [event_seconds]
+import fractions
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local"))
+
+import av # noqa: E402
+import numpy as np # noqa: E402
+import event_recorder # noqa: E402
+from event_recorder import EventRecorder, PacketRing, RING_BYTES # noqa: E402
+from frame_capture import SyntheticSource # noqa: E402
+
+FPS = 15
+GOP = 30
+CARDS = ( # name, bytes/s, seconds per write call (0 = no throttle)
+    ("tmpfs", None, 0.0),
+    ("SD card", 10e6, 0.002),
+    ("worn SD card", 1e6, 0.020),
+)
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+def encoded_packets(seconds, bitrate, width=640, height=360):
+    """The synthetic pattern as H.264 packets: (bytes, keyframe), one per frame."""
+    source = SyntheticSource(width, height, format="yuv420p", noise=True)
+    source.open()
+    frame = np.empty(source.shape, np.uint8)
+    context = av.CodecContext.create("libx264", "w")
+    context.width, context.height, context.pix_fmt = width, height, "yuv420p"
+    context.time_base = fractions.Fraction(1, FPS)
+    context.bit_rate, context.gop_size, context.max_b_frames = bitrate, GOP, 0
+    context.options = {"preset": "ultrafast", "tune": "zerolatency"}
+    packets = []
+    for i in range(int(seconds * FPS)):
+        source.read(frame)
+        video_frame = av.VideoFrame.from_ndarray(frame, format="yuv420p")
+        video_frame.pts = i
+        packets += [(bytes(packet), packet.is_keyframe) for packet in context.encode(video_frame)]
+    return packets
+
+# === Part 1: Ring ===
+def ring_cost():
+    print(f"Packet ring, {RING_BYTES / 2 ** 20:.0f} MiB, {FPS} fps, keyframe every {GOP} frames")
+    print(f"{'bitrate':>8} {'holds s':>8} {'index KiB':>10} {'append us':>10}")
+    rng = np.random.default_rng(0)
+    for bitrate in (500_000, 1_500_000, 4_000_000, 8_000_000):
+        size = bitrate / 8 / FPS
+        payloads = [rng.bytes(int(size * (4 if i % GOP == 0 else 0.9))) for i in range(GOP)]
+        tracemalloc.start()
+        ring = PacketRing(RING_BYTES, keep_s=3600) # Only the byte budget limits it here
+        baseline = tracemalloc.get_traced_memory()[0]
+        costs = []
+        for i in range(FPS * 120):
+            start = time.perf_counter()
+            ring.append(payloads[i % GOP], i / FPS, i % GOP == 0)
+            costs.append((time.perf_counter() - start) * 1e6)
+        index = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        print(f"{bitrate / 1e6:>6.1f}M {ring.duration():>8.1f} {index / 1024:>10.1f} {percentile(costs, 50):>10.1f}")
+
+# === Part 2: Writer Throughput ===
+def writer_throughput(packets, directory):
+    recorder = EventRecorder("throughput", directory, pre_s=0, post_s=3600, segment_s=10)
+    recorder.configure("h264", 640, 360)
+    recorder.add(packets[0][0], 0.0, True)
+    recorder.trigger("bench")
+    count, total = 0, 0
+    start = time.perf_counter()
+    while total < 200 * 2 ** 20:
+        data, keyframe = packets[count % len(packets)]
+        count += 1
+        while not recorder.writer.put(("packet", count / FPS, keyframe, data), len(data)):
+            time.sleep(0.001) # Unlike add(), wait for the writer: this measures its throughput
+        total += len(data)
+    recorder.close()
+    elapsed = time.perf_counter() - start
+    print(f"\nWriter throughput: {total / 2 ** 20 / elapsed:.0f} MiB/s "
+          f"({count / elapsed:.0f} packets/s, {recorder.writer.segments} segments) on this machine")
+
+# === Part 3: Events in Real Time ===
+class ThrottledFile(io.FileIO):
+    """A file whose writes take as long as they would on a slow card."""
+    rate = None
+    per_write_s = 0.0
+    writes = []
+
+    def write(self, data):
+        ThrottledFile.writes.append(len(data))
+        if self.rate:
+            time.sleep(self.per_write_s + len(data) / self.rate)
+        return super().write(data)
+
+def throttled_open(path, mode, buffering):
+    return io.BufferedWriter(ThrottledFile(path, mode), buffering)
+
+def realtime_events(packets, directory, card, event_s):
+    name, rate, per_write_s = card
+    ThrottledFile.rate, ThrottledFile.per_write_s, ThrottledFile.writes = rate, per_write_s, []
+    recorder = EventRecorder(name.replace(" ", "-"), directory, pre_s=event_s, post_s=event_s, segment_s=event_s)
+    recorder.configure("h264", 640, 360)
+    add_ms, trigger_ms = [], []
+    start = time.monotonic()
+    # Warm up the ring, trigger, trigger again mid-event (extends it), run past the end
+    schedule = {int(event_s * FPS * 1.2): "motion", int(event_s * FPS * 1.7): "brake"}
+    for i in range(int(event_s * FPS * 3.8)):
+        delay = start + i / FPS - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        if i in schedule:
+            begin = time.perf_counter()
+            recorder.trigger(schedule[i])
+            trigger_ms.append((time.perf_counter() - begin) * 1000)
+        data, keyframe = packets[i % len(packets)]
+        begin = time.perf_counter()
+        recorder.add(data, i / FPS, keyframe)
+        add_ms.append((time.perf_counter() - begin) * 1000)
+    recorder.close()
+    stats = recorder.stats()
+    writes = ThrottledFile.writes
+    print(f"{name:<13} {stats['trigger_to_disk_max_ms']:>8.0f} {max(trigger_ms):>8.2f} {percentile(writes, 50) / 1024:>9.0f} "
+          f"{len(writes):>7} {stats['write_dropped']:>8} {percentile(add_ms, 99):>9.3f} {max(add_ms):>8.3f}")
+
+def decoded_frames(directory):
+    frames = 0
+    for entry in sorted(os.listdir(directory)):
+        with av.open(os.path.join(directory, entry)) as container:
+            frames += sum(1 for _ in container.decode(video=0))
+    return frames
+
+def main(event_s):
+    event_recorder.print = lambda *args, **kwargs: None # Quiet the per-event lines
+    ring_cost()
+    packets = encoded_packets(GOP * 4 / FPS, 1_500_000)
+    rate = sum(len(data) for data, _ in packets) * 8 / (len(packets) / FPS)
+    with tempfile.TemporaryDirectory() as directory:
+        writer_throughput(packets, directory)
+
+    print(f"\nReal time at {rate / 1e6:.1f} Mbps: {event_s:.0f}s pre-event, {event_s:.0f}s post-event, "
+          f"motion trigger then a brake trigger {event_s / 2:.0f}s into the event")
+    print(f"{'card':<13} {'disk ms':>8} {'trig ms':>8} {'write KiB':>9} {'writes':>7} {'dropped':>8} {'add p99 ms':>9} {'add max':>8}")
+    event_recorder.open = throttled_open
+    for card in CARDS:
+        with tempfile.TemporaryDirectory() as directory:
+            realtime_events(packets, directory, card, event_s)
+            files = len(os.listdir(directory))
+            expected = int(event_s * FPS * (1 + 1 + 0.5)) # Pre-event (from a keyframe at or before it), post-event, extension
+            print(f"{'':<13} {files} segments, {decoded_frames(directory)} frames decoded (~{expected} expected)")
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 4.0)
@@ -0,0 +1,156 @@
+# bench_rtsp.py
+# CCTV publisher CPU and latency, transcode vs H.264 pass-through, against a
+# local RTSP test source. Starts MediaMTX and an FFmpeg "camera" publishing a
+# 640x360 H.264 stream that flashes between black and white every 0.5 s, runs
+# send_cctv_stream_to_server in each mode in a child process, and watches the
+# flashes both on the camera's RTSP stream and on the published WebRTC stream
+# (WHEP). Latency is the delay the publisher adds between the two; CPU% is the
+# publisher process's user+system time.
+# Requires ffmpeg and mediamtx on PATH and aiortc/av installed.
+# Usage: python bench/bench_rtsp.py [seconds]
+import asyncio
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local"))
+
+RTSP_PORT = 8654
+WEBRTC_PORT = 8989
+CAMERA_PATH = "camera"
+FLASH_LEVEL = 128 # Mean luma above this is a white frame
+
+MEDIAMTX_CONFIG = f"""
+logLevel: error
+rtspAddress: :{RTSP_PORT}
+rtmp: no
+hls: no
+srt: no
+webrtcAddress: :{WEBRTC_PORT}
+paths:
+  all_others:
+"""
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+# === Test Camera ===
+def start_camera(directory):
+    config = os.path.join(directory, "mediamtx.yml")
+    with open(config, "w") as f:
+        f.write(MEDIAMTX_CONFIG)
+    mediamtx = subprocess.Popen(["mediamtx", config], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1)
+    flash = "color=c=black:s=640x360:r=30,geq=lum='if(lt(mod(T\\,1)\\,0.5)\\,16\\,235)':cb=128:cr=128"
+    ffmpeg = subprocess.Popen(
+        ["ffmpeg", "-loglevel", "error", "-re", "-f", "lavfi", "-i", flash,
+         "-c:v", "libx264", "-preset", "ultrafast", "-tune", "zerolatency", "-g", "30", "-pix_fmt", "yuv420p",
+         "-f", "rtsp", "-rtsp_transport", "tcp", f"rtsp://127.0.0.1:{RTSP_PORT}/{CAMERA_PATH}"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(2)
+    return [mediamtx, ffmpeg]
+
+# === Publisher Process ===
+def run_publisher(pass_through, endpoint):
+    import builtins
+    import send_cctv_stream_to_server as cctv
+    builtins.print = lambda *args, **kwargs: None
+    cctv.CAMERA_IP, cctv.RTSP_PORT, cctv.RTSP_STREAM = "127.0.0.1", str(RTSP_PORT), CAMERA_PATH
+    cctv.RTSP_OPTIONS = dict(cctv.RTSP_OPTIONS, rtsp_transport="tcp")
+    cctv.SERVER_IP, cctv.SERVER_PORT, cctv.MediaMTX_ENDPOINT = "127.0.0.1", str(WEBRTC_PORT), endpoint
+    asyncio.run(cctv.publish_stream(pass_through=pass_through))
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK") # utime + stime
+
+# === Flash Watchers ===
+def watch_rtsp(flashes, stop):
+    """Reference: when each white flash leaves the camera, decoded straight from RTSP."""
+    import av
+    container = av.open(f"rtsp://127.0.0.1:{RTSP_PORT}/{CAMERA_PATH}", options={"rtsp_transport": "tcp", "fflags": "nobuffer"})
+    white = False
+    for frame in container.decode(video=0):
+        if stop.is_set():
+            break
+        now = time.monotonic()
+        bright = frame.to_ndarray(format="gray").mean() > FLASH_LEVEL
+        if bright and not white:
+            flashes.append(now)
+        white = bright
+    container.close()
+
+async def watch_whep(endpoint, flashes, seconds):
+    """When each white flash arrives over WebRTC, pulled from MediaMTX with WHEP."""
+    from aiohttp import ClientSession
+    from aiortc import RTCPeerConnection, RTCSessionDescription
+    pc = RTCPeerConnection()
+    pc.addTransceiver("video", direction="recvonly")
+    track_ready = asyncio.get_running_loop().create_future()
+    pc.on("track", lambda track: track_ready.set_result(track))
+    await pc.setLocalDescription(await pc.createOffer())
+    async with ClientSession() as session:
+        async with session.post(f"http://127.0.0.1:{WEBRTC_PORT}/{endpoint}/whep", data=pc.localDescription.sdp,
+                                headers={"Content-Type": "application/sdp"}) as resp:
+            await pc.setRemoteDescription(RTCSessionDescription(sdp=await resp.text(), type="answer"))
+    track = await track_ready
+    white = False
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = await track.recv()
+        bright = frame.to_ndarray(format="gray").mean() > FLASH_LEVEL
+        if bright and not white:
+            flashes.append(time.monotonic())
+        white = bright
+    await pc.close()
+
+def added_latency(reference, published):
+    """ms from each camera flash to the first published flash after it (within one flash period)."""
+    delays = []
+    for sent in reference:
+        arrived = next((t for t in published if t >= sent), None)
+        if arrived is not None and arrived - sent < 1:
+            delays.append((arrived - sent) * 1000)
+    return delays
+
+# === Driver ===
+def run(mode, pass_through, seconds):
+    endpoint = f"bench-{mode}"
+    publisher = multiprocessing.Process(target=run_publisher, args=(pass_through, endpoint))
+    publisher.start()
+    time.sleep(3) # RTSP setup, WHIP and ICE
+    reference, published, stop = [], [], threading.Event()
+    watcher = threading.Thread(target=watch_rtsp, args=(reference, stop), daemon=True)
+    watcher.start()
+    cpu_start, wall_start = cpu_seconds(publisher.pid), time.monotonic()
+    asyncio.run(watch_whep(endpoint, published, seconds))
+    cpu = (cpu_seconds(publisher.pid) - cpu_start) / (time.monotonic() - wall_start) * 100
+    stop.set()
+    publisher.terminate()
+    publisher.join()
+    delays = added_latency(reference, published)
+    print(f"{mode:<14} {cpu:>6.1f} {percentile(delays, 50):>11.1f} {percentile(delays, 90):>11.1f} {len(delays):>8}")
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 20.0
+    missing = [tool for tool in ("ffmpeg", "mediamtx") if shutil.which(tool) is None]
+    if missing:
+        sys.exit(f"bench_rtsp needs {' and '.join(missing)} on PATH")
+    directory = tempfile.mkdtemp()
+    camera = start_camera(directory)
+    try:
+        print(f"640x360 H.264 test camera, 30 fps, GOP 30, {seconds}s per mode")
+        print(f"{'mode':<14} {'CPU %':>6} {'added p50':>11} {'added p90':>11} {'flashes':>8}  (ms)")
+        run("transcode", False, seconds)
+        run("pass-through", True, seconds)
+    finally:
+        for process in camera:
+            process.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
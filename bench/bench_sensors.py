@@ -0,0 +1,101 @@
+# bench_sensors.py
+# UltrasonicArray on the fake GPIO echo model with four sensors. Part 1:
+# achieved pings per second per sensor for each direction of travel, the
+# longest gap between two pings of the sensor facing forward (what the brake
+# has to cover), and CPU per ping including the fake GPIO thread. Part 2:
+# crosstalk, with the fake sensors hearing each other's pulses: readings off
+# by more than ERROR_CM when four UltrasonicRangers fire independently at the
+# same rate, and with the array's one-at-a-time schedule.
+# Usage: python bench/bench_sensors.py [seconds] [max_rate_hz]
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from gpio_backend import FakeGPIO # noqa: E402
+from ranging import UltrasonicArray, UltrasonicRanger # noqa: E402
+
+SENSORS = [("front", 31, 32), ("rear", 29, 22), ("left", 18, 11), ("right", 40, 12)]
+OBSTACLES_CM = {"front": 80.0, "rear": 150.0, "left": 40.0, "right": 200.0}
+FACING = {"forward": "front", "backward": "rear", "left": "left", "right": "right"}
+ERROR_CM = 10.0 # Well above the fake echo model's timing jitter on a busy box
+
+def make_gpio(crosstalk=False):
+    gpio = FakeGPIO()
+    gpio.crosstalk = crosstalk
+    for name, trig, echo in SENSORS:
+        gpio.attach_ultrasonic(trig, echo).set(OBSTACLES_CM[name])
+    return gpio
+
+# === Part 1: Rates ===
+def rates(seconds, max_rate_hz):
+    print(f"Pings per second per sensor ({len(SENSORS)} sensors, max {max_rate_hz} Hz each, {seconds:.0f} s per motion)")
+    print(f"{'motion':<9}" + "".join(f"{name:>8}" for name, _, _ in SENSORS) +
+          f"{'total':>8}{'max gap ms':>12}{'cpu us/ping':>13}{'overruns':>10}")
+    for motion in ("stop", "forward", "backward", "left"):
+        gpio = make_gpio()
+        array = UltrasonicArray(gpio, SENSORS, max_rate_hz=max_rate_hz)
+        array.set_motion(motion)
+        facing = array.index(FACING.get(motion, "front"))
+        pings = []
+        array.add_listener(lambda vector: pings.append((vector.sensor, vector.samples[vector.sensor].timestamp_ns)))
+        cpu = time.process_time()
+        array.start()
+        time.sleep(seconds)
+        array.stop()
+        cpu = time.process_time() - cpu
+        gpio.cleanup()
+        times = [t for sensor, t in pings if sensor == facing]
+        gap_ms = max((b - a for a, b in zip(times, times[1:])), default=0) / 1e6
+        print(f"{motion:<9}" + "".join(f"{count / seconds:>8.1f}" for count in array.pings) +
+              f"{len(pings) / seconds:>8.1f}{gap_ms:>12.1f}{cpu / max(len(pings), 1) * 1e6:>13.0f}{array.overruns:>10}")
+
+# === Part 2: Crosstalk ===
+def bad_readings(readings):
+    return {name: (sum(abs(value - OBSTACLES_CM[name]) > ERROR_CM for value in values), len(values))
+            for name, values in readings.items()}
+
+def free_running(seconds, rate_hz):
+    gpio = make_gpio(crosstalk=True)
+    readings = {name: [] for name, _, _ in SENSORS}
+    rangers = []
+    for name, trig, echo in SENSORS:
+        ranger = UltrasonicRanger(gpio, trig, echo, rate_hz=rate_hz)
+        ranger.add_listener(lambda sample, name=name: readings[name].append(sample.value))
+        rangers.append(ranger)
+    for ranger in rangers:
+        ranger.start()
+        time.sleep(0.007) # Staggered, as separate threads would drift anyway
+    time.sleep(seconds)
+    for ranger in rangers:
+        ranger.stop()
+    gpio.cleanup()
+    return bad_readings(readings)
+
+def scheduled(seconds, rate_hz):
+    gpio = make_gpio(crosstalk=True)
+    array = UltrasonicArray(gpio, SENSORS, max_rate_hz=rate_hz)
+    readings = {name: [] for name, _, _ in SENSORS}
+    array.add_listener(lambda vector: readings[array.names[vector.sensor]].append(vector.samples[vector.sensor].value))
+    array.start()
+    time.sleep(seconds)
+    array.stop()
+    gpio.cleanup()
+    return bad_readings(readings), array.stray_edges
+
+def crosstalk(seconds, rate_hz):
+    print(f"\nReadings off by more than {ERROR_CM:.0f} cm with crosstalk "
+          f"(obstacles {', '.join(f'{name} {cm:.0f}' for name, cm in OBSTACLES_CM.items())} cm)")
+    results, stray = scheduled(seconds, rate_hz)
+    for label, result in (("independent rangers", free_running(seconds, rate_hz)), ("UltrasonicArray", results)):
+        cells = "".join(f"{name:>7} {bad:>3}/{total:<4}" for name, (bad, total) in result.items())
+        print(f"  {label:<20}{cells}")
+    print(f"  UltrasonicArray stray echo edges: {stray}")
+
+def main(seconds, max_rate_hz):
+    rates(seconds, max_rate_hz)
+    crosstalk(seconds, max_rate_hz)
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 20.0)
@@ -0,0 +1,165 @@
+# bench_shard.py
+# Local load generator for websoket_server's scale-out mode. Starts the server
+# with 1, 2 and 4 worker processes, then load processes that each simulate
+# robots (a Pi link sending 20 Hz telemetry frames), browser viewers per robot
+# and a browser sending drive commands. Connections land on workers at random
+# (SO_REUSEPORT), so most traffic crosses the shard bus. Reports delivered
+# telemetry and commands per second and telemetry latency per worker count.
+# Throughput can only scale with worker count on a machine with spare cores.
+# Usage: python bench/bench_shard.py [robots] [viewers_per_robot] [seconds]
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import aiohttp # noqa: E402
+from pi_link import CHANNELS as LINK_CHANNELS, LINK_PATH, LinkSession, encode_message # noqa: E402
+from telemetry_protocol import BINARY_SUBPROTOCOL, CHANNELS, HEADER, TelemetrySample, encode_frame # noqa: E402
+
+PORT = 9936
+TELEMETRY_HZ = 20
+COMMAND_HZ = 10
+LOADERS = 2
+WORKER_COUNTS = (1, 2, 4)
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+# === Server Process ===
+def run_server(workers):
+    os.environ["ROBOT_SERVER_PORT"] = str(PORT)
+    os.chdir(tempfile.mkdtemp()) # websoket_server logs and serves ./static relative to the cwd
+    os.makedirs("static")
+    import websoket_server as ws_srv
+    from aiohttp import web
+    from shard import run_workers
+    logging.disable(logging.WARNING) # Per-message log lines would dominate the measurement
+    if workers > 1:
+        run_workers(workers, ws_srv.serve_worker)
+    else:
+        web.run_app(ws_srv.main(), host="127.0.0.1", port=PORT, print=None)
+
+def wait_for_port():
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", PORT), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+
+# === Load Processes ===
+async def pi(session, robot_id, stop, counts):
+    link = LinkSession()
+    async with session.ws_connect(f"http://127.0.0.1:{PORT}{LINK_PATH}?robot={robot_id}") as ws:
+        await ws.send_str(link.hello())
+        await ws.receive() # Server hello
+
+        async def read():
+            async for msg in ws:
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    message = json.loads(msg.data)
+                    if message.get("ch") == LINK_CHANNELS["control"] and "action" in (message.get("data") or {}):
+                        counts["commands_received"] += 1
+        reader = asyncio.create_task(read())
+        seq = 0
+        while not stop.is_set():
+            seq += 1
+            frame = encode_frame(seq, [TelemetrySample(CHANNELS["distance"], time.monotonic_ns(), 50.0)])
+            await ws.send_bytes(encode_message(seq, LINK_CHANNELS["telemetry"], frame))
+            counts["telemetry_sent"] += 1
+            await asyncio.sleep(1 / TELEMETRY_HZ)
+        reader.cancel()
+
+async def viewer(session, robot_id, stop, counts, latencies):
+    async with session.ws_connect(f"http://127.0.0.1:{PORT}/distance?robot={robot_id}",
+                                  protocols=(BINARY_SUBPROTOCOL,)) as ws:
+        while not stop.is_set():
+            try:
+                msg = await ws.receive(timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if msg.type != aiohttp.WSMsgType.BINARY:
+                break
+            counts["telemetry_delivered"] += 1
+            base_ns = HEADER.unpack_from(msg.data)[5] # CLOCK_MONOTONIC is shared by every process
+            latencies.append((time.monotonic_ns() - base_ns) / 1e6)
+
+async def commander(session, robot_id, stop, counts):
+    async with session.ws_connect(f"http://127.0.0.1:{PORT}/control?robot={robot_id}") as ws:
+        value = 0
+        while not stop.is_set():
+            value = (value + 1) % 100
+            await ws.send_str(json.dumps({"action": "forward", "value": value, "ts": time.time() * 1000}))
+            counts["commands_sent"] += 1
+            await asyncio.sleep(1 / COMMAND_HZ)
+
+async def load_main(robot_ids, viewers, seconds, results):
+    counts = dict.fromkeys(("telemetry_sent", "telemetry_delivered", "commands_sent", "commands_received"), 0)
+    latencies = []
+    stop = asyncio.Event()
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = []
+        for robot_id in robot_ids:
+            tasks.append(asyncio.create_task(pi(session, robot_id, stop, counts)))
+            tasks += [asyncio.create_task(viewer(session, robot_id, stop, counts, latencies)) for _ in range(viewers)]
+        await asyncio.sleep(1) # Let every Pi register before commands start
+        tasks += [asyncio.create_task(commander(session, robot_id, stop, counts)) for robot_id in robot_ids]
+        await asyncio.sleep(0.5)
+        start = dict(counts)
+        await asyncio.sleep(seconds)
+        measured = {key: counts[key] - start[key] for key in counts}
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    results.put((measured, latencies[len(latencies) // 4:])) # Skip connection warm-up
+
+def run_load(robot_ids, viewers, seconds, results):
+    asyncio.run(load_main(robot_ids, viewers, seconds, results))
+
+# === Driver ===
+def run(workers, robots, viewers, seconds):
+    server = multiprocessing.Process(target=run_server, args=(workers,))
+    server.start()
+    wait_for_port()
+    time.sleep(0.5) # Every worker bound
+    results = multiprocessing.Queue()
+    robot_ids = [f"robot-{index}" for index in range(robots)]
+    loaders = [multiprocessing.Process(target=run_load, args=(robot_ids[index::LOADERS], viewers, seconds, results))
+               for index in range(LOADERS)]
+    for loader in loaders:
+        loader.start()
+    totals, latencies = {}, []
+    for _ in loaders:
+        counts, loader_latencies = results.get()
+        latencies += loader_latencies
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+    for loader in loaders:
+        loader.join()
+    server.terminate()
+    server.join()
+
+    expected = totals["telemetry_sent"] * viewers
+    print(f"{workers:>7} {totals['telemetry_sent'] / seconds:>12,.0f} {totals['telemetry_delivered'] / seconds:>13,.0f} "
+          f"{totals['telemetry_delivered'] / expected if expected else 0:>9.1%} "
+          f"{totals['commands_received'] / seconds:>10,.0f} {totals['commands_sent'] / seconds:>10,.0f} "
+          f"{percentile(latencies, 50):>9.1f} {percentile(latencies, 99):>9.1f}")
+
+if __name__ == "__main__":
+    robots = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    viewers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+    print(f"{robots} robots at {TELEMETRY_HZ} Hz, {viewers} viewers each, commands at {COMMAND_HZ} Hz per robot, "
+          f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>7} {'telemetry/s':>12} {'delivered/s':>13} {'delivery':>9} "
+          f"{'cmds in/s':>10} {'cmds out/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for workers in WORKER_COUNTS:
+        run(workers, robots, viewers, seconds)
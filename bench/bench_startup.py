@@ -0,0 +1,190 @@
+# bench_startup.py
+# robot_listener startup time: process launch -> server link up -> first
+# command accepted -> camera ready -> first pan reaching the camera. Each run
+# starts robot_listener in a fresh process on FakeGPIO with the real
+# onvif-zeep pointed at a local ONVIF stand-in (sim/onvif_service.py); this
+# script plays the server end of the link and sends a stop and a cam_left
+# every COMMAND_INTERVAL. Three modes:
+#   before  camera discovery before main(), as robot_listener did at import
+#   cold    background discovery (onvif_connector), no cache on disk
+#   warm    background setup from the cache a cold run wrote
+# Requires onvif-zeep.
+# Usage: python bench/bench_startup.py [runs] [rtt_ms]
+import asyncio
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "server"))
+sys.path.insert(0, os.path.join(ROOT, "sim"))
+
+LINK_PORT = 9970
+ONVIF_PORT = 9971
+COMMAND_INTERVAL = 0.02 # Seconds between command pairs, like a browser's key repeat
+RUN_TIMEOUT = 20.0
+ONVIF_USER = ONVIF_PASS = "admin"
+
+# === Robot Process ===
+def robot(link_port, onvif_port, wsdl_dir, cache_path, mode):
+    """Runs in the child: robot_listener with its config pointed at the bench."""
+    def report(event):
+        sys.stdout.write(f"BENCH {json.dumps({'event': event, 't': time.time()})}\n") # One write: threads print too
+        sys.stdout.flush()
+
+    os.environ["ROBOT_GPIO_BACKEND"] = "fake"
+    import robot_listener
+    from onvif_connector import discover
+    from pi_link import LINK_PATH
+    report("imported")
+    robot_listener.METRICS_PORT = 0
+    robot_listener.LOCAL_TELEMETRY_PORT = 0
+    robot_listener.link_client.uri = f"ws://127.0.0.1:{link_port}{LINK_PATH}"
+    camera = robot_listener.camera
+    camera.host, camera.port, camera.user, camera.passwd = "127.0.0.1", onvif_port, ONVIF_USER, ONVIF_PASS
+    camera.wsdl_dir = wsdl_dir
+    camera.cache_path = cache_path if mode != "before" else None
+    on_ready = camera.on_ready
+
+    def camera_ready(ptz_service, token):
+        on_ready(ptz_service, token)
+        report("camera")
+    camera.on_ready = camera_ready
+    drive = robot_listener.handle_drive_action
+
+    def first_drive(action, speed):
+        if robot_listener.handle_drive_action is first_drive:
+            robot_listener.handle_drive_action = drive
+            report("command")
+        drive(action, speed)
+    robot_listener.handle_drive_action = first_drive
+    if mode == "before":
+        binding, ptz_service = discover("127.0.0.1", onvif_port, ONVIF_USER, ONVIF_PASS, wsdl_dir)
+        camera.start = lambda: None
+        camera_ready(ptz_service, binding["token"])
+    try:
+        asyncio.run(robot_listener.main())
+    finally:
+        robot_listener.watchdog.stop()
+        robot_listener.ranger.stop()
+
+# === Server End ===
+class Bench:
+    def __init__(self, standin):
+        self.standin = standin
+        self.run = None # Event -> wall time for the run in progress
+        move = standin.op_ContinuousMove
+
+        def first_move(body):
+            if self.run is not None:
+                self.run.setdefault("pan", time.time())
+            return move(body)
+        standin.op_ContinuousMove = first_move
+
+    async def handle_link(self, request):
+        from aiohttp import web
+        from pi_link import LinkSession
+        from command_pipeline import wall_ms
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        link = LinkSession()
+        link.on("telemetry", lambda payload: None)
+        link.handshake((await ws.receive(timeout=5)).data)
+        await ws.send_str(link.hello())
+
+        async def send_raw(data):
+            if isinstance(data, bytes):
+                await ws.send_bytes(data)
+            else:
+                await ws.send_str(data)
+        link.attach(send_raw)
+        if self.run is not None:
+            self.run.setdefault("link", time.time())
+
+        async def commands():
+            seq = 0
+            while not ws.closed:
+                for action in ("stop", "cam_left"):
+                    seq += 1
+                    link.send("control", {"action": action, "seq": seq, "server_ts": wall_ms()})
+                await asyncio.sleep(COMMAND_INTERVAL)
+        sender = asyncio.ensure_future(commands())
+        try:
+            async for msg in ws:
+                link.receive(msg.data)
+        finally:
+            sender.cancel()
+            link.detach(send_raw)
+        return ws
+
+    async def start_run(self, mode, wsdl_dir, cache_path):
+        self.run = {}
+        t0 = time.time()
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "--robot", str(LINK_PORT), str(ONVIF_PORT),
+            wsdl_dir, cache_path, mode, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        deadline = time.monotonic() + RUN_TIMEOUT
+        try:
+            while not {"command", "pan"} <= self.run.keys() and time.monotonic() < deadline:
+                try:
+                    line = await asyncio.wait_for(proc.stdout.readline(), 0.05)
+                except asyncio.TimeoutError:
+                    continue
+                if not line:
+                    break
+                if b"BENCH " in line:
+                    event, _ = json.JSONDecoder().raw_decode(line.split(b"BENCH ", 1)[1].decode())
+                    self.run.setdefault(event["event"], event["t"])
+        finally:
+            proc.terminate()
+            await proc.communicate()
+        run, self.run = self.run, None
+        return {event: (t - t0) * 1000 for event, t in run.items()}
+
+async def main(runs, rtt_ms):
+    from aiohttp import web
+    import onvif_service
+    from pi_link import LINK_PATH
+    spec = importlib.util.find_spec("onvif") # Located, not imported: the parent's import cost is not measured
+    if spec is None:
+        sys.exit("bench_startup needs onvif-zeep")
+    wsdl_dir = os.path.join(os.path.dirname(os.path.dirname(spec.origin)), "wsdl")
+    standin, standin_runner = await onvif_service.serve(ONVIF_PORT, user=ONVIF_USER, passwd=ONVIF_PASS,
+                                                        rtt_s=rtt_ms / 1000)
+    bench = Bench(standin)
+    app = web.Application()
+    app.router.add_get(LINK_PATH, bench.handle_link)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", LINK_PORT).start()
+    cache_path = os.path.join(tempfile.mkdtemp(), "onvif_cache.json")
+    events = ("imported", "link", "command", "camera", "pan")
+    print(f"robot_listener startup, {runs} runs per mode, ONVIF round trip {rtt_ms:.0f} ms "
+          f"(median ms after process launch)")
+    print(f"{'mode':<7}" + "".join(f"{event:>10}" for event in events))
+    results = {mode: [] for mode in ("before", "cold", "warm")}
+    for _ in range(runs):
+        for mode in results:
+            if mode == "cold" and os.path.exists(cache_path):
+                os.remove(cache_path)
+            results[mode].append(await bench.start_run(mode, wsdl_dir, cache_path))
+    for mode, samples in results.items():
+        cells = []
+        for event in events:
+            values = [sample[event] for sample in samples if event in sample]
+            cells.append(f"{statistics.median(values):>10.0f}" if len(values) == len(samples) else f"{'-':>10}")
+        print(f"{mode:<7}" + "".join(cells))
+    print(f"Stand-in calls: {standin.calls}, rejected {standin.rejected}")
+    await runner.cleanup()
+    await standin_runner.cleanup()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--robot":
+        robot(int(sys.argv[2]), int(sys.argv[3]), sys.argv[4], sys.argv[5], sys.argv[6])
+    else:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5,
+                         float(sys.argv[2]) if len(sys.argv) > 2 else 20.0))
@@ -0,0 +1,275 @@
+# bench_suite.py
+# End-to-end benchmark of the whole stack without hardware. Starts
+# websoket_server and N simulated robots (sim/sim_robot.py: the real
+# robot_listener on FakeGPIO, a fake ONVIF camera and a scripted obstacle
+# that keeps triggering the brake) as separate processes, plus, when aiortc
+# is installed, the WHIP publisher on its synthetic source streaming to the
+# mock WHIP endpoint (sim/mock_whip.py). Scripted browsers drive every robot
+# forward and pan its camera while viewers watch /distance. Reports command
+# latency percentiles (browser -> Pi, from the robots' own histograms),
+# telemetry throughput, CPU per component and brake reaction time (obstacle
+# crosses the stopping distance -> PWM cut), and compares them with the
+# stored baseline for the same config (bench/baselines/suite.json with video,
+# suite-novideo.json without). Exits 1 when a result is worse than the
+# baseline by more than TOLERANCE (and SLACK), or when there is no baseline
+# taken with this config to compare against.
+# Usage: python bench/bench_suite.py [seconds] [robots] [--save-baseline]
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "server"))
+
+import aiohttp # noqa: E402
+from telemetry_protocol import BINARY_SUBPROTOCOL, decode_frame # noqa: E402
+
+SERVER_PORT = 9950
+ROBOT_METRICS_PORT = 9960 # Robot i serves its metrics on ROBOT_METRICS_PORT + i
+WHIP_PORT = 9990
+BROWSERS_PER_ROBOT = 2 # Each sends forward commands at COMMAND_HZ
+VIEWERS_PER_ROBOT = 5
+COMMAND_HZ = 20
+CAMERA_HZ = 2 # One more browser per robot pans the camera
+TOLERANCE = 0.5 # Relative change from the baseline counted as a regression...
+SLACK = {"ms": 2.0, "%": 2.0, "/s": 0.0} # ...once it is also larger than this (scheduler noise at ~1 ms)
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+def baseline_path(video):
+    return os.path.join(BASELINES, "suite.json" if video else "suite-novideo.json")
+
+RESULTS = ( # key, label, unit, whether lower is better
+    ("command_age_p50", "command age p50 (browser -> Pi)", "ms", True),
+    ("command_age_p90", "command age p90", "ms", True),
+    ("command_age_p99", "command age p99", "ms", True),
+    ("server_command_age_p99", "command age p99 at the server", "ms", True),
+    ("brake_reaction_p50", "brake reaction p50", "ms", True),
+    ("brake_reaction_max", "brake reaction max", "ms", True),
+    ("commands_per_s", "commands executed by Pis", "/s", False),
+    ("telemetry_frames_per_s", "telemetry frames from Pis", "/s", False),
+    ("viewer_samples_per_s", "samples delivered to viewers", "/s", False),
+    ("server_loop_lag_p99", "server loop lag p99", "ms", True),
+    ("video_fps", "video frames decoded by the WHIP endpoint", "/s", False),
+    ("cpu_server", "CPU server", "%", True),
+    ("cpu_robot", "CPU per robot", "%", True),
+    ("cpu_publisher", "CPU publisher", "%", True),
+    ("cpu_whip", "CPU mock WHIP endpoint", "%", True),
+    ("cpu_load", "CPU browsers and viewers", "%", True),
+)
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK") # utime + stime
+
+def wait_for_port(port, timeout_s=30):
+    end = time.monotonic() + timeout_s
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Nothing listening on port {port} after {timeout_s}s")
+
+# === Components ===
+def spawn(workdir, name, args, env=None):
+    log = open(os.path.join(workdir, f"{name}.log"), "wb")
+    return subprocess.Popen([sys.executable, *args], cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+                            env={**os.environ, **(env or {})})
+
+def start_components(workdir, robots, video):
+    components = {"server": spawn(workdir, "server", [os.path.join(ROOT, "server", "websoket_server.py")],
+                                  {"ROBOT_SERVER_PORT": str(SERVER_PORT)})}
+    wait_for_port(SERVER_PORT)
+    for index in range(robots):
+        components[f"robot-{index}"] = spawn(workdir, f"robot-{index}", [
+            os.path.join(ROOT, "sim", "sim_robot.py"), f"ws://127.0.0.1:{SERVER_PORT}", f"robot-{index}",
+            str(ROBOT_METRICS_PORT + index)])
+    if video:
+        components["whip"] = spawn(workdir, "whip", [os.path.join(ROOT, "sim", "mock_whip.py"), str(WHIP_PORT)])
+        wait_for_port(WHIP_PORT)
+        components["publisher"] = spawn(workdir, "publisher", [
+            os.path.join(ROOT, "local", "whip_publisher.py"), f"http://127.0.0.1:{WHIP_PORT}/cam/whip"])
+    for index in range(robots):
+        wait_for_port(ROBOT_METRICS_PORT + index)
+    return components
+
+def stop_components(components):
+    for process in components.values():
+        process.terminate()
+    for process in components.values():
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+# === Browsers and Viewers ===
+async def get_json(session, url):
+    async with session.get(url) as response:
+        return await response.json()
+
+async def wait_for_robots(session, robots, timeout_s=30):
+    end = time.monotonic() + timeout_s
+    while time.monotonic() < end:
+        connected = (await get_json(session, f"http://127.0.0.1:{SERVER_PORT}/stats/metrics"))["robot_server_pi_connected"]
+        if sum(connected.values()) >= robots:
+            return
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"Only {sum(connected.values())} of {robots} robots connected")
+
+async def browser(session, robot_id, actions, rate, stop):
+    async with session.ws_connect(f"http://127.0.0.1:{SERVER_PORT}/control?robot={robot_id}") as ws:
+        seq = 0
+        next_at = time.monotonic()
+        while not stop.is_set():
+            seq += 1
+            await ws.send_str(json.dumps({"action": actions[seq % len(actions)], "value": 50, "seq": seq,
+                                          "ts": time.time() * 1000}))
+            next_at += 1 / rate
+            await asyncio.sleep(max(0, next_at - time.monotonic()))
+
+async def viewer(session, robot_id, counts, stop):
+    async with session.ws_connect(f"http://127.0.0.1:{SERVER_PORT}/distance?robot={robot_id}",
+                                  protocols=(BINARY_SUBPROTOCOL,)) as ws:
+        while not stop.is_set():
+            try:
+                msg = await ws.receive(timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                counts["samples"] += len(decode_frame(msg.data)[1])
+            elif msg.type != aiohttp.WSMsgType.TEXT:
+                return
+
+async def scrape(session, robots, video):
+    server = await get_json(session, f"http://127.0.0.1:{SERVER_PORT}/stats/metrics")
+    pis = [await get_json(session, f"http://127.0.0.1:{ROBOT_METRICS_PORT + index}/stats") for index in range(robots)]
+    whip = await get_json(session, f"http://127.0.0.1:{WHIP_PORT}/stats") if video else None
+    return server, pis, whip
+
+def worst(pis, name, field):
+    """Worst value of a histogram field across robots, in ms."""
+    values = [pi[name][field] for pi in pis if pi[name]["count"]]
+    return max(values) * 1000 if values else None
+
+async def run_load(components, robots, video, seconds):
+    counts = {"samples": 0}
+    async with aiohttp.ClientSession() as session:
+        await wait_for_robots(session, robots)
+        stop = asyncio.Event()
+        tasks = []
+        for index in range(robots):
+            robot_id = f"robot-{index}"
+            tasks += [asyncio.create_task(browser(session, robot_id, ("forward",), COMMAND_HZ, stop))
+                      for _ in range(BROWSERS_PER_ROBOT)]
+            tasks.append(asyncio.create_task(browser(session, robot_id, ("cam_left", "cam_right"), CAMERA_HZ, stop)))
+            tasks += [asyncio.create_task(viewer(session, robot_id, counts, stop)) for _ in range(VIEWERS_PER_ROBOT)]
+        pids = {name: process.pid for name, process in components.items()}
+        pids["load"] = os.getpid()
+        server_before, pis_before, whip_before = await scrape(session, robots, video)
+        cpu_before = {name: cpu_seconds(pid) for name, pid in pids.items()}
+        start = time.monotonic()
+        await asyncio.sleep(seconds)
+        elapsed = time.monotonic() - start
+        cpu = {name: (cpu_seconds(pid) - cpu_before[name]) / elapsed * 100 for name, pid in pids.items()}
+        server, pis, whip = await scrape(session, robots, video)
+        stop.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    accepted = sum(pi["robot_pi_commands_accepted_total"] for pi in pis)
+    accepted_before = sum(pi["robot_pi_commands_accepted_total"] for pi in pis_before)
+    frames = sum(server["robot_server_telemetry_messages_total"].values())
+    frames_before = sum(server_before["robot_server_telemetry_messages_total"].values())
+    results = {
+        "command_age_p50": worst(pis, "robot_pi_command_age_seconds", "p50"),
+        "command_age_p90": worst(pis, "robot_pi_command_age_seconds", "p90"),
+        "command_age_p99": worst(pis, "robot_pi_command_age_seconds", "p99"),
+        "server_command_age_p99": (server["robot_server_command_age_seconds"]["p99"] or 0) * 1000,
+        "brake_reaction_p50": worst(pis, "sim_brake_reaction_seconds", "p50"),
+        "brake_reaction_max": worst(pis, "sim_brake_reaction_seconds", "max"),
+        "commands_per_s": (accepted - accepted_before) / elapsed,
+        "telemetry_frames_per_s": (frames - frames_before) / elapsed,
+        "viewer_samples_per_s": counts["samples"] / elapsed,
+        "server_loop_lag_p99": (server["robot_server_loop_lag_seconds"]["p99"] or 0) * 1000,
+        "cpu_server": cpu["server"],
+        "cpu_robot": sum(cpu[f"robot-{index}"] for index in range(robots)) / robots,
+        "cpu_load": cpu["load"],
+    }
+    if video:
+        results.update(video_fps=(whip["frames"] - whip_before["frames"]) / elapsed,
+                       cpu_publisher=cpu["publisher"], cpu_whip=cpu["whip"])
+    brakes = sum(pi["sim_brake_reaction_seconds"]["count"] for pi in pis)
+    return results, brakes
+
+# === Baseline ===
+def compare(results, baseline):
+    """Print results next to the baseline; return the labels of results that regressed."""
+    regressed = []
+    print(f"{'':<44} {'now':>9} {'baseline':>9} {'change':>8}")
+    for key, label, unit, lower_is_better in RESULTS:
+        value = results.get(key)
+        if value is None:
+            continue
+        before = baseline.get(key)
+        if before is None:
+            print(f"{label:<44} {value:>9.2f} {'-':>9} {'':>8} {unit}")
+            continue
+        change = (value - before) / before if before else 0.0
+        worse = abs(value - before) > SLACK[unit] and (change > TOLERANCE if lower_is_better else change < -TOLERANCE)
+        if worse:
+            regressed.append(label)
+        print(f"{label:<44} {value:>9.2f} {before:>9.2f} {change * 100:>+7.0f}% {unit}{'  REGRESSED' if worse else ''}")
+    return regressed
+
+def main(seconds, robots, save_baseline):
+    video = importlib.util.find_spec("aiortc") is not None
+    config = {"seconds": seconds, "robots": robots, "browsers_per_robot": BROWSERS_PER_ROBOT,
+              "viewers_per_robot": VIEWERS_PER_ROBOT, "command_hz": COMMAND_HZ, "video": video}
+    print(f"{robots} simulated robots, {BROWSERS_PER_ROBOT} browsers at {COMMAND_HZ} Hz and {VIEWERS_PER_ROBOT} viewers "
+          f"each, {'with' if video else 'without (no aiortc)'} video; {seconds:.0f}s")
+    workdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(workdir, "static"))
+    components = start_components(workdir, robots, video)
+    try:
+        results, brakes = asyncio.run(run_load(components, robots, video, seconds))
+    finally:
+        stop_components(components)
+    print(f"{brakes} brakes measured; component logs in {workdir}")
+
+    path = baseline_path(video)
+    if save_baseline:
+        os.makedirs(BASELINES, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"config": config, "host": {"python": platform.python_version(), "cpus": os.cpu_count()},
+                       "results": {key: round(value, 3) for key, value in results.items() if value is not None}},
+                      f, indent=2)
+            f.write("\n")
+        compare(results, {})
+        print(f"Baseline saved to {path}")
+        return
+    if not os.path.exists(path):
+        compare(results, {})
+        sys.exit(f"No baseline at {path}; record one with --save-baseline")
+    with open(path) as f:
+        stored = json.load(f)
+    if stored["config"] != config:
+        compare(results, {})
+        sys.exit(f"Baseline {path} was taken with {stored['config']}, this run is {config}; "
+                 "run with that config or record a new baseline")
+    regressed = compare(results, stored["results"])
+    if regressed:
+        sys.exit(f"Worse than the baseline by more than {TOLERANCE:.0%}: {', '.join(regressed)}")
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--save-baseline"]
+    main(float(args[0]) if args else 20.0,
+         int(args[1]) if len(args) > 1 else 3,
+         "--save-baseline" in sys.argv)
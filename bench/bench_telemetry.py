@@ -0,0 +1,54 @@
+# bench_telemetry.py
+# Compares the per-sample JSON telemetry path (Pi json.dumps -> server json.loads,
+# rebuild dict, send_json per browser) with batched binary frames forwarded as-is.
+# Reports samples/s and bytes/s on the wire for both paths.
+# Usage: python bench/bench_telemetry.py [samples] [browsers]
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+from telemetry_protocol import CHANNELS, TelemetrySample, decode_frame, encode_frame # noqa: E402
+
+def make_samples(count):
+    now = time.monotonic_ns()
+    channels = list(CHANNELS.values())
+    return [TelemetrySample(channels[i % len(channels)], now + i * 50_000_000, 20 + (i % 250) * 1.13)
+            for i in range(count)]
+
+def run_json(samples, browsers):
+    wire_bytes = 0
+    start = time.perf_counter()
+    for channel, _, value in samples:
+        message = json.dumps({"type": "distance", "value": round(value, 2)}) # Pi
+        wire_bytes += len(message)
+        data = json.loads(message) # Server
+        broadcast_data = {"type": "distance", "value": float(data["value"])}
+        for _ in range(browsers): # send_json() serializes once per client
+            wire_bytes += len(json.dumps(broadcast_data))
+    return time.perf_counter() - start, wire_bytes
+
+def run_binary(samples, browsers, batch):
+    wire_bytes = 0
+    seq = 0
+    start = time.perf_counter()
+    for i in range(0, len(samples), batch):
+        seq += 1
+        frame = encode_frame(seq, samples[i:i + batch]) # Pi
+        decode_frame(frame) # Server
+        wire_bytes += len(frame) * (1 + browsers) # Same bytes forwarded to every client
+    return time.perf_counter() - start, wire_bytes
+
+def report(name, count, elapsed, wire_bytes):
+    print(f"{name:<14} {count / elapsed:12,.0f} samples/s  {wire_bytes / count:7.1f} wire bytes/sample  "
+          f"{wire_bytes / elapsed / 1e6:8.1f} MB/s encoded")
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    browsers = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    samples = make_samples(count)
+    print(f"{count} samples, {browsers} browser clients")
+    report("json", count, *run_json(samples, browsers))
+    for batch in (1, 5, 20, 100):
+        report(f"binary x{batch}", count, *run_binary(samples, browsers, batch))
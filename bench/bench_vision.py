@@ -0,0 +1,138 @@
+# bench_vision.py
+# Camera obstacle detection (local/vision_obstacles.py) on recorded test
+# clips of the robot driving at an obstacle (sim/floor_scene.py: a box, a
+# chair leg, an angled board and a cushion, the last three giving the
+# ultrasonic sensor no echo, and a clear floor). Part 1: per-frame cost
+# (decimated copy + detection) and accuracy for each decimation, against the
+# clip's true distance. Part 2: each clip played in real time through a
+# CaptureEngine, with a consumer taking frames like the encoder; the vision
+# stage's estimates go over UDP to LocalTelemetryProtocol and ObstacleFusion,
+# and FakeGPIO's ultrasonic sensor hears what the clip says it would. It
+# reports where the brake cuts, ultrasonic alone vs fused, how long after the
+# obstacle came inside the stopping distance, and the capture latency with
+# and without the stage.
+# Usage: python bench/bench_vision.py [clip.npz ...]   (default: render the built-in clips)
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "server"))
+sys.path.insert(0, os.path.join(ROOT, "local"))
+sys.path.insert(0, os.path.join(ROOT, "sim"))
+import floor_scene # noqa: E402
+from frame_capture import CaptureEngine # noqa: E402
+from fusion import ObstacleFusion # noqa: E402
+from gpio_backend import FakeGPIO # noqa: E402
+from ranging import UltrasonicArray # noqa: E402
+from safety import BrakeController # noqa: E402
+from telemetry_protocol import LocalTelemetryProtocol, TelemetryBatcher # noqa: E402
+from vision_obstacles import MAX_RANGE_CM, FreeSpaceDetector, VisionObstacleStage, VisionTelemetry # noqa: E402
+
+DECIMATIONS = (2, 4, 8)
+TELEMETRY_PORT = 9973
+DRIVE_SPEED = 40 # % duty; the brake's default model makes this the clip's 40 cm/s
+RANGE_CM = 200 # Accuracy is scored where the obstacle is nearer than this
+TOLERANCE = 0.15 # An estimate within 15% (or 10 cm) of the truth is a hit
+
+def tolerance(truth_cm):
+    return np.maximum(10, TOLERANCE * truth_cm)
+
+# === Part 1: Cost and Accuracy ===
+def offline(clips):
+    print("Per-frame cost (copy + detect) and accuracy; hits within 15% of the truth "
+          f"where the obstacle is nearer than {RANGE_CM} cm, phantoms nearer than the truth")
+    print(f"{'clip':<9}{'step':>5}{'grid':>9}{'p50 us':>9}{'max us':>9}{'hits':>8}{'phantoms':>10}")
+    for clip in clips:
+        for step in DECIMATIONS:
+            detector = FreeSpaceDetector()
+            costs, estimates = [], []
+            for frame in clip.frames:
+                start = time.perf_counter()
+                estimates.append(detector.detect(frame[::step, ::step].copy()).ahead_cm)
+                costs.append(time.perf_counter() - start)
+            costs.sort()
+            estimates = np.array(estimates)
+            in_range = clip.truth_cm < RANGE_CM
+            hits = np.abs(estimates - clip.truth_cm)[in_range] <= tolerance(clip.truth_cm[in_range])
+            nearest = np.minimum(clip.truth_cm, MAX_RANGE_CM) # Clear floor reads as MAX_RANGE_CM
+            phantoms = estimates < nearest - tolerance(nearest)
+            grid = f"{clip.frames.shape[2] // step}x{clip.frames.shape[1] // step}"
+            hit_cell = f"{hits.mean() * 100:.0f}%" if in_range.any() else "-"
+            print(f"{clip.name:<9}{step:>5}{grid:>9}{costs[len(costs) // 2] * 1e6:>9.0f}{costs[-1] * 1e6:>9.0f}"
+                  f"{hit_cell:>8}{phantoms.mean() * 100:>9.0f}%")
+
+# === Part 2: Live Pipeline ===
+async def live_run(clip, fused, receiver):
+    """One clip in real time; returns (cut time after the clip started or None, capture stats, stage, brake)."""
+    gpio = FakeGPIO()
+    obstacle = gpio.attach_ultrasonic(31, 32)
+    ranger = UltrasonicArray(gpio, [("front", 31, 32)])
+    brake = BrakeController(lambda action, speed: None, lambda: None, sample_period_s=1 / ranger.max_rate_hz)
+    cuts = []
+    brake.add_listener(lambda sample: cuts.append(time.monotonic()))
+    fusion = ObstacleFusion(brake.on_vector)
+    ranger.add_listener(fusion.on_vector if fused else brake.on_vector)
+    receiver.listener = fusion.on_vision
+    source = floor_scene.ClipSource(clip, loop=False)
+    engine = CaptureEngine(source, name="clip")
+    stage = VisionObstacleStage(engine)
+    telemetry = VisionTelemetry(port=TELEMETRY_PORT)
+    stage.add_listener(telemetry.send)
+    engine.start()
+    first_heard = clip.ultrasonic_cm[0] if clip.ultrasonic_cm[0] != -1 else None
+    obstacle.set(first_heard, floor_scene.SPEED_CM_S) # Closes in with the clip
+    ranger.start()
+    if fused:
+        stage.start()
+    brake.command("forward", DRIVE_SPEED)
+    duration = len(clip.frames) / clip.fps
+    try:
+        while time.monotonic() - source.started < duration and not cuts:
+            engine.latest() # The encoder's pull
+            await asyncio.sleep(1 / clip.fps)
+        await asyncio.sleep(0.2) # Let the capture latency settle after the cut
+    finally:
+        stage.stop()
+        ranger.stop()
+        engine.stop()
+        gpio.cleanup()
+        telemetry.close()
+    return (cuts[0] - source.started if cuts else None), engine.stats(), stage, brake
+
+async def live(clips):
+    print("\nBrake in real time, driving at 40 cm/s: truth distance at the cut, cut delay after the obstacle "
+          "came inside the stopping distance (negative: before), capture -> encoder latency p50, vision stage "
+          "cost and capture -> estimate sent p50")
+    print(f"{'clip':<9}{'mode':<12}{'cut at cm':>10}{'delay ms':>10}{'capture ms':>12}{'vision us':>11}{'vision ms':>11}")
+    receiver = LocalTelemetryProtocol(TelemetryBatcher())
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: receiver, local_addr=("127.0.0.1", TELEMETRY_PORT))
+    for clip in clips:
+        for fused in (False, True):
+            cut, capture, stage, brake = await live_run(clip, fused, receiver)
+            threshold = brake.stopping_distance(DRIVE_SPEED)
+            if cut is None:
+                cut_cell = delay_cell = "-"
+            else:
+                truth = floor_scene.START_CM - floor_scene.SPEED_CM_S * cut if np.isfinite(clip.truth_cm[0]) else np.inf
+                cut_cell = f"{truth:.0f}" if np.isfinite(truth) else "phantom"
+                crossed = (floor_scene.START_CM - threshold) / floor_scene.SPEED_CM_S
+                delay_cell = f"{(cut - crossed) * 1000:.0f}" if np.isfinite(truth) else "-"
+            vision = stage.stats()
+            print(f"{clip.name:<9}{'fused' if fused else 'ultrasonic':<12}{cut_cell:>10}{delay_cell:>10}"
+                  f"{capture['latency_p50_ms'] or 0:>12.1f}"
+                  f"{(vision['cost_p50_ms'] or 0) * 1000:>11.0f}{vision['latency_p50_ms'] or 0:>11.1f}")
+    transport.close()
+    print(f"Stopping distance at {DRIVE_SPEED}%: {threshold:.0f} cm")
+
+def main(paths):
+    clips = [floor_scene.load(path) for path in paths] or [floor_scene.record(name) for name in floor_scene.CLIPS]
+    offline(clips)
+    asyncio.run(live(clips))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,137 @@
+# bench_watchdog.py
+# Runs websoket_server in-process and a simulated Pi (fake GPIO PWM, brake
+# controller, watchdog) in a child process. Measures heartbeat RTT, then the
+# watchdog trip and stop latency when heartbeats stall and when the server dies.
+# Usage: python bench/bench_watchdog.py [window_s] [ramp_s]
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import aiohttp # noqa: E402
+import websockets # noqa: E402
+from command_pipeline import CommandGate # noqa: E402
+from fleet import DEFAULT_ROBOT # noqa: E402
+from gpio_backend import FakeGPIO # noqa: E402
+from heartbeat import MotorWatchdog # noqa: E402
+from safety import BrakeController # noqa: E402
+
+PORT = 9933
+
+# === Pi Process ===
+async def pi_main(window_s, ramp_s, results):
+    gpio = FakeGPIO()
+    pwm = gpio.PWM(37, 100)
+    pwm.start(0)
+    brake = BrakeController(lambda action, speed: pwm.ChangeDutyCycle(speed), lambda: pwm.ChangeDutyCycle(0))
+    brake.enabled = False # No distance sensor in this scenario
+    watchdog = MotorWatchdog(brake, window_s=window_s, ramp_s=ramp_s)
+    watchdog.start()
+    gate = CommandGate()
+
+    async def report_trips():
+        reported = 0
+        while True:
+            if watchdog.trips > reported and pwm.duty_cycle == 0 and watchdog.last_stop_latency_ms is not None:
+                reported = watchdog.trips
+                results.put({"trip_latency_ms": watchdog.last_trip_latency_ms,
+                             "stop_latency_ms": watchdog.last_stop_latency_ms, "missed": watchdog.missed})
+            await asyncio.sleep(0.01)
+    reporter = asyncio.create_task(report_trips()) # Runs until the process is terminated
+
+    while True: # Reconnect whenever the server is killed and restarted
+        if reporter.done():
+            reporter.result() # Surface a crashed reporter instead of letting the bench time out
+        while True:
+            try:
+                ws = await websockets.connect(f"ws://127.0.0.1:{PORT}/pi_control")
+                break
+            except OSError:
+                await asyncio.sleep(0.05)
+        results.put("connected")
+        try:
+            async for message in ws:
+                data = json.loads(message)
+                if data.get("type") == "heartbeat":
+                    watchdog.heartbeat(data.get("interval"))
+                    gate.observe_clock(data.get("server_ts"))
+                    await ws.send(json.dumps({"type": "heartbeat_ack", "hb": data["hb"], "hb_ts": data["hb_ts"],
+                                              **watchdog.stats()}))
+                elif gate.accept(data)[0]:
+                    watchdog.feed()
+                    brake.command(data["action"], data["value"])
+        except websockets.ConnectionClosed:
+            pass
+        gate.reset()
+
+def run_pi(window_s, ramp_s, results):
+    asyncio.run(pi_main(window_s, ramp_s, results))
+
+# === Server + Browser ===
+async def start_server(ws_srv):
+    from aiohttp import web
+    app = await ws_srv.main()
+    runner = web.AppRunner(app, shutdown_timeout=0.1) # "Killing" the server drops the Pi link at once
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+    return runner
+
+async def drive_forward(session):
+    async with session.ws_connect(f"http://127.0.0.1:{PORT}/control") as browser:
+        await browser.send_str(json.dumps({"action": "forward", "value": 60, "ts": time.time() * 1000}))
+        await asyncio.sleep(0.1)
+
+async def main(window_s, ramp_s):
+    import websoket_server as ws_srv
+    loop = asyncio.get_running_loop()
+    results = multiprocessing.Queue()
+    pi = multiprocessing.Process(target=run_pi, args=(window_s, ramp_s, results), daemon=True)
+    pi.start() # Before binding, so the forked child does not inherit the listening socket
+    runner = await start_server(ws_srv)
+    await loop.run_in_executor(None, results.get)
+
+    async with aiohttp.ClientSession() as session:
+        # 1. Healthy link: heartbeats flowing, RTT histogram
+        await drive_forward(session)
+        await asyncio.sleep(3)
+        async with session.get(f"http://127.0.0.1:{PORT}/stats/heartbeat") as resp:
+            stats = await resp.json()
+        print(f"healthy: sent={stats['sent']} acked={stats['acked']} rtt mean={stats['rtt']['mean_ms']} ms "
+              f"max={stats['rtt']['max_ms']} ms  pi={stats['pi']}")
+        print(f"         rtt buckets {stats['rtt']['buckets_ms']}")
+
+        # 2. Server alive but heartbeats stop (stalled loop/link)
+        ws_srv.fleet.get(DEFAULT_ROBOT).heartbeat.stop()
+        trip = await loop.run_in_executor(None, results.get)
+        print(f"stalled heartbeats: trip {trip['trip_latency_ms']:.1f} ms after the {window_s}s window, "
+              f"motors at zero after {trip['stop_latency_ms']:.1f} ms, missed={trip['missed']}")
+        assert trip["trip_latency_ms"] < 100, "watchdog tripped late"
+
+    # 3. Server process dies while driving
+    await runner.cleanup()
+    runner = await start_server(ws_srv)
+    await loop.run_in_executor(None, results.get)
+    async with aiohttp.ClientSession() as session:
+        await drive_forward(session)
+    await asyncio.sleep(0.5)
+    await runner.cleanup()
+    trip = await loop.run_in_executor(None, results.get)
+    print(f"server killed: trip {trip['trip_latency_ms']:.1f} ms after the window, "
+          f"motors at zero after {trip['stop_latency_ms']:.1f} ms")
+    assert trip["trip_latency_ms"] < 100, "watchdog tripped late"
+    pi.terminate()
+    print("OK")
+
+if __name__ == "__main__":
+    window_s = float(sys.argv[1]) if len(sys.argv) > 1 else 0.6
+    ramp_s = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+    os.chdir(tempfile.mkdtemp()) # websoket_server logs and serves ./static relative to the cwd
+    os.makedirs("static")
+    logging.disable(logging.CRITICAL)
+    asyncio.run(main(window_s, ramp_s))
@@ -0,0 +1,99 @@
+# bench_whip.py
+# Time-to-first-frame and reconnect time of the shared WHIP publisher
+# (local/whip_publisher.py) against the mock WHIP server (sim/mock_whip.py,
+# in-process) that answers POST with a Location resource and honours
+# DELETE. The publisher sends the synthetic test pattern. Scenarios,
+# each timed to the first frame the server decodes afterwards:
+#   cold start      publisher started against a running server
+#   session closed  server closes the peer connection (DTLS close)
+#   session wedged  server stops sending RTCP but keeps ICE up
+#   server restart  server drops every session and refuses offers for a while
+# ABR is off so the numbers are signalling and recovery alone.
+# Requires aiortc.
+# Usage: python bench/bench_whip.py [trials]
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sim"))
+
+import whip_publisher # noqa: E402
+from frame_capture import SyntheticSource # noqa: E402
+from mock_whip import serve # noqa: E402
+from whip_publisher import CaptureStream, Publisher # noqa: E402
+
+PORT = 9938
+RESTART_DOWN_S = 5.0 # How long the restarted server refuses offers
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float("nan")
+
+# === Scenarios ===
+async def close_session(server):
+    await server.newest().close()
+
+async def wedge_session(server):
+    async def drop(data):
+        pass
+    for transceiver in server.newest().getTransceivers():
+        transceiver.receiver.transport._send_rtp = drop # No more receiver reports or PLI
+
+async def restart_server(server):
+    server.down = True
+    await server.close_all()
+    await asyncio.sleep(RESTART_DOWN_S)
+    server.down = False
+
+SCENARIOS = (
+    ("session closed", close_session),
+    ("session wedged", wedge_session),
+    ("server restart", restart_server),
+)
+
+async def trial(server, log):
+    """One publisher run: cold start, then each disruption in turn. Returns {scenario: seconds}."""
+    stream = CaptureStream(SyntheticSource(640, 360, fps=30, format="yuv420p"), "synthetic")
+    publisher = Publisher(stream, f"http://127.0.0.1:{PORT}/bench/whip", adaptive=False, metrics_port=None) # Signalling only
+    start = time.monotonic()
+    task = asyncio.create_task(publisher.run())
+    times = {"cold start": await server.first_frame_after(start)}
+    for name, disrupt in SCENARIOS:
+        await asyncio.sleep(2) # Let the session settle
+        start = time.monotonic()
+        await disrupt(server)
+        if name == "server restart":
+            start = time.monotonic() # Time from the server accepting offers again
+        times[name] = await server.first_frame_after(start)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await server.close_all()
+    return times
+
+async def main(trials):
+    server, runner = await serve(PORT)
+
+    log = []
+    whip_publisher.print = lambda *args, **kwargs: log.append(" ".join(map(str, args))) # Quiet the publisher
+    results = {}
+    for _ in range(trials):
+        for name, seconds in (await trial(server, log)).items():
+            results.setdefault(name, []).append(seconds)
+
+    print(f"{trials} trials; media timeout {whip_publisher.MEDIA_TIMEOUT_S:.0f}s, "
+          f"backoff {whip_publisher.BACKOFF_INITIAL_S:.0f}-{whip_publisher.BACKOFF_MAX_S:.0f}s, "
+          f"restart refuses offers for {RESTART_DOWN_S:.0f}s")
+    print(f"{'scenario':<16} {'p50 s':>7} {'max s':>7}  (to first frame at the server)")
+    for name, values in results.items():
+        print(f"{name:<16} {percentile(values, 50):>7.2f} {max(values):>7.2f}")
+    print(f"server saw {server.posts} offers and {server.deletes} WHIP DELETEs")
+    reasons = [line.split(" (", 1)[1].split("); ")[0] for line in log if "session ended" in line]
+    for reason in sorted(set(reasons)):
+        print(f"  {reasons.count(reason):>3} x session ended: {reason}")
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    asyncio.run(main(trials))
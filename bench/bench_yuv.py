@@ -0,0 +1,114 @@
+# bench_yuv.py
+# Per-frame cost of getting a 640x360 camera frame to the H.264 encoder's
+# yuv420p input, for the old RGB paths and the capture ring's YUV paths.
+# Times each path and counts bytes allocated per frame (tracemalloc). Uses
+# PyAV for from_ndarray/reformat when installed; otherwise numpy stand-ins
+# (a copy for from_ndarray, a vectorized BT.601 conversion for libswscale),
+# which are slower than libav's SIMD but allocate the same buffers.
+# Usage: python bench/bench_yuv.py [frames]
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local"))
+
+import numpy as np # noqa: E402
+from frame_capture import frame_shape # noqa: E402
+
+try:
+    import av
+except ImportError:
+    av = None
+
+WIDTH, HEIGHT = 640, 360
+
+# === Encoder Input Stand-ins ===
+def to_video_frame(array, format):
+    """av.VideoFrame.from_ndarray: one copy into an AVFrame."""
+    return av.VideoFrame.from_ndarray(array, format=format) if av else (array.copy(), format)
+
+def to_encoder(frame):
+    """What the encoder does before H.264: reformat to yuv420p unless already there."""
+    if av:
+        return frame if frame.format.name == "yuv420p" else frame.reformat(format="yuv420p")
+    array, format = frame
+    if format == "yuv420p":
+        return array
+    if format == "yuyv422":
+        y = array[..., 0]
+        chroma = array[::2, :, 1].reshape(HEIGHT // 2, WIDTH // 2, 2)
+        return np.concatenate([y.ravel(), chroma[..., 0].ravel(), chroma[..., 1].ravel()])
+    rgb = array[..., ::-1] if format == "bgr24" else array
+    r, g, b = (rgb[..., i].astype(np.float32) for i in range(3))
+    y = 0.257 * r + 0.504 * g + 0.098 * b + 16
+    sub = rgb[::2, ::2].astype(np.float32)
+    u = -0.148 * sub[..., 0] - 0.291 * sub[..., 1] + 0.439 * sub[..., 2] + 128
+    v = 0.439 * sub[..., 0] - 0.368 * sub[..., 1] - 0.071 * sub[..., 2] + 128
+    return np.concatenate([y.ravel(), u.ravel(), v.ravel()]).astype(np.uint8)
+
+def bgr_to_rgb(frame):
+    """cv2.cvtColor(frame, COLOR_BGR2RGB) without a dst: a new array."""
+    return np.ascontiguousarray(frame[..., ::-1])
+
+# === Paths ===
+# Each returns a per-frame function; `driver` stands for the camera's own buffer
+def old_webcam():
+    driver = np.zeros((HEIGHT, WIDTH, 3), np.uint8)
+    def frame():
+        captured = driver.copy() # cap.read() with no destination allocates
+        return to_encoder(to_video_frame(bgr_to_rgb(captured), "rgb24"))
+    return frame
+
+def old_picamera():
+    driver = np.zeros((HEIGHT, WIDTH, 4), np.uint8) # XBGR8888
+    def frame():
+        captured = driver.copy() # capture_array()
+        return to_encoder(to_video_frame(np.ascontiguousarray(captured[..., :3]), "rgb24"))
+    return frame
+
+def ring_path(format, driver_copy):
+    shape = frame_shape(format, WIDTH, HEIGHT)
+    driver = np.zeros(shape, np.uint8)
+    slot = np.empty(shape, np.uint8)
+    def frame():
+        if driver_copy:
+            np.copyto(slot, driver.copy()) # capture_array() allocates, then into the ring
+        else:
+            np.copyto(slot, driver) # cap.read(out) / raw V4L2 buffer straight into the ring
+        return to_encoder(to_video_frame(slot, format))
+    return frame
+
+PATHS = (
+    ("webcam bgr->rgb24 (old)", old_webcam()),
+    ("picamera xbgr->rgb24 (old)", old_picamera()),
+    ("webcam bgr24 ring", ring_path("bgr24", False)),
+    ("webcam yuyv422 ring", ring_path("yuyv422", False)),
+    ("picamera rgb888 ring", ring_path("bgr24", True)),
+    ("picamera yuv420p ring", ring_path("yuv420p", True)),
+)
+
+def measure(frame, frames):
+    for _ in range(5):
+        frame() # Warm-up
+    start = time.perf_counter()
+    for _ in range(frames):
+        frame()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    for _ in range(10):
+        frame()
+    allocated = tracemalloc.get_traced_memory()[1] - before # Peak: what one frame holds at once
+    tracemalloc.stop()
+    return elapsed / frames * 1000, allocated
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{WIDTH}x{HEIGHT}, {frames} frames per path, "
+          f"{'PyAV ' + av.__version__ if av else 'numpy stand-ins (PyAV not installed)'}")
+    print(f"{'path':<28} {'ms/frame':>9} {'peak KB/frame':>14}")
+    for name, frame in PATHS:
+        ms, allocated = measure(frame, frames)
+        print(f"{name:<28} {ms:>9.3f} {allocated / 1024:>14,.0f}")
@@ -0,0 +1,217 @@
+# adaptive_bitrate.py
+# Congestion-aware adaptation for the WHIP publishers. The controller reads
+# the WebRTC sender's stats (RTT and loss from RTCP receiver reports, plus the
+# receiver's REMB estimate when it sends one) and steps the stream along a
+# ladder of resolution / frame rate / bitrate rungs, so a weak uplink degrades
+# the picture instead of freezing it.
+import asyncio
+import collections
+import fractions
+import time
+
+# === Ladder ===
+# `stream` is only used by the CCTV pass-through publisher, which can't
+# re-encode and instead switches between the camera's own RTSP streams
+Rung = collections.namedtuple("Rung", "width height fps bitrate stream", defaults=(None,))
+
+DEFAULT_LADDER = (
+    Rung(320, 180, 10, 150_000),
+    Rung(426, 240, 15, 300_000),
+    Rung(640, 360, 20, 500_000),
+    Rung(640, 360, 30, 800_000),
+)
+
+# === Thresholds ===
+LOSS_HIGH = 0.08 # Fraction of packets lost (RTCP fraction lost) that counts as congested
+LOSS_LOW = 0.02 # Below this (and RTT_LOW_S) the link counts as clear
+RTT_HIGH_S = 0.40
+RTT_LOW_S = 0.25
+DOWN_AFTER = 2 # Consecutive congested samples before stepping down
+UP_AFTER = 8 # Consecutive clear samples before probing the next rung up
+MAX_UP_AFTER = 64 # Cap for the back-off after failed probes
+REPORT_STALE_S = 3.0 # No receiver report for this long counts as total loss (the uplink froze)
+
+VIDEO_CLOCK_RATE = 90000
+VIDEO_TIME_BASE = fractions.Fraction(1, VIDEO_CLOCK_RATE)
+
+class AdaptationController:
+    """
+    Steps `rung` along `ladder` from periodic (rtt, loss, remb) samples, sets
+    the sender's encoder bitrate and calls apply(rung) on every change.
+    Stepping down is quick (DOWN_AFTER bad samples), stepping up slow
+    (UP_AFTER clear samples); an upward probe that is followed by congestion
+    doubles the wait before the next probe. A REMB estimate below both the
+    rung's bitrate and what is actually being sent drops straight to a rung
+    that fits. Receivers estimate from what arrives, so REMB trails a quiet
+    scene or a fresh probe; neither counts as congestion.
+    """
+
+    def __init__(self, ladder=DEFAULT_LADDER, apply=None, start=None, log=print):
+        self.ladder = tuple(ladder)
+        self.apply = apply
+        self.log = log
+        self.rung = len(self.ladder) - 1 if start is None else start
+        self.up_after = UP_AFTER
+        self.bad = 0
+        self.good = 0
+        self.probing = False # Last step was up and hasn't proven itself yet
+        self.decisions = [] # (time.monotonic(), rung index, reason)
+        self.sender = None
+        self._report_at = None
+        self._report_seen = None
+        self._applied_bitrate = None
+        self._sent = None # (time.monotonic(), bytesSent) of the previous sample
+
+    @property
+    def current(self):
+        return self.ladder[self.rung]
+
+    # === Decisions ===
+    def update(self, rtt, loss, remb=None, send_bps=None):
+        """Feed one sample; returns the (possibly new) rung."""
+        overused = remb is not None and remb < self.current.bitrate * 0.9 and (send_bps is None or remb < send_bps * 0.9)
+        if overused and not self.probing and self.rung > 0:
+            fits = [i for i, rung in enumerate(self.ladder) if rung.bitrate <= remb]
+            self._step(fits[-1] if fits else 0, f"REMB {remb / 1000:.0f} kbps")
+            return self.current
+
+        congested = loss >= LOSS_HIGH or (rtt is not None and rtt >= RTT_HIGH_S)
+        clear = loss < LOSS_LOW and (rtt is None or rtt < RTT_LOW_S)
+        self.bad = self.bad + 1 if congested else 0
+        self.good = self.good + 1 if clear else 0
+        reason = f"loss {loss:.0%}, rtt {rtt * 1000:.0f} ms" if rtt is not None else f"loss {loss:.0%}"
+
+        if self.bad >= DOWN_AFTER and self.rung > 0:
+            if self.probing:
+                self.up_after = min(self.up_after * 2, MAX_UP_AFTER) # That rung didn't hold
+            self._step(self.rung - 1, reason)
+        elif self.good >= self.up_after and self.rung < len(self.ladder) - 1:
+            self._step(self.rung + 1, reason)
+            self.probing = True
+        elif self.probing and self.good >= UP_AFTER:
+            self.probing = False
+            self.up_after = UP_AFTER # The probe held; back to normal pace
+        return self.current
+
+    def _step(self, rung, reason):
+        if rung == self.rung:
+            return
+        direction = "up" if rung > self.rung else "down"
+        self.rung = rung
+        self.bad = self.good = 0
+        self.probing = False
+        self.decisions.append((time.monotonic(), rung, reason))
+        r = self.current
+        self.log(f"[INFO] ABR step {direction} to {r.width}x{r.height}@{r.fps} {r.bitrate / 1000:.0f} kbps"
+                 f"{f' ({r.stream})' if r.stream else ''}: {reason}")
+        self._set_bitrate(r.bitrate)
+        if self.apply:
+            self.apply(r)
+
+    # === Sender Stats ===
+    async def run(self, sender, interval=1.0):
+        """Sample `sender` every `interval` seconds until cancelled."""
+        self.sender = sender
+        if self.apply:
+            self.apply(self.current)
+        while True:
+            await asyncio.sleep(interval)
+            sample = await self.sample(sender)
+            if sample is not None:
+                self.update(*sample)
+            # Also re-asserts the rung after a REMB above it
+            self._set_bitrate(self.current.bitrate)
+
+    async def sample(self, sender):
+        """(rtt, loss, remb, send_bps) from the latest receiver report, or None before the first one."""
+        report = None
+        send_bps = None
+        now = time.monotonic()
+        for stats in (await sender.getStats()).values():
+            if stats.type == "remote-inbound-rtp":
+                report = stats
+            elif stats.type == "outbound-rtp":
+                if self._sent is not None and now > self._sent[0]:
+                    send_bps = (stats.bytesSent - self._sent[1]) * 8 / (now - self._sent[0])
+                self._sent = (now, stats.bytesSent)
+        if report is None:
+            return None
+        if report.timestamp != self._report_seen:
+            self._report_seen, self._report_at = report.timestamp, now
+        elif now - self._report_at > REPORT_STALE_S:
+            return None, 1.0, None, send_bps # Reports stopped: nothing is getting through
+        return report.roundTripTime, report.fractionLost / 256, self._remb(sender), send_bps
+
+    def _set_bitrate(self, bitrate):
+        """Point the sender's encoder at `bitrate` (aiortc creates it with the first frame)."""
+        encoder = getattr(self.sender, "_RTCRtpSender__encoder", None)
+        if encoder is not None and hasattr(encoder, "target_bitrate"):
+            encoder.target_bitrate = bitrate
+            self._applied_bitrate = encoder.target_bitrate # After the encoder's own clamping
+
+    def _remb(self, sender):
+        """aiortc applies a receiver's REMB straight to the encoder; spot it as a bitrate we didn't set."""
+        encoder = getattr(sender, "_RTCRtpSender__encoder", None)
+        bitrate = getattr(encoder, "target_bitrate", None)
+        if bitrate is None or self._applied_bitrate is None or bitrate == self._applied_bitrate:
+            return None
+        return bitrate
+
+
+class AdaptiveOutput:
+    """
+    Frame rate and size a video track sends at. Replaces
+    VideoStreamTrack.next_timestamp(), which is fixed at 30 fps. While
+    `idle` (motion gating) frames go out at idle_fps and idle_size; the wait
+    is checked every frame period, so clearing `idle` from any thread brings
+    the full rate back within one frame.
+    """
+
+    def __init__(self, fps, width=None, height=None, idle_fps=None, idle_size=None):
+        self.fps = fps
+        self.width = width # None = send frames at capture size
+        self.height = height
+        self.idle_fps = idle_fps
+        self.idle_size = idle_size # (width, height); small, or a rate-controlled encoder spends its budget on sensor noise
+        self.idle = False
+        self._start = None
+        self._sent = None # Wall-clock time of the last frame's timestamp
+        self._last_kept = None
+
+    def set_rung(self, rung):
+        self.fps, self.width, self.height = rung.fps, rung.width, rung.height
+
+    @property
+    def rate(self):
+        return self.idle_fps if self.idle and self.idle_fps else self.fps
+
+    async def next_timestamp(self):
+        if self._start is None:
+            self._start = self._sent = time.time()
+            return 0, VIDEO_TIME_BASE
+        while True:
+            due = self._sent + 1 / self.rate
+            wait = due - time.time()
+            if wait <= 0:
+                break
+            await asyncio.sleep(min(wait, 1 / self.fps))
+        # Behind by more than a frame (encoder stall, end of an idle wait): resync rather than burst
+        self._sent = due if time.time() - due < 1 / self.fps else time.time()
+        return int((self._sent - self._start) * VIDEO_CLOCK_RATE), VIDEO_TIME_BASE
+
+    def keep(self, now=None):
+        """For sources that push frames at their own rate: False for frames above `fps`."""
+        now = time.monotonic() if now is None else now
+        if self._last_kept is not None and now - self._last_kept < 0.9 / self.fps:
+            return False
+        self._last_kept = now
+        return True
+
+    def scale(self, video_frame):
+        """Downscale (never upscale) to the rung size; converts to the encoder's yuv420p in the same pass."""
+        width, height = self.idle_size if self.idle and self.idle_size else (self.width, self.height)
+        if width is None or video_frame.width <= width:
+            return video_frame
+        scaled = video_frame.reformat(width=width, height=height, format="yuv420p")
+        scaled.pts, scaled.time_base = video_frame.pts, video_frame.time_base
+        return scaled
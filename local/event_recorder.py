@@ -0,0 +1,515 @@
+# event_recorder.py
+# Pre/post-event recording. Encoded H.264 packets go into a fixed-size
+# in-memory ring holding the last PRE_EVENT_S seconds; a trigger (motion,
+# obstacle brake, a manual "record" command) hands the ring plus the next
+# POST_EVENT_S seconds to a writer thread, which muxes them into rolling
+# fragmented-MP4 segments under RECORD_DIR and evicts the oldest recordings
+# over DISK_QUOTA_BYTES. Producers never wait on the SD card: the writer's
+# queue is bounded in bytes and drops to the next keyframe when it is full.
+import asyncio
+import collections
+import fractions
+import json
+import os
+import queue
+import threading
+import time
+
+import av
+
+# === Configuration ===
+RECORD_DIR = "recordings"
+PRE_EVENT_S = 10.0 # Seconds kept before a trigger
+POST_EVENT_S = 20.0 # Seconds recorded after the last trigger
+RING_BYTES = 8 * 1024 * 1024 # Ring capacity; at high bitrates this, not PRE_EVENT_S, bounds the pre-event
+SEGMENT_S = 10.0 # A new file at the first keyframe after this long
+DISK_QUOTA_BYTES = 2 * 1024 ** 3 # Oldest recordings are deleted beyond this
+WRITE_BUFFER_BYTES = 1024 * 1024 # Writes reach the card in chunks of this size
+WRITE_QUEUE_BYTES = 32 * 1024 * 1024 # Packets waiting for the writer before it drops
+MAX_PTS_GAP_S = 5.0 # A bigger jump (or a step back) is a source restart: the timeline continues
+
+RECORD_CODECS = ("h264_v4l2m2m", "libx264") # Recording encoder for captured frames: Pi hardware first
+RECORD_FPS = 15
+RECORD_BITRATE = 1_500_000
+RECORD_GOP_S = 2.0 # Keyframe interval; the ring is trimmed a whole GOP at a time
+
+TRIGGER_HOST = "127.0.0.1"
+TRIGGER_PORT = 9011 # robot_listener sends {"type": "record", "reason": ...} here
+
+MP4_OPTIONS = {"movflags": "frag_keyframe+empty_moov+default_base_moof"} # Playable up to the last fragment
+TIME_BASE = fractions.Fraction(1, 90000)
+
+# === Packet Ring ===
+# One ring entry: where the packet's bytes sit in the buffer, its time in seconds
+RingEntry = collections.namedtuple("RingEntry", ["offset", "size", "pts", "keyframe"])
+
+class PacketRing:
+    """
+    Encoded packets in one preallocated buffer. Each packet is stored
+    contiguously, wrapping to the start when it doesn't fit at the end; the
+    oldest packets are evicted to make room, and the ring always starts on
+    a keyframe so its contents decode on their own. Not thread-safe.
+    """
+
+    def __init__(self, capacity=RING_BYTES, keep_s=PRE_EVENT_S):
+        self.buffer = bytearray(capacity)
+        self.capacity = capacity
+        self.keep_s = keep_s
+        self.entries = collections.deque()
+        self.keyframes = collections.deque() # pts of every keyframe in the ring
+        self.used = 0
+        self.oversized = 0
+
+    def append(self, data, pts, keyframe):
+        size = len(data)
+        if size > self.capacity:
+            self.oversized += 1
+            self.clear()
+            return
+        offset = self._allocate(size)
+        if not self.entries and not keyframe:
+            return # Nothing decodes before the first keyframe
+        self.buffer[offset:offset + size] = data
+        self.entries.append(RingEntry(offset, size, pts, keyframe))
+        if keyframe:
+            self.keyframes.append(pts)
+        self.used += size
+        self._trim(pts)
+
+    def _allocate(self, size):
+        while self.entries:
+            head, tail = self.entries[0], self.entries[-1]
+            end = tail.offset + tail.size
+            if tail.offset >= head.offset: # Not wrapped: free space at the end, then before the head
+                if self.capacity - end >= size:
+                    return end
+                if head.offset >= size:
+                    return 0
+            elif head.offset - end >= size: # Wrapped: free space between the tail and the head
+                return end
+            self._evict()
+        return 0
+
+    def _evict(self):
+        """Drop the oldest packet and the rest of its GOP."""
+        self.used -= self.entries.popleft().size
+        self.keyframes.popleft() # The ring always starts on a keyframe
+        while self.entries and not self.entries[0].keyframe:
+            self.used -= self.entries.popleft().size
+
+    def _trim(self, newest):
+        """Drop whole GOPs while the ring would still cover keep_s without them."""
+        while len(self.keyframes) > 1 and newest - self.keyframes[1] >= self.keep_s:
+            self._evict()
+
+    def packets(self):
+        """Copies of every packet, oldest first, as (pts, keyframe, bytes)."""
+        return [(e.pts, e.keyframe, bytes(self.buffer[e.offset:e.offset + e.size])) for e in self.entries]
+
+    def duration(self):
+        return self.entries[-1].pts - self.entries[0].pts if self.entries else 0.0
+
+    def clear(self):
+        self.entries.clear()
+        self.keyframes.clear()
+        self.used = 0
+
+# === Segment Writer ===
+class SegmentWriter:
+    """
+    Writer thread: muxes queued packets into fragmented MP4 segments, one
+    file per SEGMENT_S, through a large write buffer so the card sees big
+    sequential writes. Enforces the disk quota after every segment.
+    """
+
+    def __init__(self, name, directory=RECORD_DIR, segment_s=SEGMENT_S, quota_bytes=DISK_QUOTA_BYTES,
+                 max_queued_bytes=WRITE_QUEUE_BYTES):
+        self.name = name
+        self.directory = directory
+        self.segment_s = segment_s
+        self.quota_bytes = quota_bytes
+        self.stream_info = None # (codec, width, height)
+        self.segments = 0
+        self.written_bytes = 0
+        self.evicted = 0
+        self.max_queued_bytes = max_queued_bytes
+        self.queued_bytes = 0
+        self.trigger_to_disk_ms = collections.deque(maxlen=64)
+        self.write_ms = collections.deque(maxlen=256) # Time per mux call, on the writer thread
+        self._queue = queue.Queue()
+        self._file = None
+        self._container = None
+        self._stream = None
+        self._segment_start = None
+        self._reason = None
+        self._triggered_at = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"{name}-recorder", daemon=True)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread.start()
+
+    def put(self, item, size=0):
+        """Queue an item without blocking; False if `size` more bytes would overfill the queue."""
+        with self._lock:
+            if size and self.queued_bytes + size > self.max_queued_bytes:
+                return False
+            self.queued_bytes += size
+        self._queue.put_nowait((item, size))
+        return True
+
+    def stop(self):
+        self._queue.put((None, 0))
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            item, size = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._handle(*item)
+            except (OSError, av.FFmpegError, ValueError) as e:
+                print(f"[ERROR] {self.name} recording failed: {type(e).__name__}: {e}")
+                self._close_segment()
+            with self._lock:
+                self.queued_bytes -= size
+        self._close_segment()
+
+    def _handle(self, kind, *args):
+        if kind == "packet":
+            self._write(*args)
+        elif kind == "event":
+            self._reason, self._triggered_at = args
+            self._close_segment() # An event always starts a file of its own
+        elif kind == "flush":
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno()) # The pre-event backlog survives a crash or power cut from here on
+            if self._triggered_at is not None:
+                self.trigger_to_disk_ms.append((time.monotonic() - self._triggered_at) * 1000)
+                self._triggered_at = None
+        elif kind == "end":
+            self._close_segment()
+        elif kind == "configure":
+            self._close_segment()
+            self.stream_info = args[0]
+
+    def _write(self, pts, keyframe, data):
+        if self._container is not None and keyframe and pts - self._segment_start >= self.segment_s:
+            self._close_segment()
+        if self._container is None:
+            if not keyframe:
+                return # A segment starts on a keyframe
+            self._open_segment(pts)
+        packet = av.Packet(data)
+        packet.pts = packet.dts = round((pts - self._segment_start) / TIME_BASE)
+        packet.time_base = TIME_BASE
+        packet.is_keyframe = keyframe
+        packet.stream = self._stream
+        start = time.perf_counter()
+        self._container.mux(packet)
+        self.write_ms.append((time.perf_counter() - start) * 1000)
+        self.written_bytes += len(data)
+
+    def _open_segment(self, pts):
+        self._enforce_quota()
+        codec, width, height = self.stream_info
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"{self.name}-{stamp}-{self._reason or 'event'}-{self.segments:04d}.mp4")
+        self._file = open(path, "wb", buffering=WRITE_BUFFER_BYTES)
+        self._container = av.open(self._file, "w", format="mp4", options=MP4_OPTIONS)
+        self._stream = self._container.add_stream(codec)
+        self._stream.width, self._stream.height = width, height
+        self._stream.time_base = TIME_BASE
+        self._segment_start = pts
+        self.segments += 1
+
+    def _close_segment(self):
+        if self._container is None:
+            return
+        try:
+            self._container.close()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        except (OSError, av.FFmpegError) as e:
+            print(f"[ERROR] {self.name} closing recording failed: {type(e).__name__}: {e}")
+        self._container = self._stream = self._file = None
+
+    def _enforce_quota(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".mp4") and entry.is_file():
+                files.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.quota_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"[WARN] Could not evict {path}: {type(e).__name__}: {e}")
+                continue
+            total -= size
+            self.evicted += 1
+
+# === Recorder ===
+class EventRecorder:
+    """
+    add() is called from the producing thread (RTSP demux, recording
+    encoder) with each encoded packet; trigger(reason) from anywhere. Both
+    only copy bytes and queue them; the SegmentWriter does the I/O.
+    """
+
+    def __init__(self, name, directory=RECORD_DIR, pre_s=PRE_EVENT_S, post_s=POST_EVENT_S,
+                 ring_bytes=RING_BYTES, segment_s=SEGMENT_S, quota_bytes=DISK_QUOTA_BYTES):
+        self.name = name
+        self.post_s = post_s
+        self.ring = PacketRing(ring_bytes, pre_s)
+        self.writer = SegmentWriter(name, directory, segment_s, quota_bytes)
+        self.stream_info = None
+        self.events = 0
+        self.triggers = collections.Counter()
+        self.write_dropped = 0
+        self._record_until = None # Monotonic time the current event ends, None when idle
+        self._waiting_keyframe = False # Writer queue overflowed: skip to the next keyframe
+        self._written_until = None # pts of the last packet queued for writing
+        self._last_pts = None
+        self._pts_offset = 0.0
+        self._lock = threading.Lock()
+        self.writer.start()
+
+    def configure(self, codec, width, height):
+        """Stream parameters of the packets that follow; a change ends the segment and empties the ring."""
+        info = (codec, width, height)
+        with self._lock:
+            if info == self.stream_info:
+                return
+            self.stream_info = info
+            self.ring.clear()
+            self.writer.put(("configure", info))
+
+    def add(self, data, pts, keyframe):
+        """One encoded packet (Annex B with in-band SPS/PPS on keyframes); pts in seconds."""
+        data = memoryview(data)
+        with self._lock:
+            pts = self._continuous(pts)
+            self.ring.append(data, pts, keyframe)
+            if self._record_until is None:
+                return
+            if time.monotonic() > self._record_until:
+                self._record_until = None
+                self.writer.put(("end",))
+                return
+            self._queue_packet(pts, keyframe, bytes(data))
+
+    def trigger(self, reason):
+        """Start an event, or extend the one in progress by POST_EVENT_S."""
+        now = time.monotonic()
+        with self._lock:
+            self.triggers[reason] += 1
+            recording = self._record_until is not None
+            self._record_until = now + self.post_s
+            if recording:
+                return
+            if self.stream_info is None:
+                self._record_until = None # Nothing captured yet
+                return
+            self.events += 1
+            self.writer.put(("event", reason, now))
+            backlog = self._unwritten(self.ring.packets())
+            for packet in backlog:
+                self._queue_packet(*packet)
+            self.writer.put(("flush",))
+        before = self._last_pts - backlog[0][0] if backlog else 0.0
+        print(f"[INFO] {self.name} recording: {reason} (+{before:.1f}s before)")
+
+    def _unwritten(self, packets):
+        """Ring packets not already in an earlier event, from the GOP that one ended in."""
+        if self._written_until is None:
+            return packets
+        start = 0
+        for i, (pts, keyframe, _) in enumerate(packets):
+            if pts > self._written_until:
+                break
+            if keyframe:
+                start = i
+        return packets[start:]
+
+    def _continuous(self, pts):
+        pts += self._pts_offset
+        if self._last_pts is not None and not 0 < pts - self._last_pts < MAX_PTS_GAP_S:
+            step = 1 / RECORD_FPS # Any plausible frame interval; it only bridges the restart
+            self._pts_offset += self._last_pts + step - pts
+            pts = self._last_pts + step
+        self._last_pts = pts
+        return pts
+
+    def _queue_packet(self, pts, keyframe, data):
+        if keyframe:
+            self._waiting_keyframe = False
+        if self._waiting_keyframe or not self.writer.put(("packet", pts, keyframe, data), len(data)):
+            self.write_dropped += 1 # The card can't keep up; resume at a keyframe once it does
+            self._waiting_keyframe = True
+            return
+        self._written_until = pts
+
+    @property
+    def recording(self):
+        return self._record_until is not None
+
+    def stats(self):
+        latencies = sorted(self.writer.trigger_to_disk_ms)
+        writes = sorted(self.writer.write_ms)
+        return {
+            "recording": self.recording,
+            "events": self.events,
+            "triggers": dict(self.triggers),
+            "ring_used": self.ring.used,
+            "ring_seconds": round(self.ring.duration(), 1),
+            "segments": self.writer.segments,
+            "written_bytes": self.writer.written_bytes,
+            "write_dropped": self.write_dropped,
+            "write_queued": self.writer.queued_bytes,
+            "evicted": self.writer.evicted,
+            "trigger_to_disk_max_ms": round(latencies[-1], 1) if latencies else None,
+            "write_p50_ms": round(writes[len(writes) // 2], 3) if writes else None,
+            "write_max_ms": round(writes[-1], 3) if writes else None,
+        }
+
+    def close(self):
+        self.writer.stop()
+
+# === Recording Encoder ===
+class RecordingEncoder:
+    """
+    CaptureEngine hook (see frame_capture.py) for cameras without an encoded
+    stream of their own: every 1/fps a captured frame is copied on the
+    capture thread and encoded to H.264 for the recorder on a thread of its
+    own, at the capture's full size whatever the uplink does. Frames that
+    arrive while the encoder is busy are skipped. `encode_time`, a histogram
+    (metrics.py), observes each frame's encode in seconds.
+    """
+
+    def __init__(self, recorder, fps=RECORD_FPS, bitrate=RECORD_BITRATE, codecs=RECORD_CODECS, encode_time=None):
+        self.recorder = recorder
+        self.encode_time = encode_time
+        self.fps = fps
+        self.bitrate = bitrate
+        self.codecs = codecs
+        self.codec = None
+        self.encoded = 0
+        self.skipped = 0
+        self._context = None
+        self._buffer = None
+        self._format = None
+        self._captured_at = 0.0
+        self._next_at = 0.0
+        self._start = time.monotonic()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"{recorder.name}-encoder", daemon=True)
+        self._thread.start()
+
+    def analyze(self, frame, format):
+        now = time.monotonic()
+        if now + 0.005 < self._next_at: # A little slack for capture jitter
+            return
+        self._next_at = max(self._next_at + 1 / self.fps, now)
+        if self._ready.is_set():
+            self.skipped += 1 # Encoder still busy with the last one
+            return
+        if self._buffer is None or self._buffer.shape != frame.shape:
+            self._buffer = frame.copy()
+        else:
+            self._buffer[:] = frame
+        self._format, self._captured_at = format, now
+        self._ready.set()
+
+    def _open(self, width, height):
+        for codec in self.codecs:
+            try:
+                context = av.CodecContext.create(codec, "w")
+                context.width, context.height, context.pix_fmt = width, height, "yuv420p"
+                context.time_base = fractions.Fraction(1, 1000)
+                context.framerate = fractions.Fraction(self.fps)
+                context.bit_rate = self.bitrate
+                context.gop_size = round(self.fps * RECORD_GOP_S)
+                context.max_b_frames = 0
+                if codec == "libx264":
+                    context.options = {"preset": "ultrafast", "tune": "zerolatency"}
+                context.open()
+            except (av.FFmpegError, ValueError) as e:
+                print(f"[INFO] Recording encoder {codec} unavailable ({type(e).__name__}: {e})")
+                continue
+            print(f"[INFO] {self.recorder.name} recording encoder: {codec} {width}x{height}@{self.fps}")
+            self.codec = codec
+            self.recorder.configure("h264", width, height)
+            return context
+        raise RuntimeError(f"none of {', '.join(self.codecs)} could be opened")
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._ready.wait(0.5):
+                continue
+            frame = av.VideoFrame.from_ndarray(self._buffer, format=self._format)
+            pts = round((self._captured_at - self._start) * 1000)
+            self._ready.clear() # The buffer is free again once copied into the VideoFrame
+            if frame.format.name != "yuv420p":
+                frame = frame.reformat(format="yuv420p")
+            frame.pts = pts
+            try:
+                if self._context is None:
+                    self._context = self._open(frame.width, frame.height)
+                encode_at = time.perf_counter()
+                packets = self._context.encode(frame)
+                if self.encode_time is not None:
+                    self.encode_time.observe_since(encode_at)
+                for packet in packets:
+                    self.recorder.add(packet, float(packet.pts * packet.time_base), packet.is_keyframe)
+                self.encoded += 1
+            except (av.FFmpegError, RuntimeError, ValueError) as e:
+                print(f"[ERROR] {self.recorder.name} recording encoder failed, recording stopped: {type(e).__name__}: {e}")
+                return
+
+    def stats(self):
+        return {"codec": self.codec, "encoded": self.encoded, "skipped": self.skipped}
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+
+# === Triggers ===
+class TriggerProtocol(asyncio.DatagramProtocol):
+    """UDP endpoint for triggers from other processes on the robot: {"type": "record", "reason": ...}."""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.invalid = 0
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data)
+            if message.get("type") != "record":
+                raise ValueError(f"not a record trigger: {message.get('type')}")
+        except (ValueError, AttributeError) as e:
+            self.invalid += 1
+            print(f"[WARN] Invalid record trigger from {addr}: {type(e).__name__}: {e}")
+            return
+        self.recorder.trigger(str(message.get("reason", "remote")))
+
+async def listen_for_triggers(recorder, host=TRIGGER_HOST, port=TRIGGER_PORT):
+    """
+    Accept record triggers on (host, port) until the loop stops; returns the
+    transport, or None if the port is taken (the recorder still records on
+    its own triggers, e.g. motion).
+    """
+    try:
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: TriggerProtocol(recorder), local_addr=(host, port))
+    except OSError as e: # Another publisher on this machine already has the port
+        print(f"[WARN] Record triggers not received on port {port}: {type(e).__name__}: {e}")
+        return None
+    return transport
@@ -0,0 +1,215 @@
+# frame_capture.py
+# Capture engine shared by the WHIP publishers. A background thread reads the
+# camera into a small preallocated ring of frame buffers; the video track's
+# recv() takes the newest frame without blocking the asyncio loop (ICE, RTCP
+# and the WHIP session keep running while the camera waits for exposure).
+import asyncio
+import collections
+import threading
+import time
+
+import numpy as np
+
+RING_SLOTS = 3 # One being filled, one newest, one held by the encoder
+MAX_READ_FAILURES = 30 # Consecutive failed reads before the capture gives up
+
+# === Frame Formats ===
+# Names are PyAV pixel formats, so a ring slot goes straight to
+# av.VideoFrame.from_ndarray(slot, format=engine.format). The YUV formats are
+# what the H.264 encoder consumes, so they skip the per-frame colour conversion.
+def frame_shape(format, width, height):
+    """Array shape PyAV expects for `format`."""
+    if format in ("yuv420p", "nv12"):
+        return (height * 3 // 2, width) # Y plane, then the quarter-size chroma planes
+    if format == "yuyv422":
+        return (height, width, 2)
+    if format in ("rgb24", "bgr24"):
+        return (height, width, 3)
+    raise ValueError(f"Unsupported frame format: {format}")
+
+# === Frame Sources ===
+# A source exposes `format` and `shape` (see frame_shape) once opened and
+# read(out) -> bool, filling the preallocated array `out` in place.
+class SyntheticSource:
+    """
+    Moving test pattern for benchmarks. fps=None produces frames as fast as
+    possible; noise=True scrolls a random block texture so an encoder needs
+    a camera-like bitrate for it (the flat pattern compresses to nothing).
+    """
+
+    def __init__(self, width=640, height=360, fps=None, format="rgb24", noise=False):
+        self.format = format
+        self.shape = frame_shape(format, width, height)
+        self.fps = fps
+        self.count = 0
+        self._next = None
+        self._noise = None
+        if noise:
+            # Coarse blocks: busy enough to need real bitrate, still compressible like a camera scene
+            rng = np.random.default_rng(0)
+            blocks = rng.integers(0, 256, (2 * self.shape[0] // 64 + 1, self.shape[1] // 64 + 1) + self.shape[2:], dtype=np.uint8)
+            noise = blocks.repeat(64, axis=0).repeat(64, axis=1)
+            self._noise = np.ascontiguousarray(noise[:2 * self.shape[0], :self.shape[1]])
+
+    def open(self):
+        self._next = time.monotonic()
+
+    def read(self, out):
+        if self.fps:
+            self._next += 1 / self.fps
+            delay = self._next - time.monotonic()
+            if delay > 0:
+                time.sleep(delay) # Blocks like a camera waiting for the next exposure
+        self.count += 1
+        if self._noise is not None:
+            offset = (self.count * 2) % self.shape[0]
+            out[:] = self._noise[offset:offset + self.shape[0]]
+        else:
+            out[:] = self.count & 0xFF
+        column = (self.count * 8) % out.shape[1]
+        out[:, column:column + 8] = 255 # Vertical bar so motion is visible
+        return True
+
+    def close(self):
+        pass
+
+
+class CaptureEngine:
+    """
+    Runs `source` on a daemon thread and keeps the newest frame in a ring.
+    Frames the consumer never picks up count as dropped; frames it picks up
+    twice (consumer faster than the camera) count as duplicated.
+    Each of `analyzers`, called as analyze(frame, format), sees every
+    captured frame on the capture thread once it is published (see
+    motion_detector.py and event_recorder.py). `read_time` and `latency`,
+    histograms (metrics.py), observe each camera read and each capture ->
+    consumer handoff in seconds.
+    """
+
+    def __init__(self, source, slots=RING_SLOTS, name="capture", analyzers=(), read_time=None, latency=None):
+        self.source = source
+        self.name = name
+        self.analyzers = list(analyzers)
+        self.read_time = read_time
+        self.latency = latency
+        self.format = None # Pixel format of the ring's frames, known once started
+        self.ring = None
+        self.slots = slots
+        self.error = None
+        self.captured = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.read_failures = 0
+        self.latency_ms = collections.deque(maxlen=256) # Capture -> handed to the encoder
+        self._lock = threading.Lock()
+        self._newest = None # (slot, seq, captured_ns)
+        self._held = None # Slot the consumer is reading; never overwritten
+        self._last_seq = 0
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.source.open()
+        self.format = self.source.format
+        self.ring = [np.empty(self.source.shape, dtype=np.uint8) for _ in range(self.slots)]
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self.source.close()
+
+    # === Consumer (event loop) ===
+    def latest(self):
+        """Newest frame as an array in `format`, or None before the first capture. Never blocks on the camera."""
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        with self._lock:
+            if self._newest is None:
+                return None
+            slot, seq, captured_ns = self._newest
+            self._held = slot # Valid until the next latest() call
+        if seq == self._last_seq:
+            self.duplicated += 1
+        else:
+            self.dropped += seq - self._last_seq - 1
+            self._last_seq = seq
+        self.delivered += 1
+        latency_ns = time.monotonic_ns() - captured_ns
+        self.latency_ms.append(latency_ns / 1e6)
+        if self.latency is not None:
+            self.latency.observe(latency_ns / 1e9)
+        return self.ring[slot]
+
+    def snapshot(self, copy):
+        """
+        Side reader for stages running at their own rate (vision_obstacles.py):
+        returns copy(frame, format, seq, captured_ns) for the newest frame, or
+        None before the first capture. The ring is locked meanwhile, so the
+        capture thread cannot reuse the slot; `copy` should take a small
+        decimated copy and return. The consumer's latest() accounting is untouched.
+        """
+        with self._lock:
+            if self._newest is None:
+                return None
+            slot, seq, captured_ns = self._newest
+            return copy(self.ring[slot], self.format, seq, captured_ns)
+
+    async def frame(self, poll_s=0.005):
+        """latest(), waiting without blocking the loop until the first frame exists."""
+        while not self._ready.is_set() and self.error is None:
+            await asyncio.sleep(poll_s)
+        return self.latest()
+
+    def stats(self):
+        latencies = sorted(self.latency_ms)
+        return {
+            "captured": self.captured,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "duplicated": self.duplicated,
+            "read_failures": self.read_failures,
+            "latency_p50_ms": round(latencies[len(latencies) // 2], 2) if latencies else None,
+            "latency_max_ms": round(latencies[-1], 2) if latencies else None,
+        }
+
+    # === Capture Thread ===
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            with self._lock:
+                newest = self._newest[0] if self._newest else None
+                slot = next(i for i in range(self.slots) if i != newest and i != self._held)
+            read_at = time.perf_counter()
+            try:
+                ok = self.source.read(self.ring[slot])
+            except Exception as e:
+                ok = False
+                print(f"[ERROR] {self.name} read failed: {type(e).__name__}: {e}")
+            if not ok:
+                self.read_failures += 1
+                failures += 1
+                if failures >= MAX_READ_FAILURES:
+                    self.error = f"{self.name}: {failures} consecutive failed reads"
+                    return
+                time.sleep(0.01)
+                continue
+            failures = 0
+            if self.read_time is not None:
+                self.read_time.observe_since(read_at)
+            captured_ns = time.monotonic_ns()
+            with self._lock:
+                self.captured += 1
+                self._newest = (slot, self.captured, captured_ns)
+            self._ready.set()
+            # The slot is safe to read: it is only reused after a later frame is published
+            for analyze in tuple(self.analyzers):
+                try:
+                    analyze(self.ring[slot], self.format)
+                except Exception as e:
+                    print(f"[ERROR] {self.name} frame analysis failed, disabling it: {type(e).__name__}: {e}")
+                    self.analyzers.remove(analyze)
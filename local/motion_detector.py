@@ -0,0 +1,135 @@
+# motion_detector.py
+# Motion analysis stage for the capture pipeline. Runs on the capture thread
+# on a decimated luma copy of every frame: difference against a running
+# background, count the changed pixels. Motion start/end events go to the
+# robot listener's local telemetry port (riding the Pi link to the server as
+# the "motion" channel) and, in motion-gated mode, to the video track, which
+# sends a trickle of frames while the scene is idle.
+import collections
+import json
+import socket
+import time
+
+import numpy as np
+
+# === Configuration ===
+DECIMATE = 8 # Analyse every 8th pixel each way (640x360 -> 80x45)
+MAX_DECIMATE = 32
+BACKGROUND_ALPHA = 0.05 # How fast the background absorbs changes (per frame)
+PIXEL_THRESHOLD = 20 # Luma difference from the background that counts as changed
+MOTION_AREA = 0.01 # Fraction of changed pixels that counts as motion
+MOTION_HOLD_S = 2.0 # Motion ends after this long below MOTION_AREA
+BUDGET_MS = 2.0 # Per-frame analysis budget; over it, analysis gets coarser
+IDLE_FPS = 1 # Frame rate sent while motion-gated and idle
+
+TELEMETRY_HOST = "127.0.0.1" # robot_listener only listens on localhost
+TELEMETRY_PORT = 9010
+
+def luma(frame, format, step):
+    """Decimated luma view of a capture-format frame (no copy)."""
+    if format in ("yuv420p", "nv12"):
+        return frame[:frame.shape[0] * 2 // 3:step, ::step] # Y plane only
+    if format == "yuyv422":
+        return frame[::step, ::step, 0]
+    if format in ("rgb24", "bgr24"):
+        return frame[::step, ::step, 1] # Green carries most of the luma; plenty for change detection
+    raise ValueError(f"Unsupported frame format: {format}")
+
+class MotionTelemetry:
+    """
+    Fire-and-forget UDP datagrams in the legacy {"type", "value"} telemetry
+    shape, plus "ts": the reading's time.monotonic_ns(), which robot_listener
+    keeps as the sample time (now if not given).
+    """
+
+    def __init__(self, host=TELEMETRY_HOST, port=TELEMETRY_PORT):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.failed = 0
+
+    def post(self, kind, value, ts=None):
+        message = {"type": kind, "value": value, "ts": ts or time.monotonic_ns()}
+        try:
+            self.sock.sendto(json.dumps(message).encode(), self.address)
+        except OSError:
+            self.failed += 1 # Listener not running; motion still gates the stream
+
+    def send(self, active, moving):
+        self.post("motion", round(moving, 4) if active else 0.0)
+
+    def close(self):
+        self.sock.close()
+
+class MotionDetector:
+    """
+    analyze(frame, format) is the CaptureEngine hook. listeners are called as
+    listener(active, moving_fraction) when motion starts or ends, on the
+    capture thread. If the mean analysis cost goes over budget_ms the grid
+    is halved (down to MAX_DECIMATE) and the background relearned.
+    """
+
+    def __init__(self, decimate=DECIMATE, budget_ms=BUDGET_MS):
+        self.decimate = decimate
+        self.budget_ms = budget_ms
+        self.listeners = []
+        self.active = False
+        self.moving = 0.0 # Fraction of changed pixels in the last frame
+        self.events = 0
+        self.analyzed = 0
+        self.cost_ms = collections.deque(maxlen=256)
+        self._background = None
+        self._delta = None
+        self._last_motion = 0.0
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def analyze(self, frame, format):
+        start = time.perf_counter()
+        gray = luma(frame, format, self.decimate)
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            self._delta = np.empty_like(self._background)
+            return
+        np.subtract(gray, self._background, out=self._delta)
+        self.moving = np.count_nonzero(np.abs(self._delta) > PIXEL_THRESHOLD) / self._delta.size
+        self._delta *= BACKGROUND_ALPHA
+        self._background += self._delta
+        self.analyzed += 1
+        self._update(self.moving >= MOTION_AREA)
+        self.cost_ms.append((time.perf_counter() - start) * 1000)
+        self._check_budget()
+
+    def _update(self, moving):
+        now = time.monotonic()
+        if moving:
+            self._last_motion = now
+        if moving == self.active or (self.active and now - self._last_motion < MOTION_HOLD_S):
+            return
+        self.active = moving
+        self.events += 1
+        for listener in self.listeners:
+            listener(self.active, self.moving)
+
+    def _check_budget(self):
+        if len(self.cost_ms) < 30 or self.decimate >= MAX_DECIMATE:
+            return
+        mean = sum(self.cost_ms) / len(self.cost_ms)
+        if mean > self.budget_ms:
+            print(f"[WARN] Motion analysis {mean:.2f} ms/frame is over its {self.budget_ms} ms budget; "
+                  f"decimating by {self.decimate * 2}")
+            self.decimate *= 2
+            self._background = None
+            self.cost_ms.clear()
+
+    def stats(self):
+        costs = sorted(self.cost_ms)
+        return {
+            "motion": self.active,
+            "moving": round(self.moving, 4),
+            "events": self.events,
+            "decimate": self.decimate,
+            "cost_p50_ms": round(costs[len(costs) // 2], 3) if costs else None,
+            "cost_max_ms": round(costs[-1], 3) if costs else None,
+        }
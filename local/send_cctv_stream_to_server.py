@@ -2,15 +2,20 @@
 # Import necessary modules for WebRTC, RTSP media playback, and HTTP requests
 import asyncio
 import os
+import threading
+import time
+import aiortc
+import av
 from aiortc import (
-    RTCPeerConnection,
-    RTCConfiguration,
-    RTCIceServer,
-    RTCSessionDescription,
+    MediaStreamTrack,
+    RTCRtpSender,
     VideoStreamTrack
 )
+from aiortc import rtcpeerconnection
 from aiortc.contrib.media import MediaPlayer
-from aiohttp import ClientSession
+from adaptive_bitrate import AdaptiveOutput, Rung
+from event_recorder import EventRecorder, listen_for_triggers
+from whip_publisher import Publisher, StreamSource, whip_url
 
 # === Static Configuration ===
 CAMERA_IP = "192.168.0.111"  # Replace with your camera's IP
@@ -23,22 +28,44 @@ SERVER_IP = "Your Server IP Address"  # Server IP address
 SERVER_PORT = "8889"         # Port for WebRTC
 MediaMTX_ENDPOINT = "cam1"   # MediaMTX endpoint
 
+PASS_THROUGH = True          # Forward the camera's H.264 as-is (no decode/re-encode); falls back to transcode
+KEYFRAME_WAIT_S = 2.0        # After a keyframe request, restart the RTSP session if no keyframe arrives by then
+PASS_THROUGH_QUEUE = 60      # Packets buffered for the sender before skipping ahead to the next keyframe
+AIORTC_TESTED = ("1.15.0",)  # aiortc versions the keyframe request hook is tested against; others run without it
+RECORD = True                # Pass-through only: keep the camera's last seconds in memory, record on brake or "record"
+
+ADAPTIVE = True              # Step quality down on a congested uplink instead of freezing
+LADDER = (                   # Transcode mode: (width, height, fps, bitrate) rungs, lowest first
+    Rung(320, 180, 10, 150_000),
+    Rung(426, 240, 15, 300_000),
+    Rung(640, 360, 25, 800_000),
+)
+PASS_THROUGH_LADDER = (      # Pass-through mode can't re-encode; it switches between the camera's own streams
+    Rung(640, 360, 15, 500_000, "stream2"),    # Sub stream (match your camera's settings)
+    Rung(1920, 1080, 25, 2_000_000, "stream1"),  # Main stream
+)
+
+RTSP_OPTIONS = {
+    "rtsp_transport": "udp",
+    "buffer_size": "1M",
+    "timeout": "5000000",
+    "reorder_queue_size": "10"
+}
+
+def rtsp_url(stream=None):
+    return f"rtsp://{RTSP_USER}:{RTSP_PASS}@{CAMERA_IP}:{RTSP_PORT}/{stream or RTSP_STREAM}"
+
 # === Custom RTSP Video Track with Audio Access ===
 class RTSPVideoTrack(VideoStreamTrack):
     def __init__(self):
         super().__init__()
-        self.rtsp_url = f"rtsp://{RTSP_USER}:{RTSP_PASS}@{CAMERA_IP}:{RTSP_PORT}/{RTSP_STREAM}"
+        self.rtsp_url = rtsp_url()
         print(f"[INFO] Connecting to RTSP stream: {self.rtsp_url}")
 
         self.player = MediaPlayer(
             self.rtsp_url,
             format="rtsp",
-            options={
-                "rtsp_transport": "udp",
-                "buffer_size": "1M",
-                "timeout": "5000000",
-                "reorder_queue_size": "10"
-            }
+            options=RTSP_OPTIONS
         )
 
         if not self.player or not self.player.video:
@@ -46,6 +73,7 @@ class RTSPVideoTrack(VideoStreamTrack):
 
         self.video = self.player.video
         self.audio = self.player.audio  # This may be None if audio not supported
+        self.output = AdaptiveOutput(LADDER[-1].fps)  # Send rate and size, moved by the ABR controller
         if self.audio:
             print("[INFO] Audio track detected and will be included.")
         else:
@@ -53,60 +81,350 @@ class RTSPVideoTrack(VideoStreamTrack):
 
     async def recv(self):
         try:
-            frame = await self.video.recv()
-            return frame
+            while True:
+                frame = await self.video.recv()
+                if self.output.keep():  # Drop frames above the current rung's rate
+                    return self.output.scale(frame)
         except Exception as e:
             print(f"[ERROR] Error receiving video frame: {e}")
             return None
 
-# === WebRTC Streaming Function ===
-async def publish_stream():
-    config = RTCConfiguration(
-        iceServers=[RTCIceServer(urls=["stun:stun.l.google.com:19302"])]
-    )
-    pc = RTCPeerConnection(configuration=config)
-
-    # 🎥 Add video track
-    stream = RTSPVideoTrack()
-    pc.addTrack(stream)
-
-    # 🔊 Add audio track if available (FYI - Comment this if you want to reduce CPU uses)
-    if stream.audio:
-        pc.addTrack(stream.audio)
-
-    await pc.setLocalDescription(await pc.createOffer())
-
-    whip_url = f"http://{SERVER_IP}:{SERVER_PORT}/{MediaMTX_ENDPOINT}/whip"
-    print(f"[INFO] Sending offer to WHIP endpoint: {whip_url}")
-
-    async with ClientSession() as session:
-        async with session.post(
-            whip_url,
-            data=pc.localDescription.sdp,
-            headers={"Content-Type": "application/sdp"}
-        ) as resp:
-            if resp.status != 201:
-                print(f"[ERROR] Failed to initiate WHIP: HTTP {resp.status}")
-                print(await resp.text())
-                return
+    def stop(self):
+        super().stop()
+        self.video.stop()  # MediaPlayer closes the RTSP session once its tracks are stopped
+        if self.audio:
+            self.audio.stop()
+
+# === H.264 Pass-through Track ===
+def nal_types(data):
+    """NAL unit types in an Annex B buffer."""
+    types = set()
+    i = data.find(b"\x00\x00\x01")
+    while i != -1 and i + 3 < len(data):
+        types.add(data[i + 3] & 0x1F)
+        i = data.find(b"\x00\x00\x01", i + 3)
+    return types
+
+def annexb_parameter_sets(extradata):
+    """SPS/PPS from the stream's extradata as Annex B, whether FFmpeg gives Annex B or avcC."""
+    if not extradata or extradata[:1] != b"\x01":
+        return bytes(extradata or b"")
+    units, offset = [], 5
+    for mask in (0x1F, 0xFF):  # SPS count (low 5 bits), then PPS count
+        count = extradata[offset] & mask
+        offset += 1
+        for _ in range(count):
+            length = int.from_bytes(extradata[offset:offset + 2], "big")
+            units.append(b"\x00\x00\x00\x01" + bytes(extradata[offset + 2:offset + 2 + length]))
+            offset += 2 + length
+    return b"".join(units)
 
-            sdp = await resp.text()
-            print("[SUCCESS] WebRTC connection established with MediaMTX.")
-            await pc.setRemoteDescription(RTCSessionDescription(sdp=sdp, type="answer"))
+class KeyframeRequestSender(RTCRtpSender):
+    """
+    RTCRtpSender that also reports keyframe requests (RTCP PLI/FIR) to
+    `on_keyframe_request`. aiortc has no public hook for them: it handles
+    them in _send_keyframe(), which only asks its own encoder for a keyframe
+    and so does nothing for pass-through packets.
+    """
+    on_keyframe_request = None
 
-    # Keep the stream running
+    def _send_keyframe(self):
+        super()._send_keyframe()
+        if self.on_keyframe_request is not None:
+            self.on_keyframe_request()
+
+# Both internals the hook relies on are checked too, in case a tested version is patched locally
+KEYFRAME_HOOK = (aiortc.__version__ in AIORTC_TESTED
+                 and callable(getattr(RTCRtpSender, "_send_keyframe", None))
+                 and getattr(rtcpeerconnection, "RTCRtpSender", None) is RTCRtpSender)
+
+def add_pass_through_transceiver(pc, track):
+    """
+    pc.addTransceiver(track, direction="sendonly"), built with a
+    KeyframeRequestSender routed to track.request_keyframe when KEYFRAME_HOOK
+    allows. aiortc takes no sender class, so the one addTransceiver() builds
+    is swapped for the duration of that (synchronous) call.
+    """
+    if not KEYFRAME_HOOK:
+        print(f"[WARN] Keyframe requests not hooked on aiortc {aiortc.__version__} (tested: "
+              f"{', '.join(AIORTC_TESTED)}); new viewers wait for the camera's next keyframe.")
+        return pc.addTransceiver(track, direction="sendonly")
+    rtcpeerconnection.RTCRtpSender = KeyframeRequestSender
     try:
-        await asyncio.sleep(3600)
-    except KeyboardInterrupt:
-        print("[INFO] Stream interrupted by user.")
+        transceiver = pc.addTransceiver(track, direction="sendonly")
     finally:
-        print("[INFO] Closing WebRTC connection.")
-        await pc.close()
+        rtcpeerconnection.RTCRtpSender = RTCRtpSender
+    transceiver.sender.on_keyframe_request = track.request_keyframe
+    return transceiver
+
+class RTSPPassThroughTrack(MediaStreamTrack):
+    """
+    Forwards the camera's encoded H.264 access units to the WebRTC sender,
+    which only repacketizes them (aiortc packs av.Packet without encoding).
+    SPS/PPS are prepended to keyframes that lack them so a viewer can join
+    at any keyframe. The camera can't be told to send a keyframe, so a
+    keyframe request (PLI) that isn't answered within KEYFRAME_WAIT_S
+    restarts the RTSP session, which cameras begin with an IDR frame.
+    With a `recorder`, every packet also goes to it from the demux thread,
+    whether or not a WebRTC session is up.
+    """
+    kind = "video"
+
+    def __init__(self, recorder=None):
+        super().__init__()
+        self.recorder = recorder
+        self.rtsp_stream = RTSP_STREAM
+        self.rtsp_url = rtsp_url(self.rtsp_stream)
+        self.queue = asyncio.Queue()
+        self.loop = asyncio.get_event_loop()
+        self.parameter_sets = b""
+        self.waiting_keyframe = True  # Nothing decodes before the first keyframe
+        self.keyframe_requested_at = None
+        self.forwarded = 0
+        self.keyframes = 0
+        self.skipped = 0
+        self.keyframe_requests = 0
+        self.restarts = 0
+        self._container = None
+        self._quit = None
+        self._pts_offset = 0
+        self._last_pts = None
+        self._first_pts = True
+        self._switch_to = None
+        print(f"[INFO] Connecting to RTSP stream (pass-through): {self.rtsp_url}")
+        self._open()
+
+    def resume(self):
+        """A new WebRTC session: start it on a keyframe, skipping what queued up meanwhile."""
+        self.waiting_keyframe = True
+        self.request_keyframe()
+
+    def switch_stream(self, rung):
+        """ABR hook: move to the camera stream named by `rung.stream` at the next packet."""
+        if rung.stream and rung.stream != self.rtsp_stream:
+            self._switch_to = rung.stream
+
+    def request_keyframe(self):
+        self.keyframe_requests += 1
+        if self.keyframe_requested_at is None:
+            self.keyframe_requested_at = time.monotonic()
+
+    async def recv(self):
+        while True:
+            if self._switch_to:
+                self.rtsp_stream, self._switch_to = self._switch_to, None
+                await self._restart(f"switching to {self.rtsp_stream}")
+            packet = await self.queue.get()
+            if packet is None:
+                await self._restart("RTSP stream ended")
+                continue
+            now = time.monotonic()
+            if packet.is_keyframe:
+                self.keyframes += 1
+                self.waiting_keyframe = False
+                self.keyframe_requested_at = None
+                packet = self._with_parameter_sets(packet)
+            elif self.waiting_keyframe:
+                self.skipped += 1
+                continue
+            elif self.keyframe_requested_at and now - self.keyframe_requested_at > KEYFRAME_WAIT_S:
+                await self._restart("no keyframe after a keyframe request")
+                continue
+            self._retime(packet)
+            self.forwarded += 1
+            return packet
+
+    def stop(self):
+        super().stop()
+        self._close()
+
+    def stats(self):
+        return {
+            "forwarded": self.forwarded,
+            "keyframes": self.keyframes,
+            "skipped": self.skipped,
+            "keyframe_requests": self.keyframe_requests,
+            "restarts": self.restarts,
+            "queued": self.queue.qsize(),
+        }
+
+    # === RTSP Session ===
+    def _open(self):
+        self.rtsp_url = rtsp_url(self.rtsp_stream)
+        container = av.open(self.rtsp_url, format="rtsp", options=RTSP_OPTIONS, timeout=5)
+        stream = container.streams.video[0]
+        if stream.codec_context.name != "h264":
+            container.close()
+            raise ValueError(f"Camera sends {stream.codec_context.name}, pass-through needs h264")
+        self.parameter_sets = annexb_parameter_sets(stream.codec_context.extradata)
+        if self.recorder:
+            self.recorder.configure("h264", stream.codec_context.width, stream.codec_context.height)
+        self._container = container
+        self._quit = threading.Event()
+        self._first_pts = True
+        threading.Thread(target=self._demux, args=(container, stream, self._quit), daemon=True).start()
+
+    def _close(self):
+        if self._quit is not None:
+            self._quit.set()  # The demux thread closes its container
+
+    async def _restart(self, reason):
+        print(f"[WARN] Restarting RTSP session: {reason}")
+        self.restarts += 1
+        self._close()
+        self.waiting_keyframe = True
+        self.keyframe_requested_at = None
+        while self.readyState == "live":
+            try:
+                await self.loop.run_in_executor(None, self._open)  # RTSP setup blocks for up to the timeout
+                return
+            except Exception as e:
+                print(f"[ERROR] RTSP reconnect failed: {type(e).__name__}: {e}")
+                await asyncio.sleep(1)
+
+    def _demux(self, container, stream, quit):
+        try:
+            for packet in container.demux(stream):
+                if quit.is_set():
+                    break
+                if packet.size and packet.pts is not None:
+                    if self.recorder:
+                        recorded = self._with_parameter_sets(packet) if packet.is_keyframe else packet
+                        self.recorder.add(recorded, float(packet.pts * packet.time_base), packet.is_keyframe)
+                    self.loop.call_soon_threadsafe(self._enqueue, packet)
+        except Exception as e:
+            if not quit.is_set():
+                print(f"[ERROR] RTSP demux failed: {type(e).__name__}: {e}")
+        finally:
+            container.close()
+            if not quit.is_set():
+                self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+    def _enqueue(self, packet):
+        if self.queue.qsize() >= PASS_THROUGH_QUEUE:
+            # The sender fell behind; stale P-frames are useless, skip to the next keyframe
+            self.skipped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.waiting_keyframe = True
+        self.queue.put_nowait(packet)
+
+    def _with_parameter_sets(self, packet):
+        data = bytes(packet)
+        if not self.parameter_sets or 7 in nal_types(data):  # 7 = SPS already in-band
+            return packet
+        with_sets = av.Packet(self.parameter_sets + data)
+        with_sets.pts, with_sets.dts, with_sets.time_base = packet.pts, packet.dts, packet.time_base
+        return with_sets
+
+    def _retime(self, packet):
+        """Keep RTP timestamps moving forward across RTSP restarts."""
+        if self._first_pts:
+            self._first_pts = False
+            if self._last_pts is not None:
+                self._pts_offset = self._last_pts + int(1 / (30 * packet.time_base)) - packet.pts
+        packet.pts += self._pts_offset
+        packet.dts = packet.pts
+        self._last_pts = packet.pts
+
+def h264_codecs():
+    return [codec for codec in RTCRtpSender.getCapabilities("video").codecs if codec.mimeType == "video/H264"]
+
+# === CCTV Stream Source ===
+class CCTVStream(StreamSource):
+    """
+    The camera's RTSP feed for the shared publisher: H.264 pass-through
+    when the camera and the server allow it, otherwise decode + re-encode.
+    Only pass-through feeds the `recorder`: in transcode mode the encoded
+    packets stay inside the media player.
+    """
+    name = "cctv"
+
+    def __init__(self, pass_through=PASS_THROUGH, recorder=None):
+        self.pass_through = pass_through
+        self.recorder = recorder
+        self.track = None
+
+    @property
+    def ladder(self):
+        return PASS_THROUGH_LADDER if self.pass_through else LADDER
+
+    @property
+    def start_rung(self):
+        streams = [rung.stream for rung in self.ladder]
+        return streams.index(RTSP_STREAM) if RTSP_STREAM in streams else None
+
+    def open(self):
+        if self.pass_through:
+            try:
+                self.track = RTSPPassThroughTrack(self.recorder)
+            except (ValueError, OSError, av.FFmpegError) as e:  # Not H.264, or the RTSP/demux setup failed
+                print(f"[WARN] Pass-through unavailable ({type(e).__name__}: {e}); falling back to transcode.")
+        if self.track is None:
+            self._transcode()
+
+    def _transcode(self):
+        self.pass_through = False
+        if self.recorder:
+            print("[WARN] Transcode mode: event recording is off.")
+        self.track = RTSPVideoTrack()
+
+    def add_tracks(self, pc):
+        # 🎥 The camera's own H.264 if possible, otherwise decode + re-encode
+        if self.pass_through:
+            transceiver = add_pass_through_transceiver(pc, self.track)  # Keyframe requests reach the track
+            transceiver.setCodecPreferences(h264_codecs())  # Packets can only be forwarded as H.264
+            self.track.resume()
+            return transceiver.sender
+        sender = pc.addTrack(self.track)
+
+        # 🔊 Add audio track if available (FYI - Comment this if you want to reduce CPU uses)
+        # Pass-through sends video only; the camera's audio would need decoding anyway
+        if self.track.audio:
+            pc.addTrack(self.track.audio)
+        return sender
+
+    def accept(self, answer_sdp):
+        if self.pass_through and "H264/90000" not in answer_sdp:
+            print("[WARN] Server did not accept H.264; falling back to transcode.")
+            self.track.stop()
+            self._transcode()
+            return False
+        print(f"[INFO] Streaming in {'pass-through' if self.pass_through else 'transcode'} mode.")
+        return True
+
+    def apply(self, rung):
+        if self.pass_through:
+            self.track.switch_stream(rung)
+        else:
+            self.track.output.set_rung(rung)
+
+    def stats(self):
+        stats = self.track.stats() if self.pass_through else {}
+        if self.recorder:
+            stats["recording"] = self.recorder.stats()
+        return stats
+
+    def close(self):
+        if self.track is not None:
+            self.track.stop()
+        if self.recorder:
+            self.recorder.close()
+
+# === WebRTC Streaming Function (reconnects until stopped, see whip_publisher.py) ===
+async def publish_stream(pass_through=PASS_THROUGH):
+    recorder = EventRecorder("cctv") if RECORD and pass_through else None
+    if recorder:
+        await listen_for_triggers(recorder)  # Brake and "record" commands arrive from robot_listener
+    stream = CCTVStream(pass_through, recorder)
+    await Publisher(stream, whip_url(SERVER_IP, SERVER_PORT, MediaMTX_ENDPOINT), adaptive=ADAPTIVE).run()
 
 # === Entry Point ===
 async def main():
     try:
         await publish_stream()
+    except asyncio.CancelledError:
+        print("[INFO] Stream interrupted by user.")
     except Exception as e:
         print(f"[FATAL] Unhandled exception: {e}")
 
@@ -1,113 +1,109 @@
-# Import required modules for WebRTC, Pi Camera video capture, and HTTP
+# Import required modules for Pi Camera video capture and the shared WHIP publisher
 import os
 import asyncio
-import aiohttp
-import av
 import numpy as np
-from picamera2 import Picamera2
-from aiortc import (
-    RTCPeerConnection,
-    RTCConfiguration,
-    RTCIceServer,
-    RTCSessionDescription,
-    VideoStreamTrack
-)
+from picamera2 import MappedArray, Picamera2
+from frame_capture import frame_shape
+from adaptive_bitrate import Rung
+from event_recorder import EventRecorder, listen_for_triggers
+from motion_detector import MotionDetector, MotionTelemetry
+from vision_obstacles import VisionObstacleStage, VisionTelemetry
+from whip_publisher import CaptureStream, Publisher, whip_url
 
 # === Static Configuration ===
 FRAME_WIDTH  = 640
 FRAME_HEIGHT = 360
 FRAME_RATE   = 30
+PREFER_YUV   = True  # Capture YUV420 from the ISP (no RGB frames, no per-frame colour conversion)
 
 SERVER_IP = "Your Server IP Address"  # Server IP address
 SERVER_PORT = "8889"
 MediaMTX_ENDPOINT = "cam1"
+ADAPTIVE     = True  # Step resolution/frame rate/bitrate down on a congested uplink instead of freezing
+MOTION_DETECT = True # Analyse frames for motion and report it as "motion" telemetry via robot_listener
+MOTION_GATED = False # With MOTION_DETECT: send only a trickle of frames while the robot sees nothing move
+VISION_OBSTACLES = True # Find obstacles in the frames; robot_listener fuses them with the ultrasonic distance for the brake
+RECORD       = True  # Keep the last seconds in memory and record to disk on motion, brake or a "record" command
+LADDER = (           # (width, height, fps, bitrate) rungs, lowest first; the stream starts on the top one
+    Rung(320, 180, 10, 150_000),
+    Rung(426, 240, 15, 300_000),
+    Rung(FRAME_WIDTH, FRAME_HEIGHT, 20, 500_000),
+    Rung(FRAME_WIDTH, FRAME_HEIGHT, FRAME_RATE, 800_000),
+)
 
-# === Custom Video Track for Pi Camera ===
-class PiCameraVideoStreamTrack(VideoStreamTrack):
+# === Pi Camera frame source for the capture thread ===
+class PiCameraSource:
     """
-    Custom video track to capture frames from Raspberry Pi Camera using picamera2.
+    Captures with picamera2 on the capture thread. The ISP outputs YUV420
+    directly, which is what the encoder wants, so frames need no conversion;
+    RGB888 (BGR byte order) is the fallback when the row stride is padded.
+    read() maps the camera's buffer and copies it straight into the ring
+    slot, where capture_array() would allocate a frame to copy from first.
     """
-    kind = "video"
 
     def __init__(self):
-        super().__init__()
-        print("[INFO] Initializing Pi Camera...")
+        self.picam2 = None
+        self.shape = None
+        self.format = None
 
+    def open(self):
+        print("[INFO] Initializing Pi Camera...")
         self.picam2 = Picamera2()
-        config = self.picam2.create_video_configuration(
-            main={"size": (FRAME_WIDTH, FRAME_HEIGHT)},
-            controls={"FrameRate": FRAME_RATE}
-        )
-        self.picam2.configure(config)
+        for camera_format, self.format in (("YUV420", "yuv420p"), ("RGB888", "bgr24")):
+            if camera_format == "YUV420" and not PREFER_YUV:
+                continue
+            config = self.picam2.create_video_configuration(
+                main={"size": (FRAME_WIDTH, FRAME_HEIGHT), "format": camera_format},
+                controls={"FrameRate": FRAME_RATE}
+            )
+            self.picam2.configure(config)
+            # Padded YUV rows would need repacking per frame; RGB lets libav handle the stride once
+            if camera_format != "YUV420" or self.picam2.camera_config["main"]["stride"] == FRAME_WIDTH:
+                break
+        self.shape = frame_shape(self.format, FRAME_WIDTH, FRAME_HEIGHT)
         self.picam2.start()
-        print(f"[INFO] Pi Camera started at {FRAME_WIDTH}x{FRAME_HEIGHT}@{FRAME_RATE}fps")
-
-    async def recv(self):
-        pts, time_base = await self.next_timestamp()
-
-        # Capture frame as NumPy array
-        frame = self.picam2.capture_array()
-
-        # Convert to RGB and wrap in VideoFrame
-        frame_rgb = np.ascontiguousarray(frame[..., :3])
-        video_frame = av.VideoFrame.from_ndarray(frame_rgb, format="rgb24")
-        video_frame.pts = pts
-        video_frame.time_base = time_base
-
-        return video_frame
-
-# === WebRTC Streaming Function ===
+        print(f"[INFO] Pi Camera started at {FRAME_WIDTH}x{FRAME_HEIGHT}@{FRAME_RATE}fps ({self.format})")
+
+    def set_frame_rate(self, fps):
+        """Slow the sensor itself down on lower rungs (takes effect live, no restart)."""
+        if self.picam2 is not None:
+            self.picam2.set_controls({"FrameRate": fps})
+
+    def read(self, out):
+        # Blocks until the next frame is ready; the request holds its buffer until released
+        request = self.picam2.capture_request()
+        try:
+            with MappedArray(request, "main") as mapped: # The buffer itself, shaped as the frame
+                np.copyto(out, mapped.array)
+        finally:
+            request.release()
+        return True
+
+    def close(self):
+        if self.picam2 is not None:
+            self.picam2.stop()
+
+# === WebRTC Streaming Function (reconnects until stopped, see whip_publisher.py) ===
 async def publish_stream():
     print("[INFO] Preparing WebRTC connection to MediaMTX...")
-
-    config = RTCConfiguration(
-        iceServers=[RTCIceServer(urls=["stun:stun.l.google.com:19302"])]
-    )
-    pc = RTCPeerConnection(configuration=config)
-
-    # Attach video track from Pi camera
-    video_track = PiCameraVideoStreamTrack()
-    pc.addTrack(video_track)
-
-    # Create SDP offer
-    offer = await pc.createOffer()
-    await pc.setLocalDescription(offer)
-    print("[INFO] SDP offer created successfully")
-
-    # Send offer to WHIP endpoint
-    whip_url = f"http://{SERVER_IP}:{SERVER_PORT}/{MediaMTX_ENDPOINT}/whip"
-    print(f"[INFO] Sending offer to WHIP endpoint: {whip_url}")
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            whip_url,
-            data=pc.localDescription.sdp,
-            headers={"Content-Type": "application/sdp"}
-        ) as resp:
-            if resp.status != 201:
-                print(f"[ERROR] WHIP connection failed: HTTP {resp.status}")
-                print(await resp.text())
-                return
-
-            answer_sdp = await resp.text()
-            await pc.setRemoteDescription(
-                RTCSessionDescription(sdp=answer_sdp, type="answer")
-            )
-            print("[SUCCESS] WebRTC connection established with MediaMTX!")
-
-    # Keep stream alive
-    try:
-        await asyncio.sleep(3600)
-    except KeyboardInterrupt:
-        print("[INFO] Stream interrupted by user.")
-    finally:
-        await pc.close()
-        video_track.picam2.stop()
-        print("[INFO] Stream closed and Pi Camera released.")
+    motion = MotionDetector() if MOTION_DETECT else None
+    if motion:
+        motion.add_listener(MotionTelemetry().send)  # robot_listener on this Pi forwards it to the server
+    recorder = EventRecorder("picamera") if RECORD else None
+    if recorder:
+        await listen_for_triggers(recorder)  # Brake and "record" commands arrive from robot_listener
+    vision = VisionObstacleStage() if VISION_OBSTACLES else None
+    if vision:
+        vision.add_listener(VisionTelemetry().send)  # Off the capture thread, at its own rate
+    stream = CaptureStream(PiCameraSource(), "picamera", LADDER, motion=motion, gated=MOTION_GATED,
+                           recorder=recorder, vision=vision)  # Lower rungs also slow the sensor down
+    await Publisher(stream, whip_url(SERVER_IP, SERVER_PORT, MediaMTX_ENDPOINT), adaptive=ADAPTIVE).run()
 
 # === Entry Point ===
 if __name__ == "__main__":
     try:
         asyncio.run(publish_stream())
+    except KeyboardInterrupt:
+        print("[INFO] Stream interrupted by user.")
     except Exception as e:
         print(f"[FATAL] Unhandled exception: {e}")
\ No newline at end of file
@@ -1,38 +1,48 @@
 #send_webcam_stream_to_server.py
-# Import required modules for WebRTC, video capture, and HTTP communication
+# Import required modules for video capture and the shared WHIP publisher
 import os
 import cv2                            # For webcam video capture
 import asyncio                        # For asynchronous event loop
-import aiohttp                        # For sending HTTP (WHIP) requests
-import av                             # For video frame encoding
-from aiortc import (
-    RTCPeerConnection,               # Core class for managing WebRTC connections
-    RTCConfiguration,                # Configuration for STUN/TURN servers
-    RTCIceServer,                    # STUN server entry
-    RTCSessionDescription,           # WebRTC SDP offer/answer
-    VideoStreamTrack                 # Base class for sending video frames
-)
+import numpy as np
+from frame_capture import frame_shape  # Capture thread + latest-frame ring buffer layout
+from adaptive_bitrate import DEFAULT_LADDER  # Steps quality with the link
+from event_recorder import EventRecorder, listen_for_triggers  # Pre/post-event recording
+from motion_detector import MotionDetector, MotionTelemetry  # Motion events and gating
+from vision_obstacles import VisionObstacleStage, VisionTelemetry  # Free floor ahead, for the brake
+from whip_publisher import CaptureStream, Publisher, whip_url  # WebRTC/WHIP session, reconnects
 
 # === Static Configuration ===
 #Please not the bellow value should be in number format nto string format
 CAMERA_INDEX = 0        # Index of webcam (0 = default webcam)
 FRAME_WIDTH  = 640      # Desired video width
 FRAME_HEIGHT = 360      # Desired video height
+PREFER_YUV = True       # Capture raw YUYV when the driver offers it (skips BGR frames and colour conversion)
 
 SERVER_IP = "Your Server Ip"  # Your Server IP address
 SERVER_PORT = "8889"         # Port for WebRTC (Make sure to enable this port & run MediaMTX on server)
 MediaMTX_ENDPOINT = "cam1"   # MediaMTX endpoint
-
-# === Define a custom video track class that reads frames from a webcam ===
-class WebcamVideoStreamTrack(VideoStreamTrack):
+ADAPTIVE = True              # Step resolution/frame rate/bitrate down on a congested uplink instead of freezing
+LADDER = DEFAULT_LADDER      # (width, height, fps, bitrate) rungs, lowest first; the stream starts on the top one
+MOTION_DETECT = False        # Analyse frames for motion; events go to the server via robot_listener on this machine
+MOTION_GATED = False         # With MOTION_DETECT: send only a trickle of frames while nothing moves
+VISION_OBSTACLES = False     # Find obstacles in the frames for the brake; only for a camera facing forward on the robot
+RECORD = False               # Keep the last seconds in memory and record to disk on motion, brake or a "record" command
+
+# === Webcam frame source for the capture thread ===
+class WebcamSource:
     """
-    Custom video track to capture frames from a webcam device using OpenCV.
-    This class is passed to the WebRTC connection as the source of video frames.
+    Reads the webcam with OpenCV on the capture thread. Where the V4L2 driver
+    offers raw YUYV the frames stay YUV (no colour conversion in Python);
+    otherwise OpenCV's BGR frames go to the encoder as-is and libav converts
+    them once, with its vectorized scaler.
     """
-    kind = "video"
 
     def __init__(self):
-        super().__init__()mat
+        self.cap = None
+        self.shape = None
+        self.format = None
+
+    def open(self):
         # 🔌 Step 1: Open webcam device at the given index
         self.cap = cv2.VideoCapture(CAMERA_INDEX)
         if not self.cap.isOpened():
@@ -41,86 +51,59 @@ class WebcamVideoStreamTrack(VideoStreamTrack):
         # 🎥 Step 2: Set desired resolution (optional)
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
-
-        print(f"[INFO] Webcam initialized on index {CAMERA_INDEX} at resolution {FRAME_WIDTH}x{FRAME_HEIGHT}")
-
-    async def recv(self):
-        """
-        Called repeatedly by WebRTC to get the next video frame.
-        Converts OpenCV frame to aiortc-compatible for.
-        """
-        pts, time_base = await self.next_timestamp()  # Generate timestamp for the frame
-        ret, frame = self.cap.read()  # Capture frame
-
-        if not ret:
-            raise RuntimeError("❌ Failed to read frame from webcam.")
-
-        # Convert BGR (OpenCV format) to RGB
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-        # Convert NumPy array to aiortc VideoFrame
-        video_frame = av.VideoFrame.from_ndarray(frame, format="rgb24")
-        video_frame.pts = pts
-        video_frame.time_base = time_base
-
-        #print("[INFO] Frame captured and sent")
-        return video_frame
-
-# === Main function to establish a WebRTC connection and publish the webcam stream ===
+        # The driver may pick a different mode; size the ring for what it delivers
+        width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        # 🎨 Step 3: Ask V4L2 for raw YUYV and keep it if the driver complies
+        self.format = "bgr24"
+        if PREFER_YUV:
+            self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"YUYV"))
+            self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            ret, frame = self.cap.read()
+            if ret and frame.size == width * height * 2:
+                self.format = "yuyv422"
+            else:
+                self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        self.shape = frame_shape(self.format, width, height)
+        print(f"[INFO] Webcam initialized on index {CAMERA_INDEX} at resolution {width}x{height} ({self.format})")
+
+    def read(self, out):
+        if self.format == "bgr24":
+            ret, frame = self.cap.read(out)  # Decodes straight into the ring slot when the size matches
+            if ret and frame is not out:
+                np.copyto(out, frame)
+            return ret
+        ret, frame = self.cap.read()  # Raw driver buffer, one flat row of YUYV bytes
+        if ret:
+            np.copyto(out, frame.reshape(out.shape))
+        return ret
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+
+# === Publish the webcam stream, re-offering whenever the connection drops (see whip_publisher.py) ===
 async def publish_stream():
     print("[INFO] Preparing WebRTC connection to MediaMTX (Server)...")
-
-    # 🌍 Step 3: Create WebRTC peer connection with a STUN server (for NAT traversal)
-    config = RTCConfiguration(
-        iceServers=[RTCIceServer(urls=["stun:stun.l.google.com:19302"])]
-    )
-    pc = RTCPeerConnection(configuration=config)
-
-    # 📡 Step 4: Create and attach video track from webcam
-    video_track = WebcamVideoStreamTrack()
-    pc.addTrack(video_track)
-
-    # 🧾 Step 5: Generate SDP offer from the client (this device)
-    offer = await pc.createOffer()
-    await pc.setLocalDescription(offer)
-    print("[INFO] SDP offer created successfully")
-
-    # 🌐 Step 6: Send SDP offer to MediaMTX WHIP endpoint via HTTP POST
-    whip_url = f"http://{SERVER_IP}:{SERVER_PORT}/{MediaMTX_ENDPOINT}/whip" 
-    print(f"[INFO] Sending offer to WHIP endpoint: {whip_url}")
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            whip_url,
-            data=pc.localDescription.sdp,                    # SDP offer body
-            headers={"Content-Type": "application/sdp"}      # Required header for WHIP
-        ) as resp:
-            if resp.status != 201:
-                print(f"[ERROR] WHIP connection failed: HTTP {resp.status}")
-                print(await resp.text())
-                return
-
-            # ✅ Step 7: Receive SDP answer from server and complete WebRTC handshake
-            answer_sdp = await resp.text()
-            await pc.setRemoteDescription(
-                RTCSessionDescription(sdp=answer_sdp, type="answer")
-            )
-            print("[SUCCESS] WebRTC connection established with MediaMTX!")
-
-    # 🕒 Step 8: Keep stream alive for 1 hour or until manually stopped
-    try:
-        await asyncio.sleep(3600)
-    except KeyboardInterrupt:
-        print("[INFO] Stream interrupted by user.")
-    finally:
-        # 🔚 Step 9: Cleanup
-        await pc.close()
-        video_track.cap.release()
-        print("[INFO] Stream closed and webcam released.")
+    motion = MotionDetector() if MOTION_DETECT else None
+    if motion:
+        motion.add_listener(MotionTelemetry().send)
+    recorder = EventRecorder("webcam") if RECORD else None
+    if recorder:
+        await listen_for_triggers(recorder)  # Brake and "record" commands arrive from robot_listener
+    vision = VisionObstacleStage() if VISION_OBSTACLES else None
+    if vision:
+        vision.add_listener(VisionTelemetry().send)
+    stream = CaptureStream(WebcamSource(), "webcam", LADDER, motion=motion, gated=MOTION_GATED, recorder=recorder,
+                           vision=vision)
+    await Publisher(stream, whip_url(SERVER_IP, SERVER_PORT, MediaMTX_ENDPOINT), adaptive=ADAPTIVE).run()
 
 # === Entry Point ===
 if __name__ == "__main__":
     try:
         asyncio.run(publish_stream())
+    except KeyboardInterrupt:
+        print("[INFO] Stream interrupted by user.")
     except Exception as e:
         print(f"[FATAL] Unhandled exception: {e}")
\ No newline at end of file
@@ -0,0 +1,192 @@
+# vision_obstacles.py
+# Camera-based obstacle stage for the capture pipeline: finds where the floor
+# in front of the robot stops on a decimated luma copy of the newest frame,
+# for obstacles the ultrasonic sensor misses (thin, angled or soft ones).
+# Pixels whose luma is rare in the floor patch just ahead of the bumper, or
+# that sit on a strong horizontal edge, count as obstacle; per column bin, the
+# nearest run of them is projected onto the ground plane to a distance. The
+# result is a coarse free-space strip; the distance straight ahead goes to
+# robot_listener's local telemetry port as "vision_distance", where it is
+# fused with the ultrasonic reading for the brake (server/fusion.py). Runs on
+# its own thread at VISION_HZ, never on the capture thread, so the video
+# stream keeps its rate.
+import collections
+import threading
+import time
+
+import numpy as np
+
+from motion_detector import MotionTelemetry, luma
+
+# === Configuration ===
+VISION_HZ = 10 # Frames analysed per second, whatever the camera's rate
+DECIMATE = 4 # Analyse every 4th pixel each way (640x360 -> 160x90)
+STRIP_BINS = 16 # Column bins across the image in the free-space strip
+PATH_BINS = 6 # Centre bins the robot drives into; their minimum is the distance ahead
+REFERENCE_ROWS = 0.1 # Bottom fraction of the image assumed to be free floor
+LUMA_BINS = 32 # Histogram bins of the floor patch's luma
+LUMA_TOLERANCE = 2 # Bins either way a floor luma may drift (lighting falls off with distance)
+FLOOR_SHARE = 0.01 # Luma with less than this share of the floor patch within the tolerance is not floor
+EDGE_SIGMA = 4.0 # Vertical luma step, in floor step deviations, that counts as an obstacle edge
+MIN_EDGE = 24
+MIN_PIXELS = 2 # Obstacle pixels a bin needs in a row to be blocked there
+MIN_HEIGHT_ROWS = 4 # Blocked rows must stack this high: noise and floor joints don't
+MAX_RANGE_CM = 300 # Reported when a bin is free up to the horizon, like the ultrasonic maximum
+
+# Camera mounting (Pi Camera v2 at the front of the chassis)
+CAMERA_HEIGHT_CM = 15.0
+CAMERA_TILT_DEG = 15.0 # Optical axis below the horizontal
+VERTICAL_FOV_DEG = 48.0
+
+# Distances of the free-space strip; captured_ns is the frame's time.monotonic_ns()
+FreeSpace = collections.namedtuple("FreeSpace", ["strip_cm", "ahead_cm", "captured_ns"])
+
+def row_distances(rows, height_cm=CAMERA_HEIGHT_CM, tilt_deg=CAMERA_TILT_DEG, vfov_deg=VERTICAL_FOV_DEG):
+    """Ground distance (cm) seen by each image row, top to bottom; inf at and above the horizon."""
+    below = np.radians(tilt_deg + ((np.arange(rows) + 0.5) / rows - 0.5) * vfov_deg)
+    with np.errstate(divide="ignore"):
+        return np.where(below > 0, height_cm / np.tan(np.maximum(below, 1e-9)), np.inf)
+
+class FreeSpaceDetector:
+    """
+    detect(gray, captured_ns) -> FreeSpace for a decimated uint8 luma image.
+    The floor model, a luma histogram, is re-learned from the bottom
+    REFERENCE_ROWS of every frame, so lighting changes need no calibration
+    and tile joints or markings that reach the bumper count as floor. An
+    obstacle within LUMA_TOLERANCE bins of the floor's luma is only found by
+    its edges, and one already inside the floor band is left to the
+    ultrasonic sensor.
+    """
+
+    def __init__(self, bins=STRIP_BINS, path_bins=PATH_BINS):
+        self.bins = bins
+        self.path_bins = path_bins
+        self._shape = None
+        self._distances = None
+
+    def _prepare(self, shape):
+        rows, columns = shape
+        self._shape = shape
+        self._width = columns - columns % self.bins # Whole bins only
+        self._distances = np.minimum(row_distances(rows), MAX_RANGE_CM)
+        self._horizon = int(np.argmax(np.isfinite(row_distances(rows)))) # First row below the horizon
+        self._reference = max(2, int(rows * REFERENCE_ROWS))
+        lo = (self.bins - self.path_bins) // 2
+        self._path = slice(lo, lo + self.path_bins)
+
+    def detect(self, gray, captured_ns=0):
+        if gray.shape != self._shape:
+            self._prepare(gray.shape)
+        image = gray[self._horizon:, :self._width]
+        shift = 8 - int(np.log2(LUMA_BINS))
+        floor = np.bincount((image[-self._reference:] >> shift).ravel(), minlength=LUMA_BINS)
+        floor = np.convolve(floor, np.ones(2 * LUMA_TOLERANCE + 1), "same")
+        rare = floor < FLOOR_SHARE * self._reference * image.shape[1]
+        obstacle = rare[image >> shift]
+        steps = np.abs(np.diff(image.astype(np.int16), axis=0))
+        floor_steps = steps[-self._reference + 1:]
+        edge = steps > max(EDGE_SIGMA * floor_steps.std() + floor_steps.mean(), MIN_EDGE)
+        obstacle[:-1] |= edge
+        rows = obstacle.shape[0]
+        blocked = obstacle.reshape(rows, self.bins, -1).sum(axis=2) >= MIN_PIXELS # A couple: thin poles count
+        tall = blocked[:rows - MIN_HEIGHT_ROWS + 1].copy()
+        for k in range(1, MIN_HEIGHT_ROWS):
+            tall &= blocked[k:rows - MIN_HEIGHT_ROWS + 1 + k]
+        # Bottom row of the nearest stack per bin; the stack's lowest row is where it meets the floor
+        from_bottom = tall[::-1]
+        nearest = tall.shape[0] - 1 - np.argmax(from_bottom, axis=0) + MIN_HEIGHT_ROWS - 1
+        strip = np.where(from_bottom.any(axis=0), self._distances[self._horizon + nearest], MAX_RANGE_CM)
+        return FreeSpace(strip, float(strip[self._path].min()), captured_ns)
+
+class VisionTelemetry(MotionTelemetry):
+    """MotionTelemetry for free-space results, stamped with the frame's capture time."""
+
+    def send(self, free_space):
+        self.post("vision_distance", round(free_space.ahead_cm, 1), free_space.captured_ns)
+
+class VisionObstacleStage:
+    """
+    Runs a FreeSpaceDetector on `capture` (a frame_capture.CaptureEngine; a
+    CaptureStream sets its own) at `rate_hz` on its own thread. Each pass
+    copies a decimated luma view of the newest frame out of the ring
+    (CaptureEngine.snapshot) and analyses
+    the copy, so the capture thread and the encoder never wait for it.
+    Frames already analysed are skipped. listeners are called as
+    listener(free_space) on the stage thread.
+    """
+
+    def __init__(self, capture=None, detector=None, rate_hz=VISION_HZ, decimate=DECIMATE):
+        self.capture = capture
+        self.detector = detector or FreeSpaceDetector()
+        self.rate_hz = rate_hz
+        self.decimate = decimate
+        self.listeners = []
+        self.latest = None # Last FreeSpace
+        self.analyzed = 0
+        self.skipped = 0 # Passes with no new frame
+        self.cost_ms = collections.deque(maxlen=256) # Copy + detection per frame
+        self.latency_ms = collections.deque(maxlen=256) # Frame captured -> result published
+        self._last_seq = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="vision", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _copy(self, frame, format, seq, captured_ns):
+        if seq == self._last_seq:
+            return None
+        self._last_seq = seq
+        return luma(frame, format, self.decimate).copy(), captured_ns
+
+    def analyze_newest(self):
+        start = time.perf_counter()
+        snapshot = self.capture.snapshot(self._copy)
+        if snapshot is None:
+            self.skipped += 1
+            return None
+        free_space = self.detector.detect(*snapshot)
+        self.latest = free_space
+        self.analyzed += 1
+        self.cost_ms.append((time.perf_counter() - start) * 1000)
+        self.latency_ms.append((time.monotonic_ns() - free_space.captured_ns) / 1e6)
+        for listener in self.listeners:
+            listener(free_space)
+        return free_space
+
+    def _run(self):
+        period = 1 / self.rate_hz
+        next_at = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.analyze_newest()
+            except Exception as e:
+                print(f"[ERROR] Vision obstacle stage stopped: {type(e).__name__}: {e}")
+                return
+            next_at += period
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_at = time.monotonic()
+
+    def stats(self):
+        costs = sorted(self.cost_ms)
+        latencies = sorted(self.latency_ms)
+        return {
+            "ahead_cm": round(self.latest.ahead_cm, 1) if self.latest else None,
+            "analyzed": self.analyzed,
+            "skipped": self.skipped,
+            "cost_p50_ms": round(costs[len(costs) // 2], 3) if costs else None,
+            "cost_max_ms": round(costs[-1], 3) if costs else None,
+            "latency_p50_ms": round(latencies[len(latencies) // 2], 2) if latencies else None,
+        }
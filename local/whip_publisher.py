@@ -0,0 +1,393 @@
+# whip_publisher.py
+# Publisher engine shared by the webcam, Pi Camera and CCTV scripts. A
+# stream source (see StreamSource) supplies the tracks; the Publisher offers
+# them to a WHIP endpoint, watches the connection and, when it fails, closes
+# the WHIP resource (DELETE) and offers again with backoff. Sources keep
+# capturing across reconnects, so a resumed session starts on a fresh frame.
+# Runs until cancelled.
+# Usage: python whip_publisher.py http://<server>:8889/<endpoint>/whip (synthetic test pattern)
+import abc
+import asyncio
+import os
+import random
+import sys
+import time
+from urllib.parse import urljoin
+
+import aiohttp
+import av
+from aiortc import (
+    RTCPeerConnection,
+    RTCConfiguration,
+    RTCIceServer,
+    RTCSessionDescription,
+    VideoStreamTrack
+)
+from adaptive_bitrate import AdaptationController, AdaptiveOutput, DEFAULT_LADDER
+from event_recorder import RecordingEncoder
+from frame_capture import CaptureEngine, SyntheticSource
+from motion_detector import IDLE_FPS
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server")) # metrics.py is shared with the robot side
+from metrics import REGISTRY, serve_metrics, watch_loop_lag # noqa: E402
+
+# === Configuration ===
+ICE_SERVERS = ["stun:stun.l.google.com:19302"]
+CONNECT_TIMEOUT_S = 15.0 # WHIP answer to ICE + DTLS connected
+MEDIA_TIMEOUT_S = 6.0 # No RTCP receiver report for this long: the server has lost the session
+BACKOFF_INITIAL_S = 1.0 # Delay before the first re-offer; doubles per failed attempt
+BACKOFF_MAX_S = 30.0
+STATS_INTERVAL = 30 # Seconds between stats lines
+ADAPTIVE = True # Run the ABR controller (adaptive_bitrate.py) on every session
+METRICS_PORT = 9103 # Prometheus exporter: GET /metrics, JSON at /stats (robot_listener's is 9102)
+
+# === Metrics ===
+capture_read_time = REGISTRY.histogram("camera_capture_read_seconds", "Camera read per frame, on the capture thread")
+frame_latency = REGISTRY.histogram("camera_frame_latency_seconds", "Frame captured -> taken by the video track")
+encode_time = REGISTRY.histogram("camera_encode_seconds", "Frame handed to WebRTC -> next one requested (encode and send)")
+record_encode_time = REGISTRY.histogram("camera_record_encode_seconds", "Recording encoder time per frame")
+loop_lag = REGISTRY.histogram("camera_loop_lag_seconds", "How late a 100 ms timer on the event loop fires")
+reconnect_time = REGISTRY.histogram("camera_whip_reconnect_seconds", "Session lost -> next session connected")
+whip_sessions = REGISTRY.counter("camera_whip_sessions_total", "WHIP sessions connected")
+whip_connected = REGISTRY.gauge("camera_whip_connected", "1 while a WHIP session is connected")
+
+def whip_url(server_ip, server_port, endpoint):
+    return f"http://{server_ip}:{server_port}/{endpoint}/whip"
+
+# === Tracks ===
+class CapturedVideoTrack(VideoStreamTrack):
+    """
+    Sends the newest frame from a capture-thread source (see frame_capture.py)
+    at the rate and size of the current ABR rung. recv() never waits on the
+    camera inside the event loop.
+    """
+    kind = "video"
+
+    def __init__(self, source, name, fps, analyzers=()):
+        super().__init__()
+        self.source = source
+        self.capture = CaptureEngine(source, name=name, analyzers=analyzers, read_time=capture_read_time, latency=frame_latency)
+        self.output = AdaptiveOutput(fps)
+        self._returned_at = None
+
+    def start(self):
+        self.capture.start()
+
+    def set_rung(self, rung):
+        self.output.set_rung(rung)
+        if hasattr(self.source, "set_frame_rate"):
+            self.source.set_frame_rate(rung.fps) # Slow the sensor down too where it can
+
+    async def recv(self):
+        if self._returned_at is not None:
+            encode_time.observe_since(self._returned_at) # aiortc encoded and sent the last frame in between
+        pts, time_base = await self.output.next_timestamp()
+        try:
+            frame = await self.capture.frame()
+        except RuntimeError as e:
+            raise RuntimeError(f"❌ Failed to read frame from {self.capture.name} ({e}).")
+
+        # Wrap in a VideoFrame in its capture format: the only copy, the ring slot can be reused afterwards
+        video_frame = av.VideoFrame.from_ndarray(frame, format=self.capture.format)
+        video_frame.pts = pts
+        video_frame.time_base = time_base
+        video_frame = self.output.scale(video_frame) # Down to the current rung's size
+        self._returned_at = time.perf_counter()
+        return video_frame
+
+    def stop(self):
+        super().stop()
+        self.capture.stop()
+
+# === Stream Sources ===
+class StreamSource(abc.ABC):
+    """
+    What the Publisher sends. open() once before the first offer, then for
+    every session add_tracks(pc) returns the video sender; accept(answer_sdp)
+    may refuse an answer (after switching mode) to get a fresh offer right
+    away. `ladder` and apply(rung) drive the ABR controller; ladder None
+    disables it.
+    """
+    name = "stream"
+    ladder = DEFAULT_LADDER
+    start_rung = None # None = top rung
+
+    def open(self):
+        pass
+
+    @abc.abstractmethod
+    def add_tracks(self, pc):
+        """Add this source's tracks to `pc`; return the video sender."""
+
+    def accept(self, answer_sdp):
+        return True
+
+    def apply(self, rung):
+        pass
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+class CaptureStream(StreamSource):
+    """
+    A camera read on a capture thread (webcam, Pi Camera, synthetic). With a
+    MotionDetector every frame is analysed on that thread; `gated` also
+    sends only IDLE_FPS, at the bottom rung's size, while the scene is still.
+    With an EventRecorder the frames are also encoded for it, and motion
+    triggers a recording. A VisionObstacleStage reads the same ring on its
+    own thread while the stream is open.
+    """
+
+    def __init__(self, source, name, ladder=DEFAULT_LADDER, motion=None, gated=False, recorder=None, vision=None):
+        self.name = name
+        self.ladder = ladder
+        self.motion = motion
+        self.recorder = recorder
+        self.vision = vision
+        self.recording = RecordingEncoder(recorder, encode_time=record_encode_time) if recorder else None
+        analyzers = [hook.analyze for hook in (motion, self.recording) if hook]
+        self.track = CapturedVideoTrack(source, name, ladder[-1].fps, analyzers=analyzers)
+        if motion and recorder:
+            motion.add_listener(self.record_motion)
+        if motion and gated:
+            self.track.output.idle_fps = IDLE_FPS
+            self.track.output.idle_size = (ladder[0].width, ladder[0].height)
+            self.track.output.idle = True # Until the first motion
+            motion.add_listener(self.gate)
+        if vision:
+            vision.capture = self.track.capture
+
+    def gate(self, active, moving):
+        self.track.output.idle = not active
+
+    def record_motion(self, active, moving):
+        if active:
+            self.recorder.trigger("motion")
+
+    def open(self):
+        self.track.start()
+        if self.vision:
+            self.vision.start()
+
+    def add_tracks(self, pc):
+        return pc.addTrack(self.track)
+
+    def apply(self, rung):
+        self.track.set_rung(rung)
+
+    def stats(self):
+        stats = self.track.capture.stats()
+        if self.motion:
+            stats["motion"] = self.motion.stats()
+        if self.vision:
+            stats["vision"] = self.vision.stats()
+        if self.recorder:
+            stats["recording"] = {**self.recorder.stats(), **self.recording.stats()}
+        return stats
+
+    def close(self):
+        if self.vision:
+            self.vision.stop()
+        self.track.stop()
+        if self.recorder:
+            self.recording.stop()
+            self.recorder.close()
+
+# === WHIP ===
+class WhipError(Exception):
+    pass
+
+class WhipSession:
+    """One WHIP resource: created by POSTing the offer, removed with DELETE."""
+
+    def __init__(self, http, url):
+        self.http = http
+        self.url = url
+        self.resource = None
+
+    async def offer(self, sdp):
+        """POST the offer; returns the answer SDP."""
+        async with self.http.post(self.url, data=sdp, headers={"Content-Type": "application/sdp"}) as resp:
+            if resp.status != 201:
+                raise WhipError(f"HTTP {resp.status}: {(await resp.text()).strip()[:200]}")
+            location = resp.headers.get("Location")
+            self.resource = urljoin(self.url, location) if location else None
+            return await resp.text()
+
+    async def delete(self):
+        """Tell the server the session is over so it frees the path now rather than on its own timeout."""
+        if self.resource is None:
+            return
+        resource, self.resource = self.resource, None
+        try:
+            async with self.http.delete(resource, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                if resp.status not in (200, 204, 404):
+                    print(f"[WARN] WHIP DELETE returned HTTP {resp.status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"[WARN] WHIP DELETE failed: {type(e).__name__}: {e}")
+
+# === Publisher ===
+class Publisher:
+    """
+    Keeps `source` published at `url`. Each session is a new peer connection
+    and WHIP resource; it ends when the connection fails or closes, or when
+    receiver reports stop for MEDIA_TIMEOUT_S (a server that dropped the
+    session without telling us). The next offer follows after an
+    exponential backoff with jitter, reset once a session connects. While
+    it runs, the process's metrics are served on `metrics_port` (None: not
+    served).
+    """
+
+    def __init__(self, source, url, adaptive=ADAPTIVE, ice_servers=ICE_SERVERS, metrics_port=METRICS_PORT):
+        self.source = source
+        self.url = url
+        self.adaptive = adaptive
+        self.metrics_port = metrics_port
+        self.config = RTCConfiguration(iceServers=[RTCIceServer(urls=ice_servers)])
+        self.ladder = None
+        self.rung = None
+        self.sessions = 0
+        self.connected = False
+        self.connect_times = [] # Seconds from offer to connected, per session
+        self.reconnect_times = [] # Seconds from losing a session to the next one connecting
+        self._lost_at = None
+
+    async def run(self):
+        self.source.open()
+        backoff = BACKOFF_INITIAL_S
+        exporter = await self._serve_metrics()
+        lag_watch = asyncio.ensure_future(watch_loop_lag(loop_lag))
+        try:
+            async with aiohttp.ClientSession() as http:
+                while True:
+                    try:
+                        reason = await self.session(http)
+                    except (WhipError, aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                        reason = f"{type(e).__name__}: {e}"
+                    if reason is None:
+                        continue # The source changed mode; offer again straight away
+                    if self._lost_at is None and self.sessions:
+                        self._lost_at = time.monotonic()
+                    if self.connected:
+                        backoff = BACKOFF_INITIAL_S
+                    delay = backoff * random.uniform(0.5, 1.0)
+                    print(f"[WARN] WHIP session ended ({reason}); re-offering in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    backoff = min(backoff * 2, BACKOFF_MAX_S)
+        finally:
+            lag_watch.cancel()
+            if exporter:
+                exporter.close()
+            self.source.close()
+            print(f"[INFO] {self.source.name} publisher stopped.")
+
+    async def _serve_metrics(self):
+        if not self.metrics_port:
+            return None
+        try:
+            return await serve_metrics(self.metrics_port)
+        except OSError as e: # Another publisher on this machine already has the port
+            print(f"[WARN] Metrics not served on port {self.metrics_port}: {type(e).__name__}: {e}")
+            return None
+
+    async def session(self, http):
+        """Run one WHIP session to its end; returns why it ended, or None to re-offer at once."""
+        self.connected = False
+        pc = RTCPeerConnection(configuration=self.config)
+        whip = WhipSession(http, self.url)
+        up, ended = asyncio.Event(), asyncio.Event()
+        adapter = None
+
+        @pc.on("connectionstatechange")
+        def on_state():
+            if pc.connectionState == "connected":
+                up.set()
+            elif pc.connectionState in ("failed", "closed"):
+                ended.set()
+
+        try:
+            sender = self.source.add_tracks(pc)
+            await pc.setLocalDescription(await pc.createOffer())
+            offered = time.monotonic()
+            print(f"[INFO] Sending offer to WHIP endpoint: {self.url}")
+            answer = await whip.offer(pc.localDescription.sdp)
+            if not self.source.accept(answer):
+                return None
+            await pc.setRemoteDescription(RTCSessionDescription(sdp=answer, type="answer"))
+            await asyncio.wait_for(self._connected(pc, up, ended), CONNECT_TIMEOUT_S)
+            self._on_connected(offered)
+
+            if self.adaptive and self.source.ladder is not None:
+                if self.source.ladder != self.ladder: # First session, or the source changed mode
+                    self.ladder, self.rung = self.source.ladder, self.source.start_rung
+                controller = AdaptationController(self.ladder, apply=self.source.apply, start=self.rung)
+                adapter = asyncio.create_task(controller.run(sender))
+            return await self._watch(pc, sender, ended)
+        finally:
+            whip_connected.set(0)
+            if adapter:
+                adapter.cancel()
+                self.rung = controller.rung # The next session starts where this one left off
+            await whip.delete()
+            await pc.close()
+
+    async def _connected(self, pc, up, ended):
+        waits = [asyncio.ensure_future(up.wait()), asyncio.ensure_future(ended.wait())]
+        await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        for wait in waits:
+            wait.cancel()
+        if not up.is_set():
+            raise WhipError(f"connection {pc.connectionState} during setup")
+
+    def _on_connected(self, offered):
+        now = time.monotonic()
+        self.connected = True
+        self.sessions += 1
+        self.connect_times.append(now - offered)
+        whip_sessions.inc()
+        whip_connected.set(1)
+        if self._lost_at is None: # First session (or the server was never reachable until now)
+            print(f"[SUCCESS] Publishing {self.source.name} (connected in {now - offered:.2f}s)")
+        else:
+            self.reconnect_times.append(now - self._lost_at)
+            reconnect_time.observe(now - self._lost_at)
+            print(f"[SUCCESS] Resumed publishing {self.source.name} after {now - self._lost_at:.2f}s")
+            self._lost_at = None
+
+    async def _watch(self, pc, sender, ended):
+        """Until the session ends: stats lines, and a check that the server still reports receiving."""
+        report_seen, report_at = None, time.monotonic()
+        next_stats = time.monotonic() + STATS_INTERVAL
+        while not ended.is_set():
+            try:
+                await asyncio.wait_for(ended.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+            now = time.monotonic()
+            for stats in (await sender.getStats()).values():
+                if stats.type == "remote-inbound-rtp" and stats.timestamp != report_seen:
+                    report_seen, report_at = stats.timestamp, now
+            if now - report_at > MEDIA_TIMEOUT_S:
+                return f"no receiver reports for {MEDIA_TIMEOUT_S:.0f}s"
+            if now >= next_stats:
+                next_stats = now + STATS_INTERVAL
+                print(f"[INFO] {self.source.name} stats: {self.source.stats()}")
+        return f"connection {pc.connectionState}"
+
+# === Entry Point ===
+async def main(url):
+    source = CaptureStream(SyntheticSource(640, 360, fps=30, format="yuv420p", noise=True), "synthetic")
+    try:
+        await Publisher(source, url).run()
+    except Exception as e:
+        print(f"[FATAL] Unhandled exception: {type(e).__name__}: {e}")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("Usage: python whip_publisher.py http://<server>:8889/<endpoint>/whip")
+    try:
+        asyncio.run(main(sys.argv[1]))
+    except KeyboardInterrupt:
+        print("[INFO] Stream interrupted by user.")
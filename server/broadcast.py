@@ -0,0 +1,159 @@
+# broadcast.py
+# Encode-once fan-out for browser WebSocket clients. Each published frame is
+# serialized once per wire format and the same object is queued to every
+# subscriber; each subscriber has a bounded drop-oldest queue and its own
+# writer task, so one slow browser can't stall the others.
+import asyncio
+import collections
+import logging
+import time
+
+from aiohttp import WSCloseCode
+
+logger = logging.getLogger(__name__)
+
+class Subscriber:
+    """One browser connection: a drop-oldest queue drained by a writer task."""
+
+    def __init__(self, ws, binary, max_queue, remote=None):
+        self.ws = ws
+        self.remote = remote
+        self.binary = binary # True: send_bytes(frame), False: send_str() per JSON message
+        self.queue = collections.deque(maxlen=max_queue) # (published_ns, payload)
+        self.sent = 0
+        self.dropped = 0
+        self.consecutive_drops = 0
+        self.lag_ns = 0 # publish -> send completed, for the last payload
+        self.max_lag_ns = 0
+        self.sending_since = None # monotonic_ns() when the in-flight send started
+        self.task = None
+        self._wakeup = asyncio.Event()
+
+    def offer(self, published_ns, payload):
+        """Queue a payload; returns True if the oldest queued one was dropped for it."""
+        dropped = len(self.queue) == self.queue.maxlen
+        if dropped:
+            self.dropped += 1
+            self.consecutive_drops += 1
+        self.queue.append((published_ns, payload))
+        self._wakeup.set()
+        return dropped
+
+    def stats(self):
+        return {
+            "remote": self.remote,
+            "format": "binary" if self.binary else "json",
+            "queued": len(self.queue),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "lag_ms": round(self.lag_ns / 1e6, 3),
+            "max_lag_ms": round(self.max_lag_ns / 1e6, 3),
+        }
+
+
+class BroadcastHub:
+    """
+    Fan-out hub. publish() never awaits a client: it encodes the frame for
+    each format at most once and queues it. A subscriber whose in-flight send
+    is older than `send_timeout` or that drops `max_drops` frames in a row is
+    disconnected as a slow consumer; both are checked on publish, so no
+    per-send timer is needed. `lag_metric`, a histogram (metrics.py), also
+    observes every send's publish -> sent time in seconds.
+    """
+
+    def __init__(self, max_queue=32, send_timeout=2.0, max_drops=64, lag_metric=None):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.max_drops = max_drops
+        self.lag_metric = lag_metric
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0 # Across all subscribers, including ones since gone
+        self.slow_disconnects = 0
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def subscribe(self, ws, binary=False, remote=None):
+        subscriber = Subscriber(ws, binary, self.max_queue, remote)
+        subscriber.task = asyncio.ensure_future(self._writer(subscriber))
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+        if subscriber.task and not subscriber.task.done() and subscriber.task is not asyncio.current_task():
+            subscriber.task.cancel()
+
+    def publish(self, binary_payload=None, json_payload=None):
+        """
+        Queue one frame to every subscriber. Payloads may be values or
+        zero-argument callables, which are called at most once and only if a
+        subscriber of that format exists.
+        """
+        now = time.monotonic_ns()
+        send_timeout_ns = self.send_timeout * 1e9
+        self.published += 1
+        encoded = {}
+        for subscriber in tuple(self.subscribers): # Slow subscribers may be removed while iterating
+            if subscriber.ws.closed:
+                continue
+            payload = binary_payload if subscriber.binary else json_payload
+            if callable(payload):
+                if subscriber.binary not in encoded:
+                    encoded[subscriber.binary] = payload()
+                payload = encoded[subscriber.binary]
+            if payload is None:
+                continue
+            if subscriber.offer(now, payload):
+                self.dropped += 1
+            if subscriber.consecutive_drops >= self.max_drops:
+                self._disconnect_slow(subscriber, f"{subscriber.consecutive_drops} frames dropped")
+            elif subscriber.sending_since and now - subscriber.sending_since > send_timeout_ns:
+                self._disconnect_slow(subscriber, f"send blocked for over {self.send_timeout}s")
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "clients": [subscriber.stats() for subscriber in self.subscribers],
+        }
+
+    def _disconnect_slow(self, subscriber, reason):
+        if subscriber not in self.subscribers:
+            return
+        self.slow_disconnects += 1
+        logger.warning(f"Disconnecting slow browser client ({reason})")
+        self.unsubscribe(subscriber)
+        asyncio.ensure_future(subscriber.ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b"Too slow"))
+
+    async def _writer(self, subscriber):
+        ws = subscriber.ws
+        try:
+            while not ws.closed:
+                if not subscriber.queue:
+                    subscriber._wakeup.clear()
+                    await subscriber._wakeup.wait()
+                    continue
+                published_ns, payload = subscriber.queue.popleft()
+                subscriber.sending_since = time.monotonic_ns()
+                if subscriber.binary:
+                    await ws.send_bytes(payload)
+                else:
+                    for message in payload:
+                        await ws.send_str(message)
+                subscriber.sending_since = None
+                subscriber.sent += 1
+                subscriber.consecutive_drops = 0
+                subscriber.lag_ns = time.monotonic_ns() - published_ns
+                subscriber.max_lag_ns = max(subscriber.max_lag_ns, subscriber.lag_ns)
+                if self.lag_metric is not None:
+                    self.lag_metric.observe(subscriber.lag_ns / 1e9)
+        except (asyncio.CancelledError, ConnectionError):
+            pass # Unsubscribed, or the browser went away mid-send
+        except Exception as e:
+            logger.error(f"Browser writer error: {type(e).__name__}: {e}")
+        finally:
+            self.subscribers.discard(subscriber)
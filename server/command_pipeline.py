@@ -0,0 +1,172 @@
+# command_pipeline.py
+# Latest-command-wins delivery of browser commands to the Pi. The server keeps
+# one slot per command kind and only forwards the newest intent; the Pi drops
+# anything out of order or older than its deadline and reports command age.
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DRIVE_ACTIONS = ("forward", "backward", "left", "right", "stop")
+CAMERA_ACTIONS = ("cam_left", "cam_right", "cam_up", "cam_down")
+RECORD_ACTIONS = ("record",) # Start (or extend) an event recording on the camera publisher
+
+def command_kind(action):
+    """Commands of the same kind supersede each other; drive never supersedes camera."""
+    if action in DRIVE_ACTIONS:
+        return "drive"
+    return "record" if action in RECORD_ACTIONS else "camera"
+
+def wall_ms():
+    return time.time() * 1000 # Browser timestamps are Date.now(); ages across hosts are only as good as their clocks
+
+
+class CommandMailbox:
+    """
+    One slot per command kind. put() overwrites the pending command of the same
+    kind and wakes a sender task; while a send is in flight newer commands keep
+    replacing the slot, so a burst collapses to its latest intent.
+
+    The server keeps one per Pi (stamp=True adds seq and server_ts); the Pi
+    uses one between its socket reader and the command handler. `age_metric`,
+    a histogram (metrics.py), also observes each browser -> server age in
+    seconds.
+    """
+
+    def __init__(self, send, stamp=True, age_metric=None):
+        self.send = send # async callable taking the command dict
+        self.stamp = stamp
+        self.age_metric = age_metric
+        self.seq = 0 # Server-assigned sequence, increasing across all browsers
+        self.received = 0
+        self.forwarded = 0
+        self.superseded = 0
+        self.client_ages_ms = collections.deque(maxlen=1000) # Browser timestamp -> server receive
+        self.last_forwarded = {} # kind -> last command handed to send()
+        self._slots = {} # kind -> command, in arrival order
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closed = False
+
+    def put(self, data):
+        if self._closed:
+            logger.warning(f"Command for a closed mailbox ignored: {data.get('action')}")
+            return
+        now_ms = wall_ms()
+        self.received += 1
+        if self.stamp:
+            self.seq += 1
+            data["seq"] = self.seq
+            data["server_ts"] = now_ms
+        if isinstance(data.get("ts"), (int, float)):
+            self.client_ages_ms.append(now_ms - data["ts"])
+            if self.age_metric is not None:
+                self.age_metric.observe(max(0.0, now_ms - data["ts"]) / 1000)
+        kind = command_kind(data.get("action"))
+        if self._slots.pop(kind, None) is not None:
+            self.superseded += 1
+        self._slots[kind] = data
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def close(self):
+        """Drop pending commands and stop the sender for good; later put()s are ignored."""
+        self._closed = True
+        self._slots.clear()
+        if self._task:
+            self._task.cancel()
+
+    def stats(self):
+        ages = sorted(self.client_ages_ms)
+        return {
+            "received": self.received,
+            "forwarded": self.forwarded,
+            "superseded": self.superseded,
+            "pending": len(self._slots),
+            "client_age_p50_ms": round(ages[len(ages) // 2], 1) if ages else None,
+            "client_age_max_ms": round(ages[-1], 1) if ages else None,
+        }
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._slots:
+                kind = next(iter(self._slots))
+                data = self._slots.pop(kind)
+                try:
+                    await self.send(data)
+                    self.forwarded += 1
+                    self.last_forwarded[kind] = data
+                except Exception as e:
+                    logger.error(f"Error forwarding command: {type(e).__name__}: {e}")
+                await asyncio.sleep(0) # Let the reader replace slots before the next send
+
+
+class CommandGate:
+    """
+    Pi side. Rejects commands that are not newer than the last accepted one or
+    that spent longer than `deadline_s` between the server and the Pi, and
+    records the end-to-end age (browser timestamp -> Pi receive), also into
+    `age_metric` (a metrics.py histogram, seconds) when given. "stop" is
+    never rejected.
+
+    The Pi's wall clock cannot be trusted against the server's (no RTC, NTP
+    may not have synced), so the deadline is measured as the delay beyond
+    the quickest of the last `clock_window` heartbeats: observe_clock() takes
+    each heartbeat's server_ts against this Pi's monotonic clock, and the
+    smallest difference stands for the clock offset plus the shortest
+    transit. Until a heartbeat arrives no command is late.
+    """
+
+    def __init__(self, deadline_s=0.5, age_metric=None, clock_window=50):
+        self.deadline_s = deadline_s
+        self.age_metric = age_metric
+        self.offsets_ms = collections.deque(maxlen=clock_window) # Pi monotonic ms - server_ts, per heartbeat
+        self.last_seq = 0
+        self.accepted = 0
+        self.rejected_stale = 0
+        self.rejected_late = 0
+        self.last_age_ms = None
+        self.ages_ms = collections.deque(maxlen=1000)
+
+    def reset(self):
+        """Call on every (re)connect: sequence numbers restart with the server process."""
+        self.last_seq = 0
+
+    def observe_clock(self, server_ts):
+        """Call with the server_ts of every heartbeat."""
+        if isinstance(server_ts, (int, float)):
+            self.offsets_ms.append(time.monotonic() * 1000 - server_ts)
+
+    def lateness_ms(self, server_ts):
+        """How much longer than the quickest recent heartbeat a message stamped server_ts took, or None."""
+        if not self.offsets_ms or not isinstance(server_ts, (int, float)):
+            return None
+        return time.monotonic() * 1000 - server_ts - min(self.offsets_ms)
+
+    def accept(self, data):
+        """Return (True, None) to execute the command, or (False, reason)."""
+        now_ms = wall_ms()
+        seq = data.get("seq")
+        stop = data.get("action") == "stop" # Always safe to execute, however old
+        if seq is not None and seq <= self.last_seq and not stop:
+            self.rejected_stale += 1
+            return False, f"superseded (seq {seq} <= {self.last_seq})"
+        late_ms = self.lateness_ms(data.get("server_ts"))
+        if late_ms is not None and late_ms > self.deadline_s * 1000 and not stop:
+            self.rejected_late += 1
+            return False, f"past deadline ({late_ms:.0f} ms late)"
+        if seq is not None and seq > self.last_seq:
+            self.last_seq = seq # Only executed commands count, so a late one can be replayed fresh
+        origin_ts = data.get("ts", data.get("server_ts"))
+        if isinstance(origin_ts, (int, float)):
+            self.last_age_ms = now_ms - origin_ts
+            self.ages_ms.append(self.last_age_ms)
+            if self.age_metric is not None:
+                self.age_metric.observe(max(0.0, self.last_age_ms) / 1000) # Clocks a little apart can go negative
+        self.accepted += 1
+        return True, None
@@ -0,0 +1,106 @@
+# fleet.py
+# Registry of every robot behind this server, keyed by robot ID. Each robot has
+# its own Pi link, command mailbox and browser fan-out hub, so commands route
+# with one dict lookup per connection and viewers only receive their robot's
+# telemetry.
+import re
+import time
+
+from broadcast import BroadcastHub
+from pi_link import LinkSession
+
+DEFAULT_ROBOT = "default" # Used by browsers and Pis that don't send ?robot=
+ROBOT_ID_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}") # Also a directory name (timeseries.py): no "." or ".."
+
+class Robot:
+    """Per-robot routing state. __slots__ keeps hundreds of these cheap."""
+    __slots__ = ("robot_id", "link", "link_ws", "heartbeat", "commands", "hub",
+                 "control_ws", "distance_ws", "controllers", "telemetry_seq", "last_used")
+
+    def __init__(self, robot_id):
+        self.robot_id = robot_id
+        self.link = LinkSession() # Outlives reconnects; buffers while the Pi is away
+        self.link_ws = None
+        self.heartbeat = None # HeartbeatSender for the current Pi connection
+        self.commands = None # CommandMailbox, wired up by the server
+        self.hub = BroadcastHub() # This robot's browser /distance viewers
+        self.control_ws = None # Legacy /pi_control socket
+        self.distance_ws = None # Legacy /pi_distance socket
+        self.controllers = 0 # Browser /control connections holding this robot
+        self.telemetry_seq = 0 # Frames the server encodes from this robot's JSON telemetry
+        self.last_used = time.monotonic() # Last connection (Pi or browser) that resolved this robot
+
+    @property
+    def connected(self):
+        return self.link.connected or (self.control_ws is not None and not self.control_ws.closed)
+
+    @property
+    def idle(self):
+        """No Pi attached, nobody watching or driving: safe to forget when the registry is full."""
+        return not self.connected and not len(self.hub) and self.distance_ws is None and not self.controllers
+
+    def summary(self):
+        return {
+            "connected": self.connected,
+            "viewers": len(self.hub),
+            "controllers": self.controllers,
+            "buffered": len(self.link.unacked),
+            "commands_forwarded": self.commands.forwarded if self.commands else 0,
+        }
+
+
+class FleetRegistry:
+    """
+    robot ID -> Robot. `setup(robot)` runs once per new robot so the server
+    can wire its callbacks, `teardown(robot)` when one is evicted. IDs are
+    validated and the registry is capped; once it is full, a new robot
+    replaces the least recently used idle one (robots that never had a Pi
+    go first), so browsers inventing robot IDs can't lock real robots out.
+    """
+
+    def __init__(self, setup=None, max_robots=1024, teardown=None):
+        self.setup = setup
+        self.teardown = teardown
+        self.max_robots = max_robots
+        self.robots = {}
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.robots)
+
+    def get(self, robot_id):
+        return self.robots.get(robot_id)
+
+    def get_or_create(self, robot_id):
+        robot = self.robots.get(robot_id)
+        if robot is not None:
+            robot.last_used = time.monotonic()
+            return robot
+        if not ROBOT_ID_PATTERN.fullmatch(robot_id):
+            raise ValueError(f"Invalid robot ID: {robot_id!r:.80}")
+        if len(self.robots) >= self.max_robots and not self._evict_idle():
+            raise ValueError(f"Fleet full ({self.max_robots} robots, all in use)")
+        robot = self.robots[robot_id] = Robot(robot_id)
+        if self.setup:
+            self.setup(robot)
+        return robot
+
+    def _evict_idle(self):
+        idle = [robot for robot in self.robots.values() if robot.idle]
+        if not idle:
+            return False
+        robot = min(idle, key=lambda robot: (robot.link.connects > 0, robot.last_used))
+        del self.robots[robot.robot_id]
+        self.evicted += 1
+        if self.teardown:
+            self.teardown(robot)
+        return True
+
+    def stats(self):
+        return {
+            "robots": len(self.robots),
+            "evicted": self.evicted,
+            "connected": sum(1 for robot in self.robots.values() if robot.connected),
+            "viewers": sum(len(robot.hub) for robot in self.robots.values()),
+            "fleet": {robot_id: robot.summary() for robot_id, robot in self.robots.items()},
+        }
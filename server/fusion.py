@@ -0,0 +1,99 @@
+# fusion.py
+# One obstacle estimate for the brake from the front ultrasonic sensor and the
+# camera's free-floor distance (local/vision_obstacles.py, arriving as
+# "vision_distance" local telemetry). The ultrasonic sensor misses thin,
+# angled and soft obstacles; the camera misses glass and anything it cannot
+# tell from the floor. The brake sees the nearer of the two.
+import collections
+import threading
+import time
+
+from ranging import RangeVector, Sample
+from telemetry_protocol import CHANNELS
+
+VISION_CHANNEL = CHANNELS["vision_distance"]
+VISION_MAX_RANGE_CM = 300 # The camera reports this when the floor is free to the horizon
+
+class ObstacleFusion:
+    """
+    Sits between an UltrasonicArray and the brake: on_vector() passes every
+    vector on to `forward(vector)` with the `sensor` sample replaced by the
+    fused one. The camera's distance counts once `confirm` estimates in a row
+    agree (the farthest of them is used, so one odd frame cannot brake) and
+    while the newest is at most `max_age_s` old; it wins when it is nearer
+    than the ultrasonic reading, or sees an obstacle while the ultrasonic
+    echo is missing. A new camera estimate that is nearer than the last
+    fused reading is forwarded straight away with the last vector, so the
+    brake does not wait for the next ping.
+
+    on_vector() runs on the ranging thread, on_vision() (a
+    LocalTelemetryProtocol listener) on the event loop; a lock keeps the
+    forwarded samples in order.
+    """
+
+    def __init__(self, forward, sensor=0, max_age_s=0.3, confirm=2):
+        self.forward = forward
+        self.sensor = sensor
+        self.max_age_s = max_age_s
+        self.vision = collections.deque(maxlen=confirm) # Newest camera samples
+        self.vision_samples = 0
+        self.vision_nearer = 0 # Fused readings that came from the camera
+        self.last_fused = None
+        self._last_vector = None
+        self._lock = threading.Lock()
+
+    def vision_distance(self, now_ns=None):
+        """Confirmed camera distance (cm), or None while unconfirmed or stale."""
+        if len(self.vision) < self.vision.maxlen:
+            return None
+        now_ns = now_ns or time.monotonic_ns()
+        if now_ns - self.vision[-1].timestamp_ns > self.max_age_s * 1e9:
+            return None
+        return max(sample.value for sample in self.vision)
+
+    def _fuse(self, sample):
+        seen = self.vision_distance()
+        if seen is None or (sample.value != -1 and sample.value <= seen):
+            return sample
+        if sample.value == -1 and seen >= VISION_MAX_RANGE_CM:
+            return sample # Free floor does not vouch for a missing echo
+        self.vision_nearer += 1
+        return Sample(sample.seq, seen, self.vision[-1].timestamp_ns)
+
+    def _forward(self, vector, sample):
+        fused = self._fuse(sample)
+        self.last_fused = fused
+        samples = vector.samples[:self.sensor] + (fused,) + vector.samples[self.sensor + 1:]
+        self.forward(RangeVector(vector.seq, vector.sensor, samples))
+
+    def on_vector(self, vector):
+        with self._lock:
+            self._last_vector = vector
+            if vector.sensor != self.sensor:
+                self.forward(vector)
+                return
+            self._forward(vector, vector.samples[self.sensor])
+
+    def on_vision(self, sample):
+        if sample.channel != VISION_CHANNEL:
+            return
+        with self._lock:
+            self.vision_samples += 1
+            self.vision.append(sample)
+            seen = self.vision_distance()
+            last = self.last_fused
+            if self._last_vector is None or seen is None or seen >= VISION_MAX_RANGE_CM:
+                return
+            if last is not None and last.value != -1 and last.value <= seen:
+                return
+            vector = self._last_vector
+            self._forward(RangeVector(vector.seq, self.sensor, vector.samples), vector.samples[self.sensor])
+
+    def stats(self):
+        seen = self.vision_distance()
+        return {
+            "vision_cm": seen,
+            "vision_samples": self.vision_samples,
+            "vision_nearer": self.vision_nearer,
+            "fused_cm": self.last_fused.value if self.last_fused else None,
+        }
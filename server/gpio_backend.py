@@ -0,0 +1,222 @@
+# gpio_backend.py
+# Pluggable GPIO backend: the real RPi.GPIO module on the robot, or an in-process
+# fake that mimics the same API (including an ultrasonic echo model) so the
+# robot code can run, be tested and be benchmarked on an ordinary Linux box.
+import heapq
+import os
+import threading
+import time
+
+# === Backend Selection ===
+GPIO_BACKEND = os.environ.get("ROBOT_GPIO_BACKEND", "rpi")  # "rpi" on the robot, "fake" anywhere else
+
+def load_gpio(backend=None):
+    """
+    Return an object exposing the RPi.GPIO API.
+    'rpi' imports the real RPi.GPIO module, 'fake' returns a new FakeGPIO.
+    """
+    backend = backend or GPIO_BACKEND
+    if backend == "fake":
+        return FakeGPIO()
+    if backend == "rpi":
+        import RPi.GPIO as GPIO # Only importable on a Raspberry Pi
+        return GPIO
+    raise ValueError(f"Unknown GPIO backend: {backend}")
+
+
+# === Virtual Obstacle ===
+class VirtualObstacle:
+    """
+    Obstacle seen by a simulated ultrasonic sensor.
+    Distance is in cm; a positive closing speed (cm/s) moves it towards the sensor.
+    A distance of None means nothing in range (no echo is returned).
+    """
+
+    def __init__(self, distance_cm=100.0, closing_speed_cm_s=0.0):
+        self.set(distance_cm, closing_speed_cm_s)
+
+    def set(self, distance_cm, closing_speed_cm_s=0.0):
+        # Replace the whole state in one assignment so readers never see a torn update
+        self._state = (distance_cm, closing_speed_cm_s, time.monotonic())
+
+    def distance(self):
+        distance_cm, speed, since = self._state
+        if distance_cm is None:
+            return None
+        return max(0.0, distance_cm - speed * (time.monotonic() - since))
+
+
+# === Fake GPIO ===
+class FakePWM:
+    """Records duty cycle changes instead of driving a pin."""
+
+    def __init__(self, gpio, pin, frequency):
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+        self.duty_cycle = 0
+        self.running = False
+        self.last_change_ns = 0 # monotonic_ns() of the last duty cycle change
+
+    def start(self, duty_cycle):
+        self.running = True
+        self.ChangeDutyCycle(duty_cycle)
+
+    def ChangeDutyCycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+        self.last_change_ns = time.monotonic_ns()
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+    def stop(self):
+        self.running = False
+        self.duty_cycle = 0
+
+
+class FakeGPIO:
+    """
+    In-process stand-in for the RPi.GPIO module.
+    Output levels are stored in a dict, edge callbacks are delivered from a
+    single scheduler thread, and ultrasonic sensors attached with
+    attach_ultrasonic() answer trigger pulses with a timed echo pulse.
+    """
+    BOARD, BCM = 10, 11
+    OUT, IN = 0, 1
+    LOW, HIGH = 0, 1
+    RISING, FALLING, BOTH = 31, 32, 33
+    PUD_OFF, PUD_DOWN, PUD_UP = 20, 21, 22
+
+    ECHO_DELAY_S = 0.0002 # HC-SR04 starts its echo pulse ~200us after the trigger
+
+    def __init__(self):
+        self.mode = None
+        self.levels = {}
+        self.directions = {}
+        self.pwms = []
+        self._callbacks = {} # pin -> (edge, [callbacks])
+        self._ultrasonics = {} # trig pin -> (echo pin, VirtualObstacle)
+        self.crosstalk = False # Let sensors hear each other's pulses (see _cross_echoes)
+        self._windows = {} # trig pin -> (rise_ns, fall_ns) of its last echo, for crosstalk
+        self._events = [] # heap of (due_ns, seq, pin, level)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    # --- RPi.GPIO API ---
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        self.directions[pin] = direction
+        self.levels.setdefault(pin, initial or self.LOW)
+
+    def output(self, pin, value):
+        previous = self.levels.get(pin, self.LOW)
+        self.levels[pin] = self.HIGH if value else self.LOW
+        if pin in self._ultrasonics and previous and not value:
+            self._schedule_echo(pin)
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def PWM(self, pin, frequency):
+        pwm = FakePWM(self, pin, frequency)
+        self.pwms.append(pwm)
+        return pwm
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self._callbacks[pin] = (edge, [callback] if callback else [])
+        self._ensure_thread()
+
+    def add_event_callback(self, pin, callback):
+        self._callbacks[pin][1].append(callback)
+
+    def remove_event_detect(self, pin):
+        self._callbacks.pop(pin, None)
+
+    def cleanup(self, pins=None):
+        with self._cond:
+            self._events.clear()
+            self._thread, thread = None, self._thread
+            self._cond.notify()
+        if thread and thread is not threading.current_thread():
+            thread.join(timeout=1)
+        self._callbacks.clear()
+        self.levels.clear()
+
+    # --- Simulation ---
+    def attach_ultrasonic(self, trig, echo, obstacle=None):
+        """Answer falling edges on `trig` with an echo pulse on `echo`; returns the obstacle."""
+        obstacle = obstacle or VirtualObstacle()
+        self._ultrasonics[trig] = (echo, obstacle)
+        self.levels.setdefault(echo, self.LOW)
+        return obstacle
+
+    def _schedule_echo(self, trig):
+        echo, obstacle = self._ultrasonics[trig]
+        distance = obstacle.distance()
+        if distance is None:
+            return # Nothing in range: the echo pin never rises
+        rise = time.monotonic_ns() + int(self.ECHO_DELAY_S * 1e9)
+        fall = rise + int(distance / 17150 * 1e9)
+        if self.crosstalk:
+            fall = self._cross_echoes(trig, rise, fall)
+        self.schedule(rise, echo, self.HIGH)
+        self.schedule(fall, echo, self.LOW)
+
+    def _cross_echoes(self, trig, rise, fall):
+        """
+        Crosstalk model: every sensor hears every other sensor's pulse when it
+        comes back, and whichever pulse arrives first ends its echo. Returns
+        the (possibly earlier) fall for `trig`; cuts other sensors short.
+        """
+        for other, (other_rise, other_fall) in list(self._windows.items()):
+            if other == trig:
+                continue
+            if other_rise < fall < other_fall: # Our pulse ends the other sensor's echo early
+                self.schedule(fall, self._ultrasonics[other][0], self.LOW)
+                self._windows[other] = (other_rise, fall)
+            elif rise < other_fall < fall: # Theirs ends ours
+                fall = other_fall
+        self._windows[trig] = (rise, fall)
+        return fall
+
+    def schedule(self, due_ns, pin, level):
+        """Drive an input pin to `level` at monotonic time `due_ns`, firing edge callbacks."""
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._events, (due_ns, self._seq, pin, level))
+            self._cond.notify()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="fake-gpio", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                while self._thread is me and (not self._events or self._events[0][0] > time.monotonic_ns()):
+                    timeout = (self._events[0][0] - time.monotonic_ns()) / 1e9 if self._events else None
+                    self._cond.wait(timeout)
+                if self._thread is not me:
+                    return
+                _, _, pin, level = heapq.heappop(self._events)
+            previous = self.levels.get(pin, self.LOW)
+            self.levels[pin] = level
+            self._fire(pin, previous, level)
+
+    def _fire(self, pin, previous, level):
+        edge, callbacks = self._callbacks.get(pin, (None, ()))
+        if previous == level or edge is None:
+            return
+        if edge == self.BOTH or (edge == self.RISING and level) or (edge == self.FALLING and not level):
+            for callback in callbacks:
+                callback(pin)
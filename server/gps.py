@@ -0,0 +1,274 @@
+# gps.py
+# GPS on the robot. An NMEA 0183 receiver on a serial port is read on the
+# asyncio loop itself: the device is opened non-blocking and watched with
+# loop.add_reader, so bytes are read only once they are waiting and no thread
+# or blocking call is involved. NMEAParser takes the bytes as they come
+# (sentences split across reads included) and yields fixes; TrackSimplifier
+# keeps only the fixes that change the shape of the track, which go over the
+# telemetry link as gps_lat/gps_lon. The geometry helpers are shared with the
+# server's track store (tracks.py).
+import asyncio
+import collections
+import math
+import os
+import termios
+import time
+import tty
+
+EARTH_RADIUS_M = 6_371_000
+KNOTS_TO_M_S = 0.514444
+MAX_SENTENCE = 120 # NMEA allows 82 characters; a longer line without a newline is noise
+
+# One position; timestamp_ns is time.monotonic_ns() when the sentence was read
+Fix = collections.namedtuple("Fix", ["timestamp_ns", "lat", "lon", "speed_m_s", "course", "quality", "satellites", "hdop"])
+
+# === Geometry ===
+def offset_m(lat0, lon0, lat, lon):
+    """(east, north) metres of a point from (lat0, lon0); equirectangular, good to well under 1% over kilometres."""
+    return (math.radians(lon - lon0) * EARTH_RADIUS_M * math.cos(math.radians(lat0)),
+            math.radians(lat - lat0) * EARTH_RADIUS_M)
+
+def segment_distance(px, py, ax, ay, bx, by):
+    """(distance, fraction along a->b) of the point on segment a->b nearest to p, all in metres."""
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    s = 0.0 if length2 == 0 else min(1.0, max(0.0, ((px - ax) * dx + (py - ay) * dy) / length2))
+    return math.hypot(px - ax - s * dx, py - ay - s * dy), s
+
+# === NMEA ===
+def nmea_checksum(body):
+    """XOR of the bytes between "$" and "*", folded a half at a time instead of byte by byte."""
+    value = int.from_bytes(body, "little")
+    size = len(body)
+    while size > 1:
+        half = (size + 1) // 2
+        value = (value & ((1 << half * 8) - 1)) ^ (value >> half * 8)
+        size = half
+    return value
+
+def parse_coordinate(value, hemisphere):
+    """NMEA (d)ddmm.mmmm plus N/S/E/W -> signed degrees."""
+    head = value.index(".") - 2
+    degrees = int(value[:head]) + float(value[head:]) / 60
+    return -degrees if hemisphere in ("S", "W") else degrees
+
+class NMEAParser:
+    """
+    feed(data, now_ns) takes the bytes a read returned and gives back the
+    Fixes they complete: one per valid RMC sentence, with the quality,
+    satellite count and HDOP of the GGA sentence for the same second.
+    Sentences with a wrong checksum or unreadable fields are counted and
+    skipped; other sentence types are ignored.
+    """
+
+    def __init__(self):
+        self.sentences = 0
+        self.checksum_errors = 0
+        self.invalid = 0
+        self.fixes = 0
+        self.no_fix = 0 # RMC sentences saying the receiver has no fix
+        self._partial = b""
+        self._gga = None # (utc, quality, satellites, hdop) of the last GGA
+
+    def feed(self, data, now_ns=None):
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        if len(self._partial) > MAX_SENTENCE:
+            self._partial = b""
+        fixes = []
+        for line in lines:
+            fix = self.sentence(line, now_ns)
+            if fix is not None:
+                fixes.append(fix)
+        return fixes
+
+    def sentence(self, line, now_ns=None):
+        """Parse one line ("$...*hh", CR optional); returns a Fix or None."""
+        start = line.find(b"$")
+        star = line.rfind(b"*")
+        if start < 0 or star < start:
+            if line.strip():
+                self.invalid += 1
+            return None
+        self.sentences += 1
+        body = line[start + 1:star]
+        try:
+            if int(line[star + 1:star + 3], 16) != nmea_checksum(body):
+                self.checksum_errors += 1
+                return None
+            fields = body.decode("ascii").split(",")
+            kind = fields[0][-3:]
+            if kind == "GGA":
+                self._gga = (fields[1], int(fields[6] or 0), int(fields[7] or 0),
+                             float(fields[8]) if fields[8] else None)
+            elif kind == "RMC":
+                return self._rmc(fields, now_ns)
+        except (ValueError, IndexError, UnicodeDecodeError):
+            self.invalid += 1
+        return None
+
+    def _rmc(self, fields, now_ns):
+        if fields[2] != "A":
+            self.no_fix += 1
+            return None
+        utc, quality, satellites, hdop = self._gga if self._gga and self._gga[0] == fields[1] else (None, 1, 0, None)
+        self.fixes += 1
+        return Fix(now_ns or time.monotonic_ns(), parse_coordinate(fields[3], fields[4]),
+                   parse_coordinate(fields[5], fields[6]), float(fields[7] or 0) * KNOTS_TO_M_S,
+                   float(fields[8]) if fields[8] else None, quality, satellites, hdop)
+
+    def stats(self):
+        return {"sentences": self.sentences, "fixes": self.fixes, "no_fix": self.no_fix,
+                "checksum_errors": self.checksum_errors, "invalid": self.invalid}
+
+
+# === Serial Device ===
+class GPSReader:
+    """
+    Reads an NMEA device (a UART, a USB receiver's ttyACM, or the pty of
+    sim/gps_simulator.py) on the running event loop and calls on_fix(fix)
+    there. If the device cannot be opened or goes away (receiver unplugged)
+    it is reopened every `retry_s`.
+    """
+
+    def __init__(self, path, on_fix, baud=9600, retry_s=2.0):
+        self.path = path
+        self.on_fix = on_fix
+        self.baud = baud
+        self.retry_s = retry_s
+        self.parser = NMEAParser()
+        self.bytes = 0
+        self.reopens = 0
+        self.last_error = None
+        self._fd = None
+        self._loop = None
+        self._retry = None
+
+    @property
+    def open(self):
+        return self._fd is not None
+
+    def start(self):
+        """Open the device and watch it on the running loop."""
+        self._loop = asyncio.get_running_loop()
+        self._open()
+
+    def stop(self):
+        if self._retry is not None:
+            self._retry.cancel()
+            self._retry = None
+        self._close()
+        self._loop = None
+
+    def _open(self):
+        self._retry = None
+        try:
+            fd = os.open(self.path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+        except OSError as e:
+            self._failed(e)
+            return
+        try:
+            if os.isatty(fd):
+                tty.setraw(fd)
+                attrs = termios.tcgetattr(fd)
+                attrs[4] = attrs[5] = getattr(termios, f"B{self.baud}")
+                termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        except (OSError, termios.error, AttributeError) as e:
+            os.close(fd)
+            self._failed(e)
+            return
+        self._fd = fd
+        self._loop.add_reader(fd, self._on_readable)
+        if self.last_error is not None:
+            print(f"GPS: {self.path} open again")
+        self.last_error = None
+
+    def _failed(self, e):
+        error = f"{type(e).__name__}: {e}"
+        if error != self.last_error: # Once per kind of failure, not every retry
+            print(f"GPS: cannot read {self.path} ({error}); retrying every {self.retry_s:.0f}s")
+        self.last_error = error
+        if self._loop is not None and not self._loop.is_closed():
+            self._retry = self._loop.call_later(self.retry_s, self._reopen)
+
+    def _reopen(self):
+        self.reopens += 1
+        self._open()
+
+    def _close(self):
+        if self._fd is None:
+            return
+        try:
+            self._loop.remove_reader(self._fd)
+        except (RuntimeError, AttributeError):
+            pass # Loop already closed
+        os.close(self._fd)
+        self._fd = None
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            data, error = b"", e
+        else:
+            error = EOFError("device closed")
+        if not data:
+            self._close()
+            self._failed(error)
+            return
+        self.bytes += len(data)
+        for fix in self.parser.feed(data, time.monotonic_ns()):
+            self.on_fix(fix)
+
+    def stats(self):
+        return {"open": self.open, "bytes": self.bytes, "reopens": self.reopens, **self.parser.stats()}
+
+
+# === Track Simplification ===
+class TrackSimplifier:
+    """
+    Online opening-window simplification. Fixes are held back while the
+    track since the last sent point still runs within `tolerance_m` of a
+    straight line from it; when a new fix breaks that, the fix before it (the
+    corner) is sent and becomes the new start. A point also goes out at least
+    every `max_interval_s`, so a parked robot still shows where it is, and
+    the window is capped at `max_window` fixes so each fix costs a bounded
+    amount of work. add(fix) returns the fixes to send now, oldest first.
+    """
+
+    def __init__(self, tolerance_m=3.0, max_interval_s=10.0, max_window=64):
+        self.tolerance_m = tolerance_m
+        self.max_interval_ns = int(max_interval_s * 1e9)
+        self.max_window = max_window
+        self.received = 0
+        self.sent = 0
+        self.anchor = None # Last fix sent
+        self._window = [] # (fix, east, north) held back since the anchor, in metres from it
+
+    def _send(self, fix):
+        self.anchor = fix
+        self._window = []
+        self.sent += 1
+        return [fix]
+
+    def add(self, fix):
+        self.received += 1
+        anchor = self.anchor
+        if anchor is None:
+            return self._send(fix)
+        x, y = offset_m(anchor.lat, anchor.lon, fix.lat, fix.lon)
+        for _, px, py in self._window:
+            if segment_distance(px, py, 0.0, 0.0, x, y)[0] > self.tolerance_m:
+                corner = self._send(self._window[-1][0])
+                cx, cy = offset_m(corner[0].lat, corner[0].lon, fix.lat, fix.lon)
+                self._window = [(fix, cx, cy)]
+                return corner
+        if fix.timestamp_ns - anchor.timestamp_ns >= self.max_interval_ns or len(self._window) >= self.max_window:
+            return self._send(fix)
+        self._window.append((fix, x, y))
+        return []
+
+    def stats(self):
+        return {"received": self.received, "sent": self.sent}
@@ -0,0 +1,162 @@
+# heartbeat.py
+# Dead-man heartbeat between websoket_server and the Pi. The server sends a
+# small keepalive carrying the current drive intent; a Pi-side watchdog thread,
+# independent of the asyncio loop, ramps the motors to zero when keepalives
+# and commands stop arriving.
+import asyncio
+import bisect
+import threading
+import time
+
+HEARTBEAT_INTERVAL = 0.2 # Seconds between server keepalives
+
+class RttHistogram:
+    """Fixed log-spaced buckets (ms); cheap enough to update on every ack."""
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, value_ms):
+        self.counts[bisect.bisect_left(self.BOUNDS_MS, value_ms)] += 1
+        self.total += 1
+        self.sum_ms += value_ms
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def as_dict(self):
+        labels = [f"<={bound}" for bound in self.BOUNDS_MS] + [f">{self.BOUNDS_MS[-1]}"]
+        return {
+            "buckets_ms": dict(zip(labels, self.counts)),
+            "count": self.total,
+            "mean_ms": round(self.sum_ms / self.total, 3) if self.total else None,
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+class HeartbeatSender:
+    """
+    Server side, one per Pi connection. Sends {"type": "heartbeat"} with the
+    current intent every `interval` seconds through `send(dict)`, an async
+    callable that raises ConnectionError once the connection is gone; the Pi
+    echoes `hb_ts` back in a heartbeat_ack together with its watchdog counters.
+    """
+
+    def __init__(self, send, get_intent, interval=HEARTBEAT_INTERVAL):
+        self.send = send
+        self.get_intent = get_intent
+        self.interval = interval
+        self.seq = 0
+        self.acked = 0
+        self.rtt = RttHistogram()
+        self.pi_stats = {} # Watchdog counters reported by the Pi
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def handle_ack(self, data):
+        hb_ts = data.get("hb_ts")
+        if isinstance(hb_ts, (int, float)):
+            self.rtt.record((time.monotonic() - hb_ts) * 1000)
+        self.acked += 1
+        self.pi_stats = {key: data[key] for key in ("missed", "trips", "trip_latency_ms", "link") if key in data}
+
+    def stats(self):
+        return {"sent": self.seq, "acked": self.acked, "rtt": self.rtt.as_dict(), "pi": self.pi_stats}
+
+    async def _run(self):
+        while True:
+            self.seq += 1
+            message = {
+                "type": "heartbeat",
+                "hb": self.seq,
+                "hb_ts": time.monotonic(), # Only compared on the server, so no clock sync needed
+                "server_ts": time.time() * 1000,
+                "interval": self.interval,
+                "intent": self.get_intent(),
+            }
+            try:
+                await self.send(message)
+            except ConnectionError:
+                return
+            await asyncio.sleep(self.interval)
+
+
+class MotorWatchdog:
+    """
+    Pi side. feed() on every valid heartbeat or command. If nothing arrives
+    for `window_s` while the motors are driven, the watchdog thread ramps the
+    brake controller's speed to zero over `ramp_s`. Only a drive command
+    (BrakeController.command()) during the ramp hands control back; the ramp
+    steps are overrides that lose to it under the brake's lock, and anything
+    else lets the ramp finish, so the motors never stay at partial speed.
+    """
+
+    def __init__(self, brake, window_s=0.6, ramp_s=0.3, step_s=0.05):
+        self.brake = brake
+        self.window_s = window_s
+        self.ramp_s = ramp_s
+        self.step_s = step_s
+        self.trips = 0
+        self.missed = 0 # Heartbeats that never arrived, from the gaps between those that did
+        self.last_trip_latency_ms = None # Window expiry -> first PWM reduction
+        self.last_stop_latency_ms = None # Window expiry -> motors at zero
+        self._last_feed = time.monotonic()
+        self._last_heartbeat = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="watchdog", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def feed(self):
+        self._last_feed = time.monotonic()
+
+    def heartbeat(self, interval):
+        """Feed from a server heartbeat and count any keepalives missed before it."""
+        now = time.monotonic()
+        if self._last_heartbeat is not None and interval:
+            self.missed += max(0, round((now - self._last_heartbeat) / interval) - 1)
+        self._last_heartbeat = now
+        self.feed()
+
+    def stats(self):
+        return {"missed": self.missed, "trips": self.trips, "trip_latency_ms": self.last_trip_latency_ms}
+
+    def _run(self):
+        while not self._stop.wait(self.step_s / 2):
+            deadline = self._last_feed + self.window_s
+            if time.monotonic() > deadline and self.brake.applied_speed:
+                self._ramp_down(deadline)
+
+    def _ramp_down(self, deadline):
+        self.trips += 1
+        commands = self.brake.commands # Read first: a command landing after it wins every step
+        action, speed = self.brake.action, self.brake.applied_speed
+        steps = max(1, int(self.ramp_s / self.step_s))
+        print(f"Watchdog: no intent for {self.window_s}s, ramping {action} {speed}% to zero")
+        for step in range(steps - 1, -1, -1):
+            target = (action, speed * step / steps) if step else ("stop", 0)
+            if self.brake.override(*target, commands) is None:
+                return # A drive command arrived mid-ramp and set the speed itself
+            if step == steps - 1:
+                self.last_trip_latency_ms = (time.monotonic() - deadline) * 1000
+            if step:
+                self._stop.wait(self.step_s)
+        self.last_stop_latency_ms = (time.monotonic() - deadline) * 1000
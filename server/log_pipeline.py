@@ -0,0 +1,112 @@
+# log_pipeline.py
+# Logging for websoket_server that never writes on the event loop. The root
+# logger only puts records on a bounded queue; a listener thread owns the
+# file and console handlers. Per-message events go through a LogSampler, so
+# a busy link logs one line per interval instead of one per message.
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+LOG_QUEUE_SIZE = 10000 # Records waiting for the listener before new ones are dropped
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: when the listener falls behind, records are counted and dropped."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """
+    Root logger -> DroppingQueueHandler -> QueueListener thread -> `handlers`.
+    A forked worker gets a fresh queue and listener thread of its own (the
+    parent's thread doesn't survive the fork); stop() drains the queue.
+    """
+
+    def __init__(self, handlers, level=logging.INFO, queue_size=LOG_QUEUE_SIZE):
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self.listener = None
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(level)
+        self.start()
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.stop)
+
+    def start(self):
+        self.listener = logging.handlers.QueueListener(self.handler.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop() # Writes out whatever is still queued
+            self.listener = None
+
+    def _after_fork(self):
+        self.handler.queue = queue.Queue(self.queue_size) # The parent's may have been locked mid-put
+        self.handler.dropped = 0
+        self.start()
+
+    def stats(self):
+        return {"queued": self.handler.queue.qsize(), "dropped": self.handler.dropped}
+
+def start_logging(path, level=logging.INFO):
+    """Log to `path` and the console through a LogPipeline."""
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.FileHandler(path), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return LogPipeline(handlers, level)
+
+
+class LogSampler:
+    """
+    Rate-limited logging for per-message events: at most one record per key
+    every `interval_s` at `level`; the next one through says how many were
+    suppressed. A disabled level costs one isEnabledFor() check and nothing
+    is formatted.
+    """
+
+    def __init__(self, logger, level=logging.DEBUG, interval_s=5.0):
+        self.logger = logger
+        self.level = level
+        self.interval_s = interval_s
+        self.emitted = 0
+        self.suppressed = 0
+        self._keys = {} # key -> [last emitted (monotonic), suppressed since]
+
+    def log(self, key, message, *args):
+        if not self.logger.isEnabledFor(self.level):
+            return
+        now = time.monotonic()
+        state = self._keys.get(key)
+        if state is None:
+            state = self._keys[key] = [now - self.interval_s, 0]
+        if now - state[0] < self.interval_s:
+            state[1] += 1
+            self.suppressed += 1
+            return
+        if state[1]:
+            message = f"{message} (+%d suppressed)"
+            args = (*args, state[1])
+        state[0], state[1] = now, 0
+        self.emitted += 1
+        self.logger.log(self.level, message, *args)
+
+    def stats(self):
+        return {"emitted": self.emitted, "suppressed": self.suppressed}
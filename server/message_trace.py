@@ -0,0 +1,225 @@
+# message_trace.py
+# Binary trace of websoket_server's message traffic: every browser command,
+# Pi telemetry frame and control message, and every command forwarded to a
+# Pi, with its wall-clock time. The event loop only appends to a deque; a
+# writer thread packs records and writes them in batches to a size-rotated
+# file (trace, trace.1, ... trace.N). A trace can be summarised or replayed
+# against a server with the original timing.
+#
+# File layout (little endian):
+#   header: magic "RMTR" | version u8
+#   record: time_ns u64 | route u8 | flags u8 | robot_len u8 | payload_len u32 | robot | payload
+# Usage: python message_trace.py summary <trace>
+#        python message_trace.py replay <trace> ws://<server>:9000 [speed]
+import asyncio
+import atexit
+import collections
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import aiohttp
+
+TRACE_MAGIC = b"RMTR"
+TRACE_VERSION = 1
+RECORD = struct.Struct("<QBBBI")
+FLAG_BINARY = 0x01 # Payload is bytes as received (a telemetry frame), otherwise UTF-8 text
+
+# Route IDs are part of the file format: append, never renumber
+ROUTES = {
+    "browser_control": 1, # Browser -> server on /control
+    "pi_telemetry": 2, # Pi -> server, binary frame or legacy JSON
+    "to_pi": 3, # Server -> Pi command
+    "pi_control": 4, # Pi -> server control message (heartbeat acks)
+}
+ROUTE_NAMES = {route: name for name, route in ROUTES.items()}
+
+TraceRecord = collections.namedtuple("TraceRecord", ["time_ns", "route", "robot_id", "payload"])
+
+class TraceWriter:
+    """
+    record() is called on the event loop and only appends; the writer thread
+    wakes every `flush_s`, packs everything pending into one buffer and
+    writes it. Dicts are serialised on the writer thread. Past `max_pending`
+    records the trace drops rather than grow. A forked worker writes its own
+    file, `path` plus its pid.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, backups=3, max_pending=100_000, flush_s=0.5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.max_pending = max_pending
+        self.flush_s = flush_s
+        self.records = 0
+        self.written_bytes = 0
+        self.dropped = 0
+        self.rotations = 0
+        self._pending = collections.deque()
+        self._file = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._start()
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.close)
+
+    def record(self, route, robot_id, payload):
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((time.time_ns(), ROUTES[route], robot_id, payload))
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "records": self.records,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "written_bytes": self.written_bytes,
+            "rotations": self.rotations,
+        }
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="message-trace", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        self._file = None # The parent's file stays the parent's
+        self._pending.clear()
+        self._stop = threading.Event()
+        self.path = f"{self.path}.{os.getpid()}"
+        self._start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_s):
+            self._write_pending()
+        self._write_pending()
+        if self._file is not None:
+            self._file.close()
+
+    def _write_pending(self):
+        if not self._pending:
+            return
+        buf = bytearray()
+        count = 0
+        while self._pending:
+            time_ns, route, robot_id, payload = self._pending.popleft()
+            flags = 0
+            if isinstance(payload, (bytes, bytearray)):
+                flags |= FLAG_BINARY
+            else:
+                payload = (payload if isinstance(payload, str) else json.dumps(payload)).encode()
+            robot = robot_id.encode()[:255]
+            buf += RECORD.pack(time_ns, route, flags, len(robot), len(payload))
+            buf += robot
+            buf += payload
+            count += 1
+        try:
+            if self._file is None or self._file.tell() + len(buf) > self.max_bytes:
+                self._rotate()
+            self._file.write(buf)
+            self._file.flush()
+        except OSError as e:
+            self.dropped += count
+            print(f"Message trace write failed: {type(e).__name__}: {e}", file=sys.stderr)
+            return
+        self.records += count
+        self.written_bytes += len(buf)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            for index in range(self.backups - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{index}"):
+                    os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+            self.rotations += 1
+        self._file = open(self.path, "wb")
+        self._file.write(TRACE_MAGIC + bytes([TRACE_VERSION]))
+
+def read_trace(path):
+    """Yield TraceRecords from a trace file; text payloads come back as str."""
+    with open(path, "rb") as f:
+        header = f.read(len(TRACE_MAGIC) + 1)
+        if header[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+            raise ValueError(f"{path} is not a message trace")
+        if header[-1] != TRACE_VERSION:
+            raise ValueError(f"Unsupported trace version: {header[-1]}")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return # End of file, or a record cut short by a crash
+            time_ns, route, flags, robot_len, payload_len = RECORD.unpack(head)
+            robot_id = f.read(robot_len).decode()
+            payload = f.read(payload_len)
+            if len(payload) < payload_len:
+                return
+            yield TraceRecord(time_ns, ROUTE_NAMES.get(route, str(route)), robot_id,
+                              payload if flags & FLAG_BINARY else payload.decode())
+
+def summary(path):
+    counts = collections.Counter()
+    sizes = collections.Counter()
+    first = last = None
+    for record in read_trace(path):
+        key = (record.route, record.robot_id)
+        counts[key] += 1
+        sizes[key] += len(record.payload)
+        first = first or record.time_ns
+        last = record.time_ns
+    if first is None:
+        print("Empty trace")
+        return
+    duration = max((last - first) / 1e9, 1e-9)
+    print(f"{sum(counts.values())} records over {duration:.1f}s")
+    for (route, robot_id), count in counts.most_common():
+        print(f"  {route:<16} {robot_id:<16} {count:>9} records {count / duration:>9.1f}/s {sizes[(route, robot_id)]:>12} bytes")
+
+async def replay(path, server_url, speed=1.0):
+    """
+    Send the trace's inbound traffic to a server with the recorded spacing
+    (divided by `speed`): browser commands on /control, Pi telemetry on
+    /pi_distance, one connection per robot and route. Outbound records
+    (to_pi) and Pi control messages are skipped.
+    """
+    paths = {"browser_control": "/control", "pi_telemetry": "/pi_distance"}
+    sent = collections.Counter()
+    async with aiohttp.ClientSession() as session:
+        sockets = {}
+        start, first = time.monotonic(), None
+        try:
+            for record in read_trace(path):
+                if record.route not in paths:
+                    continue
+                first = first or record.time_ns
+                delay = start + (record.time_ns - first) / 1e9 / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                key = (record.route, record.robot_id)
+                if key not in sockets:
+                    sockets[key] = await session.ws_connect(f"{server_url}{paths[record.route]}?robot={record.robot_id}")
+                if isinstance(record.payload, bytes):
+                    await sockets[key].send_bytes(record.payload)
+                else:
+                    await sockets[key].send_str(record.payload)
+                sent[record.route] += 1
+        finally:
+            for ws in sockets.values():
+                await ws.close()
+    print(f"Replayed {dict(sent)} in {time.monotonic() - start:.1f}s")
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "summary":
+        summary(sys.argv[2])
+    elif len(sys.argv) >= 4 and sys.argv[1] == "replay":
+        asyncio.run(replay(sys.argv[2], sys.argv[3], float(sys.argv[4]) if len(sys.argv) > 4 else 1.0))
+    else:
+        sys.exit("Usage: python message_trace.py summary <trace> | replay <trace> ws://<server>:9000 [speed]")
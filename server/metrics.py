@@ -0,0 +1,293 @@
+# metrics.py
+# Instrumentation shared by websoket_server, robot_listener and the camera
+# publishers: counters, gauges and log-linear (HDR-style) histograms cheap
+# enough to update on every message, rendered in the Prometheus text format
+# when scraped. Counts that already live on objects (forwarded commands,
+# queue drops) are read by callbacks at scrape time instead of being counted
+# twice. The server serves /metrics from aiohttp; the Pi and the publishers
+# run serve_metrics(), a minimal HTTP exporter on the asyncio loop.
+#
+# Updates take no lock. Two threads updating the same metric at the same
+# instant can lose a count, which monitoring tolerates; each metric here is
+# normally updated from one thread.
+import asyncio
+import json
+import math
+import time
+from math import frexp
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUANTILES = (0.5, 0.9, 0.99)
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# === Metrics ===
+class Counter:
+    """
+    Monotonic count. With `labels`, labels(*values) returns (and caches) the
+    child to update; keep the child rather than looking it up per message.
+    With `fn`, the value is fn() at scrape time: a number, or a dict of label
+    value tuples -> number.
+    """
+    type = "counter"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.fn = fn
+        self.value = 0
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self.__class__(self.name, self.help)
+        return child
+
+    def remove(self, *values):
+        self._children.pop(values, None)
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        """(label values, value) pairs for this scrape."""
+        if self.fn is not None:
+            values = self.fn()
+            return list(values.items()) if isinstance(values, dict) else [((), values)]
+        if self.label_names:
+            return [(key, child.value) for key, child in self._children.items()]
+        return [((), self.value)]
+
+    def render(self, const_names, const_values):
+        names = const_names + self.label_names
+        return [f"{self.name}{format_labels(names, const_values + key)} {format_value(value)}"
+                for key, value in self.samples()]
+
+    def snapshot(self):
+        samples = self.samples()
+        if not self.label_names:
+            return samples[0][1] if samples else None
+        return {",".join(map(str, key)): value for key, value in samples}
+
+
+class Gauge(Counter):
+    """A value that goes up and down: set(), inc(), dec(), or a scrape-time `fn`."""
+    type = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Histogram:
+    """
+    Log-linear buckets: each power of two above `lowest` is split into
+    `precision` equal sub-buckets, so any recorded value is known to within
+    1/precision (12.5% at the default 8) from `lowest` to `highest`, in a
+    fixed array of counts. observe() is a frexp() and an index, no search.
+    Values are seconds by convention. The Prometheus exposition uses the
+    power-of-two bounds (exact sums of sub-buckets); quantiles come from the
+    full resolution.
+    """
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), lowest=1e-5, highest=100.0, precision=8):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lowest = lowest
+        self.highest = highest
+        self.precision = precision
+        self.octaves = max(1, math.ceil(math.log2(highest / lowest)))
+        self.counts = [0] * (self.octaves * precision + 2) # Below `lowest`, the sub-buckets, above `highest`
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._scale = 1 / lowest
+        self._double = 2 * precision
+        self._offset = 1 - 2 * precision
+        self._last = len(self.counts) - 1
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = Histogram(self.name, self.help, (), self.lowest, self.highest, self.precision)
+        return child
+
+    def remove(self, *values):
+        self._children.pop(values, None)
+
+    def observe(self, value):
+        mantissa, exponent = frexp(value * self._scale) # value / lowest = mantissa * 2**exponent, mantissa in [0.5, 1)
+        if exponent > 0:
+            # Octave exponent - 1, sub-bucket int((2 * mantissa - 1) * precision), after the underflow bucket
+            index = exponent * self.precision + int(mantissa * self._double) + self._offset
+            if index > self._last:
+                index = self._last
+        else:
+            index = 0
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def observe_since(self, start):
+        """observe() the perf_counter() time elapsed since `start`."""
+        self.observe(time.perf_counter() - start)
+
+    def upper_bound(self, index):
+        if index == 0:
+            return self.lowest
+        if index == len(self.counts) - 1:
+            return math.inf
+        octave, sub = divmod(index - 1, self.precision)
+        return self.lowest * 2 ** octave * (1 + (sub + 1) / self.precision)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (capped at the largest value seen)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _histograms(self):
+        if self.label_names:
+            return list(self._children.items())
+        return [((), self)]
+
+    def render(self, const_names, const_values):
+        names = const_names + self.label_names
+        lines = []
+        for key, histogram in self._histograms():
+            values = const_values + key
+            cumulative = histogram.counts[0]
+            for octave in range(histogram.octaves + 1):
+                if octave:
+                    cumulative += sum(histogram.counts[(octave - 1) * histogram.precision + 1:octave * histogram.precision + 1])
+                bound = format_labels(names + ("le",), values + (f"{histogram.lowest * 2 ** octave:.6g}",))
+                lines.append(f"{self.name}_bucket{bound} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(names + ('le',), values + ('+Inf',))} {histogram.count}")
+            lines.append(f"{self.name}_sum{format_labels(names, values)} {format_value(histogram.sum)}")
+            lines.append(f"{self.name}_count{format_labels(names, values)} {histogram.count}")
+        return lines
+
+    def summary(self):
+        summary = {"count": self.count, "mean": self.sum / self.count if self.count else None, "max": self.max}
+        for q in QUANTILES:
+            summary[f"p{q * 100:g}"] = self.quantile(q)
+        return summary
+
+    def snapshot(self):
+        if not self.label_names:
+            return self.summary()
+        return {",".join(map(str, key)): histogram.summary() for key, histogram in self._children.items()}
+
+
+# === Registry ===
+class Registry:
+    """
+    Named metrics of one process. `const_labels` go on every sample (a
+    server worker sets {"worker": ...}, since each worker counts its own).
+    """
+
+    def __init__(self, const_labels=None):
+        self.const_labels = dict(const_labels or {})
+        self.metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=(), fn=None):
+        return self._add(Counter(name, help, labels, fn))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self._add(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), **buckets):
+        return self._add(Histogram(name, help, labels, **buckets))
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format."""
+        names, values = tuple(self.const_labels), tuple(self.const_labels.values())
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                samples = metric.render(names, values)
+            except Exception as e: # A callback failing must not take the whole scrape down
+                lines.append(f"# {metric.name} failed: {type(e).__name__}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSON-friendly values: numbers for counters/gauges, count/mean/max/quantiles for histograms."""
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+REGISTRY = Registry() # The process's metrics; modules register theirs at import
+
+# === Event Loop Lag ===
+async def watch_loop_lag(histogram, interval=0.1):
+    """Observe how late a sleep of `interval` wakes up: time the loop spent busy with other callbacks."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        histogram.observe(max(0.0, time.perf_counter() - start - interval))
+
+# === Exporter ===
+async def serve_metrics(port, host="0.0.0.0", registry=REGISTRY):
+    """
+    Minimal HTTP exporter on the running loop for processes without a web
+    server (robot_listener, the publishers): GET /metrics (Prometheus text)
+    and GET /stats (JSON snapshot). One request per connection.
+    """
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            path = request.split(b" ", 2)[1].split(b"?")[0] if request.count(b" ") >= 2 else b""
+            if path == b"/metrics":
+                status, content_type, body = "200 OK", CONTENT_TYPE, registry.render()
+            elif path == b"/stats":
+                status, content_type, body = "200 OK", "application/json", json.dumps(registry.snapshot())
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "Not found\n"
+            body = body.encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
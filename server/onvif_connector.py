@@ -0,0 +1,281 @@
+# onvif_connector.py
+# Connects robot_listener to the ONVIF camera on a background thread, so
+# startup never waits on onvif-zeep's import, WSDL parsing or SOAP round
+# trips. What discovery learns (the PTZ endpoint, the PTZ binding's SOAP
+# version and actions, and the profile token) is cached on disk as JSON; a
+# restart drives the camera straight from the cache with SoapPTZService and
+# re-runs discovery later to revalidate it.
+# Usage: python onvif_connector.py <camera_ip> <port> <user> <password> <wsdl_dir> [cache.json]
+import base64
+import hashlib
+import http.client
+import json
+import os
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+PTZ_NAMESPACE = "http://www.onvif.org/ver20/ptz/wsdl"
+PTZ_BINDING = "{%s}PTZBinding" % PTZ_NAMESPACE
+PTZ_OPERATIONS = ("ContinuousMove", "Stop")
+SCHEMA_NAMESPACE = "http://www.onvif.org/ver10/schema"
+SOAP12_ENVELOPE = "http://www.w3.org/2003/05/soap-envelope"
+CACHE_VERSION = 1
+
+WSSE = "http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd"
+WSU = "http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd"
+PASSWORD_DIGEST = "http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-username-token-profile-1.0#PasswordDigest"
+BASE64_BINARY = "http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-soap-message-security-1.0#Base64Binary"
+
+# === Cached PTZ Client ===
+class SOAPFault(Exception):
+    pass
+
+
+def security_header(user, passwd):
+    """WS-Security UsernameToken with a password digest, as onvif-zeep sends it."""
+    nonce = os.urandom(16)
+    created = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    digest = base64.b64encode(hashlib.sha1(nonce + created.encode() + passwd.encode()).digest()).decode()
+    return (f'<wsse:Security xmlns:wsse="{WSSE}"><wsse:UsernameToken>'
+            f'<wsse:Username>{escape(user)}</wsse:Username>'
+            f'<wsse:Password Type="{PASSWORD_DIGEST}">{digest}</wsse:Password>'
+            f'<wsse:Nonce EncodingType="{BASE64_BINARY}">{base64.b64encode(nonce).decode()}</wsse:Nonce>'
+            f'<wsu:Created xmlns:wsu="{WSU}">{created}</wsu:Created>'
+            f'</wsse:UsernameToken></wsse:Security>')
+
+def vector(name, value):
+    if not isinstance(value, dict):
+        value = {"x": value} # Zoom given as a bare speed
+    attrs = "".join(f" {axis}={quoteattr(str(float(v)))}" for axis, v in value.items())
+    return f"<tt:{name}{attrs}/>"
+
+class SoapPTZService:
+    """
+    The two PTZ operations PTZExecutor calls, posted as hand-built SOAP on
+    one keep-alive HTTP connection. `binding` is the dict discover() caches:
+    xaddr, envelope namespace and soapAction per operation. Only called from
+    the PTZ worker thread.
+    """
+
+    def __init__(self, binding, user, passwd, timeout_s=5.0):
+        self.binding = binding
+        self.user = user
+        self.passwd = passwd
+        self.timeout_s = timeout_s
+        url = urllib.parse.urlsplit(binding["xaddr"])
+        self._host = url.netloc
+        self._path = url.path or "/"
+        self._https = url.scheme == "https"
+        self._conn = None
+
+    def ContinuousMove(self, request):
+        velocity = request["Velocity"]
+        body = f"<tptz:ProfileToken>{escape(request['ProfileToken'])}</tptz:ProfileToken><tptz:Velocity>"
+        body += "".join(vector(name, velocity[name]) for name in ("PanTilt", "Zoom") if name in velocity)
+        body += "</tptz:Velocity>"
+        if request.get("Timeout"):
+            body += f"<tptz:Timeout>{escape(request['Timeout'])}</tptz:Timeout>"
+        self._call("ContinuousMove", body)
+
+    def Stop(self, request):
+        self._call("Stop", f"<tptz:ProfileToken>{escape(request['ProfileToken'])}</tptz:ProfileToken>")
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _call(self, operation, body):
+        envelope = self.binding["envelope"]
+        header = f"<env:Header>{security_header(self.user, self.passwd)}</env:Header>" if self.user else ""
+        message = (f'<?xml version="1.0" encoding="utf-8"?><env:Envelope xmlns:env="{envelope}">{header}<env:Body>'
+                   f'<tptz:{operation} xmlns:tptz="{PTZ_NAMESPACE}" xmlns:tt="{SCHEMA_NAMESPACE}">{body}'
+                   f'</tptz:{operation}></env:Body></env:Envelope>').encode()
+        action = self.binding["actions"][operation]
+        if envelope == SOAP12_ENVELOPE:
+            headers = {"Content-Type": f'application/soap+xml; charset=utf-8; action="{action}"'}
+        else:
+            headers = {"Content-Type": "text/xml; charset=utf-8", "SOAPAction": f'"{action}"'}
+        if self._conn is None:
+            cls = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            self._conn = cls(self._host, timeout=self.timeout_s)
+        try:
+            self._conn.request("POST", self._path, message, headers)
+            response = self._conn.getresponse()
+            reply = response.read()
+        except (OSError, http.client.HTTPException):
+            self.close() # Reconnect on the next call
+            raise
+        if response.status >= 400:
+            raise SOAPFault(f"{operation}: HTTP {response.status}: {fault_reason(reply)}")
+
+def fault_reason(reply):
+    try:
+        for element in ET.fromstring(reply).iter():
+            if element.tag.endswith("}Text") or element.tag == "faultstring":
+                return element.text
+    except ET.ParseError:
+        pass
+    return reply[:200].decode(errors="replace")
+
+# === Discovery ===
+def discover(host, port, user, passwd, wsdl_dir):
+    """
+    Full onvif-zeep discovery (GetCapabilities, GetProfiles, PTZ WSDL parse).
+    Returns (binding, ptz_service): the cacheable description and the live
+    zeep service it came from.
+    """
+    from onvif import ONVIFCamera # Imported here: zeep alone costs ~0.2 s of CPU
+    camera = ONVIFCamera(host, port, user, passwd, wsdl_dir=wsdl_dir)
+    profile = camera.create_media_service().GetProfiles()[0]
+    ptz_service = camera.create_ptz_service()
+    binding = {
+        "version": CACHE_VERSION,
+        "camera": f"{host}:{port}",
+        "profile": profile.Name,
+        "token": profile.token,
+    }
+    zeep_binding = getattr(ptz_service, "zeep_client", None)
+    if zeep_binding is not None: # Absent on stand-ins without a WSDL
+        zeep_binding = zeep_binding.wsdl.bindings[PTZ_BINDING]
+        binding.update({
+            "xaddr": camera.xaddrs[PTZ_NAMESPACE],
+            "envelope": zeep_binding.nsmap["soap-env"],
+            "actions": {operation: zeep_binding.get(operation).soapaction for operation in PTZ_OPERATIONS},
+        })
+    return binding, ptz_service
+
+def load_cache(path, host, port):
+    try:
+        with open(path) as f:
+            binding = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if binding.get("version") != CACHE_VERSION or binding.get("camera") != f"{host}:{port}":
+        return None # Another camera, or an older format
+    return binding
+
+def save_cache(path, binding):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(binding, f, indent=2)
+    os.replace(tmp, path)
+
+# === Connector ===
+class ONVIFConnector:
+    """
+    Background camera setup. start() returns at once; the thread then calls
+    on_ready(ptz_service, token) as soon as a PTZ service is usable: first
+    from the cache (state "cached") if there is one for this camera, then
+    again from discovery only if the camera's answer differs from the cache
+    (state "ready" either way). Discovery failures retry with backoff and
+    never touch an already working cached service. cache_path=None disables
+    the cache.
+    """
+
+    def __init__(self, host, port, user, passwd, wsdl_dir, cache_path, on_ready,
+                 revalidate_after_s=30.0, retry_s=5.0, retry_max_s=120.0):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.passwd = passwd
+        self.wsdl_dir = wsdl_dir
+        self.cache_path = cache_path
+        self.on_ready = on_ready
+        self.revalidate_after_s = revalidate_after_s # Let startup settle before discovery's CPU burst
+        self.retry_s = retry_s
+        self.retry_max_s = retry_max_s
+        self.state = "idle" # idle, connecting, cached, ready, failed
+        self.binding = None
+        self.ready_at = None # time.monotonic() when the first service was handed over
+        self.discoveries = 0
+        self.failures = 0
+        self.cache_hits = 0
+        self.last_error = None
+        self._started = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._started = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name="onvif", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def ready(self):
+        return self.state in ("cached", "ready")
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "profile": self.binding and self.binding.get("profile"),
+            "ready_after_s": round(self.ready_at - self._started, 3) if self.ready_at else None,
+            "discoveries": self.discoveries,
+            "failures": self.failures,
+            "cache_hits": self.cache_hits,
+            "last_error": self.last_error,
+        }
+
+    def _hand_over(self, ptz_service, binding, state):
+        self.binding = binding
+        self.on_ready(ptz_service, binding["token"])
+        self.state = state
+        if self.ready_at is None:
+            self.ready_at = time.monotonic()
+
+    def _run(self):
+        cached = load_cache(self.cache_path, self.host, self.port) if self.cache_path else None
+        if cached:
+            self.cache_hits += 1
+            self._hand_over(SoapPTZService(cached, self.user, self.passwd), cached, "cached")
+            print(f"Camera ready from cache ({self.cache_path}). Profile: {cached['profile']}")
+            if self._stop.wait(self.revalidate_after_s):
+                return
+        else:
+            self.state = "connecting"
+        print(f"Connecting to ONVIF camera at {self.host}:{self.port}...")
+        delay = self.retry_s
+        while not self._stop.is_set():
+            try:
+                binding, ptz_service = discover(self.host, self.port, self.user, self.passwd, self.wsdl_dir)
+                self.discoveries += 1
+                break
+            except Exception as e:
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                if not self.ready:
+                    self.state = "failed"
+                print(f"ONVIF setup failed: {self.last_error}; retrying in {delay:.0f}s")
+                if self._stop.wait(delay):
+                    return
+                delay = min(delay * 2, self.retry_max_s)
+        else:
+            return
+        if binding == cached:
+            self.state = "ready" # Cache confirmed; keep the service already in use
+            return
+        self._hand_over(ptz_service, binding, "ready")
+        print(f"Connected to camera. Profile: {binding['profile']}")
+        if self.cache_path and "xaddr" in binding:
+            try:
+                save_cache(self.cache_path, binding)
+            except OSError as e:
+                print(f"Could not write the ONVIF cache: {type(e).__name__}: {e}")
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 6:
+        sys.exit("Usage: python onvif_connector.py <camera_ip> <port> <user> <password> <wsdl_dir> [cache.json]")
+    start = time.perf_counter()
+    binding, _ = discover(sys.argv[1], int(sys.argv[2]), sys.argv[3], sys.argv[4], sys.argv[5])
+    print(f"Discovered in {time.perf_counter() - start:.2f}s")
+    print(json.dumps(binding, indent=2))
+    if len(sys.argv) > 6:
+        save_cache(sys.argv[6], binding)
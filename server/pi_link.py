@@ -0,0 +1,306 @@
+# pi_link.py
+# One multiplexed, resumable WebSocket session between the Pi and websoket_server.
+# Control commands, PTZ commands and telemetry share the connection under channel
+# IDs; sequenced messages are buffered until the peer acks them and are resent
+# after a reconnect, so a dropped link loses nothing that still fits the buffer.
+#
+# Wire format:
+#   binary: channel u8 | seq u32 | payload        (telemetry frames)
+#   text:   {"ch": channel, "seq": seq, "data": {...}}
+#   link:   {"ch": 0, "hello": session, "peer": session, "ack": seq} / {"ch": 0, "ack": seq}
+# seq 0 marks a volatile message (heartbeats): never buffered, never resent.
+import asyncio
+import collections
+import json
+import logging
+import random
+import struct
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+LINK_PATH = "/pi_link"
+FRAME = struct.Struct("<BI")
+
+# Channel IDs are part of the wire format: append, never renumber
+CHANNELS = {
+    "link": 0, # Handshake and acks
+    "control": 1, # Drive commands, heartbeats and their acks
+    "telemetry": 2, # Binary telemetry frames from the Pi
+    "ptz": 3, # Camera pan/tilt commands
+}
+
+def encode_message(seq, channel, payload):
+    if isinstance(payload, (bytes, bytearray)):
+        return FRAME.pack(channel, seq) + payload
+    return json.dumps({"ch": channel, "seq": seq, "data": payload})
+
+def decode_message(raw):
+    """Return (seq, channel, payload); link messages come back as the whole dict."""
+    if isinstance(raw, (bytes, bytearray)):
+        channel, seq = FRAME.unpack_from(raw)
+        return seq, channel, bytes(raw[FRAME.size:])
+    message = json.loads(raw)
+    if message.get("ch") == CHANNELS["link"]:
+        return 0, CHANNELS["link"], message
+    return message.get("seq", 0), message["ch"], message.get("data")
+
+def backoff_delay(attempt, base_s=0.25, max_s=8.0):
+    """Exponential backoff with equal jitter: half fixed, half random, capped at max_s."""
+    delay = min(max_s, base_s * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class LinkSession:
+    """
+    Transport-independent state for one end of the link. It outlives the
+    WebSocket: attach() a send function when a connection is up, detach()
+    when it drops, and send() keeps buffering in between.
+
+    Each end has a random session ID. If the peer's ID changes (process
+    restart), its acks no longer apply and the receive counter starts over.
+    """
+
+    def __init__(self, max_buffer=256, ack_interval=0.1):
+        self.session = uuid.uuid4().hex[:12]
+        self.peer_session = None
+        self.ack_interval = ack_interval
+        self.handlers = {} # channel ID -> callable(payload)
+        self.out_seq = 0
+        self.in_seq = 0 # Highest seq received from the peer
+        self.sent_seq = 0 # Highest seq written on the current connection
+        self.unacked = collections.deque(maxlen=max_buffer) # (seq, channel, payload), contiguous seqs
+        self.max_buffered = 0
+        self.dropped = 0 # Unacked messages pushed out of the full buffer
+        self.resent = 0
+        self.duplicates = 0
+        self.connects = 0
+        self._high_seq = 0 # Highest seq ever written, to count resends
+        self._acked_in = 0
+        self._send_raw = None
+        self._wakeup = asyncio.Event()
+        self._writer = None
+
+    @property
+    def connected(self):
+        return self._send_raw is not None
+
+    def on(self, channel, handler):
+        self.handlers[CHANNELS[channel]] = handler
+
+    # === Connection ===
+    def hello(self):
+        return json.dumps({"ch": CHANNELS["link"], "hello": self.session, "peer": self.peer_session,
+                           "ack": self.in_seq})
+
+    def handshake(self, raw):
+        """Apply the peer's hello; returns True if this resumes the previous session."""
+        _, channel, message = decode_message(raw)
+        if channel != CHANNELS["link"] or "hello" not in message:
+            raise ValueError(f"Expected a link hello, got: {raw!r:.80}")
+        resumed = message["hello"] == self.peer_session
+        if not resumed:
+            self.peer_session = message["hello"]
+            self.in_seq = self._acked_in = 0
+        # The peer's ack only counts if it refers to this process's numbering
+        ack = message.get("ack", 0) if message.get("peer") == self.session else 0
+        self._trim(ack)
+        self.sent_seq = ack # Everything after the ack is resent
+        return resumed
+
+    def discard(self, keep):
+        """
+        Drop buffered messages for which keep(channel, payload) is false and
+        renumber the rest so they stay contiguous. Only for a new peer
+        session (handshake() returned False): the peer has seen none of them.
+        """
+        kept = [(channel, payload) for _, channel, payload in self.unacked if keep(channel, payload)]
+        dropped = len(self.unacked) - len(kept)
+        first = self.out_seq - len(kept) + 1
+        self.unacked.clear()
+        self.unacked.extend((first + i, channel, payload) for i, (channel, payload) in enumerate(kept))
+        self.sent_seq = min(self.sent_seq, first - 1)
+        return dropped
+
+    def attach(self, send_raw):
+        """Start writing through `send_raw(str | bytes)`, an async callable."""
+        self.detach()
+        self._send_raw = send_raw
+        self.connects += 1
+        self._wakeup.set()
+        self._writer = asyncio.ensure_future(self._write())
+
+    def detach(self, send_raw=None):
+        if send_raw is not None and send_raw is not self._send_raw:
+            return # A newer connection already took over
+        self._send_raw = None
+        if self._writer:
+            self._writer.cancel()
+            self._writer = None
+
+    # === Sending ===
+    def send(self, channel, payload):
+        """Sequenced send: buffered until acked, survives reconnects."""
+        self.out_seq += 1
+        if len(self.unacked) == self.unacked.maxlen:
+            self.dropped += 1
+        self.unacked.append((self.out_seq, CHANNELS[channel], payload))
+        self.max_buffered = max(self.max_buffered, len(self.unacked))
+        self._wakeup.set()
+
+    async def send_volatile(self, channel, payload):
+        """Send now or not at all; raises ConnectionResetError while detached."""
+        if self._send_raw is None:
+            raise ConnectionResetError("Link not connected")
+        try:
+            await self._send_raw(encode_message(0, CHANNELS[channel], payload))
+        except Exception as e: # websockets and aiohttp each raise their own closed-connection errors
+            raise ConnectionResetError(f"Link send failed: {type(e).__name__}: {e}") from e
+
+    # === Receiving ===
+    def receive(self, raw):
+        try:
+            seq, channel, payload = decode_message(raw)
+        except (ValueError, KeyError, struct.error) as e:
+            logger.error(f"Malformed link message: {type(e).__name__}: {e}")
+            return
+        if channel == CHANNELS["link"]:
+            self._trim(payload.get("ack", 0))
+            return
+        if seq:
+            if seq <= self.in_seq:
+                self.duplicates += 1 # Resent after a reconnect, already handled
+                return
+            self.in_seq = seq
+            if seq - self._acked_in >= self.unacked.maxlen // 2:
+                self._wakeup.set() # Ack early so the peer's buffer never fills while connected
+        handler = self.handlers.get(channel)
+        if handler is None:
+            logger.warning(f"No handler for link channel {channel}")
+            return
+        try:
+            handler(payload)
+        except Exception as e:
+            logger.error(f"Error handling link channel {channel}: {type(e).__name__}: {e}")
+
+    def stats(self):
+        return {
+            "session": self.session,
+            "peer_session": self.peer_session,
+            "connected": self.connected,
+            "connects": self.connects,
+            "out_seq": self.out_seq,
+            "in_seq": self.in_seq,
+            "buffered": len(self.unacked),
+            "max_buffered": self.max_buffered,
+            "dropped": self.dropped,
+            "resent": self.resent,
+            "duplicates": self.duplicates,
+        }
+
+    # === Internals ===
+    def _trim(self, ack):
+        while self.unacked and self.unacked[0][0] <= ack:
+            self.unacked.popleft()
+
+    async def _write(self):
+        send_raw = self._send_raw
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.ack_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                while self.unacked and self.sent_seq < self.unacked[-1][0]:
+                    first = self.unacked[0][0]
+                    seq, channel, payload = self.unacked[max(0, self.sent_seq + 1 - first)]
+                    await send_raw(encode_message(seq, channel, payload))
+                    self.sent_seq = seq
+                    if seq <= self._high_seq:
+                        self.resent += 1
+                    self._high_seq = max(self._high_seq, seq)
+                if self.in_seq != self._acked_in:
+                    self._acked_in = self.in_seq
+                    await send_raw(json.dumps({"ch": CHANNELS["link"], "ack": self.in_seq}))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The transport's reader notices the close and detaches
+            logger.warning(f"Link write failed: {type(e).__name__}: {e}")
+
+
+class LinkClient:
+    """
+    Pi side. Keeps one LinkSession connected to the server, reconnecting with
+    jittered exponential backoff. The server heartbeats every 200 ms, so
+    `idle_timeout_s` of silence means a dead (possibly half-open) connection.
+    `on_connect(resumed)` runs after every successful handshake.
+    """
+
+    def __init__(self, uri, session, on_connect=None, base_delay_s=0.25, max_delay_s=8.0,
+                 open_timeout_s=5.0, idle_timeout_s=2.0):
+        self.uri = uri
+        self.session = session
+        self.on_connect = on_connect
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.open_timeout_s = open_timeout_s
+        self.idle_timeout_s = idle_timeout_s
+        self.attempts = 0
+        self.reconnects = 0
+        self.last_reconnect_ms = None # Link lost -> next handshake complete
+        self.reconnect_ms = collections.deque(maxlen=100)
+        self._lost_at = None
+
+    async def run(self):
+        import websockets # Only installed on the Pi; the server side uses aiohttp
+        failures = 0
+        while True:
+            self.attempts += 1
+            try:
+                async with websockets.connect(self.uri, open_timeout=self.open_timeout_s) as ws:
+                    await ws.send(self.session.hello())
+                    resumed = self.session.handshake(await asyncio.wait_for(ws.recv(), self.open_timeout_s))
+                    self._connected(resumed)
+                    failures = 0
+                    self.session.attach(ws.send)
+                    if self.on_connect:
+                        self.on_connect(resumed)
+                    while True:
+                        try:
+                            message = await asyncio.wait_for(ws.recv(), self.idle_timeout_s)
+                        except asyncio.TimeoutError:
+                            ws.transport.abort() # Half-open: nobody will answer a close handshake
+                            raise
+                        self.session.receive(message)
+            except (OSError, asyncio.TimeoutError, ValueError, websockets.WebSocketException) as e:
+                reason = "link idle" if isinstance(e, asyncio.TimeoutError) else f"{type(e).__name__}: {e}"
+                print(f"Server link down ({reason})")
+            finally:
+                self.session.detach()
+            if self._lost_at is None:
+                self._lost_at = time.monotonic()
+            delay = backoff_delay(failures, self.base_delay_s, self.max_delay_s)
+            failures += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "attempts": self.attempts,
+            "reconnects": self.reconnects,
+            "last_reconnect_ms": self.last_reconnect_ms,
+            "buffered": len(self.session.unacked),
+            "dropped": self.session.dropped,
+            "resent": self.session.resent,
+        }
+
+    def _connected(self, resumed):
+        if self._lost_at is not None:
+            self.reconnects += 1
+            self.last_reconnect_ms = round((time.monotonic() - self._lost_at) * 1000, 1)
+            self.reconnect_ms.append(self.last_reconnect_ms)
+            self._lost_at = None
+        print(f"Server link up ({'resumed' if resumed else 'new'} session, "
+              f"{len(self.session.unacked)} buffered messages to resend)")
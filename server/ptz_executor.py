@@ -0,0 +1,123 @@
+# ptz_executor.py
+# Runs ONVIF PTZ calls on a dedicated worker thread so SOAP round trips never
+# block the asyncio loop. Only the latest camera intent is kept: repeated pan
+# commands merge into one ContinuousMove and Stop is sent from a scheduled deadline.
+import collections
+import threading
+import time
+
+class PTZExecutor:
+    """
+    Single-slot "latest intent" mailbox in front of an ONVIF PTZ service.
+
+    submit() never blocks: it overwrites the pending intent and wakes the
+    worker. Intents for the direction already moving only push the stop
+    deadline back; ContinuousMove is re-sent only when the camera's own
+    move timeout would otherwise expire before the new deadline.
+    """
+
+    def __init__(self, ptz_service, ptz_token, stop_after_s=0.5, move_timeout_s=2):
+        self.ptz_service = ptz_service
+        self.ptz_token = ptz_token
+        self.stop_after_s = stop_after_s # Stop this long after the last intent for a direction
+        self.move_timeout_s = move_timeout_s # Timeout sent with ContinuousMove, in whole seconds
+        self.submitted = 0
+        self.moves_sent = 0
+        self.stops_sent = 0
+        self.merged = 0 # Intents absorbed without a new ContinuousMove
+        self.errors = 0
+        self.latencies_ns = collections.deque(maxlen=1000) # submit() -> ContinuousMove returned
+        self._pending = None # (direction, velocity, submitted_ns)
+        self._moving = None # Direction currently moving
+        self._move_expires = 0.0 # When the camera stops on its own (monotonic seconds)
+        self._stop_deadline = None # When we send Stop (monotonic seconds)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="ptz", daemon=True)
+        self._thread.start()
+
+    def submit(self, direction, velocity):
+        with self._cond:
+            if self._pending is not None:
+                self.merged += 1 # Superseded before the worker picked it up
+            self._pending = (direction, velocity, time.monotonic_ns())
+            self.submitted += 1
+            self._cond.notify()
+
+    def merge_ratio(self):
+        return self.submitted / self.moves_sent if self.moves_sent else 0.0
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=2)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and self._pending is None:
+                    if self._stop_deadline is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self._stop_deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                intent, self._pending = self._pending, None
+                closed = self._closed
+            if closed:
+                if self._moving:
+                    self._call(self._send_stop)
+                return
+            if intent is None:
+                self._call(self._send_stop)
+            else:
+                self._call(self._handle_intent, intent)
+
+    def _handle_intent(self, intent):
+        direction, velocity, submitted_ns = intent
+        now = time.monotonic()
+        self._stop_deadline = now + self.stop_after_s
+        if direction == self._moving and self._move_expires > self._stop_deadline:
+            self.merged += 1
+            return
+        self.ptz_service.ContinuousMove({
+            'ProfileToken': self.ptz_token,
+            'Velocity': velocity,
+            'Timeout': f'PT{self.move_timeout_s}S'
+        })
+        self._moving = direction
+        self._move_expires = now + self.move_timeout_s
+        self.moves_sent += 1
+        self.latencies_ns.append(time.monotonic_ns() - submitted_ns)
+
+    def _send_stop(self):
+        self._stop_deadline = None
+        self._moving = None
+        self.ptz_service.Stop({'ProfileToken': self.ptz_token})
+        self.stops_sent += 1
+
+    def _call(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            self.errors += 1
+            self._moving = None
+            print(f"Camera movement failed: {type(e).__name__}: {e}")
+
+
+class FakePTZService:
+    """Offline stand-in for an ONVIF PTZ service; each SOAP call takes `rtt_s`."""
+
+    def __init__(self, rtt_s=0.04):
+        self.rtt_s = rtt_s
+        self.calls = [] # (monotonic_ns, operation, request)
+
+    def ContinuousMove(self, request):
+        time.sleep(self.rtt_s)
+        self.calls.append((time.monotonic_ns(), "ContinuousMove", request))
+
+    def Stop(self, request):
+        time.sleep(self.rtt_s)
+        self.calls.append((time.monotonic_ns(), "Stop", request))
@@ -0,0 +1,326 @@
+# ranging.py
+# Interrupt-driven ultrasonic ranging: echo edges are timestamped from GPIO edge
+# callbacks with time.monotonic_ns() instead of busy-polling GPIO.input().
+# UltrasonicRanger runs one sensor; UltrasonicArray schedules several so only
+# one is ever listening for its echo.
+import collections
+import threading
+import time
+
+SPEED_OF_SOUND_CM_PER_NS_HALF = 17150 / 1e9 # Round trip, so half of 343 m/s, in cm per ns
+MIN_DISTANCE_CM = 2
+MAX_DISTANCE_CM = 300
+
+# One distance reading; value is -1 when there was no valid echo
+Sample = collections.namedtuple("Sample", ["seq", "value", "timestamp_ns"])
+NO_SAMPLE = Sample(0, -1, 0)
+
+# Latest reading of every sensor of an UltrasonicArray, in the array's order;
+# `sensor` is the index of the one this ping updated
+RangeVector = collections.namedtuple("RangeVector", ["seq", "sensor", "samples"])
+
+def echo_distance(rise_ns, fall_ns):
+    """Distance in cm for an echo pulse, or -1 if it is missing or out of range."""
+    if rise_ns is None or fall_ns is None or fall_ns <= rise_ns:
+        return -1
+    distance = round((fall_ns - rise_ns) * SPEED_OF_SOUND_CM_PER_NS_HALF, 2)
+    return distance if MIN_DISTANCE_CM <= distance <= MAX_DISTANCE_CM else -1
+
+class LatestValue:
+    """
+    Single-slot, lock-free mailbox holding the most recent Sample.
+    The writer replaces the slot with one reference assignment (atomic under the
+    GIL), so readers always see a complete sample and never block the writer.
+    """
+    __slots__ = ("_sample",)
+
+    def __init__(self, initial=NO_SAMPLE):
+        self._sample = initial
+
+    def publish(self, sample):
+        self._sample = sample
+
+    def get(self):
+        return self._sample
+
+
+class UltrasonicRanger:
+    """
+    Fires an HC-SR04 style sensor at a fixed rate on a background thread.
+    The rising and falling echo edges are captured by an edge callback, the
+    thread only sleeps until the echo completes (or times out), so a ping
+    costs microseconds of CPU instead of a busy loop.
+    """
+
+    def __init__(self, gpio, trig, echo, rate_hz=20, timeout_s=0.025):
+        # 300 cm is a ~17.5 ms echo, so the default timeout covers the full range
+        self.gpio = gpio
+        self.trig = trig
+        self.echo = echo
+        self.rate_hz = rate_hz
+        self.timeout_s = timeout_s
+        self.latest = LatestValue()
+        self.samples = 0 # Pings completed
+        self.timeouts = 0 # Pings without a valid echo
+        self.overruns = 0 # Periods where the ping took longer than the sample period
+        self._listeners = []
+        self._rise_ns = None
+        self._fall_ns = None
+        self._echo_done = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        gpio.setup(trig, gpio.OUT)
+        gpio.setup(echo, gpio.IN)
+        gpio.output(trig, False)
+
+    def add_listener(self, callback):
+        """Call `callback(sample)` on the ranging thread after every ping."""
+        self._listeners.append(callback)
+
+    def latest_distance(self):
+        return self.latest.get().value
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self.gpio.add_event_detect(self.echo, self.gpio.BOTH, callback=self._on_edge)
+        self._thread = threading.Thread(target=self._run, name="ultrasonic", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._echo_done.set()
+        self._thread.join(timeout=1)
+        self._thread = None
+        self.gpio.remove_event_detect(self.echo)
+
+    def _on_edge(self, channel):
+        now = time.monotonic_ns() # Timestamp first, before anything else can delay us
+        if self.gpio.input(channel):
+            self._rise_ns = now
+        elif self._rise_ns is not None:
+            self._fall_ns = now
+            self._echo_done.set()
+
+    def _run(self):
+        period_ns = int(1e9 / self.rate_hz)
+        next_ns = time.monotonic_ns()
+        while not self._stop.is_set():
+            self.ping()
+            next_ns += period_ns
+            delay_ns = next_ns - time.monotonic_ns()
+            if delay_ns > 0:
+                self._stop.wait(delay_ns / 1e9)
+            else:
+                self.overruns += 1
+                next_ns = time.monotonic_ns() # Resync instead of bursting to catch up
+
+    def ping(self):
+        """Fire one trigger pulse, wait for its echo and publish the result."""
+        self._rise_ns = None
+        self._fall_ns = None
+        self._echo_done.clear()
+        self.gpio.output(self.trig, True)
+        time.sleep(0.00001) # 10us trigger pulse
+        self.gpio.output(self.trig, False)
+        self._echo_done.wait(self.timeout_s)
+
+        fall = self._fall_ns
+        distance = echo_distance(self._rise_ns, fall)
+        if distance == -1:
+            self.timeouts += 1
+            fall = time.monotonic_ns()
+
+        self.samples += 1
+        sample = Sample(self.samples, distance, fall)
+        self.latest.publish(sample)
+        for listener in self._listeners:
+            listener(sample)
+        return sample
+
+
+# === Sensor Array ===
+# Weight per sensor name for each drive action; unlisted sensors weigh 1
+MOTION_WEIGHTS = {
+    "forward": {"front": 4},
+    "backward": {"rear": 4},
+    "left": {"front": 2, "left": 3},
+    "right": {"front": 2, "right": 3},
+}
+
+def share_rates(weights, capacity_hz, max_rate_hz):
+    """Split capacity_hz pings per second by weight, none above max_rate_hz; the excess goes to the rest."""
+    rates = [0.0] * len(weights)
+    open_ = [i for i, weight in enumerate(weights) if weight > 0]
+    while open_:
+        total = sum(weights[i] for i in open_)
+        capped = [i for i in open_ if capacity_hz * weights[i] / total >= max_rate_hz]
+        if not capped:
+            for i in open_:
+                rates[i] = capacity_hz * weights[i] / total
+            break
+        for i in capped:
+            rates[i] = max_rate_hz
+            capacity_hz -= max_rate_hz
+            open_.remove(i)
+    return rates
+
+class UltrasonicArray:
+    """
+    Several HC-SR04 style sensors on one ranging thread, fired one at a time.
+    Each ping owns a `slot_s` window from its trigger, at least the echo
+    timeout, so no sensor is listening while another's pulse is still in
+    range. Edges on an echo pin outside its own ping are counted in
+    `stray_edges`.
+
+    The slots are shared out by weight, each sensor capped at max_rate_hz
+    with the rest going to the others; set_motion() picks the weights from
+    MOTION_WEIGHTS, so the sensor facing the direction of travel is pinged
+    most. Slots sit on a fixed grid and, of the sensors that are due, the
+    fastest goes first, so the sensor facing the way the robot moves keeps
+    an even period; the others catch up in the remaining slots.
+
+    After every ping, listeners get a RangeVector with the latest sample of
+    every sensor; `latest` holds the newest one.
+    """
+
+    def __init__(self, gpio, sensors, max_rate_hz=20, slot_s=0.025, timeout_s=0.025, weights=MOTION_WEIGHTS):
+        # sensors: [(name, trig, echo)]; the default timeout covers 300 cm, as for UltrasonicRanger
+        self.gpio = gpio
+        self.sensors = list(sensors)
+        self.names = [name for name, _, _ in self.sensors]
+        self.max_rate_hz = max_rate_hz
+        self.slot_s = max(slot_s, timeout_s)
+        self.timeout_s = timeout_s
+        self.weights = weights
+        self.latest = LatestValue(RangeVector(0, None, (NO_SAMPLE,) * len(self.sensors)))
+        self.pings = [0] * len(self.sensors)
+        self.misses = [0] * len(self.sensors) # Pings without a valid echo, per sensor
+        self.overruns = 0 # Slots that ended after the next one should have started
+        self.stray_edges = 0 # Echo edges from a sensor that was not pinged
+        self.motion = None
+        self.rates_hz = []
+        self._periods_ns = []
+        self._last_ns = [] # When each sensor was last due, set when the thread starts
+        self._echo_index = {echo: i for i, (_, _, echo) in enumerate(self.sensors)}
+        self._listeners = []
+        self._active = None # Index of the sensor whose echo is awaited
+        self._rise_ns = None
+        self._fall_ns = None
+        self._echo_done = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.set_motion("stop")
+
+        for _, trig, echo in self.sensors:
+            gpio.setup(trig, gpio.OUT)
+            gpio.setup(echo, gpio.IN)
+            gpio.output(trig, False)
+
+    @property
+    def samples(self):
+        return sum(self.pings)
+
+    @property
+    def timeouts(self):
+        return sum(self.misses)
+
+    def index(self, name):
+        return self.names.index(name)
+
+    def add_listener(self, callback):
+        """Call `callback(vector)` on the ranging thread after every ping."""
+        self._listeners.append(callback)
+
+    def latest_distance(self, name=None):
+        vector = self.latest.get()
+        return vector.samples[self.index(name) if name else 0].value
+
+    def set_motion(self, action):
+        """Weight the schedule towards the sensors facing `action` (a drive action)."""
+        if action == self.motion:
+            return
+        extra = self.weights.get(action, {})
+        self.rates_hz = share_rates([extra.get(name, 1) for name in self.names], 1 / self.slot_s, self.max_rate_hz)
+        self._periods_ns = [int(1e9 / rate) for rate in self.rates_hz] # One assignment: the thread sees old or new
+        self.motion = action
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        for _, _, echo in self.sensors:
+            self.gpio.add_event_detect(echo, self.gpio.BOTH, callback=self._on_edge)
+        self._thread = threading.Thread(target=self._run, name="ultrasonic", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._echo_done.set()
+        self._thread.join(timeout=1)
+        self._thread = None
+        for _, _, echo in self.sensors:
+            self.gpio.remove_event_detect(echo)
+
+    def _on_edge(self, channel):
+        now = time.monotonic_ns()
+        if self._active is None or self._echo_index.get(channel) != self._active:
+            self.stray_edges += 1
+        elif self.gpio.input(channel):
+            self._rise_ns = now
+        elif self._rise_ns is not None:
+            self._fall_ns = now
+            self._echo_done.set()
+
+    def _run(self):
+        slot_ns = int(self.slot_s * 1e9)
+        next_ns = time.monotonic_ns() # Start of the next slot; slots stay on one grid
+        self._last_ns = [next_ns - period for period in self._periods_ns] # All due now, none owed
+        while not self._stop.is_set():
+            periods = self._periods_ns
+            due = [last + period for last, period in zip(self._last_ns, periods)]
+            ready = [i for i, at in enumerate(due) if at <= next_ns]
+            if ready: # Otherwise the slot stays empty
+                index = min(ready, key=lambda i: (periods[i], due[i])) # Fastest first, then most overdue
+                self._last_ns[index] = max(due[index], next_ns - periods[index]) # Keep its cadence, bank nothing
+                self.ping(index)
+            next_ns += slot_ns
+            delay_ns = next_ns - time.monotonic_ns()
+            if delay_ns > 0:
+                self._stop.wait(delay_ns / 1e9)
+            else:
+                self.overruns += 1
+                next_ns = time.monotonic_ns() # Resync instead of bursting to catch up
+
+    def ping(self, index):
+        """Fire sensor `index`, wait for its echo and publish the updated vector."""
+        _, trig, _ = self.sensors[index]
+        self._rise_ns = None
+        self._fall_ns = None
+        self._echo_done.clear()
+        self._active = index
+        self.gpio.output(trig, True)
+        time.sleep(0.00001) # 10us trigger pulse
+        self.gpio.output(trig, False)
+        self._echo_done.wait(self.timeout_s)
+        self._active = None
+
+        fall = self._fall_ns
+        distance = echo_distance(self._rise_ns, fall)
+        if distance == -1:
+            self.misses[index] += 1
+            fall = time.monotonic_ns()
+        self.pings[index] += 1
+        previous = self.latest.get()
+        samples = previous.samples[:index] + (Sample(self.pings[index], distance, fall),) + previous.samples[index + 1:]
+        vector = RangeVector(previous.seq + 1, index, samples)
+        self.latest.publish(vector)
+        for listener in self._listeners:
+            listener(vector)
+        return vector
@@ -1,21 +1,34 @@
 import asyncio # Asyncio library for asynchronous programming
-import websockets # WebSocket library for async communication
-import json # JSON library for data serialization
-import RPi.GPIO as GPIO # GPIO library for Raspberry Pi pin control
-import time # Time library for delays
-import threading  # Threading library for running sensor loop in background
-from onvif import ONVIFCamera # ONVIF library for camera control
+import json
+import os
+import socket
+import time
+from gpio_backend import load_gpio # RPi.GPIO on the robot, FakeGPIO with ROBOT_GPIO_BACKEND=fake
+from ranging import UltrasonicArray # Interrupt-driven ultrasonic ranging, one sensor at a time
+from safety import BrakeController # Reactive emergency brake on the ranging thread
+from fusion import ObstacleFusion # Nearer of the front ultrasonic and camera distances, for the brake
+from gps import GPSReader, TrackSimplifier # NMEA receiver read on the event loop, track thinned before sending
+from ptz_executor import PTZExecutor # ONVIF PTZ calls on a worker thread
+from onvif_connector import ONVIFConnector # Camera discovery off the startup path, cached on disk
+from command_pipeline import CAMERA_ACTIONS, DRIVE_ACTIONS, RECORD_ACTIONS, CommandGate, CommandMailbox # Latest-command-wins
+from heartbeat import MotorWatchdog # Dead-man watchdog fed by server heartbeats
+from telemetry_protocol import CHANNELS, LocalTelemetryProtocol, TelemetryBatcher # Batched telemetry frames
+from pi_link import LINK_PATH, LinkClient, LinkSession # One multiplexed, auto-reconnecting server session
+from metrics import REGISTRY, serve_metrics, watch_loop_lag # Counters and latency histograms, scraped on METRICS_PORT
 
 # === Static Configuration ===
 SERVER_IP = "Your Server IP"  # Replace with your server's IP address
 SERVER_PORT = 9000 # Port for WebSocket communication on the server
+ROBOT_ID = "default" # Unique per vehicle when several share one server; browsers select it with ?robot=
 CAMERA_IP = "Your Camera IP"  # Replace with your camera's IP address
 ONVIF_USER = "Your ONVIF Username"  # Replace with your ONVIF username
 ONVIF_PASS = "Your ONVIF Password"  # Replace with your ONVIF password
 ONVIF_PORT = 2020 # Default ONVIF port, change if needed
 WSDL_DIR = '/home/pi/webcam_env/lib/python3.11/site-packages/wsdl' # Path to ONVIF WSDL files, adjust if necessary
+ONVIF_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "onvif_cache.json") # Discovered PTZ endpoint and profile
 
 # === GPIO Setup ===
+GPIO = load_gpio()
 GPIO.setmode(GPIO.BOARD)
 GPIO.setwarnings(False)
 
@@ -38,40 +51,79 @@ for p in pwms.values():
     p.start(0)
 
 
-# === Distance Sensor ===
-TRIG = 31 # Trigger pin for ultrasonic sensor
-ECHO = 32 # Echo pin for ultrasonic sensor
-GPIO.setup(TRIG, GPIO.OUT)
-GPIO.setup(ECHO, GPIO.IN)
-latest_distance = -1 # Initialize latest_distance to -1 to indicate no reading ye
+# === Distance Sensors ===
+TRIG = 31 # Trigger pin for the front ultrasonic sensor
+ECHO = 32 # Echo pin for the front ultrasonic sensor
+ULTRASONIC_SENSORS = [ # (name, trig, echo); fired in turn, never two at once, so echoes don't cross
+    ("front", TRIG, ECHO),
+    # ("rear", 29, 22), # Uncomment for each sensor fitted
+    # ("left", 18, 11),
+    # ("right", 40, 12),
+]
+BRAKE_SENSORS = {"forward": "front", "backward": "rear"} # Drive action -> sensor that can brake it
+SENSOR_CHANNELS = {"front": "distance", "rear": "distance_rear", "left": "distance_left", "right": "distance_right"}
+SENSOR_RATE_HZ = 20 # Max pings per second per sensor; the sensor facing the direction of travel gets the most
+ranger = UltrasonicArray(GPIO, ULTRASONIC_SENSORS, max_rate_hz=SENSOR_RATE_HZ)
 AUTO_BRAKE = True # Enable automatic braking if an obstacle is detected
+VISION_FUSION = True # Also brake on the camera publisher's obstacle distance (VISION_OBSTACLES in send_picamera)
+VISION_MAX_AGE_S = 0.3 # Camera distances older than this are ignored; the ultrasonic sensor brakes alone
+COMMAND_DEADLINE = 0.5 # Seconds; commands that took longer from server to Pi are dropped
+WATCHDOG_WINDOW = 0.6 # Seconds without a heartbeat or command before the motors ramp to zero
+WATCHDOG_RAMP = 0.3 # Seconds to ramp the motors from their current speed to zero
+
+# === Telemetry ===
+TELEMETRY_INTERVAL = 0.25 # Seconds between telemetry frames; each frame carries every sample since the last
+LOCAL_TELEMETRY_PORT = 9010 # UDP on localhost: samples from other processes on the robot (camera motion, obstacles)
+RECORD_TRIGGER_PORT = 9011 # UDP on localhost: the camera publisher's event recorder (event_recorder.py)
+METRICS_PORT = 9102 # Prometheus exporter: GET /metrics, JSON at /stats
+telemetry = TelemetryBatcher()
+
+sensor_channels = [SENSOR_CHANNELS[name] for name in ranger.names]
+
+def queue_distance_telemetry(vector): # Ranging thread listener; only the sensor just pinged is new
+    sample = vector.samples[vector.sensor]
+    if sample.value != -1:
+        telemetry.add(sensor_channels[vector.sensor], sample.value, sample.timestamp_ns)
+ranger.add_listener(queue_distance_telemetry)
+
+# === GPS ===
+# Read without blocking on the event loop; only fixes that change the shape
+# of the track are sent, as gps_lat/gps_lon pairs with the same timestamp.
+# For a bench test, run sim/gps_simulator.py and set GPS_DEVICE to the path it prints
+GPS_DEVICE = "/dev/serial0" # UART the receiver is wired to; None if no receiver is fitted
+GPS_BAUD = 9600
+GPS_TOLERANCE_M = 3.0 # A point is sent once the track strays this far from a straight line
+track = TrackSimplifier(GPS_TOLERANCE_M)
+
+def queue_gps_telemetry(fix):
+    for point in track.add(fix):
+        telemetry.add("gps_lat", point.lat, point.timestamp_ns)
+        telemetry.add("gps_lon", point.lon, point.timestamp_ns)
+gps = GPSReader(GPS_DEVICE, queue_gps_telemetry, GPS_BAUD)
 
 # === ONVIF Setup ===
-try:
-    print(f"Connecting to ONVIF Camera at {CAMERA_IP}:{ONVIF_PORT}...")
-    cam = ONVIFCamera(CAMERA_IP, ONVIF_PORT, ONVIF_USER, ONVIF_PASS, wsdl_dir=WSDL_DIR)
-    media_service = cam.create_media_service()
-    ptz_service = cam.create_ptz_service()
-    profile = media_service.GetProfiles()[0]
-    ptz_token = profile.token
-    print(f"Connected to camera. Profile: {profile.Name}")
-except Exception as e:
-    print(f"ONVIF setup failed: {type(e).__name__}: {e}")
-    ptz_service = None
-    ptz_token = None
+# The camera connects on its own thread once the link is up, so a restart can
+# take stop commands before any SOAP round trip; until then camera actions are
+# dropped. SOAP calls run on the executor's worker thread; the event loop only
+# posts intents
+ptz = None
+
+def on_camera_ready(ptz_service, ptz_token): # Connector thread; again if rediscovery finds a change
+    global ptz
+    if ptz is None:
+        ptz = PTZExecutor(ptz_service, ptz_token)
+    else:
+        ptz.ptz_service, ptz.ptz_token = ptz_service, ptz_token
+
+camera = ONVIFConnector(CAMERA_IP, ONVIF_PORT, ONVIF_USER, ONVIF_PASS, WSDL_DIR, ONVIF_CACHE, on_camera_ready)
 
 # === Motor Control ===
 def stop_all():
     for p in pwms.values():
         p.ChangeDutyCycle(0)
 
-def handle_drive_action(action, speed):
-    global latest_distance # Use global variable to access latest_distanc
-    stop_all() # Stop all motors before executing new actio
-    if action == "forward" and AUTO_BRAKE and latest_distance != -1 and latest_distance < 25:
-        print("Emergency brake: Obstacle too close")
-        return
-    if action == "forward": 
+def apply_drive(action, speed): # Set the PWM for one drive action (motors already stopped)
+    if action == "forward":
         pwms['r_r'].ChangeDutyCycle(speed)
     elif action == "backward":
         pwms['l_r'].ChangeDutyCycle(speed)
@@ -79,113 +131,207 @@ def handle_drive_action(action, speed):
         pwms['r_f'].ChangeDutyCycle(speed)
     elif action == "right":
         pwms['l_f'].ChangeDutyCycle(speed)
-    elif action == "stop":
-        stop_all()
+
+# === Emergency Brake ===
+# Evaluated on the ranging thread for every sample, so forward drive is cut
+# within one sample period even if no new command arrives. With VISION_FUSION
+# the front sensor's samples go through ObstacleFusion first, and a nearer
+# obstacle seen by the camera brakes without waiting for the next ping
+brake = BrakeController(apply_drive, stop_all, sample_period_s=1 / SENSOR_RATE_HZ,
+                        guards={action: ranger.index(name) for action, name in BRAKE_SENSORS.items()
+                                if name in ranger.names})
+brake.enabled = AUTO_BRAKE
+fusion = ObstacleFusion(brake.on_vector, ranger.index("front"), max_age_s=VISION_MAX_AGE_S)
+ranger.add_listener(fusion.on_vector if VISION_FUSION else brake.on_vector)
+
+# === Event Recording ===
+record_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+record_socket.setblocking(False)
+
+def request_recording(reason): # Never blocks: called on the ranging thread for brakes
+    try:
+        record_socket.sendto(json.dumps({"type": "record", "reason": reason}).encode(), ("127.0.0.1", RECORD_TRIGGER_PORT))
+    except OSError:
+        pass # No camera publisher running on this Pi
+brake.add_listener(lambda sample: request_recording("brake"))
+
+# === Dead-man Watchdog ===
+# Runs on its own thread so it still fires if the asyncio loop or the link stalls
+watchdog = MotorWatchdog(brake, window_s=WATCHDOG_WINDOW, ramp_s=WATCHDOG_RAMP)
+
+def handle_drive_action(action, speed):
+    applied = brake.command(action, speed) # Stops all motors, then drives within the brake limits
+    ranger.set_motion(action)
+    if action in brake.guards and applied < speed:
+        print(f"Emergency brake: {action} limited to {applied}% "
+              f"(distance {ranger.latest_distance(BRAKE_SENSORS[action])} cm)")
 
 # === Camera PT Movement ===
 def handle_camera_movement(direction):
-    if not ptz_service or not ptz_token:
-        print("ONVIF not configured")
+    if not ptz:
+        print(f"Camera not ready ({camera.state}), dropped {direction}")
+        return
+    velocity = {'PanTilt': {'x': 0.0, 'y': 0.0}, 'Zoom': 0.0} # Initialize velocity for PanTilt and Zoo
+    if direction == "cam_left":
+        velocity['PanTilt']['x'] = -0.5
+    elif direction == "cam_right":
+        velocity['PanTilt']['x'] = 0.5
+    elif direction == "cam_up":
+        velocity['PanTilt']['y'] = 0.5
+    elif direction == "cam_down":
+        velocity['PanTilt']['y'] = -0.5
+    else:
+        print(f"Unknown camera direction: {direction}")
         return
+    ptz.submit(direction, velocity) # Non-blocking; the worker merges repeats and schedules Stop
+
+
+# === Server Link ===
+# Control, PTZ and telemetry share one session that reconnects on its own and
+# buffers outbound frames while the server is unreachable
+LINK_BUFFER = 256 # Unacked messages kept for resend; about a minute of telemetry frames
+link = LinkSession(max_buffer=LINK_BUFFER)
+
+async def send_telemetry():
+    while True:
+        samples = telemetry.drain()
+        if samples:
+            now_ns = time.monotonic_ns()
+            for sample in samples:
+                if sample.channel == CHANNELS["distance"]:
+                    sample_age.observe((now_ns - sample.timestamp_ns) / 1e9)
+            link.send("telemetry", telemetry.next_frame(samples))
+        await asyncio.sleep(TELEMETRY_INTERVAL)
+
+# === Metrics ===
+loop_lag = REGISTRY.histogram("robot_pi_loop_lag_seconds", "How late a 100 ms timer on the event loop fires")
+command_age = REGISTRY.histogram("robot_pi_command_age_seconds", "Browser timestamp -> Pi receive, per executed command")
+sample_age = REGISTRY.histogram("robot_pi_sensor_sample_age_seconds", "Distance sample taken -> sent to the server")
+REGISTRY.counter("robot_pi_commands_accepted_total", "Commands executed", fn=lambda: command_gate.accepted)
+REGISTRY.counter("robot_pi_commands_rejected_total", "Commands dropped by the gate", ("reason",),
+                 lambda: {("stale",): command_gate.rejected_stale, ("late",): command_gate.rejected_late})
+REGISTRY.counter("robot_pi_ranging_samples_total", "Ultrasonic pings completed", fn=lambda: ranger.samples)
+REGISTRY.counter("robot_pi_ranging_timeouts_total", "Pings without a valid echo", fn=lambda: ranger.timeouts)
+REGISTRY.counter("robot_pi_ranging_sensor_samples_total", "Ultrasonic pings completed per sensor", ("sensor",),
+                 lambda: {(name,): pings for name, pings in zip(ranger.names, ranger.pings)})
+REGISTRY.counter("robot_pi_ranging_stray_edges_total", "Echo edges on a sensor that was not pinged",
+                 fn=lambda: ranger.stray_edges)
+REGISTRY.counter("robot_pi_brake_events_total", "Emergency brake cuts", fn=lambda: brake.brake_events)
+REGISTRY.counter("robot_pi_vision_samples_total", "Obstacle distances from the camera publisher",
+                 fn=lambda: fusion.vision_samples)
+REGISTRY.counter("robot_pi_vision_nearer_total", "Front readings for the brake taken from the camera",
+                 fn=lambda: fusion.vision_nearer)
+REGISTRY.counter("robot_pi_gps_sentences_total", "NMEA sentences read", fn=lambda: gps.parser.sentences)
+REGISTRY.counter("robot_pi_gps_checksum_errors_total", "NMEA sentences with a bad checksum",
+                 fn=lambda: gps.parser.checksum_errors)
+REGISTRY.counter("robot_pi_gps_fixes_total", "Valid position fixes", fn=lambda: gps.parser.fixes)
+REGISTRY.counter("robot_pi_gps_points_sent_total", "Track points sent after simplification", fn=lambda: track.sent)
+REGISTRY.gauge("robot_pi_gps_device_open", "1 while the GPS device is open", fn=lambda: int(gps.open))
+REGISTRY.counter("robot_pi_watchdog_trips_total", "Motor ramp-downs for lack of intent", fn=lambda: watchdog.trips)
+REGISTRY.counter("robot_pi_watchdog_missed_heartbeats_total", "Server heartbeats that never arrived",
+                 fn=lambda: watchdog.missed)
+REGISTRY.counter("robot_pi_telemetry_dropped_total", "Samples dropped with the batch full", fn=lambda: telemetry.dropped)
+REGISTRY.counter("robot_pi_link_reconnects_total", "Server link reconnects", fn=lambda: link_client.reconnects)
+REGISTRY.counter("robot_pi_link_dropped_total", "Messages dropped from a full link buffer", fn=lambda: link.dropped)
+REGISTRY.gauge("robot_pi_link_connected", "1 while the server link is up", fn=lambda: int(link.connected))
+REGISTRY.gauge("robot_pi_link_buffered", "Messages to the server awaiting an ack", fn=lambda: len(link.unacked))
+REGISTRY.gauge("robot_pi_camera_ready", "1 once PTZ commands reach the camera", fn=lambda: int(ptz is not None))
+REGISTRY.counter("robot_pi_camera_setup_failures_total", "Failed ONVIF discoveries", fn=lambda: camera.failures)
+
+# === Commands ===
+command_gate = CommandGate(deadline_s=COMMAND_DEADLINE, age_metric=command_age)
+
+async def execute_command(data):
+    action = data.get("action")
+    value = data.get("value", 100)
+    accepted, reason = command_gate.accept(data)
+    if not accepted:
+        print(f"Dropped {action} command: {reason}")
+        return
+    watchdog.feed()
+    if command_gate.last_age_ms is not None:
+        telemetry.add("command_age", command_gate.last_age_ms)
+    if action in DRIVE_ACTIONS:
+        handle_drive_action(action, value)
+    elif action in CAMERA_ACTIONS:
+        handle_camera_movement(action)
+    elif action in RECORD_ACTIONS:
+        request_recording("manual")
+    else:
+        print(f"Unknown action: {action}")
+
+# The link handler only files commands; the handler runs on the latest one per kind
+commands = CommandMailbox(execute_command, stamp=False)
+
+async def send_heartbeat_ack(data):
     try:
-        velocity = {'PanTilt': {'x': 0.0, 'y': 0.0}, 'Zoom': 0.0} # Initialize velocity for PanTilt and Zoo
-        if direction == "cam_left":
-            velocity['PanTilt']['x'] = -0.5
-        elif direction == "cam_right":
-            velocity['PanTilt']['x'] = 0.5
-        elif direction == "cam_up":
-            velocity['PanTilt']['y'] = 0.5
-        elif direction == "cam_down":
-            velocity['PanTilt']['y'] = -0.5
-        else:
-            print(f"Unknown camera direction: {direction}")
-            return
-
-        ptz_service.ContinuousMove({
-            'ProfileToken': ptz_token,
-            'Velocity': velocity,
-            'Timeout': 'PT1S'
+        await link.send_volatile("control", {
+            "type": "heartbeat_ack", "hb": data.get("hb"), "hb_ts": data.get("hb_ts"),
+            **watchdog.stats(), "link": link_client.stats(),
         })
-        time.sleep(0.5)
-        ptz_service.Stop({'ProfileToken': ptz_token})
-    except Exception as e:
-        print(f"Camera movement failed: {type(e).__name__}: {e}")
-
-
-# === Distance Sensor Reading ===
-def read_distance():
-    GPIO.output(TRIG, True)
-    time.sleep(0.00001)
-    GPIO.output(TRIG, False)
-    start = time.time()
-    timeout = start + 0.05
-    while GPIO.input(ECHO) == 0 and time.time() < timeout: 
-        start = time.time()  
-    stop = time.time() 
-    timeout = stop + 0.05
-    while GPIO.input(ECHO) == 1 and time.time() < timeout:
-        stop = time.time()
-    duration = stop - start
-    distance = round(duration * 17150, 2) # Convert time to distance in c
-    return distance if 2 <= distance <= 300 else -1
-
-def sensor_loop(): # Continuously read distance sensor in a separate thread
-    global latest_distance
-    while True:
-        dist = read_distance() # Read distance from the sensor
-        latest_distance = dist # Update the latest distance readin
-        time.sleep(0.5) # Sleep for 0.5 seconds before next reading
-
-# === WebSocket: Send distance to /control ===
-async def websocket_handler():
-    uri = f"ws://{SERVER_IP}:9000/control" # WebSocket URI for distance messages
-    async with websockets.connect(uri) as websocket:
-        print("WebSocket connected to /control")
-        threading.Thread(target=sensor_loop, daemon=True).start()
-
-        async def send_distance():
-            while True:
-                if latest_distance != -1:
-                    await websocket.send(json.dumps({"type": "distance", "value": latest_distance}))
-                await asyncio.sleep(0.5)
-        asyncio.create_task(send_distance())
-
-        # Listen for messages from server (if any)
-        async for message in websocket:
-            print(f"Unexpected /control message: {message}")
-
-# === WebSocket: Receive commands from /pi_control ===
-async def pi_control_handler(): 
-    uri = f"ws://{SERVER_IP}:9000/pi_control" # WebSocket URI for camera/robot control
-    async with websockets.connect(uri) as websocket:
-        print("WebSocket connected to /pi_control")
-        async for message in websocket:
-            try:
-                data = json.loads(message)
-                action = data.get("action")
-                value = data.get("value", 100)
-                print(f"Received from browser: {data}")
-                if action in ["forward", "backward", "left", "right", "stop"]:
-                    handle_drive_action(action, value)
-                elif action in ["cam_left", "cam_right", "cam_up", "cam_down"]:
-                    handle_camera_movement(action)
-                else:
-                    print(f"Unknown action: {action}")
-            except Exception as e:
-                print(f"Error handling message: {e}")
+    except ConnectionError:
+        pass # Link dropped; the server stops expecting acks with it
+
+def handle_heartbeat(data):
+    watchdog.heartbeat(data.get("interval"))
+    command_gate.observe_clock(data.get("server_ts")) # Clock offset for the command deadline
+    intent = data.get("intent")
+    if intent and intent.get("seq", 0) > command_gate.last_seq:
+        # The server forwarded a drive command we never executed: replay it as fresh
+        commands.put({**intent, "server_ts": data.get("server_ts")})
+    asyncio.ensure_future(send_heartbeat_ack(data))
+
+def handle_control_message(data):
+    if data.get("type") == "heartbeat":
+        handle_heartbeat(data)
+    else:
+        commands.put(data)
+
+def on_link_connect(resumed):
+    if not resumed:
+        command_gate.reset() # The server numbers commands per process
+    camera.start() # First connect only; the motor path is live by now
+
+link.on("control", handle_control_message)
+link.on("ptz", handle_control_message)
+link_client = LinkClient(f"ws://{SERVER_IP}:{SERVER_PORT}{LINK_PATH}?robot={ROBOT_ID}", link, on_connect=on_link_connect)
 
 # === Main Async Runner ===
 async def main():
-    await asyncio.gather(
-        websocket_handler(), # Start WebSocket handler for distance sensor
-        pi_control_handler() # Start WebSocket handler for camera/robot control
-    )
+    watchdog.start()
+    ranger.start() # Start pinging on the ranging thread; the brake works with or without the link
+    try: # A busy port costs the feature, never the motor path: the threads are already running
+        await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: LocalTelemetryProtocol(telemetry, fusion.on_vision if VISION_FUSION else None),
+            local_addr=("127.0.0.1", LOCAL_TELEMETRY_PORT))
+    except OSError as e:
+        print(f"Local telemetry off: cannot bind UDP port {LOCAL_TELEMETRY_PORT} ({type(e).__name__}: {e})")
+    try:
+        await serve_metrics(METRICS_PORT)
+    except OSError as e:
+        print(f"Metrics off: cannot listen on port {METRICS_PORT} ({type(e).__name__}: {e})")
+    if GPS_DEVICE:
+        gps.start()
+    try:
+        await asyncio.gather(
+            send_telemetry(), # Batch sensor samples into the link every TELEMETRY_INTERVAL
+            link_client.run(), # Keep the server session up, reconnecting with backoff
+            watch_loop_lag(loop_lag) # A busy loop delays commands and heartbeats
+        )
+    finally:
+        commands.close()
+        gps.stop()
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     finally:
         print("Cleanup")
+        watchdog.stop()
+        ranger.stop()
+        camera.stop()
+        if ptz:
+            ptz.close()
         stop_all()
         for p in pwms.values():
             p.stop()
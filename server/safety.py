@@ -0,0 +1,165 @@
+# safety.py
+# Reactive emergency brake driven by every new distance sample on the ranging
+# thread, independent of when (or whether) the browser sends another command.
+import collections
+import threading
+import time
+
+class Guard:
+    """Brake state for one drive action, from the sensor facing that way."""
+    __slots__ = ("braked", "missing", "last_sample")
+
+    def __init__(self):
+        self.braked = False
+        self.missing = 0
+        self.last_sample = None
+
+
+class BrakeController:
+    """
+    Cuts forward drive as soon as a sample shows the obstacle inside the
+    stopping distance for the current speed, and only releases once the
+    obstacle is `hysteresis_cm` further away again.
+
+    A run of `unknown_after` missing echoes (-1), or no sample at all for
+    `stale_after_s`, means the distance is unknown: forward speed is capped at
+    `unknown_speed` until valid readings come back.
+
+    `apply_drive(action, speed)` sets the PWM outputs and `stop_motors()` cuts
+    them; both are called with the controller lock held so a brake and a new
+    command can never interleave. Listeners are called as listener(sample)
+    after each brake, on the ranging thread.
+
+    `guards` maps each drive action the brake protects to the index of the
+    sensor watching that way in an UltrasonicArray's RangeVector (see
+    on_vector()); each guard keeps its own brake and unknown-distance state.
+    A single UltrasonicRanger feeds on_sample(), which guards "forward".
+    """
+
+    def __init__(self, apply_drive, stop_motors, sample_period_s=0.05,
+                 stop_cm=25, hysteresis_cm=10, max_speed_cm_s=100, decel_cm_s2=200,
+                 unknown_after=3, unknown_speed=30, stale_after_s=0.5, guards=None):
+        self.apply_drive = apply_drive
+        self.stop_motors = stop_motors
+        self.sample_period_s = sample_period_s
+        self.stop_cm = stop_cm # Minimum gap kept even at crawling speed
+        self.hysteresis_cm = hysteresis_cm
+        self.max_speed_cm_s = max_speed_cm_s # Ground speed at 100% duty cycle
+        self.decel_cm_s2 = decel_cm_s2 # Deceleration once the PWM is cut
+        self.unknown_after = unknown_after
+        self.unknown_speed = unknown_speed
+        self.stale_after_s = stale_after_s
+        self.enabled = True
+        self.guards = guards if guards is not None else {"forward": 0} # Drive action -> sensor index
+        self._guards = {action: Guard() for action in self.guards}
+
+        self.action = "stop"
+        self.speed = 0 # Speed requested by the operator
+        self.applied_speed = 0 # Speed actually on the PWM after braking/throttling
+        self.commands = 0 # command() calls; a watchdog override() yields to any newer one
+        self.brake_events = 0
+        self.throttle_events = 0
+        self.last_cut_latency_ns = None # Sample timestamp -> PWM cut, for the last brake
+        self.max_cut_latency_ns = 0
+        self.cut_latencies_ns = collections.deque(maxlen=1000)
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    # === Limits ===
+    def stopping_distance(self, speed):
+        """Distance (cm) needed to stop from `speed`% duty: reaction over one sample period plus braking."""
+        v = self.max_speed_cm_s * speed / 100
+        return self.stop_cm + v * self.sample_period_s + v * v / (2 * self.decel_cm_s2)
+
+    def distance_unknown(self, now_ns=None, action="forward"):
+        guard = self._guards[action]
+        if guard.missing >= self.unknown_after:
+            return True
+        if guard.last_sample is None:
+            return False # Nothing received yet: leave the operator in control, as before
+        now_ns = now_ns or time.monotonic_ns()
+        return now_ns - guard.last_sample.timestamp_ns > self.stale_after_s * 1e9
+
+    def _limit(self, action, speed, now_ns=None):
+        if not self.enabled or action not in self._guards:
+            return speed
+        if self._guards[action].braked:
+            return 0
+        if self.distance_unknown(now_ns, action):
+            return min(speed, self.unknown_speed)
+        return speed
+
+    # === Command Path ===
+    def command(self, action, speed):
+        """Record the operator's intent and drive the motors within the current limits."""
+        with self._lock:
+            self.commands += 1
+            return self._drive(action, speed)
+
+    def override(self, action, speed, commands):
+        """
+        Watchdog path: command() unless the operator has commanded since
+        `commands` was read, checked under the same lock. Returns the applied
+        speed, or None if a newer command won.
+        """
+        with self._lock:
+            if self.commands != commands:
+                return None
+            return self._drive(action, speed)
+
+    def _drive(self, action, speed):
+        changed = action != self.action
+        self.action, self.speed = action, speed
+        self.applied_speed = self._limit(action, speed)
+        if changed or not self.applied_speed:
+            self.stop_motors() # Same action at a new speed only needs its duty cycle changed
+        if self.applied_speed and action != "stop":
+            self.apply_drive(action, self.applied_speed)
+        return self.applied_speed
+
+    # === Sensor Path ===
+    def on_vector(self, vector):
+        """UltrasonicArray listener: re-evaluate the guard the updated sensor is watching for."""
+        for action, index in self.guards.items():
+            if index == vector.sensor:
+                self.on_sample(vector.samples[index], action)
+
+    def on_sample(self, sample, action="forward"):
+        """Ranging thread listener: re-evaluate the brake for every new sample."""
+        with self._lock:
+            guard = self._guards[action]
+            guard.last_sample = sample
+            guard.missing = guard.missing + 1 if sample.value == -1 else 0
+            if not self.enabled:
+                return
+
+            if sample.value != -1:
+                threshold = self.stopping_distance(self.speed if self.action == action else 0)
+                if not guard.braked and sample.value < threshold:
+                    guard.braked = True
+                elif guard.braked and sample.value > threshold + self.hysteresis_cm:
+                    guard.braked = False
+
+            if self.action != action:
+                return
+            limited = self._limit(self.action, self.speed, sample.timestamp_ns)
+            if limited == self.applied_speed:
+                return
+            if limited == 0:
+                self.stop_motors()
+                latency = time.monotonic_ns() - sample.timestamp_ns
+                self.last_cut_latency_ns = latency
+                self.max_cut_latency_ns = max(self.max_cut_latency_ns, latency)
+                self.cut_latencies_ns.append(latency)
+                self.brake_events += 1
+                print(f"Emergency brake: obstacle at {sample.value} cm ({action})")
+                for listener in self.listeners:
+                    listener(sample)
+            else:
+                if limited < self.applied_speed:
+                    self.throttle_events += 1
+                self.apply_drive(self.action, limited)
+            self.applied_speed = limited
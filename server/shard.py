@@ -0,0 +1,295 @@
+# shard.py
+# Scale-out mode for websoket_server: N worker processes accept on one port
+# (SO_REUSEPORT), keep each robot's current state in a shared-memory table and
+# forward commands and telemetry between workers over Unix datagram sockets,
+# so a browser on any worker can drive and watch a Pi connected to another.
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import struct
+import tempfile
+import time
+import zlib
+from multiprocessing import shared_memory
+
+from command_pipeline import CAMERA_ACTIONS, DRIVE_ACTIONS, RECORD_ACTIONS
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = (None,) + DRIVE_ACTIONS + CAMERA_ACTIONS + RECORD_ACTIONS # Stored as an index; 0 = no command yet
+NO_OWNER = -1
+
+# === Shared Robot Table ===
+# One fixed-size slot per robot, open addressing on crc32(robot_id). The worker
+# that owns the Pi connection writes a slot's state fields behind a per-slot
+# seqlock so readers in other workers never see a torn update. Slot allocation,
+# ownership changes and viewer bits go through one lock.
+SLOT_FIELDS = (
+    ("seqlock", "I"), # Odd while a write is in progress
+    ("robot_id", "64s"), # fleet.ROBOT_ID_PATTERN allows up to 64 ASCII characters
+    ("owner", "h"), # Worker index holding the Pi connection, NO_OWNER if none
+    ("connected", "B"),
+    ("action", "B"), # Index into ACTIONS
+    ("command_seq", "I"),
+    ("command_value", "f"),
+    ("distance", "f"),
+    ("distance_ns", "Q"), # time.time_ns() of the latest distance sample
+    ("command_ns", "Q"),
+    ("viewers", "Q"), # Bit per worker with browser viewers for this robot
+)
+SLOT = struct.Struct("<" + "".join(fmt for _, fmt in SLOT_FIELDS))
+OFFSETS = {}
+_offset = 0
+for _name, _fmt in SLOT_FIELDS:
+    OFFSETS[_name] = (_offset, struct.Struct("<" + _fmt))
+    _offset += struct.calcsize("<" + _fmt)
+MAX_WORKERS = 64 # Width of the viewers bitmask
+
+class SharedRobotTable:
+    """
+    Created by the parent before forking; workers inherit the mapping.
+    Readers retry while the seqlock is odd or changed under them.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=capacity * SLOT.size)
+        self.buf = self.shm.buf
+        self.lock = multiprocessing.Lock()
+        self._index = {} # robot_id -> slot, per process (slots are never reused)
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+    def slot(self, robot_id, create=True):
+        index = self._index.get(robot_id)
+        if index is not None:
+            return index
+        key = robot_id.encode()
+        start = zlib.crc32(key) % self.capacity
+        for probe in range(self.capacity):
+            index = (start + probe) % self.capacity
+            stored = self._get(index, "robot_id").rstrip(b"\0")
+            if stored == key:
+                break
+            if not stored:
+                if not create:
+                    return None
+                with self.lock:
+                    stored = self._get(index, "robot_id").rstrip(b"\0")
+                    if stored and stored != key:
+                        continue # Another worker took this slot first
+                    if not stored:
+                        self._put(index, "owner", NO_OWNER)
+                        self._put(index, "robot_id", key)
+                break
+        else:
+            raise ValueError(f"Shared robot table full ({self.capacity} robots)")
+        self._index[robot_id] = index
+        return index
+
+    # === Owner Writes ===
+    def update(self, robot_id, **fields):
+        self._update(self.slot(robot_id), fields)
+
+    def claim(self, robot_id, worker):
+        index = self.slot(robot_id) # Outside the lock: allocating a slot takes it too
+        with self.lock:
+            self._update(index, {"owner": worker, "connected": 1})
+
+    def release(self, robot_id, worker):
+        index = self.slot(robot_id)
+        with self.lock:
+            if self._get(index, "owner") == worker: # A newer connection elsewhere keeps it
+                self._update(index, {"owner": NO_OWNER, "connected": 0})
+
+    def record_distance(self, robot_id, value):
+        self.update(robot_id, distance=value, distance_ns=time.time_ns())
+
+    def record_command(self, robot_id, action, value, seq):
+        code = ACTIONS.index(action) if action in ACTIONS else 0
+        self.update(robot_id, action=code, command_value=float(value or 0), command_seq=seq or 0,
+                    command_ns=time.time_ns())
+
+    # === Viewer Bits ===
+    def set_viewing(self, robot_id, worker, viewing):
+        index = self.slot(robot_id)
+        with self.lock:
+            mask = self._get(index, "viewers")
+            self._put(index, "viewers", mask | (1 << worker) if viewing else mask & ~(1 << worker))
+
+    def viewers(self, robot_id):
+        """Bitmask of workers with viewers; a single field, read without the seqlock."""
+        return self._get(self.slot(robot_id), "viewers")
+
+    # === Reads (any worker) ===
+    def read(self, robot_id):
+        index = self.slot(robot_id, create=False)
+        return None if index is None else self._read(index)
+
+    def owner(self, robot_id):
+        state = self.read(robot_id)
+        return state["owner"] if state and state["connected"] else None
+
+    def snapshot(self):
+        return [self._read(index) for index in range(self.capacity) if self._get(index, "robot_id")[:1] != b"\0"]
+
+    def _read(self, index, retries=1000):
+        for _ in range(retries): # Bounded: a writer killed mid-update must not hang readers
+            seq = self._get(index, "seqlock")
+            values = SLOT.unpack_from(self.buf, index * SLOT.size)
+            if not seq & 1 and self._get(index, "seqlock") == seq:
+                break
+        state = dict(zip((name for name, _ in SLOT_FIELDS), values))
+        del state["seqlock"]
+        state["robot_id"] = state["robot_id"].rstrip(b"\0").decode()
+        state["action"] = ACTIONS[state["action"]] if state["action"] < len(ACTIONS) else None
+        return state
+
+    def _update(self, index, fields):
+        # seq | 1 rather than seq + 1: if an old owner is still writing during a
+        # handover the counter still ends even, so readers can't spin forever
+        odd = self._get(index, "seqlock") | 1
+        self._put(index, "seqlock", odd)
+        for name, value in fields.items():
+            self._put(index, name, value)
+        self._put(index, "seqlock", (odd + 1) & 0xFFFFFFFF)
+
+    def _get(self, index, name):
+        offset, field = OFFSETS[name]
+        return field.unpack_from(self.buf, index * SLOT.size + offset)[0]
+
+    def _put(self, index, name, value):
+        offset, field = OFFSETS[name]
+        field.pack_into(self.buf, index * SLOT.size + offset, value)
+
+
+# === Worker Bus ===
+# Datagram: kind (1 byte) | robot ID length (1 byte) | robot ID | payload
+# C = command JSON for the worker owning the Pi, T = telemetry frame for viewers
+class _BusProtocol(asyncio.DatagramProtocol):
+    def __init__(self, bus):
+        self.bus = bus
+
+    def datagram_received(self, data, addr):
+        self.bus._received(data)
+
+    def error_received(self, exc):
+        self.bus.errors += 1
+
+
+class ShardBus:
+    """Unix datagram pub/sub between workers; a full or missing peer drops the message."""
+
+    def __init__(self, directory, workers):
+        self.paths = [os.path.join(directory, f"worker-{index}.sock") for index in range(workers)]
+        self.worker = None
+        self.on_command = None # callable(robot_id, data)
+        self.on_telemetry = None # callable(robot_id, frame)
+        self.sent = 0
+        self.received = 0
+        self.errors = 0
+        self._transport = None
+
+    async def start(self, worker, on_command, on_telemetry):
+        self.worker = worker
+        self.on_command = on_command
+        self.on_telemetry = on_telemetry
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _BusProtocol(self), local_addr=self.paths[worker], family=socket.AF_UNIX)
+
+    def send_command(self, worker, robot_id, data):
+        self._send(worker, b"C", robot_id, json.dumps(data).encode())
+
+    def send_telemetry(self, viewers, robot_id, frame):
+        """Send a frame to every worker whose bit is set in `viewers`, except this one."""
+        viewers &= ~(1 << self.worker)
+        worker = 0
+        while viewers:
+            if viewers & 1:
+                self._send(worker, b"T", robot_id, frame)
+            viewers >>= 1
+            worker += 1
+
+    def stats(self):
+        return {"worker": self.worker, "sent": self.sent, "received": self.received, "errors": self.errors}
+
+    def _send(self, worker, kind, robot_id, payload):
+        if worker >= len(self.paths) or self._transport is None:
+            return
+        key = robot_id.encode()
+        try:
+            self._transport.sendto(kind + bytes((len(key),)) + key + payload, self.paths[worker])
+            self.sent += 1
+        except OSError:
+            self.errors += 1
+
+    def _received(self, data):
+        self.received += 1
+        kind, length = data[:1], data[1]
+        robot_id = data[2:2 + length].decode()
+        payload = data[2 + length:]
+        try:
+            if kind == b"C":
+                self.on_command(robot_id, json.loads(payload))
+            elif kind == b"T":
+                self.on_telemetry(robot_id, payload)
+        except Exception as e:
+            logger.error(f"Error handling shard message for {robot_id}: {type(e).__name__}: {e}")
+
+
+class Shard:
+    """What one worker knows about the others: its index, the table and the bus."""
+
+    def __init__(self, worker, table, bus):
+        self.worker = worker
+        self.table = table
+        self.bus = bus
+
+    def stats(self):
+        return {"worker": self.worker, "bus": self.bus.stats(), "robots": self.table.snapshot()}
+
+# === Process Management ===
+def run_workers(workers, serve_worker, capacity=1024):
+    """
+    Fork `workers` processes running serve_worker(shard) and wait for them.
+    Each worker binds the same port with SO_REUSEPORT; the kernel spreads
+    incoming connections across them.
+    """
+    if not 1 <= workers <= MAX_WORKERS:
+        raise ValueError(f"Workers must be between 1 and {MAX_WORKERS}")
+    table = SharedRobotTable(capacity)
+    directory = tempfile.mkdtemp(prefix="robot-shard-")
+    context = multiprocessing.get_context("fork") # Workers inherit the shared mapping and lock
+    processes = [
+        context.Process(target=serve_worker, args=(Shard(index, table, ShardBus(directory, workers)),),
+                        name=f"worker-{index}")
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop(None, None)
+        for process in processes:
+            process.join()
+    finally:
+        table.close(unlink=True)
+        shutil.rmtree(directory, ignore_errors=True)
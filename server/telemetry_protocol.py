@@ -0,0 +1,165 @@
+# telemetry_protocol.py
+# Compact, versioned binary wire format for robot telemetry, shared by
+# robot_listener (Pi) and websoket_server. A frame carries many samples behind
+# one fixed header; JSON stays available as a fallback for the existing index.html.
+#
+# Frame layout (little endian):
+#   header: magic "RT" | version u8 | flags u8 | count u16 | seq u32 | base_ns u64
+#   sample: channel u8 | offset_us u32 (from base_ns) | value f32      x count
+import asyncio
+import collections
+import json
+import logging
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 1
+BINARY_SUBPROTOCOL = f"robot-telemetry.v{PROTOCOL_VERSION}" # Negotiated as a WebSocket subprotocol
+MAGIC = b"RT"
+HEADER = struct.Struct("<2sBBHIQ")
+SAMPLE = struct.Struct("<BIf")
+MAX_SAMPLES = 0xFFFF
+LOCAL_TS_MAX_AGE_NS = 10 * 10**9 # A local sample's "ts" older than this (or in the future) is replaced by its arrival time
+
+# Channel IDs are part of the wire format: append, never renumber
+CHANNELS = {
+    "distance": 1,
+    "battery": 2,
+    "motor_current": 3,
+    "gps_lat": 4,
+    "gps_lon": 5,
+    "command_age": 6, # ms from the browser sending a command to the Pi accepting it
+    "motion": 7, # Fraction of the camera frame moving when motion starts, 0 when it ends
+    "distance_rear": 8, # "distance" is the front sensor
+    "distance_left": 9,
+    "distance_right": 10,
+    "vision_distance": 11, # Free floor straight ahead seen by the camera, cm (local/vision_obstacles.py)
+}
+CHANNEL_NAMES = {channel: name for name, channel in CHANNELS.items()}
+JSON_DECIMALS = {CHANNELS["gps_lat"]: 6, CHANNELS["gps_lon"]: 6} # Other channels are rounded to 2
+
+# One telemetry reading; timestamp_ns is time.monotonic_ns() on the robot
+TelemetrySample = collections.namedtuple("TelemetrySample", ["channel", "timestamp_ns", "value"])
+
+def encode_frame(seq, samples):
+    """Pack samples into one binary frame; timestamps are stored relative to the oldest."""
+    count = len(samples)
+    if count > MAX_SAMPLES:
+        raise ValueError(f"Too many samples for one frame: {count}")
+    base_ns = min(sample.timestamp_ns for sample in samples) if samples else 0
+    buf = bytearray(HEADER.size + SAMPLE.size * count)
+    HEADER.pack_into(buf, 0, MAGIC, PROTOCOL_VERSION, 0, count, seq & 0xFFFFFFFF, base_ns)
+    offset = HEADER.size
+    for channel, timestamp_ns, value in samples:
+        SAMPLE.pack_into(buf, offset, channel, (timestamp_ns - base_ns) // 1000, value)
+        offset += SAMPLE.size
+    return bytes(buf)
+
+def decode_frame(data):
+    """Return (seq, samples) from a binary frame; raises ValueError on malformed input."""
+    if len(data) < HEADER.size:
+        raise ValueError("Telemetry frame too short")
+    magic, version, _flags, count, seq, base_ns = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a telemetry frame")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported telemetry version: {version}")
+    if len(data) != HEADER.size + SAMPLE.size * count:
+        raise ValueError("Telemetry frame length does not match sample count")
+    samples = [
+        TelemetrySample(channel, base_ns + offset_us * 1000, value)
+        for channel, offset_us, value in SAMPLE.iter_unpack(memoryview(data)[HEADER.size:])
+    ]
+    return seq, samples
+
+def to_json_messages(samples):
+    """Legacy JSON fallback: the latest value of each channel as {"type": name, "value": v}."""
+    latest = {}
+    for sample in samples:
+        latest[sample.channel] = sample.value
+    return [
+        json.dumps({"type": CHANNEL_NAMES.get(channel, str(channel)), "value": round(value, JSON_DECIMALS.get(channel, 2))})
+        for channel, value in latest.items()
+    ]
+
+def from_json_message(data):
+    """
+    Parse a legacy {"type": ..., "value": ...} dict into a TelemetrySample
+    stamped on arrival, or None.
+    """
+    channel = CHANNELS.get(data.get("type"))
+    value = data.get("value")
+    if channel is None or value is None:
+        return None
+    return TelemetrySample(channel, time.monotonic_ns(), float(value))
+
+def local_timestamp(data, arrived_ns):
+    """
+    The "ts" of a message from another process on the same machine (its
+    time.monotonic_ns() at the reading) if it is an int no older than
+    LOCAL_TS_MAX_AGE_NS and not in the future; else arrived_ns.
+    """
+    ts = data.get("ts")
+    if type(ts) is int and 0 <= arrived_ns - ts <= LOCAL_TS_MAX_AGE_NS:
+        return ts
+    return arrived_ns
+
+
+class TelemetryBatcher:
+    """
+    Collects samples from any thread and drains them into one frame per send.
+    The deque is bounded so a stalled link drops the oldest samples, not memory.
+    """
+
+    def __init__(self, max_pending=1024):
+        self.seq = 0
+        self.dropped = 0
+        self._pending = collections.deque(maxlen=max_pending)
+
+    def add(self, channel, value, timestamp_ns=None):
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1
+        self._pending.append(TelemetrySample(CHANNELS[channel], timestamp_ns or time.monotonic_ns(), value))
+
+    def drain(self):
+        samples = []
+        while self._pending:
+            samples.append(self._pending.popleft())
+        return samples
+
+    def next_frame(self, samples):
+        self.seq += 1
+        return encode_frame(self.seq, samples)
+
+
+class LocalTelemetryProtocol(asyncio.DatagramProtocol):
+    """
+    UDP endpoint for other processes on the robot (the camera publisher's
+    motion detector and vision stage) to add samples to `batcher`: one legacy
+    {"type": ..., "value": ...} JSON message per datagram, with an optional
+    "ts" (see local_timestamp). `listener`, if given, is also called with
+    every valid TelemetrySample.
+    """
+
+    def __init__(self, batcher, listener=None):
+        self.batcher = batcher
+        self.listener = listener
+        self.invalid = 0
+
+    def datagram_received(self, data, addr):
+        try:
+            message = json.loads(data)
+            sample = from_json_message(message)
+            if sample is not None:
+                sample = sample._replace(timestamp_ns=local_timestamp(message, sample.timestamp_ns))
+        except (ValueError, AttributeError, TypeError) as e:
+            sample = None
+            logger.debug(f"Invalid local telemetry from {addr}: {type(e).__name__}: {e}")
+        if sample is None:
+            self.invalid += 1
+            return
+        self.batcher.add(CHANNEL_NAMES[sample.channel], sample.value, sample.timestamp_ns)
+        if self.listener is not None:
+            self.listener(sample)
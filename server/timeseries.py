@@ -0,0 +1,455 @@
+# timeseries.py
+# Telemetry history for websoket_server. Per robot and channel, a ring buffer
+# of raw (time, value) samples plus min/max/mean rollups at coarser
+# resolutions, held in typed arrays (array module) that grow up to a fixed
+# capacity and then wrap, so memory per series is bounded. A query returns
+# any window at a point budget from the finest resolution that fits it.
+# Optionally a SegmentWriter also appends every sample to per-robot segment
+# files on a background thread; they are read back at startup (restore())
+# and can be dumped for analysis after an incident.
+#
+# Times are wall-clock ms. Pi timestamps are the Pi's monotonic clock, so
+# each batch is anchored on arrival: its newest sample is taken as "now" and
+# the others keep their spacing.
+#
+# Segment file layout (little endian):
+#   header: magic "RTSG" | version u8
+#   record: time_ms i64 | channel u8 | value f32
+# Usage: python timeseries.py dump <history dir> <robot> [channel]
+import atexit
+import collections
+import math
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from telemetry_protocol import CHANNELS, CHANNEL_NAMES, TelemetrySample
+
+RAW_CAPACITY = 12_000 # Raw samples kept per series: 10 min of 20 Hz distance
+LEVELS = ( # Rollups: (bucket ms, buckets kept)
+    (1_000, 3600), # 1 s for an hour
+    (10_000, 2160), # 10 s for 6 hours
+    (60_000, 1440), # 1 min for a day
+)
+SEGMENT_MAGIC = b"RTSG"
+SEGMENT_VERSION = 1
+SEGMENT_RECORD = struct.Struct("<qBf")
+SEGMENT_SUFFIX = ".tseg"
+
+# === Ring Buffers ===
+class Ring:
+    """Columns of typed arrays in time order; once `capacity` rows are held, append() overwrites the oldest."""
+
+    def __init__(self, capacity, typecodes):
+        self.capacity = capacity
+        self.columns = tuple(array(code) for code in typecodes)
+        self.start = 0 # Physical index of the oldest row once full
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def append(self, *row):
+        if len(self.columns[0]) < self.capacity:
+            for column, value in zip(self.columns, row):
+                column.append(value)
+        else:
+            start = self.start
+            for column, value in zip(self.columns, row):
+                column[start] = value
+            self.start = (start + 1) % self.capacity
+
+    def oldest(self):
+        return self.columns[0][self.start] if len(self) else None
+
+    def runs(self):
+        """Physical (lo, hi) index ranges, oldest first."""
+        if self.start == 0:
+            return ((0, len(self)),)
+        return ((self.start, self.capacity), (0, self.start))
+
+    def count(self, start_ms, end_ms):
+        times = self.columns[0]
+        total = 0
+        for lo, hi in self.runs():
+            i = bisect_left(times, start_ms, lo, hi)
+            total += bisect_left(times, end_ms, i, hi) - i
+        return total
+
+    def select(self, start_ms, end_ms):
+        """Rows with start_ms <= time < end_ms, as one list per column."""
+        times = self.columns[0]
+        selected = [[] for _ in self.columns]
+        for lo, hi in self.runs():
+            i = bisect_left(times, start_ms, lo, hi)
+            j = bisect_left(times, end_ms, i, hi)
+            if i < j:
+                for column, values in zip(self.columns, selected):
+                    values.extend(column[i:j])
+        return selected
+
+    def nbytes(self):
+        return sum(len(column) * column.itemsize for column in self.columns)
+
+
+class Rollup:
+    """
+    min/max/sum/count per `resolution_ms` bucket. The bucket still filling is
+    kept in `open`; closed buckets go into the ring and on to the `coarser`
+    rollup, so each level is fed once per bucket of the one below (and lags
+    it by up to that bucket).
+    """
+
+    def __init__(self, resolution_ms, capacity, coarser=None):
+        self.resolution_ms = resolution_ms
+        self.ring = Ring(capacity, "qffdI") # start, min, max, sum, count
+        self.coarser = coarser
+        self.open = None
+
+    def add(self, time_ms, low, high, total, count):
+        start = time_ms - time_ms % self.resolution_ms
+        bucket = self.open
+        if bucket is not None and bucket[0] == start:
+            if low < bucket[1]:
+                bucket[1] = low
+            if high > bucket[2]:
+                bucket[2] = high
+            bucket[3] += total
+            bucket[4] += count
+            return
+        if bucket is not None:
+            self.ring.append(*bucket)
+            if self.coarser is not None:
+                self.coarser.add(*bucket)
+        self.open = [start, low, high, total, count]
+
+    def oldest(self):
+        oldest = self.ring.oldest()
+        return oldest if oldest is not None else (self.open[0] if self.open else None)
+
+    def select(self, start_ms, end_ms):
+        """Buckets overlapping [start_ms, end_ms), including the open one."""
+        columns = self.ring.select(start_ms - start_ms % self.resolution_ms, end_ms)
+        if self.open is not None and start_ms - self.resolution_ms < self.open[0] < end_ms:
+            for values, value in zip(columns, self.open):
+                values.append(value)
+        return columns
+
+    def nbytes(self):
+        return self.ring.nbytes()
+
+
+class Series:
+    """One robot's channel: raw samples and the rollup levels above them."""
+
+    def __init__(self, raw_capacity=RAW_CAPACITY, levels=LEVELS):
+        self.raw = Ring(raw_capacity, "qf")
+        self.rollups = []
+        coarser = None
+        for resolution_ms, capacity in reversed(levels):
+            coarser = Rollup(resolution_ms, capacity, coarser)
+            self.rollups.insert(0, coarser)
+        self.first_ms = None
+        self.last_ms = None
+
+    def add(self, time_ms, value):
+        if self.last_ms is None:
+            self.first_ms = time_ms
+        elif time_ms < self.last_ms:
+            time_ms = self.last_ms # Rings are searched by time: never go backwards
+        self.last_ms = time_ms
+        self.raw.append(time_ms, value)
+        self.rollups[0].add(time_ms, value, value, value, 1)
+
+    def query(self, start_ms, end_ms, points):
+        """
+        The raw samples if there are at most `points` of them, else the
+        finest rollup whose buckets fit the budget; either one only if it
+        still holds the start of the window (or of the series). The coarsest
+        level with data is merged down to the budget if nothing fits.
+        """
+        if self.first_ms is None:
+            return {"resolution_ms": 0, "t": [], "value": []}
+        reach = max(start_ms, self.first_ms)
+        for resolution_ms, level in [(0, self.raw)] + [(rollup.resolution_ms, rollup) for rollup in self.rollups]:
+            oldest = level.oldest()
+            if oldest is None or oldest > reach:
+                continue
+            if resolution_ms == 0:
+                if self.raw.count(start_ms, end_ms) <= points:
+                    times, values = self.raw.select(start_ms, end_ms)
+                    return {"resolution_ms": 0, "t": times, "value": [round(value, 3) for value in values]}
+            elif (end_ms - start_ms) / resolution_ms <= points:
+                return rollup_points(resolution_ms, level.select(start_ms, end_ms), points)
+        coarsest = [rollup for rollup in self.rollups if rollup.oldest() is not None][-1]
+        return rollup_points(coarsest.resolution_ms, coarsest.select(start_ms, end_ms), points)
+
+    def recent(self, since_ms):
+        return self.raw.select(since_ms, math.inf)
+
+    def nbytes(self):
+        return self.raw.nbytes() + sum(rollup.nbytes() for rollup in self.rollups)
+
+def rollup_points(resolution_ms, columns, points):
+    """Rollup buckets as t/min/max/mean lists, adjacent buckets merged if there are more than `points`."""
+    times, lows, highs, totals, counts = columns
+    group = max(1, math.ceil(len(times) / points))
+    if group > 1:
+        ranges = [(i, i + group) for i in range(0, len(times), group)]
+        times = [times[i] for i, _ in ranges]
+        lows = [min(lows[i:j]) for i, j in ranges]
+        highs = [max(highs[i:j]) for i, j in ranges]
+        totals = [sum(totals[i:j]) for i, j in ranges]
+        counts = [sum(counts[i:j]) for i, j in ranges]
+    return {
+        "resolution_ms": resolution_ms * group,
+        "t": times,
+        "min": [round(value, 3) for value in lows],
+        "max": [round(value, 3) for value in highs],
+        "mean": [round(total / count, 3) for total, count in zip(totals, counts)],
+    }
+
+# === Store ===
+class TimeSeriesStore:
+    """
+    (robot ID, channel) -> Series, created on a robot's first sample on that
+    channel; past `max_series` new series are refused (counted as dropped
+    samples). Everything runs on the event loop. With `segments` (a
+    SegmentWriter) every sample is also queued for disk.
+    """
+
+    def __init__(self, raw_capacity=RAW_CAPACITY, levels=LEVELS, segments=None, max_series=2048):
+        self.raw_capacity = raw_capacity
+        self.levels = levels
+        self.segments = segments
+        self.max_series = max_series
+        self.series = {}
+        self.samples = 0
+        self.dropped = 0
+        self.queries = 0
+
+    def _series(self, robot_id, channel):
+        key = (robot_id, channel)
+        series = self.series.get(key)
+        if series is None and len(self.series) < self.max_series:
+            series = self.series[key] = Series(self.raw_capacity, self.levels)
+        return series
+
+    def add(self, robot_id, samples):
+        """Store one batch of TelemetrySamples, anchoring the newest to the current time."""
+        if not samples:
+            return
+        offset_ns = time.time_ns() - max(sample.timestamp_ns for sample in samples)
+        records = [] if self.segments else None
+        for channel, timestamp_ns, value in samples:
+            series = self._series(robot_id, channel)
+            if series is None:
+                self.dropped += 1
+                continue
+            time_ms = (timestamp_ns + offset_ns) // 1_000_000
+            series.add(time_ms, value)
+            if records is not None:
+                records.append((series.last_ms, channel, value))
+        self.samples += len(samples)
+        if records:
+            self.segments.write(robot_id, records)
+
+    def query(self, robot_id, channel, start_ms, end_ms, points):
+        self.queries += 1
+        series = self.series.get((robot_id, channel))
+        if series is None:
+            return {"resolution_ms": 0, "t": [], "value": []}
+        return series.query(start_ms, end_ms, points)
+
+    def recent(self, robot_id, seconds):
+        """
+        Every channel's raw samples from the last `seconds`, oldest first, as
+        TelemetrySamples stamped in this process's monotonic clock.
+        """
+        now_ms = time.time() * 1000
+        to_monotonic_ns = time.monotonic_ns() - int(now_ms * 1_000_000)
+        samples = []
+        for (series_robot, channel), series in self.series.items():
+            if series_robot != robot_id:
+                continue
+            times, values = series.recent(now_ms - seconds * 1000)
+            samples.extend(TelemetrySample(channel, time_ms * 1_000_000 + to_monotonic_ns, value)
+                           for time_ms, value in zip(times, values))
+        samples.sort(key=lambda sample: sample.timestamp_ns)
+        return samples
+
+    def restore(self, directory, since_ms):
+        """Load segment records newer than `since_ms` back into memory (not written again)."""
+        restored = 0
+        if not os.path.isdir(directory):
+            return restored
+        for robot_id in sorted(os.listdir(directory)):
+            try:
+                robot_directory(directory, robot_id)
+            except ValueError: # A symlink out of the history directory
+                continue
+            for time_ms, channel, value in read_segments(directory, robot_id, since_ms):
+                series = self._series(robot_id, channel)
+                if series is not None:
+                    series.add(time_ms, value)
+                    restored += 1
+        return restored
+
+    def stats(self):
+        retained = sum(len(series.raw) for series in self.series.values())
+        return {
+            "series": len(self.series),
+            "samples": self.samples,
+            "retained_raw": retained,
+            "dropped": self.dropped,
+            "queries": self.queries,
+            "bytes": sum(series.nbytes() for series in self.series.values()),
+            "segments": self.segments.stats() if self.segments else None,
+        }
+
+# === Segment Files ===
+class SegmentWriter:
+    """
+    write() is called on the event loop and only appends; the writer thread
+    wakes every `flush_s`, packs what is pending and appends it to
+    <directory>/<robot>/<first time ms>-<pid>.tseg, starting a new segment
+    past `segment_bytes` and deleting a robot's oldest beyond `max_segments`.
+    Past `max_pending` batches the writer drops rather than grow.
+    """
+
+    def __init__(self, directory, segment_bytes=8 * 1024 * 1024, max_segments=32, max_pending=10_000, flush_s=1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.max_pending = max_pending
+        self.flush_s = flush_s
+        self.records = 0
+        self.written_bytes = 0
+        self.dropped = 0
+        self.segments_started = 0
+        self._pending = collections.deque()
+        self._files = {} # robot ID -> open segment
+        self._stop = threading.Event()
+        self._thread = None
+        self._start()
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.close)
+
+    def write(self, robot_id, records):
+        if len(self._pending) >= self.max_pending:
+            self.dropped += len(records)
+            return
+        self._pending.append((robot_id, records))
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "records": self.records,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+            "written_bytes": self.written_bytes,
+            "segments_started": self.segments_started,
+        }
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="history-segments", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        self._files = {} # The parent's files stay the parent's; file names carry the pid
+        self._pending.clear()
+        self._stop = threading.Event()
+        self._start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_s):
+            self._write_pending()
+        self._write_pending()
+        for segment in self._files.values():
+            segment.close()
+
+    def _write_pending(self):
+        batches = {}
+        while self._pending:
+            robot_id, records = self._pending.popleft()
+            batches.setdefault(robot_id, []).extend(records)
+        for robot_id, records in batches.items():
+            buf = b"".join(SEGMENT_RECORD.pack(*record) for record in records)
+            try:
+                segment = self._files.get(robot_id)
+                if segment is None or segment.tell() + len(buf) > self.segment_bytes:
+                    segment = self._rotate(robot_id, records[0][0])
+                segment.write(buf)
+                segment.flush()
+            except (OSError, ValueError) as e:
+                self.dropped += len(records)
+                print(f"History segment write failed: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            self.records += len(records)
+            self.written_bytes += len(buf)
+
+    def _rotate(self, robot_id, first_ms):
+        if robot_id in self._files:
+            self._files.pop(robot_id).close()
+        directory = robot_directory(self.directory, robot_id)
+        os.makedirs(directory, exist_ok=True)
+        segment = self._files[robot_id] = open(os.path.join(directory, f"{first_ms}-{os.getpid()}{SEGMENT_SUFFIX}"), "wb")
+        segment.write(SEGMENT_MAGIC + bytes([SEGMENT_VERSION]))
+        self.segments_started += 1
+        for old in segment_paths(self.directory, robot_id)[:-self.max_segments]:
+            os.remove(old)
+        return segment
+
+def robot_directory(directory, robot_id):
+    """A robot's segment directory; raises ValueError unless it resolves to a child of `directory`."""
+    path = os.path.realpath(os.path.join(directory, robot_id))
+    if os.path.dirname(path) != os.path.realpath(directory):
+        raise ValueError(f"Robot ID {robot_id!r:.80} is not a directory under {directory}")
+    return path
+
+def segment_paths(directory, robot_id):
+    """A robot's segment files, oldest first (names start with their first record's time)."""
+    directory = robot_directory(directory, robot_id)
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)]
+    names.sort(key=lambda name: int(name.split("-", 1)[0]))
+    return [os.path.join(directory, name) for name in names]
+
+def read_segments(directory, robot_id, since_ms=None):
+    """Yield (time_ms, channel, value) records of a robot, from its segments that can hold times >= since_ms."""
+    paths = segment_paths(directory, robot_id)
+    firsts = [int(os.path.basename(path).split("-", 1)[0]) for path in paths]
+    for index, path in enumerate(paths):
+        if since_ms is not None and index + 1 < len(paths) and firsts[index + 1] < since_ms:
+            continue # The next segment starts before since_ms, so this one ends before it
+        with open(path, "rb") as f:
+            header = f.read(len(SEGMENT_MAGIC) + 1)
+            if header[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC or header[-1] != SEGMENT_VERSION:
+                continue
+            data = f.read()
+        usable = len(data) - len(data) % SEGMENT_RECORD.size # A record cut short by a crash
+        for record in SEGMENT_RECORD.iter_unpack(memoryview(data)[:usable]):
+            if since_ms is None or record[0] >= since_ms:
+                yield record
+
+def dump(directory, robot_id, channel=None):
+    channel_id = CHANNELS[channel] if channel else None
+    print("time_ms,channel,value")
+    for time_ms, record_channel, value in read_segments(directory, robot_id):
+        if channel_id is None or record_channel == channel_id:
+            print(f"{time_ms},{CHANNEL_NAMES.get(record_channel, record_channel)},{value:.3f}")
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == "dump":
+        dump(sys.argv[2], sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else None)
+    else:
+        sys.exit("Usage: python timeseries.py dump <history dir> <robot> [channel]")
@@ -0,0 +1,456 @@
+# tracks.py
+# Where each robot has been, for websoket_server. The Pi sends gps_lat/gps_lon
+# telemetry already thinned by gps.TrackSimplifier; here the two channels are
+# paired back into points and kept per robot as a polyline in typed arrays.
+# Every segment between consecutive points goes into a spatio-temporal grid
+# (cells of CELL_M by CELL_M and BUCKET_MS of time), so "which robots were
+# within r of (lat, lon) around time T" reads only the segments in the cells
+# the query circle and window touch, and scores each by its closest approach
+# (positions between points interpolated in time). Geofences have a grid of
+# their own: each new segment is checked against the fences near it, and a
+# robot entering, leaving or passing through a fence raises an alert. Points
+# a robot could not have driven between (a GPS glitch) are kept but not joined.
+#
+# Times are wall-clock ms, anchored like timeseries.py: the newest sample of
+# a batch is taken as "now". Positions travel as f32 (telemetry_protocol),
+# whose step is 2**-18 degrees at 32-64 and doubles with each power of two:
+# 0.4 m of latitude at mid latitudes, up to 1.7 m of longitude (times
+# cos(lat)) past 128 degrees. Points are good to a metre or two; the f64
+# arrays here add nothing to that.
+import collections
+import json
+import math
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from gps import offset_m, segment_distance
+from telemetry_protocol import CHANNELS
+
+LAT_CHANNEL = CHANNELS["gps_lat"]
+LON_CHANNEL = CHANNELS["gps_lon"]
+METRES_PER_DEGREE = 111_320 # Along a meridian
+CELL_M = 100 # Grid cell size; cells are fixed in degrees, so narrower east-west away from the equator
+CELL_DEG = CELL_M / METRES_PER_DEGREE
+BUCKET_MS = 60_000 # Time slice of the grid
+MAX_GAP_MS = 60_000 # Points further apart are not joined: the robot had no fix or no link in between
+MAX_SPEED_M_S = 30 # Nor are points the robot could not have driven between: a GPS glitch
+MAX_SEGMENT_M = 8 * CELL_M # Nor points further apart than this, so a segment touches a bounded number of cells
+MAX_SEGMENT_CELLS = 400 # Cap on the cells one segment is indexed in; past it, only its end point's cell
+PAIR_MS = 500 # A lat and a lon this close in time are one point (legacy JSON stamps them separately)
+RETAIN_MS = 24 * 3600 * 1000 # Points and index cells older than this are dropped
+MAX_POINTS = 200_000 # Per robot; the oldest quarter goes when exceeded
+MAX_ALERTS = 1000 # Geofence alerts kept for /geofences
+
+def degree_box(lat, lon, radius_m):
+    """(lat_min, lon_min, lat_max, lon_max) around a circle."""
+    dlat = radius_m / METRES_PER_DEGREE
+    dlon = radius_m / (METRES_PER_DEGREE * max(0.01, math.cos(math.radians(lat))))
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+def cell_range(lat_min, lon_min, lat_max, lon_max, cell_deg=CELL_DEG):
+    """Every (x, y) grid cell a degree box touches."""
+    return [(x, y)
+            for x in range(math.floor(lon_min / cell_deg), math.floor(lon_max / cell_deg) + 1)
+            for y in range(math.floor(lat_min / cell_deg), math.floor(lat_max / cell_deg) + 1)]
+
+# === Tracks ===
+class Track:
+    """
+    One robot's points in time order, in typed arrays. Points are addressed
+    by absolute index (the grid refers to them that way); `base` is the
+    absolute index of the oldest point still held.
+    """
+
+    def __init__(self):
+        self.times = array("q")
+        self.lats = array("d")
+        self.lons = array("d")
+        self.base = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, time_ms, lat, lon):
+        if self.times and time_ms < self.times[-1]:
+            time_ms = self.times[-1] # Searched by time: never go backwards
+        self.times.append(time_ms)
+        self.lats.append(lat)
+        self.lons.append(lon)
+        return self.base + len(self.times) - 1
+
+    def point(self, index):
+        """(time_ms, lat, lon) at an absolute index, or None once dropped."""
+        i = index - self.base
+        if i < 0 or i >= len(self.times):
+            return None
+        return self.times[i], self.lats[i], self.lons[i]
+
+    def segment(self, index):
+        """
+        (a, b): the point before `index` and the point itself; a is b when
+        they are not joined (too far apart in time or space, or an
+        impossible speed between them).
+        """
+        b = self.point(index)
+        a = self.point(index - 1) if b is not None else None
+        if a is None or b[0] - a[0] > MAX_GAP_MS:
+            return b, b
+        distance = math.hypot(*offset_m(a[1], a[2], b[1], b[2]))
+        if distance > MAX_SEGMENT_M or distance > MAX_SPEED_M_S * max(1.0, (b[0] - a[0]) / 1000):
+            return b, b
+        return a, b
+
+    def drop(self, count):
+        del self.times[:count]
+        del self.lats[:count]
+        del self.lons[:count]
+        self.base += count
+
+    def drop_before(self, time_ms):
+        count = bisect_left(self.times, time_ms)
+        if count:
+            self.drop(count)
+
+    def select(self, start_ms, end_ms):
+        i = bisect_left(self.times, start_ms)
+        j = bisect_right(self.times, end_ms)
+        return list(self.times[i:j]), list(self.lats[i:j]), list(self.lons[i:j])
+
+    def nbytes(self):
+        return len(self.times) * 24
+
+
+def closest_approach(lat, lon, a, b, start_ms, end_ms):
+    """
+    (distance_m, time_ms, lat, lon) of the nearest position to (lat, lon)
+    on segment a -> b (points (time_ms, lat, lon)) within [start_ms, end_ms],
+    moving at constant speed between them; None if they do not overlap in time.
+    """
+    t0, t1 = a[0], b[0]
+    if t0 > end_ms or t1 < start_ms:
+        return None
+    span = t1 - t0
+    s0 = max(0.0, (start_ms - t0) / span) if span else 0.0
+    s1 = min(1.0, (end_ms - t0) / span) if span else 0.0
+    ax, ay = offset_m(lat, lon, a[1], a[2])
+    bx, by = offset_m(lat, lon, b[1], b[2])
+    dx, dy = bx - ax, by - ay
+    distance, s = segment_distance(0.0, 0.0, ax + s0 * dx, ay + s0 * dy, ax + s1 * dx, ay + s1 * dy)
+    s = s0 + s * (s1 - s0)
+    return distance, t0 + s * span, a[1] + s * (b[1] - a[1]), a[2] + s * (b[2] - a[2])
+
+# === Geofences ===
+class Geofence:
+    """
+    A named area: a circle (`radius_m` around lat, lon) or a polygon
+    (`polygon`: [(lat, lon), ...], centred on its vertices' mean). Tests run
+    in metres around the centre, so a fence should span kilometres at most.
+    """
+
+    def __init__(self, name, lat=None, lon=None, radius_m=None, polygon=None):
+        if polygon is not None:
+            if len(polygon) < 3:
+                raise ValueError(f"Geofence {name}: a polygon needs 3 or more points")
+            lat = sum(p[0] for p in polygon) / len(polygon)
+            lon = sum(p[1] for p in polygon) / len(polygon)
+        elif radius_m is None or lat is None or lon is None:
+            raise ValueError(f"Geofence {name}: needs lat, lon and radius_m, or a polygon")
+        self.name = name
+        self.lat = float(lat)
+        self.lon = float(lon)
+        self.radius_m = radius_m
+        self.polygon = [(float(p[0]), float(p[1])) for p in polygon] if polygon is not None else None
+        self._vertices = [offset_m(self.lat, self.lon, p[0], p[1]) for p in self.polygon] if polygon else None
+        if self.polygon:
+            lats = [p[0] for p in self.polygon]
+            lons = [p[1] for p in self.polygon]
+            self.box = (min(lats), min(lons), max(lats), max(lons))
+        else:
+            self.box = degree_box(self.lat, self.lon, radius_m)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["name"], data.get("lat"), data.get("lon"), data.get("radius_m"), data.get("polygon"))
+
+    def to_dict(self):
+        if self.polygon:
+            return {"name": self.name, "polygon": [list(p) for p in self.polygon]}
+        return {"name": self.name, "lat": self.lat, "lon": self.lon, "radius_m": self.radius_m}
+
+    def _inside(self, x, y):
+        if self._vertices is None:
+            return math.hypot(x, y) <= self.radius_m
+        inside = False
+        vertices = self._vertices
+        for (x0, y0), (x1, y1) in zip(vertices, vertices[1:] + vertices[:1]):
+            if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+                inside = not inside
+        return inside
+
+    def contains(self, lat, lon):
+        return self._inside(*offset_m(self.lat, self.lon, lat, lon))
+
+    def crosses(self, lat0, lon0, lat1, lon1):
+        """True if the straight line between two points runs through the fence."""
+        ax, ay = offset_m(self.lat, self.lon, lat0, lon0)
+        bx, by = offset_m(self.lat, self.lon, lat1, lon1)
+        if self._vertices is None:
+            return segment_distance(0.0, 0.0, ax, ay, bx, by)[0] <= self.radius_m
+        if self._inside(ax, ay) or self._inside(bx, by):
+            return True
+        vertices = self._vertices
+        return any(_intersects(ax, ay, bx, by, *p, *q) for p, q in zip(vertices, vertices[1:] + vertices[:1]))
+
+
+def _intersects(ax, ay, bx, by, cx, cy, dx, dy):
+    def side(px, py, qx, qy, rx, ry):
+        return (qx - px) * (ry - py) - (qy - py) * (rx - px)
+    return (side(ax, ay, bx, by, cx, cy) * side(ax, ay, bx, by, dx, dy) <= 0
+            and side(cx, cy, dx, dy, ax, ay) * side(cx, cy, dx, dy, bx, by) <= 0)
+
+def load_geofences(path):
+    """Geofences from a JSON list of {"name", "lat", "lon", "radius_m"} or {"name", "polygon": [[lat, lon], ...]}."""
+    with open(path) as f:
+        return [Geofence.from_dict(data) for data in json.load(f)]
+
+
+class FenceIndex:
+    """Geofences by the grid cells their bounding boxes touch."""
+
+    def __init__(self, fences=(), cell_m=2 * CELL_M):
+        self.cell_deg = cell_m / METRES_PER_DEGREE
+        self.fences = {}
+        self.cells = collections.defaultdict(list)
+        for fence in fences:
+            self.add(fence)
+
+    def __len__(self):
+        return len(self.fences)
+
+    def add(self, fence):
+        if fence.name in self.fences:
+            raise ValueError(f"Duplicate geofence name: {fence.name}")
+        self.fences[fence.name] = fence
+        for cell in cell_range(*fence.box, self.cell_deg):
+            self.cells[cell].append(fence)
+
+    def candidates(self, lat_min, lon_min, lat_max, lon_max):
+        """Fences whose boxes share a cell with the given box (a superset of those overlapping it)."""
+        found = {}
+        for cell in cell_range(lat_min, lon_min, lat_max, lon_max, self.cell_deg):
+            for fence in self.cells.get(cell, ()):
+                found[fence.name] = fence
+        return found.values()
+
+
+# === Store ===
+class TrackStore:
+    """
+    robot ID -> Track, plus the segment grid and the geofences. add() takes
+    the telemetry batches websoket_server gets from each Pi; near() answers
+    the proximity query. on_alert(alert) is called with every geofence alert
+    (a dict: seq, time, robot, fence, event "enter"/"exit"/"crossed", lat,
+    lon); the last MAX_ALERTS are also kept for alerts(). Everything runs on
+    the event loop.
+    """
+
+    def __init__(self, fences=(), on_alert=None, retain_ms=RETAIN_MS, max_points=MAX_POINTS):
+        self.retain_ms = retain_ms
+        self.max_points = max_points
+        self.on_alert = on_alert
+        self.tracks = {}
+        self.fences = FenceIndex(fences)
+        self.grid = {} # (x, y, bucket) -> {robot ID: array of absolute segment end indices}
+        self.buckets = collections.defaultdict(set) # bucket -> its grid keys, for expiry
+        self.points = 0
+        self.rejected = 0 # Points with an impossible latitude or longitude
+        self.entries = 0
+        self.queries = 0
+        self.alerts_raised = collections.Counter() # event -> count
+        self.recent_alerts = collections.deque(maxlen=MAX_ALERTS)
+        self._alert_seq = 0
+        self._inside = collections.defaultdict(set) # robot ID -> names of the fences it is in
+        self._pending = {} # robot ID -> [timestamp_ns, lat, lon] still missing a half
+        self._oldest_bucket = None
+
+    def set_fences(self, fences):
+        """Replace the geofences; robots stay inside the fences that keep their names."""
+        self.fences = FenceIndex(fences)
+        for names in self._inside.values():
+            names.intersection_update(self.fences.fences)
+
+    # --- Ingest ---
+    def add(self, robot_id, samples):
+        """Take one batch of TelemetrySamples; the gps_lat/gps_lon pairs in it become track points."""
+        pairs = []
+        pending = self._pending.get(robot_id)
+        for channel, timestamp_ns, value in samples:
+            if channel != LAT_CHANNEL and channel != LON_CHANNEL:
+                continue
+            if pending is None or abs(timestamp_ns - pending[0]) > PAIR_MS * 1_000_000:
+                pending = [timestamp_ns, None, None]
+            pending[1 if channel == LAT_CHANNEL else 2] = value
+            pending[0] = max(pending[0], timestamp_ns)
+            if pending[1] is not None and pending[2] is not None:
+                pairs.append(pending)
+                pending = None
+        self._pending[robot_id] = pending
+        if not pairs:
+            return
+        offset_ns = time.time_ns() - max(sample.timestamp_ns for sample in samples)
+        for timestamp_ns, lat, lon in pairs:
+            self.add_point(robot_id, (timestamp_ns + offset_ns) // 1_000_000, lat, lon)
+
+    def add_point(self, robot_id, time_ms, lat, lon):
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180): # Also false for NaN
+            self.rejected += 1
+            return
+        track = self.tracks.get(robot_id)
+        if track is None:
+            track = self.tracks[robot_id] = Track()
+        index = track.append(time_ms, lat, lon)
+        a, b = track.segment(index)
+        self._index(robot_id, index, a, b)
+        self._check_fences(robot_id, a, b)
+        self.points += 1
+        if len(track) > self.max_points:
+            track.drop(self.max_points // 4)
+        self._expire(b[0])
+
+    def _index(self, robot_id, index, a, b):
+        cells = cell_range(min(a[1], b[1]), min(a[2], b[2]), max(a[1], b[1]), max(a[2], b[2]))
+        if len(cells) > MAX_SEGMENT_CELLS:
+            cells = cell_range(b[1], b[2], b[1], b[2])
+        for bucket in range(a[0] // BUCKET_MS, b[0] // BUCKET_MS + 1):
+            keys = self.buckets[bucket]
+            for x, y in cells:
+                key = (x, y, bucket)
+                cell = self.grid.get(key)
+                if cell is None:
+                    cell = self.grid[key] = {}
+                    keys.add(key)
+                entries = cell.get(robot_id)
+                if entries is None:
+                    entries = cell[robot_id] = array("q")
+                entries.append(index)
+                self.entries += 1
+
+    def _expire(self, now_ms):
+        """Drop grid buckets and points older than retain_ms; runs about once per bucket."""
+        cutoff = (now_ms - self.retain_ms) // BUCKET_MS
+        if self._oldest_bucket is not None and self._oldest_bucket >= cutoff:
+            return
+        for bucket in [bucket for bucket in self.buckets if bucket < cutoff]:
+            for key in self.buckets.pop(bucket):
+                self.entries -= sum(len(entries) for entries in self.grid.pop(key).values())
+        for track in self.tracks.values():
+            track.drop_before(now_ms - self.retain_ms)
+        self._oldest_bucket = min(self.buckets, default=cutoff)
+
+    # --- Geofences ---
+    def _check_fences(self, robot_id, a, b):
+        inside = self._inside[robot_id]
+        nearby = self.fences.candidates(min(a[1], b[1]), min(a[2], b[2]), max(a[1], b[1]), max(a[2], b[2]))
+        names = {fence.name for fence in nearby}
+        candidates = list(nearby) + [self.fences.fences[name] for name in inside if name not in names]
+        for fence in candidates:
+            now = fence.contains(b[1], b[2])
+            if now and fence.name not in inside:
+                inside.add(fence.name)
+                self._alert(robot_id, fence, "enter", b)
+            elif not now and fence.name in inside:
+                inside.discard(fence.name)
+                self._alert(robot_id, fence, "exit", b)
+            elif not now and a is not b and fence.crosses(a[1], a[2], b[1], b[2]):
+                self._alert(robot_id, fence, "crossed", b) # In and out between two points
+
+    def _alert(self, robot_id, fence, event, point):
+        self._alert_seq += 1
+        self.alerts_raised[event] += 1
+        alert = {"seq": self._alert_seq, "time": point[0], "robot": robot_id, "fence": fence.name,
+                 "event": event, "lat": point[1], "lon": point[2]}
+        self.recent_alerts.append(alert)
+        if self.on_alert:
+            self.on_alert(alert)
+
+    def alerts(self, since_seq=0):
+        return [alert for alert in self.recent_alerts if alert["seq"] > since_seq]
+
+    def inside(self, robot_id):
+        return sorted(self._inside.get(robot_id, ()))
+
+    # --- Queries ---
+    def track(self, robot_id, start_ms, end_ms):
+        track = self.tracks.get(robot_id)
+        times, lats, lons = track.select(start_ms, end_ms) if track else ([], [], [])
+        return {"t": times, "lat": lats, "lon": lons}
+
+    def near(self, lat, lon, radius_m, time_ms, window_ms):
+        """
+        Robots that came within radius_m of (lat, lon) between time_ms -
+        window_ms and time_ms + window_ms, nearest first, each with its closest
+        approach: [{"robot", "distance_m", "time", "lat", "lon"}].
+        """
+        self.queries += 1
+        start_ms, end_ms = time_ms - window_ms, time_ms + window_ms
+        cells = cell_range(*degree_box(lat, lon, radius_m))
+        seen = set()
+        best = {}
+        for bucket in range(start_ms // BUCKET_MS, end_ms // BUCKET_MS + 1):
+            if bucket not in self.buckets:
+                continue
+            for x, y in cells:
+                cell = self.grid.get((x, y, bucket))
+                if cell is None:
+                    continue
+                for robot_id, entries in cell.items():
+                    track = self.tracks[robot_id]
+                    for index in entries:
+                        if (robot_id, index) in seen:
+                            continue
+                        seen.add((robot_id, index))
+                        a, b = track.segment(index)
+                        if b is not None:
+                            self._score(best, robot_id, lat, lon, radius_m, a, b, start_ms, end_ms)
+        return self._result(best)
+
+    def near_scan(self, lat, lon, radius_m, time_ms, window_ms):
+        """near() by checking every segment of every track in the window, without the grid; for comparison."""
+        start_ms, end_ms = time_ms - window_ms, time_ms + window_ms
+        best = {}
+        for robot_id, track in self.tracks.items():
+            first = max(track.base, track.base + bisect_left(track.times, start_ms) - 1)
+            last = track.base + bisect_right(track.times, end_ms) + 1
+            for index in range(first, min(last, track.base + len(track))):
+                a, b = track.segment(index)
+                self._score(best, robot_id, lat, lon, radius_m, a, b, start_ms, end_ms)
+        return self._result(best)
+
+    @staticmethod
+    def _score(best, robot_id, lat, lon, radius_m, a, b, start_ms, end_ms):
+        approach = closest_approach(lat, lon, a, b, start_ms, end_ms)
+        if approach is not None and approach[0] <= radius_m:
+            current = best.get(robot_id)
+            if current is None or approach[0] < current[0]:
+                best[robot_id] = approach
+
+    @staticmethod
+    def _result(best):
+        return [{"robot": robot_id, "distance_m": round(distance, 1), "time": int(time_ms),
+                 "lat": round(lat, 7), "lon": round(lon, 7)}
+                for robot_id, (distance, time_ms, lat, lon) in sorted(best.items(), key=lambda item: item[1][0])]
+
+    def stats(self):
+        return {
+            "robots": len(self.tracks),
+            "points": self.points,
+            "rejected": self.rejected,
+            "retained": sum(len(track) for track in self.tracks.values()),
+            "cells": len(self.grid),
+            "index_entries": self.entries,
+            "fences": len(self.fences),
+            "alerts": dict(self.alerts_raised),
+            "queries": self.queries,
+            "bytes": sum(track.nbytes() for track in self.tracks.values()) + self.entries * 8,
+        }
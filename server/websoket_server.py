@@ -4,48 +4,273 @@ import aiohttp
 from aiohttp import web
 import json
 import logging
+import math
 import os
-
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("websocket_server.log"),
-        logging.StreamHandler()
-    ]
+import time
+from command_pipeline import CAMERA_ACTIONS, CommandMailbox
+from fleet import DEFAULT_ROBOT, FleetRegistry
+from heartbeat import HeartbeatSender
+from log_pipeline import LogSampler, start_logging
+from message_trace import TraceWriter
+from metrics import CONTENT_TYPE, REGISTRY, watch_loop_lag
+from pi_link import LINK_PATH
+from shard import run_workers
+from telemetry_protocol import (
+    BINARY_SUBPROTOCOL,
+    CHANNELS,
+    MAX_SAMPLES,
+    TelemetrySample,
+    decode_frame,
+    encode_frame,
+    from_json_message,
+    to_json_messages,
 )
+from timeseries import LEVELS, SegmentWriter, TimeSeriesStore
+from tracks import TrackStore, load_geofences
+
+SERVER_PORT = int(os.environ.get("ROBOT_SERVER_PORT", "9000"))
+WORKERS = int(os.environ.get("ROBOT_SERVER_WORKERS", "1")) # >1: worker processes sharing the port (Linux)
+LOG_LEVEL = os.environ.get("ROBOT_SERVER_LOG_LEVEL", "INFO") # DEBUG adds sampled per-message lines
+LOG_SAMPLE_S = 5.0 # At most one per-message log line per robot and kind in this many seconds
+TRACE_PATH = os.environ.get("ROBOT_SERVER_TRACE", "websocket_server.trace") # Raw message trace; empty disables
+HISTORY_DIR = os.environ.get("ROBOT_SERVER_HISTORY", "") # Telemetry segment files, reloaded on restart; empty disables
+HISTORY_RESTORE_S = 3600 # How much of the segment history is loaded back into memory at startup
+HISTORY_POINTS = 500 # Default point budget of a /history query
+HISTORY_MAX_POINTS = 10_000
+BACKFILL_S = 10.0 # Telemetry history a new /distance client gets before live frames
+GEOFENCES_PATH = os.environ.get("ROBOT_SERVER_GEOFENCES", "") # JSON list of geofences (tracks.load_geofences); empty: none
+NEAR_WINDOW_S = 60 # Default half-width of a /near query's time window
+NEAR_MAX_RADIUS_M = 2000 # /near runs on the event loop: its cost grows with radius squared and with the window
+NEAR_MAX_WINDOW_S = 3600
+
+# Setup logging: file and console writes happen on a background thread, never on the event loop
+log_pipeline = start_logging("websocket_server.log", LOG_LEVEL)
 logger = logging.getLogger(__name__)
+trace = TraceWriter(TRACE_PATH) if TRACE_PATH else None # Every message, for replay (message_trace.py)
+# Per-robot telemetry history with rollups (timeseries.py); with workers, each keeps its own Pis' history
+history = TimeSeriesStore(segments=SegmentWriter(HISTORY_DIR) if HISTORY_DIR else None)
+if HISTORY_DIR:
+    logger.info(f"Restored {history.restore(HISTORY_DIR, (time.time() - HISTORY_RESTORE_S) * 1000)} "
+                f"telemetry samples from {HISTORY_DIR}")
+
+def log_geofence_alert(alert):
+    logger.warning(f"Geofence {alert['fence']}: robot {alert['robot']} {alert['event']} "
+                   f"at {alert['lat']:.6f}, {alert['lon']:.6f}")
+
+# GPS tracks with a spatial index and geofence alerts (tracks.py); with workers, per worker like history
+tracks = TrackStore(load_geofences(GEOFENCES_PATH) if GEOFENCES_PATH else (), log_geofence_alert)
+
+# Per-message events, sampled per robot
+control_log = LogSampler(logger, logging.DEBUG, LOG_SAMPLE_S)
+forward_log = LogSampler(logger, logging.DEBUG, LOG_SAMPLE_S)
+telemetry_log = LogSampler(logger, logging.DEBUG, LOG_SAMPLE_S)
+buffered_log = LogSampler(logger, logging.WARNING, LOG_SAMPLE_S)
+invalid_log = LogSampler(logger, logging.ERROR, LOG_SAMPLE_S)
+
+# === Metrics (/metrics) ===
+# Latencies are fleet-wide histograms; per-robot counts are read from the robots at scrape time
+def per_robot(value):
+    return lambda: {(robot_id,): value(robot) for robot_id, robot in fleet.robots.items()}
+
+loop_lag = REGISTRY.histogram("robot_server_loop_lag_seconds", "How late a 100 ms timer on the event loop fires")
+command_age = REGISTRY.histogram("robot_server_command_age_seconds", "Browser timestamp -> server receive, per command")
+broadcast_lag = REGISTRY.histogram("robot_server_broadcast_lag_seconds", "Telemetry published -> sent, per browser send")
+history_query_time = REGISTRY.histogram("robot_server_history_query_seconds", "Time to answer a /history query")
+near_query_time = REGISTRY.histogram("robot_server_near_query_seconds", "Time to answer a /near query")
+telemetry_messages = REGISTRY.counter("robot_server_telemetry_messages_total", "Telemetry messages from Pis", ("robot",))
+REGISTRY.counter("robot_server_commands_received_total", "Browser commands received", ("robot",),
+                 per_robot(lambda robot: robot.commands.received))
+REGISTRY.counter("robot_server_commands_forwarded_total", "Commands sent to the Pi", ("robot",),
+                 per_robot(lambda robot: robot.commands.forwarded))
+REGISTRY.counter("robot_server_commands_superseded_total", "Commands replaced by a newer one before sending", ("robot",),
+                 per_robot(lambda robot: robot.commands.superseded))
+REGISTRY.counter("robot_server_broadcast_published_total", "Telemetry frames published to viewers", ("robot",),
+                 per_robot(lambda robot: robot.hub.published))
+REGISTRY.counter("robot_server_broadcast_dropped_total", "Frames dropped from slow viewers' queues", ("robot",),
+                 per_robot(lambda robot: robot.hub.dropped))
+REGISTRY.counter("robot_server_slow_disconnects_total", "Viewers disconnected as too slow", ("robot",),
+                 per_robot(lambda robot: robot.hub.slow_disconnects))
+REGISTRY.counter("robot_server_link_resent_total", "Messages resent to the Pi after a reconnect", ("robot",),
+                 per_robot(lambda robot: robot.link.resent))
+REGISTRY.counter("robot_server_link_dropped_total", "Messages to the Pi dropped from a full link buffer", ("robot",),
+                 per_robot(lambda robot: robot.link.dropped))
+REGISTRY.gauge("robot_server_pi_connected", "1 while the robot's Pi is connected", ("robot",),
+               per_robot(lambda robot: int(robot.connected)))
+REGISTRY.gauge("robot_server_viewers", "Browser /distance clients", ("robot",), per_robot(lambda robot: len(robot.hub)))
+REGISTRY.gauge("robot_server_link_buffered", "Messages to the Pi awaiting an ack", ("robot",),
+               per_robot(lambda robot: len(robot.link.unacked)))
+REGISTRY.gauge("robot_server_control_clients", "Browser /control clients", fn=lambda: len(browser_control_clients))
+REGISTRY.counter("robot_server_log_dropped_total", "Log records dropped with the log queue full",
+                 fn=lambda: log_pipeline.handler.dropped)
+REGISTRY.counter("robot_server_trace_dropped_total", "Message trace records dropped",
+                 fn=lambda: trace.dropped if trace else 0)
+REGISTRY.gauge("robot_server_history_bytes", "Memory held by the telemetry history", fn=lambda: history.stats()["bytes"])
+REGISTRY.counter("robot_server_history_dropped_total", "Telemetry samples not kept in (or written out from) history",
+                 fn=lambda: history.dropped + (history.segments.dropped if history.segments else 0))
+REGISTRY.counter("robot_server_track_points_total", "GPS track points received", fn=lambda: tracks.points)
+REGISTRY.counter("robot_server_geofence_alerts_total", "Geofence alerts raised", ("event",),
+                 lambda: {(event,): count for event, count in tracks.alerts_raised.items()})
 
 # Store connected clients
 browser_control_clients = set()
-browser_distance_clients = set()
-pi_control_client = None
-pi_distance_client = None
+shard = None # This worker's view of the others (shared robot table + bus) when WORKERS > 1
+
+async def send_to_pi(robot, data):
+    if shard and not robot.connected:
+        owner = shard.table.owner(robot.robot_id)
+        if owner is not None and owner != shard.worker:
+            shard.bus.send_command(owner, robot.robot_id, data) # The Pi is connected to another worker
+            return
+    link = robot.link
+    if shard:
+        shard.table.record_command(robot.robot_id, data.get("action"), data.get("value"), data.get("seq"))
+    if trace:
+        trace.record("to_pi", robot.robot_id, dict(data))
+    if robot.control_ws and not robot.control_ws.closed and not link.connected:
+        await robot.control_ws.send_json(data) # Legacy listener on /pi_control
+        forward_log.log(robot.robot_id, "Forwarded to Pi %s: %s", robot.robot_id, data)
+        return
+    link.send("ptz" if data.get("action") in CAMERA_ACTIONS else "control", data)
+    if link.connected:
+        forward_log.log(robot.robot_id, "Forwarded to Pi %s: %s", robot.robot_id, data)
+    else:
+        buffered_log.log(robot.robot_id, "Pi %s link down, buffered for resend: %s", robot.robot_id, data)
+
+def broadcast_telemetry(robot, samples, frame=None):
+    """Queue telemetry samples to the robot's browser distance clients in their negotiated format."""
+    def binary_payload():
+        robot.telemetry_seq += 1
+        return encode_frame(robot.telemetry_seq, samples)
+    robot.hub.publish(
+        binary_payload=frame or binary_payload, # Forward the Pi's frame as-is when there is one
+        json_payload=lambda: to_json_messages(samples),
+    )
+
+def handle_pi_telemetry(robot, data):
+    """Broadcast telemetry from a Pi and keep it in history: a binary frame, or a legacy JSON message (text or parsed dict)."""
+    if trace:
+        trace.record("pi_telemetry", robot.robot_id, data)
+    telemetry_messages.labels(robot.robot_id).inc()
+    if isinstance(data, (bytes, bytearray)):
+        _, samples = decode_frame(data)
+        broadcast_telemetry(robot, samples, data)
+    else:
+        sample = from_json_message(json.loads(data) if isinstance(data, str) else data)
+        if sample is None:
+            invalid_log.log(robot.robot_id, "Invalid telemetry data from %s: %s", robot.robot_id, data)
+            return
+        samples = [sample]
+        broadcast_telemetry(robot, samples)
+    history.add(robot.robot_id, samples)
+    tracks.add(robot.robot_id, samples)
+    if shard:
+        share_telemetry(robot, samples, data if isinstance(data, (bytes, bytearray)) else None)
+    telemetry_log.log(robot.robot_id, "Broadcasted telemetry from %s: %d samples", robot.robot_id, len(samples))
+
+def handle_pi_link_control(robot, data):
+    if trace:
+        trace.record("pi_control", robot.robot_id, data)
+    if data.get("type") == "heartbeat_ack":
+        if robot.heartbeat:
+            robot.heartbeat.handle_ack(data)
+    else:
+        logger.info(f"Pi {robot.robot_id} link control message (unexpected): {data}")
+
+# === Shards ===
+def share_telemetry(robot, samples, frame=None):
+    """Record the latest distance in the shared table and forward the frame to workers with viewers."""
+    for sample in reversed(samples):
+        if sample.channel == CHANNELS["distance"]:
+            shard.table.record_distance(robot.robot_id, sample.value)
+            break
+    viewers = shard.table.viewers(robot.robot_id)
+    if viewers:
+        shard.bus.send_telemetry(viewers, robot.robot_id, frame or encode_frame(0, samples))
+
+def offer_history(robot, subscriber):
+    """Start a new viewer with the last BACKFILL_S of telemetry; False if this worker has none."""
+    samples = history.recent(robot.robot_id, BACKFILL_S)
+    if not samples:
+        return False
+    subscriber.offer(time.monotonic_ns(),
+                     encode_frame(0, samples[-MAX_SAMPLES:]) if subscriber.binary else to_json_messages(samples))
+    return True
+
+def offer_latest_distance(robot, subscriber):
+    """Start a new viewer from the shared table instead of waiting for the Pi's next frame."""
+    state = shard.table.read(robot.robot_id)
+    if state and state["distance_ns"]:
+        samples = [TelemetrySample(CHANNELS["distance"], time.monotonic_ns(), state["distance"])]
+        subscriber.offer(time.monotonic_ns(), encode_frame(0, samples) if subscriber.binary else to_json_messages(samples))
+
+def handle_shard_command(robot_id, data):
+    fleet.get_or_create(robot_id).commands.put(data) # Sent here because this worker holds the Pi
+
+def handle_shard_telemetry(robot_id, frame):
+    robot = fleet.get(robot_id)
+    if robot is not None and len(robot.hub):
+        _, samples = decode_frame(frame)
+        broadcast_telemetry(robot, samples, frame)
+
+async def start_shard_bus(app):
+    await shard.bus.start(shard.worker, handle_shard_command, handle_shard_telemetry)
+
+# === Fleet ===
+def setup_robot(robot):
+    # Latest drive/camera intent per robot, superseded commands are dropped
+    robot.commands = CommandMailbox(lambda data: send_to_pi(robot, data), age_metric=command_age)
+    robot.hub.lag_metric = broadcast_lag
+    robot.link.on("telemetry", lambda data: handle_pi_telemetry(robot, data))
+    robot.link.on("control", lambda data: handle_pi_link_control(robot, data))
+
+def teardown_robot(robot):
+    robot.commands.close() # Only idle robots are evicted; anything still holding one gets its commands ignored
+
+fleet = FleetRegistry(setup_robot, teardown=teardown_robot)
+
+def robot_for(request):
+    """Resolve ?robot=<id> once per connection; every message after that routes by reference."""
+    try:
+        return fleet.get_or_create(request.query.get("robot", DEFAULT_ROBOT))
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
 
 async def handle_control(request):
-    ws = web.WebSocketResponse()
-    await ws.prepare(request)
+    robot = robot_for(request)
+    robot.controllers += 1 # Keeps the registry from evicting the robot this browser drives
+    ws = web.WebSocketResponse(protocols=(BINARY_SUBPROTOCOL,)) # The Pi offers binary telemetry here
+    try:
+        await ws.prepare(request)
+    except Exception:
+        robot.controllers -= 1
+        raise
     browser_control_clients.add(ws)
-    logger.info(f"Browser control client connected: {request.remote}")
+    logger.info(f"Browser control client connected: {request.remote} -> {robot.robot_id}")
 
     try:
         async for msg in ws:
-            if msg.type == aiohttp.WSMsgType.TEXT:
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                # Binary frames on /control are telemetry from the Pi
                 try:
-                    logger.info(f"Browser control message: {msg.data}")
+                    handle_pi_telemetry(robot, msg.data)
+                except Exception as e:
+                    logger.error(f"Error processing telemetry: {type(e).__name__}: {e}")
+            elif msg.type == aiohttp.WSMsgType.TEXT:
+                try:
+                    if trace:
+                        trace.record("browser_control", robot.robot_id, msg.data)
+                    control_log.log(robot.robot_id, "Browser control message for %s: %s", robot.robot_id, msg.data)
                     data = json.loads(msg.data)
                     action = data.get("action")
                     value = data.get("value")
+                    if not action and "type" in data:
+                        handle_pi_telemetry(robot, data) # Legacy JSON telemetry from the Pi
+                        continue
                     if not action:
                         logger.error(f"Missing action in control data: {data}")
                         continue
-                    # Forward to Pi
-                    if pi_control_client and not pi_control_client.closed:
-                        await pi_control_client.send_json(data)
-                        logger.info(f"Forwarded to Pi: {data}")
-                    else:
-                        logger.warning("No Pi control client connected")
+                    # Queue for the Pi; replaces any unsent command of the same kind
+                    robot.commands.put(data)
                 except json.JSONDecodeError as e:
                     logger.error(f"Invalid JSON from browser control: {msg.data}, Error: {e}")
                 except Exception as e:
@@ -55,15 +280,21 @@ async def handle_control(request):
     except Exception as e:
         logger.error(f"Unexpected error in browser control: {type(e).__name__}: {e}")
     finally:
+        robot.controllers -= 1
         browser_control_clients.discard(ws)
         logger.info(f"Browser control client disconnected: {request.remote}")
     return ws
 
 async def handle_distance(request):
-    ws = web.WebSocketResponse()
+    robot = robot_for(request)
+    ws = web.WebSocketResponse(protocols=(BINARY_SUBPROTOCOL,)) # Browsers that don't offer it get JSON
     await ws.prepare(request)
-    browser_distance_clients.add(ws)
-    logger.info(f"Browser distance client connected: {request.remote}")
+    subscriber = robot.hub.subscribe(ws, binary=ws.ws_protocol == BINARY_SUBPROTOCOL, remote=request.remote)
+    if shard and len(robot.hub) == 1:
+        shard.table.set_viewing(robot.robot_id, shard.worker, True) # Owner starts forwarding frames here
+    if not offer_history(robot, subscriber) and shard:
+        offer_latest_distance(robot, subscriber)
+    logger.info(f"Browser distance client connected: {request.remote} -> {robot.robot_id}")
 
     try:
         async for msg in ws:
@@ -74,101 +305,307 @@ async def handle_distance(request):
     except Exception as e:
         logger.error(f"Unexpected error in browser distance: {type(e).__name__}: {e}")
     finally:
-        browser_distance_clients.discard(ws)
+        robot.hub.unsubscribe(subscriber)
+        if shard and not len(robot.hub):
+            shard.table.set_viewing(robot.robot_id, shard.worker, False)
         logger.info(f"Browser distance client disconnected: {request.remote}")
     return ws
 
 async def handle_pi_control(request):
-    global pi_control_client
+    robot = robot_for(request)
     ws = web.WebSocketResponse()
     await ws.prepare(request)
-    pi_control_client = ws
-    logger.info(f"Pi control client connected: {request.remote}")
+    robot.control_ws = ws
+    if shard:
+        shard.table.claim(robot.robot_id, shard.worker)
+    # Keepalives carry the current drive intent so the Pi's watchdog can tell a live link from a dead one
+    heartbeat = robot.heartbeat = HeartbeatSender(ws.send_json, lambda: robot.commands.last_forwarded.get("drive"))
+    heartbeat.start()
+    logger.info(f"Pi control client connected: {request.remote} ({robot.robot_id})")
 
     try:
         async for msg in ws:
             if msg.type == aiohttp.WSMsgType.TEXT:
-                logger.info(f"Pi control message (unexpected): {msg.data}")
+                if trace:
+                    trace.record("pi_control", robot.robot_id, msg.data)
+                try:
+                    data = json.loads(msg.data)
+                except json.JSONDecodeError:
+                    data = {}
+                if data.get("type") == "heartbeat_ack":
+                    heartbeat.handle_ack(data)
+                else:
+                    logger.info(f"Pi control message (unexpected): {msg.data}")
             elif msg.type == aiohttp.WSMsgType.ERROR:
                 logger.error(f"Pi control WebSocket error: {ws.exception()}")
     except Exception as e:
         logger.error(f"Unexpected error in Pi control: {type(e).__name__}: {e}")
     finally:
-        pi_control_client = None
-        logger.info(f"Pi control client disconnected: {request.remote}")
+        heartbeat.stop()
+        if robot.control_ws is ws:
+            robot.control_ws = None
+        if shard and not robot.connected:
+            shard.table.release(robot.robot_id, shard.worker)
+        logger.info(f"Pi control client disconnected: {request.remote} ({robot.robot_id})")
     return ws
 
-async def handle_pi_control(request):
-    global pi_control_client
-    ws = web.WebSocketResponse()
+async def handle_pi_distance(request):
+    robot = robot_for(request)
+    ws = web.WebSocketResponse(protocols=(BINARY_SUBPROTOCOL,))
     await ws.prepare(request)
-    pi_control_client = ws
-    logger.info(f"Pi control client connected: {request.remote}")
+    robot.distance_ws = ws
+    logger.info(f"Pi distance client connected: {request.remote} ({robot.robot_id})")
 
     try:
         async for msg in ws:
-            if msg.type == aiohttp.WSMsgType.TEXT:
-                logger.info(f"Pi control message (unexpected): {msg.data}")
+            if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                try:
+                    handle_pi_telemetry(robot, msg.data)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Invalid JSON from Pi distance: {msg.data}, Error: {e}")
+                except Exception as e:
+                    logger.error(f"Error processing Pi distance: {type(e).__name__}: {e}")
             elif msg.type == aiohttp.WSMsgType.ERROR:
-                logger.error(f"Pi control WebSocket error: {ws.exception()}")
+                logger.error(f"Pi distance WebSocket error: {ws.exception()}")
     except Exception as e:
-        logger.error(f"Unexpected error in Pi control: {type(e).__name__}: {e}")
+        logger.error(f"Unexpected error in Pi distance: {type(e).__name__}: {e}")
     finally:
-        pi_control_client = None
-        logger.info(f"Pi control client disconnected: {request.remote}")
+        if robot.distance_ws is ws:
+            robot.distance_ws = None
+        logger.info(f"Pi distance client disconnected: {request.remote} ({robot.robot_id})")
     return ws
 
-async def handle_pi_distance(request):
-    global pi_distance_client
+async def handle_pi_link(request):
+    robot = robot_for(request)
+    link = robot.link
     ws = web.WebSocketResponse()
     await ws.prepare(request)
-    pi_distance_client = ws
-    logger.info(f"Pi distance client connected: {request.remote}")
+    try:
+        resumed = link.handshake((await ws.receive(timeout=5)).data)
+    except (asyncio.TimeoutError, ValueError, TypeError) as e:
+        logger.error(f"Pi {robot.robot_id} link handshake failed: {type(e).__name__}: {e}")
+        await ws.close()
+        return ws
+    if robot.link_ws is not None and not robot.link_ws.closed:
+        asyncio.ensure_future(robot.link_ws.close()) # Half-open leftover; don't wait out its close handshake
+    robot.link_ws = ws
+    await ws.send_str(link.hello())
+
+    async def send_raw(data):
+        if isinstance(data, bytes):
+            await ws.send_bytes(data)
+        else:
+            await ws.send_str(data)
+    discarded = 0
+    if not resumed:
+        # A restarted Pi has no gate state and no clock offset: only a buffered stop is still safe
+        discarded = link.discard(lambda channel, payload: payload.get("action") == "stop")
+        if robot.commands.last_forwarded.get("drive", {}).get("action") != "stop":
+            robot.commands.last_forwarded.pop("drive", None) # Heartbeats would replay it as fresh
+    # Heartbeats are volatile: a stale one must never feed the Pi's watchdog after a reconnect.
+    # Its task is queued before the writer's, so the first one (with the clock offset) goes out
+    # ahead of any resend.
+    heartbeat = robot.heartbeat = HeartbeatSender(lambda message: link.send_volatile("control", message),
+                                                  lambda: robot.commands.last_forwarded.get("drive"))
+    heartbeat.start()
+    link.attach(send_raw)
+    if shard:
+        shard.table.claim(robot.robot_id, shard.worker) # Commands from browsers on other workers come here
+    logger.info(f"Pi link connected: {request.remote} ({robot.robot_id}, {'resumed' if resumed else 'new'} "
+                f"session, {len(link.unacked)} buffered messages to resend, {discarded} stale dropped)")
 
     try:
         async for msg in ws:
-            if msg.type == aiohttp.WSMsgType.TEXT:
-                try:
-                    logger.info(f"Pi distance message: {msg.data}")
-                    data = json.loads(msg.data)
-                    if data.get("type") == "distance":
-                        value = data.get("value")
-                        if value is None:
-                            logger.error(f"Missing value in distance data: {data}")
-                            continue
-                        broadcast_data = {"type": "distance", "value": float(value)}
-                        # Broadcast to browser distance clients
-                        await asyncio.gather(
-                            *[client.send_json(broadcast_data) for client in browser_distance_clients if not client.closed],
-                            return_exceptions=True
-                        )
-                        logger.info(f"Broadcasted distance: {value}")
-                except json.JSONDecodeError as e:
-                    logger.error(f"Invalid JSON from Pi distance: {msg.data}, Error: {e}")
-                except Exception as e:
-                    logger.error(f"Error processing Pi distance: {type(e).__name__}: {e}")
+            if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                link.receive(msg.data)
             elif msg.type == aiohttp.WSMsgType.ERROR:
-                logger.error(f"Pi distance WebSocket error: {ws.exception()}")
+                logger.error(f"Pi {robot.robot_id} link WebSocket error: {ws.exception()}")
     except Exception as e:
-        logger.error(f"Unexpected error in Pi distance: {type(e).__name__}: {e}")
+        logger.error(f"Unexpected error in Pi {robot.robot_id} link: {type(e).__name__}: {e}")
     finally:
-        pi_distance_client = None
-        logger.info(f"Pi distance client disconnected: {request.remote}")
+        heartbeat.stop()
+        link.detach(send_raw)
+        if shard and not robot.connected:
+            shard.table.release(robot.robot_id, shard.worker)
+        if robot.link_ws is ws:
+            robot.link_ws = None
+        logger.info(f"Pi link disconnected: {request.remote} ({robot.robot_id})")
     return ws
 
+# === Stats (?robot=<id>, default robot if absent) ===
+def existing_robot(request):
+    robot = fleet.get(request.query.get("robot", DEFAULT_ROBOT))
+    if robot is None:
+        raise web.HTTPNotFound(text="Unknown robot")
+    return robot
+
+def time_window(query, default_s):
+    """(start, end) wall-clock ms from ?start=&end= or ?seconds=; ValueError if malformed or not finite."""
+    end = int(query["end"]) if "end" in query else int(time.time() * 1000)
+    if "start" in query:
+        return int(query["start"]), end
+    seconds = float(query.get("seconds", default_s))
+    if not math.isfinite(seconds):
+        raise ValueError(f"seconds must be finite: {seconds}")
+    return end - int(seconds * 1000), end
+
+async def handle_history(request):
+    # ?channel=distance&start=<ms>&end=<ms>&points=500, or &seconds=<window ending now>; wall-clock ms
+    robot = existing_robot(request)
+    query = request.query
+    try:
+        channel = CHANNELS[query.get("channel", "distance")]
+        start, end = time_window(query, 600)
+        points = max(1, min(int(query.get("points", HISTORY_POINTS)), HISTORY_MAX_POINTS))
+    except (KeyError, ValueError) as e:
+        raise web.HTTPBadRequest(text=f"Invalid history query: {type(e).__name__}: {e}")
+    started = time.perf_counter()
+    result = history.query(robot.robot_id, channel, start, end, points)
+    history_query_time.observe_since(started)
+    return web.json_response({"robot": robot.robot_id, "channel": query.get("channel", "distance"),
+                              "start": start, "end": end, **result})
+
+async def handle_track(request):
+    # ?start=<ms>&end=<ms>, or &seconds=<window ending now>: the robot's GPS points
+    robot = existing_robot(request)
+    try:
+        start, end = time_window(request.query, 3600)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=f"Invalid track query: {type(e).__name__}: {e}")
+    return web.json_response({"robot": robot.robot_id, "start": start, "end": end,
+                              "inside": tracks.inside(robot.robot_id), **tracks.track(robot.robot_id, start, end)})
+
+async def handle_near(request):
+    # ?lat=&lon=&radius=<m>&time=<ms, default now>&window=<s either side>: robots that passed within radius
+    query = request.query
+    try:
+        lat, lon, radius = float(query["lat"]), float(query["lon"]), float(query.get("radius", 10))
+        time_ms = int(query["time"]) if "time" in query else int(time.time() * 1000)
+        window = float(query.get("window", NEAR_WINDOW_S))
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180 and radius >= 0 and window >= 0): # Also false for NaN
+            raise ValueError("lat, lon, radius or window out of range")
+        radius = min(radius, NEAR_MAX_RADIUS_M)
+        window_ms = int(min(window, NEAR_MAX_WINDOW_S) * 1000)
+    except (KeyError, ValueError) as e:
+        raise web.HTTPBadRequest(text=f"Invalid near query: {type(e).__name__}: {e}")
+    started = time.perf_counter()
+    robots = tracks.near(lat, lon, radius, time_ms, window_ms)
+    near_query_time.observe_since(started)
+    return web.json_response({"lat": lat, "lon": lon, "radius_m": radius, "time": time_ms, "robots": robots})
+
+async def handle_geofences(request):
+    # The geofences and their alerts after ?since=<seq>
+    try:
+        since = int(request.query.get("since", 0))
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=f"Invalid geofence query: {type(e).__name__}: {e}")
+    return web.json_response({"fences": [fence.to_dict() for fence in tracks.fences.fences.values()],
+                              "alerts": tracks.alerts(since)})
+
+async def handle_track_stats(request):
+    # Robots, points retained, index cells and entries, alerts by event, memory
+    return web.json_response(tracks.stats())
+
+async def handle_history_stats(request):
+    # Series, samples retained, memory and segment writes; rollup levels as (bucket ms, buckets kept)
+    return web.json_response({**history.stats(), "levels": LEVELS})
+
+async def handle_distance_stats(request):
+    return web.json_response(existing_robot(request).hub.stats()) # Per-client queue depth, drops and lag
+
+async def handle_control_stats(request):
+    # Forwarded/superseded commands and browser -> server age
+    return web.json_response(existing_robot(request).commands.stats())
+
+async def handle_heartbeat_stats(request):
+    # RTT histogram plus the Pi's missed-heartbeat and watchdog trip counters
+    robot = existing_robot(request)
+    return web.json_response(robot.heartbeat.stats() if robot.heartbeat else {})
+
+async def handle_link_stats(request):
+    return web.json_response(existing_robot(request).link.stats()) # Buffered/resent/dropped messages and reconnects
+
+async def handle_fleet_stats(request):
+    return web.json_response(fleet.stats()) # Every robot: connected, viewers, buffered messages
+
+async def handle_shard_stats(request):
+    # This worker's bus counters and every robot's shared state
+    return web.json_response(shard.stats() if shard else {"worker": None})
+
+async def handle_logging_stats(request):
+    # Log records queued/dropped, per-message lines sampled away, trace records written
+    samplers = {"control": control_log, "forward": forward_log, "telemetry": telemetry_log,
+                "buffered": buffered_log, "invalid": invalid_log}
+    return web.json_response({
+        "log": log_pipeline.stats(),
+        "sampled": {name: sampler.stats() for name, sampler in samplers.items()},
+        "trace": trace.stats() if trace else None,
+    })
+
+async def handle_metrics(request):
+    return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+async def handle_metrics_stats(request):
+    # The same metrics as /metrics, with histogram quantiles
+    return web.json_response(REGISTRY.snapshot())
+
+async def start_metrics(app):
+    app["loop_lag"] = asyncio.ensure_future(watch_loop_lag(loop_lag))
+
+async def stop_metrics(app):
+    app["loop_lag"].cancel()
+
 async def main():
     app = web.Application()
     app.add_routes([
         web.get('/control', handle_control),
         web.get('/distance', handle_distance),
+        web.get(LINK_PATH, handle_pi_link), # Multiplexed Pi session (robot_listener)
+        web.get('/pi_control', handle_pi_control), # Legacy Pi command socket
+        web.get('/pi_distance', handle_pi_distance), # Legacy Pi telemetry socket
+        web.get('/stats/distance', handle_distance_stats),
+        web.get('/stats/control', handle_control_stats),
+        web.get('/stats/heartbeat', handle_heartbeat_stats),
+        web.get('/stats/link', handle_link_stats),
+        web.get('/stats/fleet', handle_fleet_stats),
+        web.get('/stats/shard', handle_shard_stats),
+        web.get('/stats/logging', handle_logging_stats),
+        web.get('/stats/metrics', handle_metrics_stats),
+        web.get('/stats/history', handle_history_stats),
+        web.get('/stats/tracks', handle_track_stats),
+        web.get('/history', handle_history), # Telemetry history at a point budget
+        web.get('/track', handle_track), # GPS track of one robot
+        web.get('/near', handle_near), # Which robots were near a place around a time
+        web.get('/geofences', handle_geofences), # Geofences and entry/exit alerts
+        web.get('/metrics', handle_metrics), # Prometheus; with workers, each scrape reaches one of them
         web.static('/', os.path.join(os.getcwd(), 'static'))
     ])
-    logger.info("WebSocket server started on http://your_server_ip:9000")
+    app.on_startup.append(start_metrics)
+    app.on_cleanup.append(stop_metrics)
+    if shard:
+        app.on_startup.append(start_shard_bus)
+    logger.info(f"WebSocket server started on http://your_server_ip:{SERVER_PORT}"
+                + (f" (worker {shard.worker})" if shard else ""))
     return app
 
+def serve_worker(worker_shard):
+    global shard
+    shard = worker_shard
+    REGISTRY.const_labels["worker"] = str(shard.worker) # Each worker counts only its own traffic
+    try:
+        web.run_app(main(), host="0.0.0.0", port=SERVER_PORT, reuse_port=True, print=None)
+    finally:
+        # Forked workers exit without running atexit handlers: write out queued log lines and trace records
+        log_pipeline.stop()
+        if trace:
+            trace.close()
+
 if __name__ == "__main__":
     try:
-        web.run_app(main(), host="0.0.0.0", port=9000)
+        if WORKERS > 1:
+            run_workers(WORKERS, serve_worker)
+        else:
+            web.run_app(main(), host="0.0.0.0", port=SERVER_PORT)
     except KeyboardInterrupt:
         logger.info("Server shut down by user")
     except Exception as e:
@@ -0,0 +1,92 @@
+# fake_onvif.py
+# Offline stand-in for the `onvif` package's ONVIFCamera: a media service
+# with one profile and a PTZ service (ptz_executor.FakePTZService) that also
+# tracks where the camera is pointing. install() puts it in sys.modules so
+# onvif_connector's `from onvif import ONVIFCamera` needs no camera, no WSDL
+# files and no onvif-zeep.
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from ptz_executor import FakePTZService # noqa: E402
+
+class FakeProfile:
+    def __init__(self, token="profile_1", name="mainStream"):
+        self.token = token
+        self.Name = name
+
+
+class FakeMediaService:
+    def __init__(self, profiles):
+        self.profiles = profiles
+
+    def GetProfiles(self):
+        return self.profiles
+
+
+class SimPTZService(FakePTZService):
+    """
+    FakePTZService that integrates ContinuousMove velocities into a pan/tilt
+    position in [-1, 1], the way a camera moves until Stop or the move's
+    timeout. `speed` is full-scale units per second at velocity 1.
+    """
+
+    def __init__(self, rtt_s=0.04, speed=0.5):
+        super().__init__(rtt_s)
+        self.speed = speed
+        self.pan = 0.0
+        self.tilt = 0.0
+        self._velocity = (0.0, 0.0)
+        self._since = time.monotonic()
+        self._until = self._since
+
+    def position(self):
+        now = time.monotonic()
+        moving = max(0.0, min(now, self._until) - self._since)
+        self.pan = max(-1.0, min(1.0, self.pan + self._velocity[0] * self.speed * moving))
+        self.tilt = max(-1.0, min(1.0, self.tilt + self._velocity[1] * self.speed * moving))
+        self._since = now
+        return self.pan, self.tilt
+
+    def ContinuousMove(self, request):
+        super().ContinuousMove(request)
+        self.position()
+        pan_tilt = request["Velocity"]["PanTilt"]
+        self._velocity = (pan_tilt.get("x", 0.0), pan_tilt.get("y", 0.0))
+        timeout = request.get("Timeout", "PT2S") # ISO 8601 duration, whole seconds as PTZExecutor sends it
+        self._until = self._since + float(timeout[2:-1])
+
+    def Stop(self, request):
+        super().Stop(request)
+        self.position()
+        self._velocity = (0.0, 0.0)
+
+
+class FakeONVIFCamera:
+    """ONVIFCamera(host, port, user, passwd, wsdl_dir=...) with the services robot_listener uses."""
+    ptz_rtt_s = 0.04 # Set before robot_listener imports to change every camera's SOAP round trip
+    cameras = [] # Every camera created, so a simulation can reach the PTZ service
+
+    def __init__(self, host, port, user, passwd, wsdl_dir=None, **kwargs):
+        self.host = host
+        self.port = port
+        self.profiles = [FakeProfile()]
+        self.ptz = None
+        FakeONVIFCamera.cameras.append(self)
+
+    def create_media_service(self):
+        return FakeMediaService(self.profiles)
+
+    def create_ptz_service(self):
+        self.ptz = SimPTZService(self.ptz_rtt_s)
+        return self.ptz
+
+def install():
+    """Make `import onvif` resolve to this module's camera."""
+    module = types.ModuleType("onvif")
+    module.ONVIFCamera = FakeONVIFCamera
+    sys.modules["onvif"] = module
+    return module
@@ -0,0 +1,155 @@
+# floor_scene.py
+# What the robot's front camera sees while it drives towards an obstacle:
+# a tiled floor (joints, texture, a lighting gradient and a shadow) in
+# perspective from the camera mounting in local/vision_obstacles.py, and
+# upright obstacles standing on it, rendered as luma. Each clip also says what
+# an ultrasonic sensor would report at every frame, so vision and ultrasonic
+# readings can be compared and fused against the true distance. Clips are
+# recorded to .npz for bench_vision and play through a CaptureEngine with
+# ClipSource.
+# Usage: python sim/floor_scene.py <clip> <out.npz>   (clip: box, pole, board, cushion, clear)
+import collections
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "local"))
+
+from vision_obstacles import CAMERA_HEIGHT_CM, CAMERA_TILT_DEG, VERTICAL_FOV_DEG # noqa: E402
+
+WIDTH, HEIGHT = 640, 360
+FPS = 30
+START_CM = 250 # Obstacle distance at the first frame
+END_CM = 20
+SPEED_CM_S = 40 # Robot approach speed
+NOISE = 3 # Sensor noise, luma standard deviation
+WALL_BEHIND_CM = 100 # Wall behind the obstacle: what the ultrasonic sensor hears when the obstacle returns no echo
+
+# An upright obstacle START_CM ahead of the camera when the clip starts,
+# centred `x_cm` to the right; `echoes` is False when the ultrasonic pulse
+# does not come back from it (thin, angled or soft) and the sensor hears the
+# wall behind it instead
+Obstacle = collections.namedtuple("Obstacle", ["width_cm", "height_cm", "x_cm", "luma", "echoes"])
+
+CLIPS = {
+    "box": Obstacle(30, 20, 0, 45, True), # Cardboard box: both see it
+    "pole": Obstacle(2.5, 80, 4, 170, False), # Chair leg: too thin for the ultrasonic beam
+    "board": Obstacle(40, 15, -5, 175, False), # Board at an angle: the echo goes elsewhere
+    "cushion": Obstacle(35, 12, 0, 60, False), # Soft: absorbs the pulse
+    "clear": None, # Nothing but floor and a shadow
+}
+
+Clip = collections.namedtuple("Clip", ["name", "frames", "fps", "truth_cm", "ultrasonic_cm"])
+
+def _angles():
+    below = np.radians(CAMERA_TILT_DEG + ((np.arange(HEIGHT) + 0.5) / HEIGHT - 0.5) * VERTICAL_FOV_DEG)
+    half_h = math.atan(math.tan(math.radians(VERTICAL_FOV_DEG / 2)) * WIDTH / HEIGHT)
+    across = np.tan(((np.arange(WIDTH) + 0.5) / WIDTH - 0.5) * 2 * half_h)
+    return below[:, None], across[None, :]
+
+def _hash(i, j):
+    return np.modf(np.sin(i * 12.9898 + j * 78.233) * 43758.5453)[0] % 1.0
+
+class FloorScene:
+    """Renders one frame of a clip as a HEIGHTxWIDTH uint8 luma image."""
+
+    def __init__(self, obstacle, seed=0):
+        self.obstacle = obstacle
+        self.rng = np.random.default_rng(seed)
+        self.below, self.across = _angles()
+        with np.errstate(divide="ignore"):
+            self.ground = np.where(self.below > 0, CAMERA_HEIGHT_CM / np.tan(np.maximum(self.below, 1e-9)), np.inf)
+        self.lateral = np.where(np.isfinite(self.ground), self.ground, 0) * self.across
+
+    def render(self, distance_cm, travelled_cm):
+        finite = np.isfinite(self.ground)
+        z = np.where(finite, self.ground, 0) + travelled_cm # Floor coordinates move past the camera
+        x = self.lateral
+        texture = _hash(np.floor(z / 3), np.floor(x / 3)) * 16 # Speckle, 3 cm cells
+        joint = (np.abs((z + 15) % 60 - 30) > 29.4) | (np.abs(x % 60 - 30) > 29.4) # 60 cm tiles
+        luma = 118 + texture - 24 * joint - 0.08 * np.minimum(self.ground, 400) # Darker into the distance
+        shadow = (np.abs(z - travelled_cm - 140) < 25) & (x > 10) & (x < 60) # Off to the right, fixed in the world
+        luma = np.where(shadow, luma * 0.8, luma)
+        luma = np.where(finite, luma, 60) # Far wall above the horizon
+        if self.obstacle is not None:
+            o = self.obstacle
+            height = CAMERA_HEIGHT_CM - distance_cm * np.tan(self.below) # Height on the face the ray hits
+            face_x = distance_cm * self.across
+            hit = ((height >= 0) & (height <= o.height_cm) & (np.abs(face_x - o.x_cm) <= o.width_cm / 2)
+                   & (self.ground > distance_cm))
+            luma = np.where(hit, o.luma + 10 * height / o.height_cm, luma) # Lit from above
+        luma = luma + self.rng.normal(0, NOISE, luma.shape)
+        return np.clip(luma, 0, 255).astype(np.uint8)
+
+def record(name, fps=FPS, seed=0):
+    """Render clip `name` (one of CLIPS) as a Clip; ultrasonic_cm is -1 out of the sensor's range."""
+    obstacle = CLIPS[name]
+    scene = FloorScene(obstacle, seed)
+    count = int((START_CM - END_CM) / SPEED_CM_S * fps)
+    frames = np.empty((count, HEIGHT, WIDTH), dtype=np.uint8)
+    truth = np.empty(count)
+    for i in range(count):
+        travelled = SPEED_CM_S * i / fps
+        truth[i] = START_CM - travelled if obstacle is not None else np.inf
+        frames[i] = scene.render(truth[i], travelled)
+    wall = START_CM + WALL_BEHIND_CM - SPEED_CM_S * np.arange(count) / fps
+    heard = truth if obstacle is not None and obstacle.echoes else wall
+    return Clip(name, frames, fps, truth, np.where(heard <= 300, heard, -1))
+
+def save(clip, path):
+    np.savez_compressed(path, frames=clip.frames, fps=clip.fps, truth_cm=clip.truth_cm,
+                        ultrasonic_cm=clip.ultrasonic_cm)
+
+def load(path):
+    data = np.load(path)
+    return Clip(os.path.splitext(os.path.basename(path))[0], data["frames"], float(data["fps"]),
+                data["truth_cm"], data["ultrasonic_cm"])
+
+class ClipSource:
+    """
+    frame_capture source playing a clip's frames as yuv420p at the clip's
+    rate (grey chroma); `index` is the frame last read, so a consumer can
+    look up the truth for it. Loops at the end unless `loop` is False.
+    """
+
+    def __init__(self, clip, loop=True):
+        self.clip = clip
+        self.loop = loop
+        self.format = "yuv420p"
+        count, height, width = clip.frames.shape
+        self.shape = (height * 3 // 2, width)
+        self.index = -1
+        self.started = None
+
+    def open(self):
+        self.started = time.monotonic()
+
+    def read(self, out):
+        index = self.index + 1
+        if index >= len(self.clip.frames):
+            if not self.loop:
+                time.sleep(0.01)
+                return False
+            index = 0
+            self.started = time.monotonic()
+        delay = self.started + index / self.clip.fps - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        height = self.clip.frames.shape[1]
+        out[:height] = self.clip.frames[index]
+        out[height:] = 128
+        self.index = index
+        return True
+
+    def close(self):
+        pass
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in CLIPS:
+        sys.exit(f"Usage: python sim/floor_scene.py <{'|'.join(CLIPS)}> <out.npz>")
+    clip = record(sys.argv[1])
+    save(clip, sys.argv[2])
+    print(f"{clip.name}: {len(clip.frames)} frames at {clip.fps} fps -> {sys.argv[2]}")
@@ -0,0 +1,138 @@
+# gps_simulator.py
+# Stand-in for a serial NMEA GPS receiver: a pseudo-terminal whose other end
+# gets GGA, GSA and RMC sentences for a robot driving a loop around ORIGIN,
+# with receiver noise, at the pace of the configured baud rate and in
+# irregular chunks, as a UART delivers them. Point robot_listener's
+# GPS_DEVICE (or anything opening a serial port) at the printed path.
+# route_fixes() and nmea_epoch() are also used by bench_gps to build streams.
+# Usage: python sim/gps_simulator.py [rate_hz] [speed_m_s] [baud]
+import math
+import os
+import random
+import sys
+import time
+
+ORIGIN = (48.1173, 11.5167) # lat, lon of the loop's start
+LOOP_M = ((0, 0), (120, 0), (120, 80), (40, 140), (0, 80)) # Waypoints, metres east/north of ORIGIN
+NOISE_M = 1.5 # Receiver position noise (standard deviation, slowly wandering)
+EARTH_RADIUS_M = 6_371_000
+
+def nmea_sentence(body):
+    checksum = 0
+    for byte in body.encode("ascii"):
+        checksum ^= byte
+    return f"${body}*{checksum:02X}\r\n".encode("ascii")
+
+def nmea_coordinate(degrees, lat):
+    hemisphere = ("N" if degrees >= 0 else "S") if lat else ("E" if degrees >= 0 else "W")
+    degrees = abs(degrees)
+    whole = int(degrees)
+    return f"{whole:0{2 if lat else 3}d}{(degrees - whole) * 60:07.4f}", hemisphere
+
+def nmea_epoch(utc_s, lat, lon, speed_m_s, course, satellites=9, hdop=0.9, talker="GP"):
+    """One second's sentences from a receiver: GGA, GSA and RMC."""
+    clock = time.gmtime(utc_s)
+    hhmmss = f"{time.strftime('%H%M%S', clock)}.{int(utc_s * 100) % 100:02d}"
+    ddmmyy = time.strftime("%d%m%y", clock)
+    lat_text, ns = nmea_coordinate(lat, True)
+    lon_text, ew = nmea_coordinate(lon, False)
+    return b"".join((
+        nmea_sentence(f"{talker}GGA,{hhmmss},{lat_text},{ns},{lon_text},{ew},1,{satellites:02d},{hdop:.1f},"
+                      f"520.0,M,47.0,M,,"),
+        nmea_sentence(f"{talker}GSA,A,3,04,05,09,12,17,20,24,25,28,,,,1.6,{hdop:.1f},1.3"),
+        nmea_sentence(f"{talker}RMC,{hhmmss},A,{lat_text},{ns},{lon_text},{ew},{speed_m_s / 0.514444:.2f},"
+                      f"{course:.1f},{ddmmyy},,,A"),
+    ))
+
+def route_fixes(rate_hz, speed_m_s, origin=ORIGIN, waypoints=LOOP_M, noise_m=NOISE_M, seed=None):
+    """Endless (seconds, lat, lon, speed, course, true east, true north) along the loop, with noise."""
+    rng = random.Random(seed)
+    legs = list(zip(waypoints, waypoints[1:] + waypoints[:1]))
+    leg, along, t = 0, 0.0, 0.0
+    wander_x = wander_y = 0.0
+    scale_lon = EARTH_RADIUS_M * math.cos(math.radians(origin[0]))
+    while True:
+        (ax, ay), (bx, by) = legs[leg]
+        length = math.hypot(bx - ax, by - ay)
+        x, y = ax + (bx - ax) * along / length, ay + (by - ay) * along / length
+        wander_x = 0.9 * wander_x + rng.gauss(0, noise_m * 0.45) # Correlated, like real receiver drift
+        wander_y = 0.9 * wander_y + rng.gauss(0, noise_m * 0.45)
+        course = math.degrees(math.atan2(bx - ax, by - ay)) % 360
+        yield (t, origin[0] + math.degrees((y + wander_y) / EARTH_RADIUS_M),
+               origin[1] + math.degrees((x + wander_x) / scale_lon), speed_m_s, course, x, y)
+        t += 1 / rate_hz
+        along += speed_m_s / rate_hz
+        while along >= length:
+            along -= length
+            leg = (leg + 1) % len(legs)
+            (ax, ay), (bx, by) = legs[leg]
+            length = math.hypot(bx - ax, by - ay)
+
+class PtyGPS:
+    """
+    The receiver end of a pty. run() writes each epoch in random chunks, no
+    faster than `baud` allows (10 bits per byte); with nobody reading, bytes
+    are dropped like on a real serial line. A `corrupt` fraction of epochs
+    gets one byte flipped, as line noise would. `path` is what a reader opens.
+    """
+
+    def __init__(self, rate_hz=1.0, speed_m_s=1.0, baud=9600, corrupt=0.0, seed=None):
+        self.rate_hz = rate_hz
+        self.speed_m_s = speed_m_s
+        self.baud = baud
+        self.corrupt = corrupt
+        self.master, self.slave = os.openpty()
+        os.set_blocking(self.master, False)
+        self.path = os.ttyname(self.slave)
+        self.rng = random.Random(seed)
+        self.fixes = route_fixes(rate_hz, speed_m_s, seed=seed)
+        self.written = 0
+        self.dropped = 0
+        self.epochs = 0
+        self.corrupted = 0
+
+    def write(self, data):
+        """Write `data` in 1-64 byte chunks, paced at the baud rate."""
+        byte_s = 10 / self.baud
+        i = 0
+        while i < len(data):
+            chunk = data[i:i + self.rng.randint(1, 64)]
+            try:
+                self.written += os.write(self.master, chunk)
+            except BlockingIOError:
+                self.dropped += len(chunk)
+            i += len(chunk)
+            time.sleep(len(chunk) * byte_s)
+
+    def run(self, seconds=None):
+        started = time.time()
+        first = next_at = time.monotonic()
+        while seconds is None or time.monotonic() - first < seconds:
+            t, lat, lon, speed, course, _, _ = next(self.fixes)
+            data = bytearray(nmea_epoch(started + t, lat, lon, speed, course))
+            if self.rng.random() < self.corrupt:
+                i = self.rng.randrange(1, len(data) - 2)
+                if data[i] not in b"$*\r\n":
+                    data[i] ^= 0x04 # Caught by the checksum
+                    self.corrupted += 1
+            self.write(data)
+            self.epochs += 1
+            next_at += 1 / self.rate_hz
+            time.sleep(max(0.0, next_at - time.monotonic()))
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+if __name__ == "__main__":
+    gps = PtyGPS(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0,
+                 float(sys.argv[2]) if len(sys.argv) > 2 else 1.0,
+                 int(sys.argv[3]) if len(sys.argv) > 3 else 9600)
+    print(f"NMEA at {gps.rate_hz:g} Hz, {gps.baud} baud on {gps.path}", flush=True)
+    try:
+        gps.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Wrote {gps.written} bytes, dropped {gps.dropped}")
+        gps.close()
@@ -0,0 +1,105 @@
+# mock_whip.py
+# Stand-in for MediaMTX's WHIP ingest: aiohttp + aiortc, answers POST with a
+# Location resource, honours DELETE and decodes every frame it receives, so
+# a publisher runs end to end without a media server. Used in-process by
+# bench_whip and as its own process by the benchmark suite.
+# Requires aiortc.
+# Usage: python sim/mock_whip.py [port]
+import asyncio
+import sys
+import time
+import uuid
+
+from aiohttp import web
+from aiortc import RTCPeerConnection, RTCSessionDescription
+
+WHIP_PORT = 8889 # MediaMTX's WebRTC port, so publishers need no reconfiguring
+
+class MockWhip:
+    def __init__(self):
+        self.sessions = {} # resource id -> RTCPeerConnection
+        self.first_frames = [] # (time, resource id) of each session's first decoded frame
+        self.frames = 0 # Frames decoded across all sessions
+        self.down = False # Refuse offers (503), like a server restarting
+        self.posts = 0
+        self.deletes = 0
+
+    def add_routes(self, app):
+        app.router.add_post("/{path}/whip", self.post)
+        app.router.add_delete("/{path}/whip/{resource}", self.delete)
+
+    async def post(self, request):
+        self.posts += 1
+        if self.down:
+            return web.Response(status=503, text="restarting")
+        resource = uuid.uuid4().hex
+        pc = RTCPeerConnection()
+        self.sessions[resource] = pc
+
+        @pc.on("track")
+        def on_track(track):
+            asyncio.ensure_future(self.consume(track, resource))
+
+        await pc.setRemoteDescription(RTCSessionDescription(sdp=await request.text(), type="offer"))
+        await pc.setLocalDescription(await pc.createAnswer())
+        return web.Response(status=201, text=pc.localDescription.sdp, content_type="application/sdp",
+                            headers={"Location": f"/{request.match_info['path']}/whip/{resource}"})
+
+    async def delete(self, request):
+        self.deletes += 1
+        pc = self.sessions.pop(request.match_info["resource"], None)
+        if pc is None:
+            return web.Response(status=404)
+        await pc.close()
+        return web.Response(status=200)
+
+    async def consume(self, track, resource):
+        try:
+            await track.recv()
+            self.first_frames.append((time.monotonic(), resource))
+            while True:
+                self.frames += 1
+                await track.recv()
+        except Exception:
+            return # Session closed
+
+    async def first_frame_after(self, start, timeout=60):
+        """Seconds from `start` to the first frame of a session that began after it."""
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            for at, _ in self.first_frames:
+                if at >= start:
+                    return at - start
+            await asyncio.sleep(0.02)
+        return float("nan")
+
+    def newest(self):
+        return next(reversed(self.sessions.values()))
+
+    async def close_all(self):
+        for pc in list(self.sessions.values()):
+            await pc.close()
+        self.sessions.clear()
+
+async def serve(port=WHIP_PORT, host="127.0.0.1"):
+    """Run a MockWhip until cancelled; returns (server, runner)."""
+    server = MockWhip()
+    app = web.Application()
+    server.add_routes(app)
+    app.router.add_get("/stats", lambda request: web.json_response(
+        {"sessions": len(server.sessions), "posts": server.posts, "deletes": server.deletes, "frames": server.frames}))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return server, runner
+
+async def main(port):
+    await serve(port)
+    print(f"Mock WHIP endpoint on http://127.0.0.1:{port}/<path>/whip, stats on /stats")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else WHIP_PORT))
+    except KeyboardInterrupt:
+        pass
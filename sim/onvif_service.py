@@ -0,0 +1,128 @@
+# onvif_service.py
+# Local stand-in for an ONVIF camera's SOAP endpoints: the device, media and
+# PTZ services answer just the calls onvif-zeep's ONVIFCamera and
+# robot_listener make (GetCapabilities, GetProfiles, ContinuousMove, Stop),
+# each after a configurable round trip, and check the WS-Security password
+# digest. PTZ moves drive fake_onvif's SimPTZService, so the camera's pan/tilt
+# is in /stats. Used by bench_startup with the real onvif-zeep.
+# Usage: python sim/onvif_service.py [port] [rtt_ms]
+import asyncio
+import base64
+import hashlib
+import sys
+import xml.etree.ElementTree as ET
+
+from aiohttp import web
+
+from fake_onvif import SimPTZService
+
+ONVIF_PORT = 2020 # robot_listener's default
+SOAP12 = "http://www.w3.org/2003/05/soap-envelope"
+WSSE = "http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd"
+WSU = "http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd"
+NAMESPACES = {
+    "tds": "http://www.onvif.org/ver10/device/wsdl",
+    "trt": "http://www.onvif.org/ver10/media/wsdl",
+    "tptz": "http://www.onvif.org/ver20/ptz/wsdl",
+    "tt": "http://www.onvif.org/ver10/schema",
+}
+
+class ONVIFStandIn:
+    def __init__(self, user="admin", passwd="admin", rtt_s=0.02, token="profile_1", profile="mainStream"):
+        self.user = user
+        self.passwd = passwd
+        self.rtt_s = rtt_s
+        self.token = token
+        self.profile = profile
+        self.base = None # http://host:port, set by serve()
+        self.ptz = SimPTZService(rtt_s=0.0) # Round trip simulated here, off the thread
+        self.calls = {} # operation -> count
+        self.rejected = 0 # Bad or missing credentials
+
+    def add_routes(self, app):
+        for service in ("device_service", "media_service", "ptz_service"):
+            app.router.add_post(f"/onvif/{service}", self.post)
+
+    async def post(self, request):
+        envelope = ET.fromstring(await request.read())
+        body = envelope.find(f"{{{SOAP12}}}Body")[0]
+        operation = body.tag.rsplit("}", 1)[-1]
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        await asyncio.sleep(self.rtt_s)
+        if not self.authorized(envelope):
+            self.rejected += 1
+            return fault("env:Sender", "Sender not Authorized")
+        handler = getattr(self, f"op_{operation}", None)
+        if handler is None:
+            return fault("env:Receiver", f"{operation} not supported")
+        return respond(handler(body))
+
+    def authorized(self, envelope):
+        token = envelope.find(f".//{{{WSSE}}}UsernameToken")
+        if token is None:
+            return not self.user
+        nonce = base64.b64decode(token.findtext(f"{{{WSSE}}}Nonce", ""))
+        created = token.findtext(f"{{{WSU}}}Created", "")
+        digest = base64.b64encode(hashlib.sha1(nonce + created.encode() + self.passwd.encode()).digest()).decode()
+        return token.findtext(f"{{{WSSE}}}Username") == self.user and token.findtext(f"{{{WSSE}}}Password") == digest
+
+    def op_GetCapabilities(self, body):
+        return (f'<tds:GetCapabilitiesResponse><tds:Capabilities>'
+                f'<tt:Media><tt:XAddr>{self.base}/onvif/media_service</tt:XAddr><tt:StreamingCapabilities>'
+                f'<tt:RTPMulticast>false</tt:RTPMulticast><tt:RTP_TCP>true</tt:RTP_TCP>'
+                f'<tt:RTP_RTSP_TCP>true</tt:RTP_RTSP_TCP></tt:StreamingCapabilities></tt:Media>'
+                f'<tt:PTZ><tt:XAddr>{self.base}/onvif/ptz_service</tt:XAddr></tt:PTZ>'
+                f'</tds:Capabilities></tds:GetCapabilitiesResponse>')
+
+    def op_GetProfiles(self, body):
+        return (f'<trt:GetProfilesResponse><trt:Profiles token="{self.token}" fixed="true">'
+                f'<tt:Name>{self.profile}</tt:Name></trt:Profiles></trt:GetProfilesResponse>')
+
+    def op_ContinuousMove(self, body):
+        pan_tilt = body.find(f".//{{{NAMESPACES['tt']}}}PanTilt")
+        velocity = {"PanTilt": {axis: float(pan_tilt.get(axis, 0)) for axis in ("x", "y")}}
+        self.ptz.ContinuousMove({"ProfileToken": self.token, "Velocity": velocity,
+                                 "Timeout": body.findtext(f"{{{NAMESPACES['tptz']}}}Timeout", "PT2S")})
+        return "<tptz:ContinuousMoveResponse/>"
+
+    def op_Stop(self, body):
+        self.ptz.Stop({"ProfileToken": self.token})
+        return "<tptz:StopResponse/>"
+
+    def stats(self):
+        pan, tilt = self.ptz.position()
+        return {"calls": self.calls, "rejected": self.rejected, "pan": round(pan, 3), "tilt": round(tilt, 3)}
+
+def respond(body, status=200):
+    prefixes = " ".join(f'xmlns:{prefix}="{ns}"' for prefix, ns in NAMESPACES.items())
+    text = (f'<?xml version="1.0" encoding="UTF-8"?><env:Envelope xmlns:env="{SOAP12}" {prefixes}>'
+            f'<env:Body>{body}</env:Body></env:Envelope>')
+    return web.Response(text=text, status=status, content_type="application/soap+xml", charset="utf-8")
+
+def fault(code, reason):
+    return respond(f'<env:Fault><env:Code><env:Value>{code}</env:Value></env:Code>'
+                   f'<env:Reason><env:Text xml:lang="en">{reason}</env:Text></env:Reason></env:Fault>', 400)
+
+async def serve(port=ONVIF_PORT, host="127.0.0.1", **kwargs):
+    """Run an ONVIFStandIn until cancelled; returns (camera, runner)."""
+    camera = ONVIFStandIn(**kwargs)
+    camera.base = f"http://{host}:{port}"
+    app = web.Application()
+    camera.add_routes(app)
+    app.router.add_get("/stats", lambda request: web.json_response(camera.stats()))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return camera, runner
+
+async def main(port, rtt_ms):
+    camera, _ = await serve(port, rtt_s=rtt_ms / 1000)
+    print(f"ONVIF stand-in on {camera.base}/onvif/device_service (user {camera.user}), stats on /stats")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else ONVIF_PORT,
+                         float(sys.argv[2]) if len(sys.argv) > 2 else 20.0))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,112 @@
+# sim_robot.py
+# Runs the real robot_listener with no hardware: FakeGPIO (gpio_backend) for
+# the motors and the ultrasonic sensor, the fake ONVIF camera (fake_onvif)
+# for PTZ, and a scripted obstacle that keeps approaching the robot so the
+# emergency brake fires over and over. Each brake's reaction time (obstacle
+# crosses the stopping distance -> PWM cut) goes into the
+# sim_brake_reaction_seconds histogram, served with the robot's own metrics.
+# Usage: python sim/sim_robot.py ws://<server>:9000 [robot_id] [metrics_port] [closing_speed_cm_s]
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+os.environ["ROBOT_GPIO_BACKEND"] = "fake" # Read by gpio_backend when robot_listener imports it
+
+import fake_onvif # noqa: E402
+fake_onvif.install()
+import robot_listener # noqa: E402
+from metrics import REGISTRY # noqa: E402
+from pi_link import LINK_PATH # noqa: E402
+
+# === Obstacle Scenario ===
+CLEAR_CM = 200 # Where the obstacle starts each approach; well inside the ranger's 300 cm timeout
+CLEAR_S = 1.0 # Time at CLEAR_CM between approaches, long enough for the brake to release
+CLOSING_SPEED_CM_S = 60.0
+
+brake_reaction = REGISTRY.histogram("sim_brake_reaction_seconds",
+                                    "Obstacle crosses the stopping distance -> forward PWM cut")
+approaches = REGISTRY.counter("sim_obstacle_approaches_total", "Scripted obstacle approaches started")
+
+class ObstacleScenario:
+    """
+    Moves the sensor's VirtualObstacle: CLEAR_CM away for CLEAR_S, then
+    closing at `closing_speed` cm/s until the brake cuts the motors (or it
+    reaches the robot), then clear again. on_brake() is a brake listener.
+    """
+
+    def __init__(self, obstacle, brake, forward_pwm, closing_speed=CLOSING_SPEED_CM_S):
+        self.obstacle = obstacle
+        self.brake = brake
+        self.forward_pwm = forward_pwm
+        self.closing_speed = closing_speed
+        self._approach = None # (start monotonic_ns, start distance) of the running approach
+        self._braked = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sim-obstacle", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._braked.set()
+        self._thread.join(timeout=2)
+
+    def on_brake(self, sample):
+        approach = self._approach
+        if approach is None:
+            return
+        start_ns, start_cm = approach
+        threshold = self.brake.stopping_distance(self.brake.speed)
+        crossing_ns = start_ns + (start_cm - threshold) / self.closing_speed * 1e9
+        brake_reaction.observe(max(0.0, (self.forward_pwm.last_change_ns - crossing_ns) / 1e9))
+        self._braked.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._approach = None
+            self.obstacle.set(CLEAR_CM)
+            if self._stop.wait(CLEAR_S):
+                return
+            self._braked.clear()
+            self._approach = (time.monotonic_ns(), CLEAR_CM)
+            self.obstacle.set(CLEAR_CM, self.closing_speed)
+            approaches.inc()
+            self._braked.wait(CLEAR_CM / self.closing_speed)
+
+def main(server_uri, robot_id, metrics_port, closing_speed):
+    robot_listener.ROBOT_ID = robot_id
+    robot_listener.METRICS_PORT = metrics_port
+    robot_listener.LOCAL_TELEMETRY_PORT = 0 # Several simulated robots share one host
+    robot_listener.link_client.uri = f"{server_uri}{LINK_PATH}?robot={robot_id}"
+    robot_listener.camera.cache_path = None # The fake camera has no SOAP binding to cache
+    obstacle = robot_listener.GPIO.attach_ultrasonic(robot_listener.TRIG, robot_listener.ECHO)
+    scenario = ObstacleScenario(obstacle, robot_listener.brake, robot_listener.pwms['r_r'], closing_speed)
+    robot_listener.brake.add_listener(scenario.on_brake)
+    scenario.start()
+    print(f"Simulated robot {robot_id} -> {server_uri}, metrics on :{metrics_port}")
+    try:
+        asyncio.run(robot_listener.main())
+    finally:
+        scenario.stop()
+        robot_listener.watchdog.stop()
+        robot_listener.ranger.stop()
+        robot_listener.camera.stop()
+        if robot_listener.ptz:
+            robot_listener.ptz.close()
+        robot_listener.stop_all()
+        robot_listener.GPIO.cleanup()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python sim/sim_robot.py ws://<server>:9000 [robot_id] [metrics_port] [closing_speed_cm_s]")
+    try:
+        main(sys.argv[1],
+             sys.argv[2] if len(sys.argv) > 2 else "default",
+             int(sys.argv[3]) if len(sys.argv) > 3 else robot_listener.METRICS_PORT,
+             float(sys.argv[4]) if len(sys.argv) > 4 else CLOSING_SPEED_CM_S)
+    except KeyboardInterrupt:
+        pass